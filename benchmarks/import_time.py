@@ -0,0 +1,43 @@
+"""Benchmark the import time of dash_annotate_cv
+
+Each measurement runs in a fresh interpreter, so nothing is cached in `sys.modules`.
+
+Usage:
+    python benchmarks/import_time.py [--repeats 10]
+"""
+import argparse
+import statistics
+import subprocess
+import sys
+
+
+STATEMENTS = {
+    "core": "import dash_annotate_cv",
+    "core + formats": "import dash_annotate_cv; import dash_annotate_cv.formats.coco; import dash_annotate_cv.formats.default",
+    "ui": "import dash_annotate_cv; dash_annotate_cv.AnnotateImageBboxsAIO",
+}
+
+
+def time_statement(statement: str) -> float:
+    code = f"import time; t0 = time.perf_counter(); {statement}; print(time.perf_counter() - t0)"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+def modules_loaded(statement: str, modules: list) -> list:
+    code = f"import sys; {statement}; print(','.join(m for m in {modules!r} if m in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return [ m for m in output.strip().split(",") if m != "" ]
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark import time of dash_annotate_cv")
+    parser.add_argument("--repeats", type=int, default=10, help="Number of fresh interpreters per statement")
+    args = parser.parse_args()
+
+    ui_modules = ["dash", "plotly", "pandas", "dash_bootstrap_components"]
+    for name, statement in STATEMENTS.items():
+        times = [ time_statement(statement) for _ in range(args.repeats) ]
+        loaded = modules_loaded(statement, ui_modules)
+        print(f"{name:16s} median {1000*statistics.median(times):8.1f} ms  min {1000*min(times):8.1f} ms  UI modules loaded: {loaded or 'none'}")
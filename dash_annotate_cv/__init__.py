@@ -1,7 +1,75 @@
-from .annotate_image_bboxs import AnnotateImageBboxsAIO, Bbox, BboxUpdate, BboxToShapeConverter
-from .annotate_image_controller import AnnotateImageController, AnnotateImageOptions, ImageAnn, NoCurrLabelError, InvalidLabelError, bbox_eq_annotation, InvalidBboxError
-from .annotate_image_labels import AnnotateImageLabelsAIO, ImageAnnotations, SelectionMode
+# Headless core: no Dash/Plotly imports
+from .annotate_image_controller import AnnotateImageController, AnnotateImageOptions, ImageAnn, NoCurrLabelError, InvalidLabelError, bbox_eq_annotation, InvalidBboxError, DuplicateBboxError, InvalidMaskError, Bbox, BboxUpdate
+from .annotation_stats import AnnotationStats, ProgressSnapshot, register_progress_route
 from .annotation_storage import AnnotationStorage, AnnotationWriter, load_image_anns_if_exist, StorageType, load_image_anns_from_storage
+from .checkpoints import CheckpointStore, CheckpointInfo
 from .formats import ImageAnnotations
 from .image_source import ImageSource
-from .label_source import LabelSource
\ No newline at end of file
+from .image_reader import ImageReader
+from .image_source_manifest import ManifestFileList, load_manifest_index
+from .image_order import ImageOrder, PermutationOrder, PriorityOrder, shuffled_order, stratified_order, load_priority_file
+from .image_hash import ImageHashIndex, BKTree, HashMethod, DuplicateImageAction, average_hash, difference_hash, hamming_distance
+from .label_source import LabelSource, LabelSet
+from .taxonomy import Taxonomy
+from .rle import rle_encode, rle_decode, rle_area, rle_to_xyxy, rle_from_polygon, rle_overlay
+from .overlap import DuplicatePolicy, DuplicatePair, iou_matrix, find_duplicates, merge_duplicates
+from .metrics import MetricsRegistry, Histogram, register_metrics_route, registry as metrics_registry
+from .merge import ConflictPolicy, MergeOptions, MergeResult, merge_image_entries, merge_annotations
+
+import importlib
+
+
+# Imported on first access. Image readers are only needed for their source type, and tools for batch work
+# are not needed to annotate
+_LAZY_ATTRS = {
+    "RemoteImageReader": ".image_source_remote",
+    "ArchiveImageReader": ".image_source_archive",
+    "VideoImageReader": ".image_source_video",
+    "LoaderImageReader": ".image_source_memory",
+    "GeneratorImageReader": ".image_source_memory",
+    "ArrayImageReader": ".image_source_memory",
+    "SharedMemoryImageReader": ".image_source_memory",
+    "create_shared_image_stack": ".image_source_memory",
+    "NpyImageReader": ".image_source_npy",
+    "window_to_uint8": ".image_source_npy",
+    "AgreementReport": ".agreement",
+    "PairAgreement": ".agreement",
+    "ClassAgreement": ".agreement",
+    "compute_agreement": ".agreement",
+    "match_bboxs": ".agreement",
+    "load_annotators": ".agreement",
+    "ValidationIssue": ".validation",
+    "validate_entry": ".validation",
+    "validate_entries": ".validation",
+    "JobRunner": ".jobs",
+    "JobState": ".jobs",
+    "JobStatus": ".jobs",
+    "JobContext": ".jobs",
+    "JobCancelledError": ".jobs",
+    "export_job": ".jobs",
+    "convert_job": ".jobs",
+    "import_job": ".jobs",
+    "validate_job": ".jobs",
+
+    # UI components, since they pull in dash, plotly and dash_bootstrap_components
+    "AnnotateImageBboxsAIO": ".annotate_image_bboxs",
+    "BboxToShapeConverter": ".annotate_image_bboxs",
+    "AnnotateImageControlsAIO": ".annotate_image_controls",
+    "AnnotateImageLabelsAIO": ".annotate_image_labels",
+    "SelectionMode": ".annotate_image_labels",
+    "AnnotateImageGalleryAIO": ".annotate_image_gallery",
+    "AnnotateImageMasksAIO": ".annotate_image_masks",
+}
+
+
+def __getattr__(name: str):
+    if name in _LAZY_ATTRS:
+        module = importlib.import_module(_LAZY_ATTRS[name], __name__)
+        value = getattr(module, name)
+        globals()[name] = value
+        return value
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__():
+    return sorted(list(globals().keys()) + list(_LAZY_ATTRS.keys()))
@@ -0,0 +1,398 @@
+from dash_annotate_cv.annotation_storage import iter_image_anns, detect_storage_type
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.overlap import iou_matrix, xyxy_array
+
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from mashumaro import DataClassDictMixin
+from typing import Optional, List, Dict, Tuple, Sequence
+import itertools
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Label value used for images whose label has neither a single nor multiple value
+NO_LABEL = ""
+
+
+@dataclass
+class BboxMatch:
+    """Result of matching the bboxs of two annotators on one image
+    """
+
+    # Pairs (index in a, index in b, IoU)
+    matches: List[Tuple[int,int,float]]
+
+    # Indexes of bboxs in a without a match
+    unmatched_a: List[int]
+
+    # Indexes of bboxs in b without a match
+    unmatched_b: List[int]
+
+
+def match_bboxs(
+    bboxs_a: Sequence[ImageAnnotations.Annotation.Bbox],
+    bboxs_b: Sequence[ImageAnnotations.Annotation.Bbox],
+    iou_threshold: float = 0.5
+    ) -> BboxMatch:
+    """Match bboxs of two annotators by optimal assignment on the IoU matrix
+
+    The assignment maximizes the total IoU; assigned pairs below `iou_threshold` are left unmatched. Classes are not
+    considered in the matching, so a matched pair with different classes counts as a class disagreement.
+
+    Args:
+        bboxs_a (Sequence[ImageAnnotations.Annotation.Bbox]): Bboxs of the first annotator
+        bboxs_b (Sequence[ImageAnnotations.Annotation.Bbox]): Bboxs of the second annotator
+        iou_threshold (float, optional): Minimum IoU of a match. Defaults to 0.5.
+
+    Returns:
+        BboxMatch: Matches
+    """
+    if len(bboxs_a) == 0 or len(bboxs_b) == 0:
+        return BboxMatch(matches=[], unmatched_a=list(range(len(bboxs_a))), unmatched_b=list(range(len(bboxs_b))))
+
+    from scipy.optimize import linear_sum_assignment
+
+    ious = iou_matrix(xyxy_array([ bbox.xyxy for bbox in bboxs_a ]), xyxy_array([ bbox.xyxy for bbox in bboxs_b ]))
+    rows, cols = linear_sum_assignment(ious, maximize=True)
+    keep = ious[rows, cols] >= iou_threshold
+    matches = [ (int(i), int(j), float(ious[i,j])) for i, j in zip(rows[keep], cols[keep]) ]
+    matched_a = set(i for i, _, _ in matches)
+    matched_b = set(j for _, j, _ in matches)
+    return BboxMatch(
+        matches=matches,
+        unmatched_a=[ i for i in range(len(bboxs_a)) if i not in matched_a ],
+        unmatched_b=[ j for j in range(len(bboxs_b)) if j not in matched_b ]
+        )
+
+
+def label_value(label: Optional[ImageAnnotations.Annotation.Label]) -> Optional[str]:
+    """Categorical value of a label for agreement: the single label, or the sorted multiple labels joined by ","
+
+    Args:
+        label (Optional[ImageAnnotations.Annotation.Label]): Label
+
+    Returns:
+        Optional[str]: Value, or None if the image is not labeled
+    """
+    if label is None:
+        return None
+    if label.single is not None:
+        return label.single
+    if label.multiple is not None:
+        return ",".join(sorted(label.multiple))
+    return NO_LABEL
+
+
+def cohens_kappa(confusion: Dict[Tuple[str,str],int]) -> Optional[float]:
+    """Cohen's kappa from counts of (value by a, value by b)
+
+    Args:
+        confusion (Dict[Tuple[str,str],int]): Counts
+
+    Returns:
+        Optional[float]: Kappa, or None if there are no counts
+    """
+    n = sum(confusion.values())
+    if n == 0:
+        return None
+    marginals_a: Dict[str,int] = {}
+    marginals_b: Dict[str,int] = {}
+    observed = 0
+    for (value_a, value_b), count in confusion.items():
+        marginals_a[value_a] = marginals_a.get(value_a, 0) + count
+        marginals_b[value_b] = marginals_b.get(value_b, 0) + count
+        if value_a == value_b:
+            observed += count
+    p_observed = observed / n
+    p_expected = sum(count * marginals_b.get(value, 0) for value, count in marginals_a.items()) / (n * n)
+    if p_expected == 1:
+        # Both annotators always gave the same single value
+        return 1.0
+    return (p_observed - p_expected) / (1 - p_expected)
+
+
+@dataclass
+class ClassCounts:
+    """Bbox counts for one class, treating annotator a as reference and b as prediction
+    """
+    tp: int = 0
+    fp: int = 0
+    fn: int = 0
+
+
+@dataclass
+class PairCounts:
+    """Mergeable counts for one pair of annotators over a subset of images
+    """
+
+    # Images annotated by both
+    no_images_common: int = 0
+
+    # (label by a, label by b) for images labeled by both
+    label_confusion: Dict[Tuple[str,str],int] = field(default_factory=dict)
+
+    # Bboxs of each annotator on common images
+    no_bboxs_a: int = 0
+    no_bboxs_b: int = 0
+
+    # Matched bboxs and the sum of their IoUs
+    no_bboxs_matched: int = 0
+    iou_sum: float = 0.0
+
+    # Class name to counts; bboxs without class are counted under NO_LABEL
+    class_counts: Dict[str,ClassCounts] = field(default_factory=dict)
+
+
+    def _class(self, class_name: Optional[str]) -> ClassCounts:
+        return self.class_counts.setdefault(class_name if class_name is not None else NO_LABEL, ClassCounts())
+
+
+    def add_image(self, entry_a: ImageAnnotations.Annotation, entry_b: ImageAnnotations.Annotation, iou_threshold: float):
+        """Add the comparison of one image
+        """
+        self.no_images_common += 1
+
+        value_a, value_b = label_value(entry_a.label), label_value(entry_b.label)
+        if value_a is not None and value_b is not None:
+            self.label_confusion[(value_a, value_b)] = self.label_confusion.get((value_a, value_b), 0) + 1
+
+        bboxs_a, bboxs_b = entry_a.bboxs or [], entry_b.bboxs or []
+        self.no_bboxs_a += len(bboxs_a)
+        self.no_bboxs_b += len(bboxs_b)
+        match = match_bboxs(bboxs_a, bboxs_b, iou_threshold)
+        for i, j, iou in match.matches:
+            self.no_bboxs_matched += 1
+            self.iou_sum += iou
+            class_a, class_b = bboxs_a[i].class_name, bboxs_b[j].class_name
+            if class_a == class_b:
+                self._class(class_a).tp += 1
+            else:
+                self._class(class_a).fn += 1
+                self._class(class_b).fp += 1
+        for i in match.unmatched_a:
+            self._class(bboxs_a[i].class_name).fn += 1
+        for j in match.unmatched_b:
+            self._class(bboxs_b[j].class_name).fp += 1
+
+
+    def merge(self, other: "PairCounts"):
+        """Add counts from another subset of images
+        """
+        self.no_images_common += other.no_images_common
+        for key, count in other.label_confusion.items():
+            self.label_confusion[key] = self.label_confusion.get(key, 0) + count
+        self.no_bboxs_a += other.no_bboxs_a
+        self.no_bboxs_b += other.no_bboxs_b
+        self.no_bboxs_matched += other.no_bboxs_matched
+        self.iou_sum += other.iou_sum
+        for class_name, counts in other.class_counts.items():
+            mine = self.class_counts.setdefault(class_name, ClassCounts())
+            mine.tp += counts.tp
+            mine.fp += counts.fp
+            mine.fn += counts.fn
+
+
+@dataclass
+class ClassAgreement(DataClassDictMixin):
+    """Bbox agreement for one class, treating annotator a as reference and b as prediction
+    """
+
+    # True positives: matched with the same class
+    tp: int
+
+    # False positives: bboxs of b with this class not matched to a bbox of a with this class
+    fp: int
+
+    # False negatives: bboxs of a with this class not matched to a bbox of b with this class
+    fn: int
+
+    # tp / (tp + fp), if defined
+    precision: Optional[float]
+
+    # tp / (tp + fn), if defined
+    recall: Optional[float]
+
+
+@dataclass
+class PairAgreement(DataClassDictMixin):
+    """Agreement between two annotators
+    """
+
+    # Annotators
+    annotator_a: str
+    annotator_b: str
+
+    # Images annotated by both
+    no_images_common: int
+
+    # Images labeled by both
+    no_images_labeled_both: int
+
+    # Fraction of images labeled by both with the same label
+    label_accuracy: Optional[float]
+
+    # Cohen's kappa of the labels
+    label_kappa: Optional[float]
+
+    # Bboxs of each annotator on common images
+    no_bboxs_a: int
+    no_bboxs_b: int
+
+    # Matched bboxs (any class)
+    no_bboxs_matched: int
+
+    # Mean IoU of matched bboxs
+    mean_iou: Optional[float]
+
+    # Class name to agreement
+    per_class: Dict[str,ClassAgreement] = field(default_factory=dict)
+
+    @classmethod
+    def from_counts(cls, annotator_a: str, annotator_b: str, counts: PairCounts) -> "PairAgreement":
+        no_labeled = sum(counts.label_confusion.values())
+        no_same = sum(count for (value_a, value_b), count in counts.label_confusion.items() if value_a == value_b)
+        return cls(
+            annotator_a=annotator_a,
+            annotator_b=annotator_b,
+            no_images_common=counts.no_images_common,
+            no_images_labeled_both=no_labeled,
+            label_accuracy=no_same / no_labeled if no_labeled > 0 else None,
+            label_kappa=cohens_kappa(counts.label_confusion),
+            no_bboxs_a=counts.no_bboxs_a,
+            no_bboxs_b=counts.no_bboxs_b,
+            no_bboxs_matched=counts.no_bboxs_matched,
+            mean_iou=counts.iou_sum / counts.no_bboxs_matched if counts.no_bboxs_matched > 0 else None,
+            per_class={
+                class_name: ClassAgreement(
+                    tp=c.tp,
+                    fp=c.fp,
+                    fn=c.fn,
+                    precision=c.tp / (c.tp + c.fp) if c.tp + c.fp > 0 else None,
+                    recall=c.tp / (c.tp + c.fn) if c.tp + c.fn > 0 else None
+                    )
+                for class_name, c in sorted(counts.class_counts.items())
+                }
+            )
+
+
+@dataclass
+class AgreementReport(DataClassDictMixin):
+    """Agreement between every pair of annotators
+    """
+
+    # Annotator names
+    annotators: List[str]
+
+    # IoU threshold used for matching bboxs
+    iou_threshold: float
+
+    # One entry per pair of annotators
+    pairs: List[PairAgreement] = field(default_factory=list)
+
+
+    def pair(self, annotator_a: str, annotator_b: str) -> PairAgreement:
+        """Agreement of a pair, in either order of the annotators
+        """
+        for pair in self.pairs:
+            if (pair.annotator_a, pair.annotator_b) in [(annotator_a, annotator_b), (annotator_b, annotator_a)]:
+                return pair
+        raise KeyError(f"No pair ({annotator_a}, {annotator_b}) in report")
+
+
+# Images per task sent to a worker
+CHUNK_SIZE = 1000
+
+
+def _compare_chunk(args: Tuple[List[Tuple[int,int]], List[Dict[int,ImageAnnotations.Annotation]], float]) -> List[PairCounts]:
+    """Compare a chunk of images for every pair of annotators
+
+    Runs in a worker process.
+    """
+    pairs, chunk, iou_threshold = args
+    counts = [ PairCounts() for _ in pairs ]
+    for entries in chunk:
+        for counts_pair, (idx_a, idx_b) in zip(counts, pairs):
+            if idx_a in entries and idx_b in entries:
+                counts_pair.add_image(entries[idx_a], entries[idx_b], iou_threshold)
+    return counts
+
+
+def compute_agreement(
+    annotations: Dict[str,ImageAnnotations],
+    iou_threshold: float = 0.5,
+    workers: int = 1,
+    chunk_size: int = CHUNK_SIZE
+    ) -> AgreementReport:
+    """Compute agreement between every pair of annotators on the images they have in common
+
+    Images are split into chunks that are compared in `workers` processes; the counts of the chunks are then summed.
+
+    Args:
+        annotations (Dict[str,ImageAnnotations]): Annotator name to annotations
+        iou_threshold (float, optional): Minimum IoU for bboxs to match. Defaults to 0.5.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        chunk_size (int, optional): Images per chunk. Defaults to CHUNK_SIZE.
+
+    Returns:
+        AgreementReport: Report
+    """
+    assert len(annotations) >= 2, "Need annotations from at least two annotators"
+    annotators = list(annotations.keys())
+    pairs = list(itertools.combinations(range(len(annotators)), 2))
+
+    # Per image, the entries of the annotators that have it; only images shared by at least two are compared
+    image_to_entries: Dict[str,Dict[int,ImageAnnotations.Annotation]] = {}
+    for idx, anns in enumerate(annotations.values()):
+        for image_name, entry in anns.image_to_entry.items():
+            image_to_entries.setdefault(image_name, {})[idx] = entry
+    shared = [ entries for entries in image_to_entries.values() if len(entries) >= 2 ]
+    logger.debug(f"Comparing {len(annotators)} annotators on {len(shared)} shared images")
+
+    tasks = [ (pairs, shared[start:start+chunk_size], iou_threshold) for start in range(0, len(shared), chunk_size) ]
+    totals = [ PairCounts() for _ in pairs ]
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(_compare_chunk, tasks))
+    else:
+        results = [ _compare_chunk(task) for task in tasks ]
+    for counts in results:
+        for total, counts_pair in zip(totals, counts):
+            total.merge(counts_pair)
+
+    return AgreementReport(
+        annotators=annotators,
+        iou_threshold=iou_threshold,
+        pairs=[ PairAgreement.from_counts(annotators[idx_a], annotators[idx_b], total) for (idx_a, idx_b), total in zip(pairs, totals) ]
+        )
+
+
+def load_annotators(fnames: Sequence[str]) -> Dict[str,ImageAnnotations]:
+    """Load the annotation files of several annotators
+
+    Each entry is either a file name, in which case the annotator is named after the file, or `name=file`.
+    The storage type of each file is detected from its contents.
+
+    Args:
+        fnames (Sequence[str]): Files
+
+    Returns:
+        Dict[str,ImageAnnotations]: Annotator name to annotations
+    """
+    annotations: Dict[str,ImageAnnotations] = {}
+    for spec in fnames:
+        if "=" in spec and not os.path.exists(spec):
+            name, fname = spec.split("=", 1)
+        else:
+            name, fname = os.path.splitext(os.path.basename(spec))[0], spec
+        assert name not in annotations, f"Duplicate annotator name: {name}"
+
+        anns = ImageAnnotations.new()
+        for entry in iter_image_anns(detect_storage_type(fname), fname):
+            anns.image_to_entry[entry.image_name] = entry
+        annotations[name] = anns
+        logger.debug(f"Loaded {len(anns.image_to_entry)} images for annotator {name} from {fname}")
+    return annotations
@@ -1,19 +1,27 @@
-from dash_annotate_cv.annotate_image_controller import AnnotateImageController, AnnotateImageOptions, Bbox, BboxUpdate, NoUpdate
+from dash_annotate_cv.annotate_image_controller import AnnotateImageController, AnnotateImageOptions, Bbox, BboxUpdate, NoUpdate, DuplicateBboxError
 from dash_annotate_cv.annotate_image_controls import AnnotateImageControlsAIO
 from dash_annotate_cv.helpers import get_trigger_id, Xyxy
 from dash_annotate_cv.image_source import ImageSource
 from dash_annotate_cv.label_source import LabelSource
+from dash_annotate_cv.label_dropdown import label_dropdown, define_label_search_callback
 from dash_annotate_cv.formats.image_annotations import ImageAnnotations
 from dash_annotate_cv.annotation_storage import AnnotationStorage
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.jobs import JobRunner
+from dash_annotate_cv.large_image import LargeImage, viewport_from_relayout
 
 from typing import Optional
 import plotly.express as px
+import plotly.graph_objects as go
 from dash import dcc, html, Input, Output, no_update, callback, State
-from dash import Output, Input, html, dcc, callback, MATCH, ALL
-from typing import Optional, List, Dict, Any
+from dash import Output, Input, html, dcc, callback, MATCH, ALL, Patch, set_props
+from typing import Optional, List, Dict, Any, Tuple
 import plotly.express as px
 import dash_bootstrap_components as dbc
 from dataclasses import dataclass
+from PIL import Image
+import base64
+import io
 import logging
 
 
@@ -47,6 +55,12 @@ class AnnotateImageBboxsAIO(html.Div):
             'aio_id': aio_id,
             'idx': idx
         }
+        row_status = lambda aio_id, idx: {
+            'component': 'AnnotateImageBboxsAIO',
+            'subcomponent': 'row_status',
+            'aio_id': aio_id,
+            'idx': idx
+        }
         delete_button = lambda aio_id, idx: {
             'component': 'AnnotateImageBboxsAIO',
             'subcomponent': 'delete_button',
@@ -64,6 +78,26 @@ class AnnotateImageBboxsAIO(html.Div):
             'subcomponent': 'alert',
             'aio_id': aio_id
         }
+        list_pager = lambda aio_id: {
+            'component': 'AnnotateImageBboxsAIO',
+            'subcomponent': 'list_pager',
+            'aio_id': aio_id
+        }
+        list_pager_label = lambda aio_id: {
+            'component': 'AnnotateImageBboxsAIO',
+            'subcomponent': 'list_pager_label',
+            'aio_id': aio_id
+        }
+        list_prev = lambda aio_id: {
+            'component': 'AnnotateImageBboxsAIO',
+            'subcomponent': 'list_prev',
+            'aio_id': aio_id
+        }
+        list_next = lambda aio_id: {
+            'component': 'AnnotateImageBboxsAIO',
+            'subcomponent': 'list_next',
+            'aio_id': aio_id
+        }
 
     ids = ids
 
@@ -73,7 +107,8 @@ class AnnotateImageBboxsAIO(html.Div):
         annotation_storage: AnnotationStorage = AnnotationStorage(),
         annotations_existing: Optional[ImageAnnotations] = None,
         aio_id: Optional[str] = None,
-        options: AnnotateImageOptions = AnnotateImageOptions()
+        options: AnnotateImageOptions = AnnotateImageOptions(),
+        job_runner: Optional[JobRunner] = None
         ):
         """Constructor
 
@@ -84,6 +119,7 @@ class AnnotateImageBboxsAIO(html.Div):
             annotations_existing (Optional[ImageAnnotations], optional): Existing annotations. Defaults to None.
             aio_id (Optional[str], optional): AIO Id to use for components. Defaults to None.
             options (AnnotateImageOptions, optional): Options. Defaults to AnnotateImageOptions().
+            job_runner (Optional[JobRunner], optional): Runner for export, import and validation jobs; their controls are shown if set. Defaults to None.
         """        
         options.check_valid()
 
@@ -96,10 +132,12 @@ class AnnotateImageBboxsAIO(html.Div):
             options=options
             )
         self.converter = BboxToShapeConverter(options=options)
+        self.list_view = BboxListView(page_size=options.bbox_list_page_size)
         self.controls = AnnotateImageControlsAIO(
             controller=self.controller,
             refresh_layout_callback=self._create_layout,
-            aio_id=aio_id
+            aio_id=aio_id,
+            job_runner=job_runner
             )
         self.aio_id = self.controls.aio_id
 
@@ -110,6 +148,7 @@ class AnnotateImageBboxsAIO(html.Div):
         """Create layout for component
         """
         logger.debug("Creating layout for component")
+        self.list_view.page = 0
 
         curr_image_layout = self._create_layout_for_curr_image()  
 
@@ -123,7 +162,12 @@ class AnnotateImageBboxsAIO(html.Div):
             dbc.Col([
                 html.Div(id=self.ids.alert(self.aio_id)),
                 instructions,
-                html.Div(id=self.ids.bbox_labeling(self.aio_id))
+                dbc.ListGroup(id=self.ids.bbox_labeling(self.aio_id)),
+                html.Div([
+                    dbc.Button("Previous", color="secondary", size="sm", className="mr-1", id=self.ids.list_prev(self.aio_id)),
+                    html.Small(id=self.ids.list_pager_label(self.aio_id), className="mx-2"),
+                    dbc.Button("Next", color="secondary", size="sm", className="mr-1", id=self.ids.list_next(self.aio_id))
+                    ], id=self.ids.list_pager(self.aio_id), style={"display": "none"}, className="mt-2")
                 ], md=6, class_name="align-self-center")
         ])
 
@@ -133,7 +177,12 @@ class AnnotateImageBboxsAIO(html.Div):
         image = self.controller.curr.image if self.controller.curr is not None else None
         if image is None:
             return []
-        fig = px.imshow(image)
+        if isinstance(image, LargeImage):
+            fig = self._create_large_image_figure(image)
+        else:
+            with metrics.timer("image_decode_duration_seconds", {"component": "AnnotateImageBboxsAIO"}):
+                image.load()
+            fig = px.imshow(image)
         rgb = self.options.default_bbox_color
         line_color = 'rgba(%d,%d,%d,1)' % rgb
         fig.update_layout(
@@ -143,29 +192,114 @@ class AnnotateImageBboxsAIO(html.Div):
         fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
         return dcc.Graph(id=self.ids.graph_picture(self.aio_id), figure=fig)
     
+    def _create_large_image_figure(self, image: LargeImage) -> go.Figure:
+        """Figure for a large image: the image is a layout image covering only the viewport, in base image coordinates
+
+        An invisible trace at the corners sets the extent of the axes, so that resetting the zoom shows the whole image.
+        """
+        fig = go.Figure(go.Scatter(
+            x=[0, image.width], 
+            y=[0, image.height], 
+            mode="markers", 
+            marker=dict(opacity=0), 
+            hoverinfo="skip", 
+            showlegend=False
+            ))
+        fig.update_xaxes(showgrid=False, zeroline=False, constrain="domain")
+        fig.update_yaxes(showgrid=False, zeroline=False, autorange="reversed", scaleanchor="x", constrain="domain")
+        fig.update_layout(
+            images=[self._viewport_layout_image(image, [0, 0, image.width, image.height])],
+            # Keep the user's zoom when the figure is updated with a new viewport image
+            uirevision=self.controller.curr.image_name if self.controller.curr is not None else None,
+            plot_bgcolor="white"
+            )
+        return fig
+
+    def _viewport_layout_image(self, image: LargeImage, viewport: Xyxy) -> Dict:
+        viewport_image, xyxy = image.viewport(viewport, self.options.large_image_viewport_size)
+        return dict(
+            source=_image_to_data_uri(viewport_image),
+            xref="x",
+            yref="y",
+            x=xyxy[0],
+            y=xyxy[1],
+            sizex=xyxy[2] - xyxy[0],
+            sizey=xyxy[3] - xyxy[1],
+            xanchor="left",
+            yanchor="top",
+            sizing="stretch",
+            layer="below"
+            )
+
     def _create_bbox_layout(self):
+        """Render the shown page of the bbox list from scratch
+        """
         if self.controller.curr is None:
             logger.debug("Creating bbox layout - no curr image")
             return no_update
         
-        if self.controller.curr.bboxs is None:
-            logger.debug("Creating bbox layout - no bboxs")
-            bbox_list_group = []
-        else:
-            logger.debug(f"Creating bbox layout - num bboxs: {len(self.controller.curr.bboxs)}")
-            bbox_list_group = [
-                self._create_list_group_for_bbox_layout(bbox,idx)
-                for idx,bbox in enumerate(self.controller.curr.bboxs)
-                ]
+        bboxs = self.controller.curr_bboxs
+        logger.debug(f"Creating bbox layout - num bboxs: {len(bboxs)}")
+        self.list_view.reset(len(bboxs))
+        start, end = self.list_view.page_range()
+        return [ self._create_list_group_for_bbox_layout(bboxs[idx], self.list_view.keys[idx]) for idx in range(start, end) ]
+
+    def _patch_bbox_layout(self, ops: Optional[List[Tuple]]):
+        """Apply changes of the shown rows in the browser, rendering only added and changed rows
+
+        Args:
+            ops (Optional[List[Tuple]]): Operations from `BboxListView`, or None to render the page from scratch
+        """
+        if ops is None:
+            return self._create_bbox_layout()
+        if len(ops) == 0:
+            return no_update
+        bboxs = self.controller.curr_bboxs
+        patch = Patch()
+        for op in ops:
+            if op[0] == "remove":
+                del patch[op[1]]
+            elif op[0] == "append":
+                patch.append(self._create_list_group_for_bbox_layout(bboxs[op[1]], self.list_view.keys[op[1]]))
+            elif op[0] == "replace":
+                patch[op[1]] = self._create_list_group_for_bbox_layout(bboxs[op[2]], self.list_view.keys[op[2]])
+            else:
+                raise NotImplementedError(f"Unknown list operation: {op[0]}")
+        return patch
+
+    def _list_ops_for_count_change(self, change: int, idx: Optional[int] = None) -> Optional[List[Tuple]]:
+        """List operations after a bbox was added (change 1) or deleted (change -1). Any other change in the number
+        of bboxs, e.g. when the controller merged duplicates, renders the page from scratch
+        """
+        if len(self.controller.curr_bboxs) != len(self.list_view.keys) + change:
+            return None
+        if change == 1:
+            return self.list_view.added()
+        elif change == -1:
+            assert idx is not None, "idx should not be None"
+            return self.list_view.removed(idx)
+        return None
+
+    def _create_pager_layout(self) -> Tuple[Any,Dict]:
+        """Label and style of the pager below the bbox list, which is only shown for lists longer than a page
+        """
+        no_bboxs = len(self.list_view.keys)
+        if self.list_view.no_pages <= 1:
+            return None, {"display": "none"}
+        start, end = self.list_view.page_range()
+        return f"Bounding boxes {start+1}-{end} of {no_bboxs}", {}
 
-        return dbc.ListGroup(bbox_list_group)
+    def _create_row_status_layout(self, bbox: Bbox):
+        if bbox.class_name is None:
+            return dbc.Badge("No label", color="warning")
+        return None
 
-    def _create_list_group_for_bbox_layout(self, bbox: Bbox, bbox_idx: int):
+    def _create_list_group_for_bbox_layout(self, bbox: Bbox, row_key: int):
         xyxy_label = "(%s)" % ",".join([str(int(x)) for x in bbox.xyxy])
-        dropdown = dcc.Dropdown(
-            self.controller.labels, 
-            value=bbox.class_name, 
-            id=self.ids.dropdown(self.aio_id, bbox_idx), 
+        dropdown = label_dropdown(
+            self.controller.label_set,
+            self.ids.dropdown(self.aio_id, row_key),
+            value=bbox.class_name
             )
 
         button_delete = dbc.Button(
@@ -173,7 +307,7 @@ class AnnotateImageBboxsAIO(html.Div):
             color="danger", 
             size="sm", 
             className="mr-1",
-            id=self.ids.delete_button(self.aio_id, bbox_idx)
+            id=self.ids.delete_button(self.aio_id, row_key)
             )
 
         button_highlight = dbc.Button(
@@ -181,13 +315,13 @@ class AnnotateImageBboxsAIO(html.Div):
             color="primary", 
             size="sm", 
             className="mr-1",
-            id=self.ids.highlight_bbox(self.aio_id, bbox_idx)
+            id=self.ids.highlight_bbox(self.aio_id, row_key)
             )
 
         return dbc.ListGroupItem([
             dbc.Row([
                 dbc.Col(dropdown, lg=4, md=6),
-                dbc.Col(xyxy_label, lg=4, md=6),
+                dbc.Col([xyxy_label, html.Span(self._create_row_status_layout(bbox), id=self.ids.row_status(self.aio_id, row_key), className="ms-2")], lg=4, md=6),
                 dbc.Col(button_highlight, lg=2, md=6),
                 dbc.Col(button_delete, lg=2, md=6)
                 ])
@@ -216,41 +350,47 @@ class AnnotateImageBboxsAIO(html.Div):
             Output(self.ids.bbox_labeling(MATCH), 'children'),
             Output(self.ids.graph_picture(MATCH), "figure"),
             Output(self.ids.alert(MATCH), "children"),
+            Output(self.ids.list_pager_label(MATCH), "children"),
+            Output(self.ids.list_pager(MATCH), "style"),
             Input(self.ids.graph_picture(MATCH), "relayoutData"),
             Input(self.ids.delete_button(MATCH, ALL), "n_clicks"),
             Input(self.ids.highlight_bbox(MATCH, ALL), "n_clicks"),
-            Input(self.ids.dropdown(MATCH, ALL), "value"),
+            Input(self.ids.list_prev(MATCH), "n_clicks"),
+            Input(self.ids.list_next(MATCH), "n_clicks"),
             State(self.ids.graph_picture(MATCH), "figure")
             )
-        def update(relayout_data, n_clicks_delete, n_clicks_select, dropdown_value, figure):
+        @metrics.instrument_callback("AnnotateImageBboxsAIO.update")
+        def update(relayout_data, n_clicks_delete, n_clicks_select, n_clicks_prev, n_clicks_next, figure):
 
-            trigger_id, idx = get_trigger_id()
-            logger.debug(f"Update: trigger ID: {trigger_id} idx: {idx}")
+            trigger_id, key = get_trigger_id()
+            logger.debug(f"Update: trigger ID: {trigger_id} key: {key}")
 
             if trigger_id == "delete_button":
                 logger.debug("Pressed delete_button")
-                assert idx is not None, "idx should not be None"
-                update = self._handle_delete_button_pressed(idx, figure)
+                assert key is not None, "key should not be None"
+                update = self._handle_delete_button_pressed(self.list_view.idx_of(key), figure)
 
             elif trigger_id == "highlight_bbox":
                 logger.debug("Pressed highlight_bbox")
-                assert idx is not None, "idx should not be None"
-                update = self._handle_highlight_button_pressed(idx, figure)
+                assert key is not None, "key should not be None"
+                update = self._handle_highlight_button_pressed(self.list_view.idx_of(key), figure)
 
-            elif trigger_id == "dropdown":
-                logger.debug(f"Changed dropdown to {dropdown_value}")
-                assert idx is not None, "idx should not be None"
-                update = self._handle_dropdown_changed(idx, dropdown_value[idx], figure)
+            elif trigger_id in ["list_prev", "list_next"]:
+                self.list_view.page += -1 if trigger_id == "list_prev" else 1
+                update = AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), no_update, no_update)
 
             elif trigger_id == "graph_picture":
 
                 if relayout_data is not None and "shapes" in relayout_data:
                     # A new box was drawn
                     # We receive all boxes from the data
-                    update = self._handle_new_box_drawn(relayout_data)
+                    update = self._handle_new_box_drawn(relayout_data, figure)
                 elif relayout_data is not None and "shapes" in " ".join(list(relayout_data.keys())):
                     # A box was updated
-                    update = self._handle_box_updated(relayout_data)
+                    update = self._handle_box_updated(relayout_data, figure)
+                elif relayout_data is not None and self._is_large_image() and viewport_from_relayout(relayout_data, 1, 1) is not None:
+                    # Zoom or pan: fetch the viewport at the matching resolution
+                    update = self._handle_viewport_changed(relayout_data, figure)
                 else:
                     logger.warning(f"Unrecognized trigger for {trigger_id}")
                     # Just draw latest
@@ -262,8 +402,25 @@ class AnnotateImageBboxsAIO(html.Div):
                 self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
                 update = AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), figure, self._create_alert_layout())
             
-            return update.bbox_layout, update.figure, update.alert
+            if trigger_id in ["delete_button", "graph_picture"]:
+                self.controls.refresh_progress()
+            pager_label, pager_style = self._create_pager_layout()
+            return update.bbox_layout, update.figure, update.alert, pager_label, pager_style
 
+        # One callback per row, so that changing a class sends only that dropdown's value
+        @callback(
+            Output(self.ids.row_status(MATCH, MATCH), "children"),
+            Input(self.ids.dropdown(MATCH, MATCH), "value"),
+            prevent_initial_call=True
+            )
+        @metrics.instrument_callback("AnnotateImageBboxsAIO.change_class")
+        def change_class(dropdown_value):
+            _, key = get_trigger_id()
+            logger.debug(f"Changed dropdown of row {key} to {dropdown_value}")
+            assert key is not None, "key should not be None"
+            return self._handle_dropdown_changed(self.list_view.idx_of(key), dropdown_value)
+
+        define_label_search_callback(self.ids.dropdown(MATCH, MATCH), self.controller.label_set, "AnnotateImageBboxsAIO.search_labels")
         logger.debug("Defined callbacks")
 
     @dataclass
@@ -272,33 +429,74 @@ class AnnotateImageBboxsAIO(html.Div):
         figure: Any
         alert: Any
 
+    def _is_large_image(self) -> bool:
+        return self.controller.curr is not None and isinstance(self.controller.curr.image, LargeImage)
+
+    def _handle_viewport_changed(self, relayout_data: Dict, figure: Dict) -> Update:
+        assert self.controller.curr is not None, "curr should not be None"
+        image = self.controller.curr.image
+        assert isinstance(image, LargeImage), "image should be a LargeImage"
+        viewport = viewport_from_relayout(relayout_data, image.width, image.height)
+        assert viewport is not None, "relayout_data should contain a viewport"
+        logger.debug(f"Viewport changed: {viewport}")
+        figure['layout']['images'] = [self._viewport_layout_image(image, viewport)]
+        return AnnotateImageBboxsAIO.Update(no_update, figure, no_update)
+
     def _handle_delete_button_pressed(self, idx: int, figure: Dict) -> Update:
         logger.debug(f"Deleting bbox idx: {idx}")
         self.controller.delete_bbox(idx)
         self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
-        return AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), figure, self._create_alert_layout())
+        ops = self._list_ops_for_count_change(-1, idx)
+        return AnnotateImageBboxsAIO.Update(self._patch_bbox_layout(ops), figure, self._create_alert_layout())
 
     def _handle_highlight_button_pressed(self, idx: int, figure: Dict) -> Update:
         self.controller.curr_bboxs[idx].is_highlighted = not self.controller.curr_bboxs[idx].is_highlighted
         self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
         return AnnotateImageBboxsAIO.Update(no_update, figure, self._create_alert_layout())
 
-    def _handle_dropdown_changed(self, idx: int, dropdown_value_new: str, figure: Dict) -> Update:
+    def _handle_dropdown_changed(self, idx: int, dropdown_value_new: Optional[str]):
+        """Store the class chosen in a row's dropdown, and update only that bbox's shape
+
+        Returns:
+            Status shown in the row
+        """
         if type(dropdown_value_new) == list:
             logger.warning("Dropdown value is list, expected string")
-            return AnnotateImageBboxsAIO.Update(no_update, no_update, self._create_alert_layout())
-        assert idx is not None, "idx should not be None"
+            return no_update
         self.controller.update_bbox(BboxUpdate(idx, class_name_new=dropdown_value_new))
-        self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
-        return AnnotateImageBboxsAIO.Update(no_update, figure, self._create_alert_layout())
+        bbox = self.controller.curr_bboxs[idx]
+
+        # Patch the one shape rather than sending the figure, which holds the image
+        figure = Patch()
+        figure['layout']['shapes'][idx] = self.converter.bbox_to_shape(bbox)
+        set_props(self.ids.graph_picture(self.aio_id), {"figure": figure})
+        set_props(self.ids.alert(self.aio_id), {"children": self._create_alert_layout()})
+        self.controls.refresh_progress()
+        return self._create_row_status_layout(bbox)
 
-    def _handle_new_box_drawn(self, relayout_data: Dict) -> Update:
+    def _handle_new_box_drawn(self, relayout_data: Dict, figure: Dict) -> Update:
         new_shape = relayout_data["shapes"][-1]
         new_bbox = self.converter.shape_to_bbox(new_shape)
-        self.controller.add_bbox(new_bbox)
-        return AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), no_update, self._create_alert_layout())
+        try:
+            self.controller.add_bbox(new_bbox)
+        except DuplicateBboxError as e:
+            logger.info(f"Rejected duplicate bbox: {e}")
+            return self._update_with_rejected_shape("Bounding box duplicates an existing one", figure)
+
+        ops = self._list_ops_for_count_change(1)
+        if len(relayout_data["shapes"]) != len(self.controller.curr_bboxs):
+            # Shape was merged into an existing bbox
+            self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
+            return AnnotateImageBboxsAIO.Update(self._patch_bbox_layout(ops), figure, self._create_alert_layout())
+        return AnnotateImageBboxsAIO.Update(self._patch_bbox_layout(ops), no_update, self._create_alert_layout())
+
+    def _update_with_rejected_shape(self, message: str, figure: Dict) -> Update:
+        # Redraw from the stored bboxs to drop the rejected shape
+        self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
+        alerts = [dbc.Alert(message, color="warning")] + self._create_alert_layout()
+        return AnnotateImageBboxsAIO.Update(no_update, figure, alerts)
 
-    def _handle_box_updated(self, relayout_data: Dict) -> Update:
+    def _handle_box_updated(self, relayout_data: Dict, figure: Dict) -> Update:
 
         # Parse shapes[0].x1 -> 0 from the brackets
         label = list(relayout_data.keys())[0]
@@ -308,9 +506,117 @@ class AnnotateImageBboxsAIO(html.Div):
 
         # Update
         update = BboxUpdate(box_idx, xyxy_new=xyxy)
-        self.controller.update_bbox(update)
-        return AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), no_update, self._create_alert_layout())
-        
+        try:
+            self.controller.update_bbox(update)
+        except DuplicateBboxError as e:
+            logger.info(f"Rejected duplicate bbox update: {e}")
+            return self._update_with_rejected_shape("Bounding box duplicates an existing one", figure)
+
+        if len(figure['layout'].get('shapes', [])) != len(self.controller.curr_bboxs):
+            # Bbox was merged into an existing bbox
+            self.converter.refresh_figure_shapes(figure, self.controller.curr_bboxs)
+            return AnnotateImageBboxsAIO.Update(self._create_bbox_layout(), figure, self._create_alert_layout())
+        return AnnotateImageBboxsAIO.Update(self._patch_bbox_layout(self.list_view.changed(box_idx)), no_update, self._create_alert_layout())
+
+
+class BboxListView:
+    """Which bboxs of the current image are shown in the list panel: one page of rows, each with a key that stays the same while it is shown
+
+    Rows are keyed rather than numbered by bbox, so that single rows can be added, replaced or removed in the browser without
+    renumbering the others. Changes return the operations on the shown rows, or None if the page must be rendered from scratch:
+    ("append", bbox idx), ("remove", row position) and ("replace", row position, bbox idx).
+    """
+
+
+    def __init__(self, page_size: int):
+        """Constructor
+
+        Args:
+            page_size (int): Maximum number of rows shown
+        """
+        self.page_size = page_size
+        self.page = 0
+        self.keys: List[int] = []
+        self._key_next = 0
+
+
+    @property
+    def no_pages(self) -> int:
+        return max(1, -(-len(self.keys) // self.page_size))
+
+
+    def page_range(self) -> Tuple[int,int]:
+        """Indexes of the first shown bbox and one past the last
+        """
+        start = self.page * self.page_size
+        return start, min(start + self.page_size, len(self.keys))
+
+
+    def _new_key(self) -> int:
+        self._key_next += 1
+        return self._key_next
+
+
+    def reset(self, no_bboxs: int):
+        """New keys for all bboxs, when the page is rendered from scratch. Keeps the page if it still exists
+
+        Args:
+            no_bboxs (int): Number of bboxs
+        """
+        self.keys = [ self._new_key() for _ in range(no_bboxs) ]
+        self.page = min(max(self.page, 0), self.no_pages - 1)
+
+
+    def idx_of(self, key: int) -> int:
+        """Index of the bbox shown in a row
+
+        Args:
+            key (int): Row key
+
+        Returns:
+            int: Bbox index
+        """
+        return self.keys.index(key)
+
+
+    def added(self) -> Optional[List[Tuple]]:
+        """A bbox was appended. Shows the last page, where it is
+        """
+        self.keys.append(self._new_key())
+        idx = len(self.keys) - 1
+        start, end = self.page_range()
+        if start <= idx < end:
+            return [("append", idx)]
+        self.page = self.no_pages - 1
+        return None
+
+
+    def removed(self, idx: int) -> Optional[List[Tuple]]:
+        """A bbox was deleted. The rows after it move up, and the first bbox of the next page moves into the last row
+        """
+        start, end = self.page_range()
+        del self.keys[idx]
+        if idx >= end:
+            return []
+        if start >= len(self.keys) and self.page > 0:
+            # The page is now empty
+            self.page -= 1
+            return None
+        ops: List[Tuple] = [("remove", max(idx - start, 0))]
+        if end - 1 < len(self.keys):
+            ops.append(("append", end - 1))
+        return ops
+
+
+    def changed(self, idx: int) -> List[Tuple]:
+        """A bbox was changed
+        """
+        start, end = self.page_range()
+        if start <= idx < end:
+            return [("replace", idx - start, idx)]
+        return []
+
+
 class BboxToShapeConverter:
 
     def __init__(self, options: AnnotateImageOptions):
@@ -403,3 +709,16 @@ class BboxToShapeConverter:
             'x1': bbox.xyxy[2], 
             'y1': bbox.xyxy[3]
             }
+
+
+def _image_to_data_uri(image: Image.Image) -> str:
+    """Encode an image as a data URI for a figure's layout image: JPEG for RGB and grayscale, PNG otherwise
+    """
+    buf = io.BytesIO()
+    if image.mode in ("RGB", "L"):
+        image.save(buf, format="JPEG", quality=90)
+        mime = "image/jpeg"
+    else:
+        image.save(buf, format="PNG")
+        mime = "image/png"
+    return f"data:{mime};base64,{base64.b64encode(buf.getvalue()).decode('ascii')}"
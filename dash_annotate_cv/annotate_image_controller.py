@@ -1,8 +1,16 @@
 from dash_annotate_cv.formats.image_annotations import ImageAnnotations
 from dash_annotate_cv.annotation_storage import AnnotationStorage, AnnotationWriter
 from dash_annotate_cv.image_source import ImageSource, ImageIterator, IndexAboveError
-from dash_annotate_cv.label_source import LabelSource
+from dash_annotate_cv.label_source import LabelSource, LabelSet
 from dash_annotate_cv.helpers import UnknownError, Xyxy
+from dash_annotate_cv.annotation_stats import AnnotationStats, ProgressSnapshot
+from dash_annotate_cv.overlap import DuplicatePolicy, find_duplicate, find_duplicates, merge_duplicates
+from dash_annotate_cv.large_image import LargeImage
+from dash_annotate_cv.rle import Rle, counts_to_string
+from dash_annotate_cv.checkpoints import CheckpointInfo
+from dash_annotate_cv.image_hash import DuplicateImageAction
+from dash_annotate_cv.merge import MergeOptions, merge_image_entries
+from dash_annotate_cv.metrics import registry as metrics
 
 from dataclasses import dataclass
 from typing import Optional, List, Dict, Tuple, Union
@@ -14,6 +22,7 @@ import json
 import random
 from enum import Enum
 import copy
+import threading
 import logging
 
 
@@ -45,6 +54,16 @@ class InvalidBboxError(Exception):
     pass
 
 
+class DuplicateBboxError(InvalidBboxError):
+    """Bbox duplicates an existing bbox
+    """
+    pass
+
+
+class InvalidMaskError(Exception):
+    pass
+
+
 class NoUpdate(Enum):
     NO_UPDATE = "NO_UPDATE"
 
@@ -64,13 +83,15 @@ class BboxUpdate:
 class ImageAnn:
     image_idx: int
     image_name: str
-    image: Image.Image
+    image: Union[Image.Image,LargeImage]
     label_single: Optional[str]
     label_multiple: Optional[List[str]]
     bboxs: Optional[List[Bbox]]
+    masks: Optional[List[ImageAnnotations.Annotation.Mask]] = None
 
     def __repr__(self):
-        return f"ImageAnn(image_idx={self.image_idx}, image_name={self.image_name}, label_single={self.label_single}, label_multiple={self.label_multiple}, bboxs={self.bboxs})"
+        no_masks = len(self.masks) if self.masks is not None else None
+        return f"ImageAnn(image_idx={self.image_idx}, image_name={self.image_name}, label_single={self.label_single}, label_multiple={self.label_multiple}, bboxs={self.bboxs}, no_masks={no_masks})"
 
 
 @dataclass
@@ -99,9 +120,51 @@ class AnnotateImageOptions(DataClassDictMixin):
     # Default color
     default_bbox_color: Tuple[int,int,int] = (64,64,88)
 
+    # IoU at or above which a bbox duplicates an existing bbox of the same class (or either without class). None = no check
+    duplicate_iou_threshold: Optional[float] = None
+
+    # What to do with duplicate bboxs when adding, updating or loading
+    duplicate_policy: DuplicatePolicy = DuplicatePolicy.REJECT
+
+    # Large images: maximum size in pixels along the longer side of the displayed region, read at the matching resolution
+    large_image_viewport_size: int = 1024
+
+    # Gallery: number of thumbnails per page
+    gallery_page_size: int = 24
+
+    # Gallery: maximum thumbnail size in pixels along the longer side
+    thumbnail_size: int = 160
+
+    # Gallery: directory for cached thumbnails. None = system temporary directory
+    thumbnail_cache_dir: Optional[str] = None
+
+    # Image labels: label with number keys and navigate with arrow keys in the browser, saving decisions in batches
+    keyboard_shortcuts: bool = False
+
+    # Keyboard shortcuts: number of label decisions sent to the server at once. Twice as many images are preloaded
+    keyboard_batch_size: int = 10
+
+    # Keyboard shortcuts: maximum size in pixels along the longer side of the preloaded images
+    keyboard_image_size: int = 768
+
+    # Masks: maximum size in pixels along the longer side of the overlay showing the masks
+    mask_overlay_size: int = 1024
+
+    # Bboxs: number of rows shown at a time in the list of bboxs; longer lists are paged
+    bbox_list_page_size: int = 50
+
     def check_valid(self):
         """Check options are valid
         """        
+        if self.duplicate_iou_threshold is not None:
+            assert 0 < self.duplicate_iou_threshold <= 1, "duplicate_iou_threshold must be in (0,1]"
+        assert self.large_image_viewport_size > 0, "large_image_viewport_size must be positive"
+        assert self.gallery_page_size > 0, "gallery_page_size must be positive"
+        assert self.thumbnail_size > 0, "thumbnail_size must be positive"
+        assert self.keyboard_batch_size > 0, "keyboard_batch_size must be positive"
+        assert self.keyboard_image_size > 0, "keyboard_image_size must be positive"
+        assert self.mask_overlay_size > 0, "mask_overlay_size must be positive"
+        assert self.bbox_list_page_size > 0, "bbox_list_page_size must be positive"
         if self.class_to_color is not None:
             assert isinstance(self.class_to_color, dict), "class_to_color must be a dict"
             for k,v in self.class_to_color.items():
@@ -170,12 +233,17 @@ class AnnotateImageController:
         """
         options.check_valid()
         self.options = options
-        self.annotation_writer = AnnotationWriter(annotation_storage)
+        self._lock = threading.RLock()
         self.label_source = label_source
         self.image_source = image_source
-        self._labels = label_source.get_labels()
+        self.taxonomy = label_source.get_taxonomy()
+        self.annotation_writer = AnnotationWriter(annotation_storage, self.taxonomy.supercategories() if self.taxonomy is not None else None)
+        self._labels = label_source.get_label_set()
         self.annotations = annotations_existing or ImageAnnotations.new()
-        self._image_iterator = ImageIterator(self.image_source)
+        self._check_duplicates_on_load()
+        self.stats = AnnotationStats.from_annotations(self.annotations)
+        skip_duplicates = image_source.duplicate_max_distance is not None and image_source.duplicate_action == DuplicateImageAction.SKIP
+        self._image_iterator = ImageIterator(self.image_source, skip=self._is_duplicate_of_annotated if skip_duplicates else None)
 
         # Load the first image
         try:
@@ -195,6 +263,26 @@ class AnnotateImageController:
         return self._image_iterator.no_images
 
 
+    @property
+    def curr_position(self) -> int:
+        """Position of the current image in the order images are visited in, which is its index unless `order` is set in the image source
+        """
+        return self._image_iterator.pos_of_curr_img
+
+
+    def progress(self) -> ProgressSnapshot:
+        """Dataset progress and statistics, maintained incrementally. Counts per class are rolled up the taxonomy, if labels come from one
+
+        Returns:
+            ProgressSnapshot: Progress
+        """        
+        snapshot = self.stats.snapshot(no_images_total=self.no_images)
+        if self.taxonomy is not None:
+            snapshot.bboxs_per_class_rolled_up = self.taxonomy.roll_up(snapshot.bboxs_per_class)
+            snapshot.labels_per_class_rolled_up = self.taxonomy.roll_up(snapshot.labels_per_class)
+        return snapshot
+
+
     @property
     def labels(self) -> List[str]:
         """Labels
@@ -202,7 +290,17 @@ class AnnotateImageController:
         Returns:
             List[str]: Labels
         """        
-        return list(self._labels)
+        return list(self._labels.labels)
+
+
+    @property
+    def label_set(self) -> LabelSet:
+        """Labels, indexed for lookup and search. Prefer over `labels` for large taxonomies, which copies the list
+
+        Returns:
+            LabelSet: Labels
+        """
+        return self._labels
 
 
     @property
@@ -227,6 +325,94 @@ class AnnotateImageController:
         return self.curr.bboxs or []
 
 
+    @property
+    def curr_masks(self) -> List[ImageAnnotations.Annotation.Mask]:
+        """Current segmentation masks
+
+        Returns:
+            List[ImageAnnotations.Annotation.Mask]: List of masks
+        """        
+        if self.curr is None:
+            return []
+        return self.curr.masks or []
+
+
+    def image_name_at_idx(self, idx: int) -> str:
+        """Name of the image at an index of the image source, without loading the image
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            str: Image name
+        """        
+        return self._image_iterator.name_at_idx(idx)
+
+
+    def thumbnail_source_at_idx(self, idx: int) -> Union[str,Image.Image]:
+        """File name of the image at an index, or the image itself for in-memory sources
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            Union[str,Image.Image]: File name or image
+        """        
+        return self._image_iterator.source_at_idx(idx)
+
+
+    def duplicates_at_idx(self, idx: int) -> List[int]:
+        """Indexes of near-duplicates of the image at an index, closest first. Empty unless `duplicate_max_distance` is set in the image source
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            List[int]: Indexes of other images
+        """
+        return self._image_iterator.duplicates_of(idx)
+
+
+    def update_priorities(self, image_scores: Dict[str,float]):
+        """Change the scores of images in the priority order, e.g. with new model uncertainties. Images already visited keep their position
+
+        Args:
+            image_scores (Dict[str,float]): Score of each image name
+        """
+        with self._lock:
+            no_updated = 0
+            for image_name, score in image_scores.items():
+                idx = self._image_idx_of_name(image_name)
+                if idx is None:
+                    logger.warning(f"Cannot update the score of unknown image {image_name}")
+                    continue
+                self._image_iterator.update_priority(idx, score)
+                no_updated += 1
+            logger.debug(f"Updated the scores of {no_updated} images")
+
+
+    def prefetch_images(self, idxs: List[int]):
+        """Start downloading images of a remote source in the background. Does nothing for other sources
+
+        Args:
+            idxs (List[int]): Indexes
+        """        
+        self._image_iterator.prefetch(idxs)
+
+
+    def label_for_image(self, image_name: str) -> Optional[ImageAnnotations.Annotation.Label]:
+        """Stored label of an image
+
+        Args:
+            image_name (str): Image name as returned by `image_name_at_idx`
+
+        Returns:
+            Optional[ImageAnnotations.Annotation.Label]: Label, or None if not labeled
+        """        
+        entry = self.annotations.image_to_entry.get(self._ann_image_name(image_name))
+        return entry.label if entry is not None else None
+
+
     @property
     def _curr_image_name(self) -> str:
         if self._curr is None:
@@ -248,43 +434,60 @@ class AnnotateImageController:
         Raises:
             InvalidLabelError: Invalid label
         """        
-        logger.debug(f"Adding bbox: {bbox}")
-
-        # Store the annotation
-        ann = self.annotations.get_or_add_image(
-            image_name=self._curr_image_name, 
-            img_width=self._curr.image.width if self._curr is not None else None,
-            img_height=self._curr.image.height if self._curr is not None else None, 
-            )
-        ann.bboxs = ann.bboxs or []
-
-        # Check labels are allowed
-        if bbox.class_name is not None and not bbox.class_name in self._labels:
-            raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (bbox.class_name, str(self._labels)))
-        self._check_fix_xyxy_valid(bbox.xyxy)
-
-        # Add bounding box
-        bbox_obj = ImageAnnotations.Annotation.Bbox(
-            xyxy=bbox.xyxy,
-            class_name=bbox.class_name,
-            timestamp=self._timestamp_or_none,
-            author=self.options.author
-            )
-        ann.bboxs = (ann.bboxs or []) + [bbox_obj]
-
-        # History
-        if self.options.store_history:
-            op = ImageAnnotations.Annotation.BboxHistory(
-                operation=ImageAnnotations.Annotation.BboxHistory.Operation.ADD,
-                bbox=copy.deepcopy(bbox_obj)
+        with self._lock:
+            logger.debug(f"Adding bbox: {bbox}")
+
+            # Store the annotation
+            ann = self.annotations.get_or_add_image(
+                image_name=self._curr_image_name, 
+                img_width=self._curr.image.width if self._curr is not None else None,
+                img_height=self._curr.image.height if self._curr is not None else None, 
+                )
+            ann.bboxs = ann.bboxs or []
+
+            # Check labels are allowed
+            if bbox.class_name is not None and not bbox.class_name in self._labels:
+                raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (bbox.class_name, str(self._labels)))
+            self._check_fix_xyxy_valid(bbox.xyxy)
+
+            # Duplicates
+            duplicate = self._find_duplicate(ann.bboxs, bbox.xyxy, bbox.class_name)
+            if duplicate is not None:
+                idx_existing, iou = duplicate
+                if self.options.duplicate_policy == DuplicatePolicy.REJECT:
+                    raise DuplicateBboxError(f"Bbox {bbox} duplicates existing bbox {idx_existing} (IoU {iou:.2f})")
+                elif self.options.duplicate_policy == DuplicatePolicy.MERGE:
+                    logger.info(f"Merging bbox {bbox} into existing bbox {idx_existing} (IoU {iou:.2f})")
+                    if ann.bboxs[idx_existing].class_name is None and bbox.class_name is not None:
+                        self.update_bbox(BboxUpdate(idx_existing, class_name_new=bbox.class_name))
+                    return
+                else:
+                    logger.warning(f"Bbox {bbox} duplicates existing bbox {idx_existing} (IoU {iou:.2f})")
+
+            # Add bounding box
+            bbox_obj = ImageAnnotations.Annotation.Bbox(
+                xyxy=bbox.xyxy,
+                class_name=bbox.class_name,
+                timestamp=self._timestamp_or_none,
+                author=self.options.author
                 )
-            ann.history_bboxs = [op] + (ann.history_bboxs or [])
+            ann.bboxs = (ann.bboxs or []) + [bbox_obj]
+            self.stats.bbox_added(bbox_obj)
+            self.stats.image_changed(ann)
+
+            # History
+            if self.options.store_history:
+                op = ImageAnnotations.Annotation.BboxHistory(
+                    operation=ImageAnnotations.Annotation.BboxHistory.Operation.ADD,
+                    bbox=copy.deepcopy(bbox_obj)
+                    )
+                ann.history_bboxs = [op] + (ann.history_bboxs or [])
 
-        # Write
-        self.annotation_writer.write(self.annotations)
+            # Write
+            self._write([self._curr_image_name])
 
-        # Refresh
-        self._refresh_curr()
+            # Refresh
+            self._refresh_curr()
 
 
     def delete_bbox(self, idx: int):
@@ -296,33 +499,36 @@ class AnnotateImageController:
         Raises:
             UnknownError: Unknown error
         """        
-        # Update annotation
-        ann = self.annotations.get_or_add_image(
-            image_name=self._curr_image_name,
-            img_width=self._curr.image.width if self._curr is not None else None,
-            img_height=self._curr.image.height if self._curr is not None else None, 
-            )
-        ann.bboxs = ann.bboxs or []
-        if ann.bboxs is None:
-            raise UnknownError("Bboxs must be set")
-        if idx >= len(ann.bboxs):
-            raise UnknownError("Bbox idx must be less than number of bboxs")
-        bbox_old = ann.bboxs[idx]
-        del ann.bboxs[idx]
-        
-        # History
-        if self.options.store_history:
-            op = ImageAnnotations.Annotation.BboxHistory(
-                operation=ImageAnnotations.Annotation.BboxHistory.Operation.DELETE,
-                bbox=copy.deepcopy(bbox_old)
+        with self._lock:
+            # Update annotation
+            ann = self.annotations.get_or_add_image(
+                image_name=self._curr_image_name,
+                img_width=self._curr.image.width if self._curr is not None else None,
+                img_height=self._curr.image.height if self._curr is not None else None, 
                 )
-            ann.history_bboxs = [op] + (ann.history_bboxs or [])
+            ann.bboxs = ann.bboxs or []
+            if ann.bboxs is None:
+                raise UnknownError("Bboxs must be set")
+            if idx >= len(ann.bboxs):
+                raise UnknownError("Bbox idx must be less than number of bboxs")
+            bbox_old = ann.bboxs[idx]
+            del ann.bboxs[idx]
+            self.stats.bbox_removed(bbox_old)
+            self.stats.image_changed(ann)
+        
+            # History
+            if self.options.store_history:
+                op = ImageAnnotations.Annotation.BboxHistory(
+                    operation=ImageAnnotations.Annotation.BboxHistory.Operation.DELETE,
+                    bbox=copy.deepcopy(bbox_old)
+                    )
+                ann.history_bboxs = [op] + (ann.history_bboxs or [])
 
-        # Write
-        self.annotation_writer.write(self.annotations)
+            # Write
+            self._write([self._curr_image_name])
 
-        # Refresh
-        self._refresh_curr()
+            # Refresh
+            self._refresh_curr()
 
 
     def update_bbox(self, update: BboxUpdate):
@@ -336,48 +542,172 @@ class AnnotateImageController:
             InvalidLabelError: Invalid label
             InvalidBboxError: Invalid bounding box
         """        
-        # Store the annotation
-        ann = self.annotations.get_or_add_image(
-            image_name=self._curr_image_name,
-            img_width=self._curr.image.width if self._curr is not None else None,
-            img_height=self._curr.image.height if self._curr is not None else None, 
-            )
-        ann.bboxs = ann.bboxs or []
-
-        # Update the bbox
-        if ann.bboxs is None:
-            raise UnknownError("Bboxs must be set")
-        if update.xyxy_new != NoUpdate.NO_UPDATE:
-            self._check_fix_xyxy_valid(update.xyxy_new)
-            ann.bboxs[update.idx].xyxy = update.xyxy_new
-        if update.class_name_new != NoUpdate.NO_UPDATE:
-            if not update.class_name_new in self._labels:
+        with self._lock:
+            # Store the annotation
+            ann = self.annotations.get_or_add_image(
+                image_name=self._curr_image_name,
+                img_width=self._curr.image.width if self._curr is not None else None,
+                img_height=self._curr.image.height if self._curr is not None else None, 
+                )
+            ann.bboxs = ann.bboxs or []
+
+            # Check the update
+            if ann.bboxs is None:
+                raise UnknownError("Bboxs must be set")
+            if update.idx >= len(ann.bboxs):
+                raise UnknownError("Bbox idx must be less than number of bboxs")
+            bbox = ann.bboxs[update.idx]
+            if update.class_name_new != NoUpdate.NO_UPDATE and not update.class_name_new in self._labels:
                 raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (update.class_name_new, str(self._labels)))
-            ann.bboxs[update.idx].class_name = update.class_name_new
+            if update.xyxy_new != NoUpdate.NO_UPDATE:
+                self._check_fix_xyxy_valid(update.xyxy_new)
+            xyxy = update.xyxy_new if update.xyxy_new != NoUpdate.NO_UPDATE else bbox.xyxy
+            class_name = update.class_name_new if update.class_name_new != NoUpdate.NO_UPDATE else bbox.class_name
+
+            # Duplicates, with the bbox as it would be after the update
+            duplicate = self._find_duplicate(ann.bboxs, xyxy, class_name, exclude_idx=update.idx)
+            if duplicate is not None:
+                idx_existing, iou = duplicate
+                if self.options.duplicate_policy == DuplicatePolicy.REJECT:
+                    raise DuplicateBboxError(f"Updated bbox {update.idx} duplicates existing bbox {idx_existing} (IoU {iou:.2f})")
+                elif self.options.duplicate_policy == DuplicatePolicy.MERGE:
+                    logger.info(f"Merging updated bbox {update.idx} into existing bbox {idx_existing} (IoU {iou:.2f})")
+                    self._merge_bbox_into(ann, update.idx, idx_existing, class_name)
+                    self._write([self._curr_image_name])
+                    self._refresh_curr()
+                    return
+                else:
+                    logger.warning(f"Updated bbox {update.idx} duplicates existing bbox {idx_existing} (IoU {iou:.2f})")
+
+            # Update the bbox
+            bbox.xyxy = xyxy
+            if update.class_name_new != NoUpdate.NO_UPDATE:
+                class_name_old = bbox.class_name
+                bbox.class_name = update.class_name_new
+                self.stats.bbox_changed(class_name_old, bbox.author, bbox)
         
-        # Update timestamp
-        ann.bboxs[update.idx].timestamp = self._timestamp_or_none
+            # Update timestamp
+            bbox.timestamp = self._timestamp_or_none
 
-        # History
-        if self.options.store_history:
-            op = ImageAnnotations.Annotation.BboxHistory(
-                operation=ImageAnnotations.Annotation.BboxHistory.Operation.UPDATE,
-                bbox=copy.deepcopy(ann.bboxs[update.idx])
+            # History
+            if self.options.store_history:
+                op = ImageAnnotations.Annotation.BboxHistory(
+                    operation=ImageAnnotations.Annotation.BboxHistory.Operation.UPDATE,
+                    bbox=copy.deepcopy(bbox)
+                    )
+                ann.history_bboxs = [op] + (ann.history_bboxs or [])
+
+            # Write
+            self._write([self._curr_image_name])
+
+            # Refresh
+            self._refresh_curr()
+
+
+    def add_mask(self, rle: Rle, class_name: Optional[str] = None):
+        """Add segmentation mask
+
+        Args:
+            rle (Rle): Mask in COCO run-length encoding, of the size of the image
+            class_name (Optional[str], optional): Class. Defaults to None.
+
+        Raises:
+            InvalidLabelError: Invalid label
+            InvalidMaskError: Mask is empty or does not match the image size
+        """        
+        with self._lock:
+            if class_name is not None and not class_name in self._labels:
+                raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (class_name, str(self._labels)))
+            if self._curr is not None and list(rle["size"]) != [self._curr.image.height, self._curr.image.width]:
+                raise InvalidMaskError(f"Mask size {rle['size']} does not match image size {[self._curr.image.height, self._curr.image.width]}")
+            counts = rle["counts"] if isinstance(rle["counts"], str) else counts_to_string(rle["counts"])
+            mask = ImageAnnotations.Annotation.Mask(
+                size=list(rle["size"]),
+                counts=counts,
+                class_name=class_name,
+                timestamp=self._timestamp_or_none,
+                author=self.options.author
+                )
+            if mask.area == 0:
+                raise InvalidMaskError("Mask is empty")
+            logger.debug(f"Adding mask with area {mask.area} and bbox {mask.xyxy}")
+
+            ann = self.annotations.get_or_add_image(
+                image_name=self._curr_image_name, 
+                img_width=self._curr.image.width if self._curr is not None else None,
+                img_height=self._curr.image.height if self._curr is not None else None, 
                 )
-            ann.history_bboxs = [op] + (ann.history_bboxs or [])
+            ann.masks = (ann.masks or []) + [mask]
+            self.stats.mask_added(mask)
+            self.stats.image_changed(ann)
+
+            # Write
+            self._write([self._curr_image_name])
+
+            # Refresh
+            self._refresh_curr()
+
+
+    def update_mask_class(self, idx: int, class_name: str):
+        """Update the class of a segmentation mask
+
+        Args:
+            idx (int): Index of mask
+            class_name (str): New class
+
+        Raises:
+            UnknownError: Unknown error
+            InvalidLabelError: Invalid label
+        """        
+        with self._lock:
+            if not class_name in self._labels:
+                raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (class_name, str(self._labels)))
+            ann = self.annotations.get_or_add_image(image_name=self._curr_image_name)
+            if ann.masks is None or idx >= len(ann.masks):
+                raise UnknownError("Mask idx must be less than number of masks")
+            ann.masks[idx].class_name = class_name
+            ann.masks[idx].timestamp = self._timestamp_or_none
+
+            # Write
+            self._write([self._curr_image_name])
+
+            # Refresh
+            self._refresh_curr()
+
+
+    def delete_mask(self, idx: int):
+        """Delete segmentation mask
+
+        Args:
+            idx (int): Index of mask to delete
+
+        Raises:
+            UnknownError: Unknown error
+        """        
+        with self._lock:
+            ann = self.annotations.get_or_add_image(image_name=self._curr_image_name)
+            if ann.masks is None or idx >= len(ann.masks):
+                raise UnknownError("Mask idx must be less than number of masks")
+            mask_old = ann.masks[idx]
+            del ann.masks[idx]
+            if len(ann.masks) == 0:
+                ann.masks = None
+            self.stats.mask_removed(mask_old)
+            self.stats.image_changed(ann)
 
-        # Write
-        self.annotation_writer.write(self.annotations)
+            # Write
+            self._write([self._curr_image_name])
 
-        # Refresh
-        self._refresh_curr()
+            # Refresh
+            self._refresh_curr()
 
 
-    def store_label_multiple(self, label_values: List[str]):
+    def store_label_multiple(self, label_values: List[str], image_names: Optional[List[str]] = None):
         """Store multiple labels for image
 
         Args:
             label_values (List[str]): Label values
+            image_names (Optional[List[str]], optional): Images to label in one batch with a single write, instead of the current image; the current image is then not advanced. Defaults to None.
 
         Raises:
             NoCurrLabelError: If no current label
@@ -395,13 +725,14 @@ class AnnotateImageController:
             timestamp=self._timestamp_or_none,
             author=self.options.author
             )
-        self._store_label(label)
+        self._store_label(label, image_names)
         
-    def store_label_single(self, label_value: str):
+    def store_label_single(self, label_value: str, image_names: Optional[List[str]] = None):
         """Store label for image
 
         Args:
             label_value (str): Label value
+            image_names (Optional[List[str]], optional): Images to label in one batch with a single write, instead of the current image; the current image is then not advanced. Defaults to None.
 
         Raises:
             NoCurrLabelError: If no current label
@@ -420,35 +751,169 @@ class AnnotateImageController:
             timestamp=self._timestamp_or_none,
             author=self.options.author
             )
-        self._store_label(label)
+        self._store_label(label, image_names)
+
+
+    def store_labels_batch(self, image_labels: List[Tuple[str,Union[str,List[str]]]]):
+        """Store labels decided for several images, with a single write
+
+        The labels are all validated before any is stored. The current image is not advanced.
+
+        Args:
+            image_labels (List[Tuple[str,Union[str,List[str]]]]): Image names and label values: a string for a single label, a list for multiple labels
+
+        Raises:
+            InvalidLabelError: If a provided label is not in label source
+        """
+        with self._lock:
+            labels: List[Tuple[str,ImageAnnotations.Annotation.Label]] = []
+            for image_name, label_value in image_labels:
+                label_values = label_value if type(label_value) == list else [label_value]
+                for value in label_values:
+                    if not value in self._labels:
+                        raise InvalidLabelError("Label value: %s not in allowed labels: %s" % (value, str(self._labels)))
+                label = ImageAnnotations.Annotation.Label(
+                    single=label_value if type(label_value) == str else None,
+                    multiple=label_value if type(label_value) == list else None,
+                    timestamp=self._timestamp_or_none,
+                    author=self.options.author
+                    )
+                labels.append((image_name, label))
+            if len(labels) == 0:
+                return
+
+            ann_image_names: List[str] = []
+            for image_name, label in labels:
+                ann_image_names.append(self._ann_image_name(image_name))
+                self._store_label_for_image(ann_image_names[-1], label)
+            if self.image_source.duplicate_action == DuplicateImageAction.PROPAGATE:
+                for image_name, label in labels:
+                    image_idx = self._image_idx_of_name(image_name)
+                    if image_idx is not None:
+                        ann_image_names += self._propagate_label(label, [image_idx])
+            self._write(ann_image_names)
+            self._refresh_curr()
+
+
+    def import_entries(self, entries: List[ImageAnnotations.Annotation], options: Optional[MergeOptions] = None) -> int:
+        """Add the annotations of images, e.g. read from an imported file, with a single write
+
+        Images already annotated are merged with `merge_image_entries` against their annotations at the time of the call, so changes made while the file was read are kept.
+
+        Args:
+            entries (List[ImageAnnotations.Annotation]): Annotation of each image, keyed like the stored annotations (by basename if `use_basename_for_image` is set)
+            options (Optional[MergeOptions], optional): How to merge images annotated in both. Defaults to None, i.e. MergeOptions().
+
+        Returns:
+            int: Number of conflicts resolved
+        """
+        with self._lock:
+            # Bulk changes can be rolled back to the state before them
+            self.checkpoint()
+            no_conflicts = 0
+            image_names: List[str] = []
+            for entry in entries:
+                image_name = self._ann_image_name(entry.image_name)
+                entry.image_name = image_name
+                entry_old = self.annotations.image_to_entry.get(image_name)
+                if entry_old is not None:
+                    entry, no_conflicts_entry = merge_image_entries([entry_old, entry], options)
+                    no_conflicts += no_conflicts_entry
+                self.annotations.image_to_entry[image_name] = entry
+                self.stats.entry_replaced(entry_old, entry)
+                image_names.append(image_name)
+            self._write(image_names)
+            self._refresh_curr()
+            return no_conflicts
+
+
+    def checkpoints(self) -> List[CheckpointInfo]:
+        """Checkpoints of the annotations, oldest first. Empty unless `checkpoint_dir` is set in the storage
+
+        Returns:
+            List[CheckpointInfo]: Checkpoints
+        """
+        store = self.annotation_writer.checkpoints
+        return store.checkpoints() if store is not None else []
+
+
+    def checkpoint(self) -> Optional[CheckpointInfo]:
+        """Write a checkpoint of the images changed since the previous one now, rather than after `checkpoint_every_n` writes
+
+        Returns:
+            Optional[CheckpointInfo]: New checkpoint, or None if nothing changed or checkpoints are not enabled
+        """
+        with self._lock:
+            store = self.annotation_writer.checkpoints
+            return store.checkpoint(self.annotations) if store is not None else None
+
+
+    def restore_checkpoint(self, checkpoint_id: int):
+        """Replace all annotations with those of a checkpoint. The annotations before are checkpointed first, so this can be undone
+
+        Args:
+            checkpoint_id (int): Checkpoint
+        """
+        with self._lock:
+            store = self.annotation_writer.checkpoints
+            assert store is not None, "checkpoint_dir must be set in the storage to restore checkpoints"
+            annotations = store.restore(checkpoint_id)
+            store.checkpoint(self.annotations)
+
+            # Images only in the annotations before are recorded as removed
+            store.mark_changed(self.annotations.image_to_entry.keys())
+            self.annotations = annotations
+            self.stats = AnnotationStats.from_annotations(self.annotations)
+            self.annotation_writer.write(self.annotations)
+            store.checkpoint(self.annotations)
+            logger.info(f"Restored checkpoint {checkpoint_id} with {len(annotations.image_to_entry)} images")
+            self._refresh_curr()
+
+
+    def go_to_image(self, idx: int):
+        """Go to the image at an index
+
+        Args:
+            idx (int): Index in the image source
+
+        Raises:
+            IndexBelowError: If the index is negative
+            IndexAboveError: If the index is past the last image
+        """
+        with self._lock:
+            image_idx, image_name, image = self._image_iterator.go_to(idx)
+            self._update_curr(image_idx, image_name, image)
 
 
     def next_image(self):
         """Skip to next image
         """        
-        image_idx, image_name, image = self._image_iterator.next()
-        self._update_curr(image_idx, image_name, image)
+        with self._lock:
+            image_idx, image_name, image = self._image_iterator.next()
+            self._update_curr(image_idx, image_name, image)
 
 
     def previous_image(self):
         """Go to previous image
         """        
-        image_idx, image_name, image = self._image_iterator.prev()
-        self._update_curr(image_idx, image_name, image)
+        with self._lock:
+            image_idx, image_name, image = self._image_iterator.prev()
+            self._update_curr(image_idx, image_name, image)
 
 
     def skip_to_next_missing_ann(self):
         """Skip to next image with no annotation
         """        
-        image, image_idx = None, None
-        image_name = self._curr.image_name if self._curr is not None else None
-        while image_name in self.annotations.image_to_entry:
-            image_idx, image_name, image = self._image_iterator.next()
-        if image is not None and image_idx is not None and image_name is not None:
-            # Changed image
-            self._update_curr(image_idx, image_name, image)
-        else:
-            self._curr = None
+        with self._lock:
+            image, image_idx = None, None
+            image_name = self._curr.image_name if self._curr is not None else None
+            while image_name in self.annotations.image_to_entry:
+                image_idx, image_name, image = self._image_iterator.next()
+            if image is not None and image_idx is not None and image_name is not None:
+                # Changed image
+                self._update_curr(image_idx, image_name, image)
+            else:
+                self._curr = None
 
 
     def _refresh_curr(self):
@@ -459,14 +924,15 @@ class AnnotateImageController:
             logger.debug("No curr to refresh")
 
 
-    def _update_curr(self, image_idx: int, image_name: str, image: Image.Image):
+    def _update_curr(self, image_idx: int, image_name: str, image: Union[Image.Image,LargeImage]):
         label_single: Optional[str] = None  
         label_multiple: Optional[List[str]] = None
         bboxs: Optional[List[Bbox]] = None
+        masks: Optional[List[ImageAnnotations.Annotation.Mask]] = None
 
         # Retrieve the label if it exists
-        if image_name in self.annotations.image_to_entry:
-            entry = self.annotations.image_to_entry[image_name]
+        entry = self.annotations.image_to_entry.get(self._ann_image_name(image_name))
+        if entry is not None:
             if entry.label is not None:
                 label_single = entry.label.single
                 label_multiple = entry.label.multiple
@@ -478,11 +944,58 @@ class AnnotateImageController:
                         class_name=bbox.class_name
                         )
                     bboxs.append(bbox_obj)
+            if entry.masks is not None:
+                masks = list(entry.masks)
         
-        self._curr = ImageAnn(image_idx, image_name, image, label_single, label_multiple, bboxs)
+        self._curr = ImageAnn(image_idx, image_name, image, label_single, label_multiple, bboxs, masks)
         logger.debug(f"Updated curr: {self._curr}")
 
     
+    def _find_duplicate(self, 
+        bboxs: List[ImageAnnotations.Annotation.Bbox], 
+        xyxy: Xyxy, 
+        class_name: Optional[str], 
+        exclude_idx: Optional[int] = None
+        ) -> Optional[Tuple[int,float]]:
+        if self.options.duplicate_iou_threshold is None:
+            return None
+        return find_duplicate(bboxs, xyxy, class_name, self.options.duplicate_iou_threshold, exclude_idx=exclude_idx)
+
+    def _merge_bbox_into(self, ann: ImageAnnotations.Annotation, idx: int, idx_existing: int, class_name: Optional[str]):
+        """Remove a bbox that duplicates an existing one, giving its class to the existing bbox if that has none
+        """
+        assert ann.bboxs is not None
+        bbox_old = ann.bboxs.pop(idx)
+        self.stats.bbox_removed(bbox_old)
+        history = [ ImageAnnotations.Annotation.BboxHistory(
+            operation=ImageAnnotations.Annotation.BboxHistory.Operation.DELETE,
+            bbox=copy.deepcopy(bbox_old)
+            ) ]
+        bbox_existing = ann.bboxs[idx_existing if idx_existing < idx else idx_existing - 1]
+        if bbox_existing.class_name is None and class_name is not None:
+            bbox_existing.class_name = class_name
+            bbox_existing.timestamp = self._timestamp_or_none
+            self.stats.bbox_changed(None, bbox_existing.author, bbox_existing)
+            history.insert(0, ImageAnnotations.Annotation.BboxHistory(
+                operation=ImageAnnotations.Annotation.BboxHistory.Operation.UPDATE,
+                bbox=copy.deepcopy(bbox_existing)
+                ))
+        self.stats.image_changed(ann)
+        if self.options.store_history:
+            ann.history_bboxs = history + (ann.history_bboxs or [])
+
+    def _check_duplicates_on_load(self):
+        if self.options.duplicate_iou_threshold is None:
+            return
+        pairs = find_duplicates(self.annotations, self.options.duplicate_iou_threshold)
+        if len(pairs) == 0:
+            return
+        if self.options.duplicate_policy == DuplicatePolicy.MERGE:
+            no_removed = merge_duplicates(self.annotations, pairs)
+            logger.info(f"Merged {no_removed} duplicate bboxs in existing annotations")
+        else:
+            logger.warning(f"Existing annotations contain {len(pairs)} duplicate bbox pairs, e.g. {pairs[0]}")
+
     def _check_fix_xyxy_valid(self, xyxy: Xyxy):
         if len(xyxy) != 4:
             raise InvalidBboxError("xyxy must have length 4")
@@ -498,17 +1011,80 @@ class AnnotateImageController:
         if xyxy[1] >= xyxy[3]:
             xyxy[1], xyxy[3] = xyxy[3], xyxy[1]
 
-    def _store_label(self, label: ImageAnnotations.Annotation.Label):
-        if self._curr is None:
-            raise NoCurrLabelError("No current label")
+    def _store_label(self, label: ImageAnnotations.Annotation.Label, image_names: Optional[List[str]] = None):
+        with self._lock:
+            if image_names is None:
+                if self._curr is None:
+                    raise NoCurrLabelError("No current label")
+                ann_image_names = [ self._ann_image_name(self._curr.image_name) ]
+                self._store_label_for_image(ann_image_names[0], label)
+            else:
+                ann_image_names = [ self._ann_image_name(image_name) for image_name in image_names ]
+                for image_name in ann_image_names:
+                    self._store_label_for_image(image_name, copy.deepcopy(label))
+
+            if self.image_source.duplicate_action == DuplicateImageAction.PROPAGATE:
+                image_idxs = [self._curr.image_idx] if image_names is None else [ self._image_idx_of_name(image_name) for image_name in image_names ] # type: ignore
+                ann_image_names += self._propagate_label(label, [ idx for idx in image_idxs if idx is not None ])
+        
+            # Write
+            self._write(ann_image_names)
+
+            if image_names is None:
+                # Load the next image
+                image_idx, image_name, image = self._image_iterator.next()
+                self._update_curr(image_idx, image_name, image)
+            else:
+                # The current image may be among the batch
+                self._refresh_curr()
+
+    def _is_duplicate_of_annotated(self, idx: int) -> bool:
+        """Whether an image without annotation is a near-duplicate of an annotated one
+        """
+        if self._ann_image_name(self._image_iterator.name_at_idx(idx)) in self.annotations.image_to_entry:
+            return False
+        return any(self._ann_image_name(self._image_iterator.name_at_idx(other)) in self.annotations.image_to_entry for other in self._image_iterator.duplicates_of(idx))
 
-        # Store the annotation
-        image_name = os.path.basename(self._curr.image_name) if self.options.use_basename_for_image else self._curr.image_name
+    def _image_idx_of_name(self, image_name: str) -> Optional[int]:
+        return self._image_iterator.idx_of_name(image_name)
 
+    def _propagate_label(self, label: ImageAnnotations.Annotation.Label, image_idxs: List[int]) -> List[str]:
+        """Store a label for the near-duplicates without annotations of images
+
+        Returns:
+            List[str]: Names of the images labeled
+        """
+        labeled: List[str] = []
+        for idx in image_idxs:
+            for other in self._image_iterator.duplicates_of(idx):
+                image_name = self._ann_image_name(self._image_iterator.name_at_idx(other))
+                if image_name in self.annotations.image_to_entry:
+                    continue
+                self._store_label_for_image(image_name, copy.deepcopy(label))
+                labeled.append(image_name)
+        if len(labeled) > 0:
+            logger.debug(f"Propagated label to {len(labeled)} duplicates: {labeled}")
+            metrics.inc("duplicate_labels_propagated_total", len(labeled))
+        return labeled
+
+    def _write(self, image_names: List[str]):
+        """Write the annotations after the given images changed
+
+        With storage shared by multiple processes, entries of other images may be replaced by ones written by other processes.
+        """
+        replaced = self.annotation_writer.write(self.annotations, image_names)
+        for entry_old, entry_new in replaced:
+            self.stats.entry_replaced(entry_old, entry_new)
+
+    def _ann_image_name(self, image_name: str) -> str:
+        return os.path.basename(image_name) if self.options.use_basename_for_image else image_name
+
+    def _store_label_for_image(self, image_name: str, label: ImageAnnotations.Annotation.Label):
         did_update = False
         if image_name in self.annotations.image_to_entry:
             ann = self.annotations.image_to_entry[image_name]
             if ann.label != label:
+                self.stats.label_changed(ann.label, label)
                 ann.label = label
                 did_update = True
         else:
@@ -517,15 +1093,10 @@ class AnnotateImageController:
                 label=label
                 )
             self.annotations.image_to_entry[image_name] = ann
+            self.stats.label_changed(None, label)
             did_update = True
+        self.stats.image_changed(ann)
 
         # Also add history
         if did_update and self.options.store_history:
             ann.history_labels = [copy.deepcopy(label)] + (ann.history_labels or [])
-        
-        # Write
-        self.annotation_writer.write(self.annotations)
-
-        # Load the next image
-        image_idx, image_name, image = self._image_iterator.next()
-        self._update_curr(image_idx, image_name, image)
\ No newline at end of file
@@ -1,8 +1,11 @@
 from dash_annotate_cv.annotate_image_controller import AnnotateImageController
 from dash_annotate_cv.helpers import get_trigger_id
 from dash_annotate_cv.image_source import IndexAboveError, IndexBelowError
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.annotation_storage import AnnotationStorage, StorageType
+from dash_annotate_cv.jobs import JobRunner, JobState, JobStatus, export_job, import_job, validate_job
 
-from dash import Output, Input, html, callback, MATCH
+from dash import Output, Input, State, html, dcc, callback, MATCH, set_props
 import uuid
 from typing import Optional, Union, List, Callable
 import dash_bootstrap_components as dbc
@@ -49,11 +52,51 @@ class AnnotateImageControlsAIO(html.Div):
             'subcomponent': 'next_missing_ann',
             'aio_id': aio_id
         }
+        progress = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'progress',
+            'aio_id': aio_id
+        }
         content = lambda aio_id: {
             'component': 'AnnotateImageLabelsAIO',
             'subcomponent': 'content',
             'aio_id': aio_id
         }
+        job_file = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_file',
+            'aio_id': aio_id
+        }
+        job_format = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_format',
+            'aio_id': aio_id
+        }
+        job_export = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_export',
+            'aio_id': aio_id
+        }
+        job_import = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_import',
+            'aio_id': aio_id
+        }
+        job_validate = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_validate',
+            'aio_id': aio_id
+        }
+        job_interval = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_interval',
+            'aio_id': aio_id
+        }
+        job_list = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'job_list',
+            'aio_id': aio_id
+        }
 
     ids = ids
 
@@ -61,10 +104,16 @@ class AnnotateImageControlsAIO(html.Div):
         self,
         controller: AnnotateImageController,
         refresh_layout_callback: Callable[[], dbc.Row],
-        aio_id: Optional[str] = None
+        aio_id: Optional[str] = None,
+        enable_buttons: Optional["AnnotateImageControlsAIO.EnableButtons"] = None,
+        job_runner: Optional[JobRunner] = None
         ):
         self.controller = controller
         self._refresh_layout_callback = refresh_layout_callback
+        self._enable_buttons = enable_buttons or AnnotateImageControlsAIO.EnableButtons()
+
+        # Background jobs for exports, imports and validation; the controls for them are shown if set
+        self.job_runner = job_runner
         
         # Allow developers to pass in their own `aio_id` if they're
         # binding their own callback to a particular component.
@@ -89,11 +138,13 @@ class AnnotateImageControlsAIO(html.Div):
             Output(self.ids.title(MATCH), 'children'),
             Output(self.ids.content(MATCH), 'children'),
             Output(self.ids.alert(MATCH), 'children'),
+            Output(self.ids.progress(MATCH), 'children'),
             Input(self.ids.next_submit(MATCH), 'n_clicks'),
             Input(self.ids.next_skip(MATCH), 'n_clicks'),
             Input(self.ids.prev(MATCH), 'n_clicks'),
             Input(self.ids.next_missing_ann(MATCH), 'n_clicks')
             )
+        @metrics.instrument_callback("AnnotateImageControlsAIO.button_press")
         def button_press(submit_n_clicks, skip_n_clicks, prev_n_clicks, next_missing_ann_n_clicks):
             trigger_id, _ = get_trigger_id()
             logger.debug(f"Trigger: '{trigger_id}'")
@@ -136,26 +187,120 @@ class AnnotateImageControlsAIO(html.Div):
                 alert_layout = dbc.Alert("Start of images",color="danger")
 
             title_layout = self._create_title_layout()
+            progress_layout = self._create_progress_layout()
+
+            return title_layout, content_layout, alert_layout, progress_layout
+
+        @callback(
+            Output(self.ids.job_list(MATCH), 'children'),
+            Output(self.ids.job_interval(MATCH), 'disabled'),
+            Input(self.ids.job_export(MATCH), 'n_clicks'),
+            Input(self.ids.job_import(MATCH), 'n_clicks'),
+            Input(self.ids.job_validate(MATCH), 'n_clicks'),
+            Input(self.ids.job_interval(MATCH), 'n_intervals'),
+            State(self.ids.job_file(MATCH), 'value'),
+            State(self.ids.job_format(MATCH), 'value')
+            )
+        @metrics.instrument_callback("AnnotateImageControlsAIO.jobs")
+        def jobs(export_n_clicks, import_n_clicks, validate_n_clicks, n_intervals, fname, output_type):
+            trigger_id, _ = get_trigger_id()
+            assert self.job_runner is not None, "job_runner must be set to show jobs"
+
+            alert_layout = None
+            if trigger_id in [ self.ids.job_export(MATCH)["subcomponent"], self.ids.job_import(MATCH)["subcomponent"] ] and not fname:
+                alert_layout = dbc.Alert("Enter a file name", color="warning")
+
+            elif trigger_id == self.ids.job_export(MATCH)["subcomponent"]:
+                storage_type = StorageType(output_type)
+                output_storage = AnnotationStorage(
+                    storage_types=[storage_type],
+                    json_file=fname if storage_type == StorageType.JSON else None,
+                    coco_file=fname if storage_type == StorageType.COCO else None
+                    )
+                self.job_runner.submit(f"Export to {fname}", export_job(self.controller.annotations, output_storage, self.controller.annotation_writer.supercategories))
+
+            elif trigger_id == self.ids.job_import(MATCH)["subcomponent"]:
+                self.job_runner.submit(f"Import from {fname}", import_job(self.controller, fname))
 
-            return title_layout, content_layout, alert_layout
+            elif trigger_id == self.ids.job_validate(MATCH)["subcomponent"]:
+                self.job_runner.submit("Validate annotations", validate_job(
+                    annotations=self.controller.annotations,
+                    labels=self.controller.label_set,
+                    duplicate_iou_threshold=self.controller.options.duplicate_iou_threshold
+                    ))
+
+            elif trigger_id == self.ids.job_interval(MATCH)["subcomponent"]:
+                # Imports change the annotations in the background
+                self.refresh_progress()
+
+            jobs = self.job_runner.jobs()
+            any_active = any([ job.is_active for job in jobs ])
+            return [alert_layout] + [ self._create_job_layout(job) for job in jobs ], not any_active
     
     def _create_layout(self):
         """Create layout for component
         """        
         return dbc.Row([
             dbc.Row([
-                dbc.Col(
+                dbc.Col([
                     html.Div(id=self.ids.title(self.aio_id)),
-                    md=6),
+                    html.Div(id=self.ids.progress(self.aio_id))
+                    ], md=6),
                 dbc.Col(
-                    self._create_layout_buttons(self.aio_id),
+                    self._create_layout_buttons(self.aio_id, self._enable_buttons),
                     md=6),
             ]),
             dbc.Col(html.Hr(), xs=12),
             dbc.Col(id=self.ids.alert(self.aio_id), xs=12),
-            dbc.Col(id=self.ids.content(self.aio_id), xs=12)
+            dbc.Col(id=self.ids.content(self.aio_id), xs=12),
+            dbc.Col(self._create_layout_jobs() if self.job_runner is not None else [], xs=12)
         ])
 
+    def _create_layout_jobs(self):
+        """Create layout for starting background jobs and showing their progress
+        """
+        return html.Div([
+            html.Hr(),
+            html.H5("Export, import and validate"),
+            dbc.Row([
+                dbc.Col(dbc.Input(id=self.ids.job_file(self.aio_id), placeholder="Annotation file", type="text"), md=5),
+                dbc.Col(dcc.Dropdown(
+                    [ t.value for t in StorageType ],
+                    value=StorageType.COCO.value,
+                    clearable=False,
+                    id=self.ids.job_format(self.aio_id)
+                    ), md=2),
+                dbc.Col(dbc.ButtonGroup([
+                    dbc.Button("Export", color="secondary", id=self.ids.job_export(self.aio_id)),
+                    dbc.Button("Import", color="secondary", id=self.ids.job_import(self.aio_id)),
+                    dbc.Button("Validate", color="secondary", id=self.ids.job_validate(self.aio_id))
+                    ]), md=5)
+                ], class_name="mb-2"),
+            html.Div(id=self.ids.job_list(self.aio_id)),
+            dcc.Interval(id=self.ids.job_interval(self.aio_id), interval=1000, disabled=True)
+            ])
+
+    def _create_job_layout(self, job: JobState):
+        colors = {
+            JobStatus.PENDING: "secondary",
+            JobStatus.RUNNING: "primary",
+            JobStatus.SUCCEEDED: "success",
+            JobStatus.FAILED: "danger",
+            JobStatus.CANCELLED: "warning"
+            }
+        stage = f" ({job.stage}: {job.done}{'/' + str(job.total) if job.total is not None else ''})" if job.is_active and job.stage is not None else ""
+        fraction_done = job.fraction_done
+        return html.Div([
+            html.Small(f"{job.name}: {job.status.value}{stage}"),
+            dbc.Progress(
+                value=100*(fraction_done if fraction_done is not None else 1.0),
+                striped=job.is_active and fraction_done is None,
+                animated=job.is_active,
+                color=colors[job.status]
+                ) if job.is_active else html.Small(f" - {job.message}" if job.message else ""),
+            html.Ul([ html.Li(html.Small(detail)) for detail in job.details ]) if len(job.details) > 0 else None
+            ], className="mb-2")
+
     @dataclass
     class EnableButtons:
         """Layout for buttons
@@ -209,7 +354,24 @@ class AnnotateImageControlsAIO(html.Div):
     def _create_title_layout(self):
         if self.controller.curr is not None:
             no_images = self.controller.no_images
-            title = f"Image {self.controller.curr.image_idx+1}/{no_images}"
+            title = f"Image {self.controller.curr_position+1}/{no_images}"
         else:
             title = "Image"
-        return html.H2(title)
\ No newline at end of file
+        return html.H2(title)
+
+    def refresh_progress(self):
+        """Show the current progress, from within a callback that changed the annotations
+        """
+        set_props(self.ids.progress(self.aio_id), {"children": self._create_progress_layout()})
+
+    def _create_progress_layout(self):
+        progress = self.controller.progress()
+        fraction_done = progress.fraction_done or 0.0
+        return html.Div([
+            dbc.Progress(
+                value=100*fraction_done, 
+                label=f"{progress.no_images_done}/{progress.no_images_total} done",
+                color="success"
+                ),
+            html.Small(f"Labeled images: {progress.no_images_labeled}, images with bounding boxes: {progress.no_images_with_bboxs}, bounding boxes: {progress.no_bboxs}")
+        ])
\ No newline at end of file
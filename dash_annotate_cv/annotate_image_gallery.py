@@ -0,0 +1,292 @@
+from dash_annotate_cv.annotate_image_controller import AnnotateImageController, AnnotateImageOptions, InvalidLabelError
+from dash_annotate_cv.annotate_image_labels import SelectionMode
+from dash_annotate_cv.helpers import get_trigger_id, UnknownError
+from dash_annotate_cv.image_source import ImageSource
+from dash_annotate_cv.label_source import LabelSource
+from dash_annotate_cv.label_dropdown import label_dropdown, define_label_search_callback
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.annotation_storage import AnnotationStorage
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.thumbnails import ThumbnailCache, thumbnail_data_uri
+
+from dash import Output, Input, State, html, dcc, callback, MATCH, no_update
+from typing import Optional, List, Dict, Any
+import dash_bootstrap_components as dbc
+import uuid
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AnnotateImageGalleryAIO(html.Div):
+    """Annotation component for labeling pages of images at once
+
+    Shows a page of thumbnails; the selected images are labeled in one batch with a single write.
+    """
+
+    # A set of functions that create pattern-matching callbacks of the subcomponents
+    class ids:
+        page_label = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'page_label',
+            'aio_id': aio_id
+        }
+        alert = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'alert',
+            'aio_id': aio_id
+        }
+        gallery = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'gallery',
+            'aio_id': aio_id
+        }
+        dropdown = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'dropdown',
+            'aio_id': aio_id
+        }
+        apply = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'apply',
+            'aio_id': aio_id
+        }
+        select_all = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'select_all',
+            'aio_id': aio_id
+        }
+        select_none = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'select_none',
+            'aio_id': aio_id
+        }
+        prev = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'prev',
+            'aio_id': aio_id
+        }
+        next = lambda aio_id: {
+            'component': 'AnnotateImageGalleryAIO',
+            'subcomponent': 'next',
+            'aio_id': aio_id
+        }
+
+    ids = ids
+
+    def __init__(
+        self,
+        label_source: LabelSource,
+        image_source: ImageSource,
+        annotation_storage: AnnotationStorage = AnnotationStorage(),
+        annotations_existing: Optional[ImageAnnotations] = None,
+        aio_id: Optional[str] = None,
+        options: AnnotateImageOptions = AnnotateImageOptions(),
+        selection_mode: SelectionMode = SelectionMode.SINGLE
+        ):
+        """Constructor
+
+        Args:
+            label_source (LabelSource): Source of labels
+            image_source (ImageSource): Source of images
+            annotation_storage (AnnotationStorage, optional): Where to store annotations. Defaults to AnnotationStorage().
+            annotations_existing (Optional[ImageAnnotations], optional): Existing annotations to continue from, if any. Defaults to None.
+            aio_id (Optional[str], optional): IDs for components. Defaults to None.
+            options (AnnotateImageOptions, optional): Options, including the page and thumbnail sizes. Defaults to AnnotateImageOptions().
+            selection_mode (SelectionMode): Selection mode. Defaults to SelectionMode.SINGLE.
+        """
+        options.check_valid()
+        self.options = options
+        self.controller = AnnotateImageController(
+            label_source=label_source,
+            image_source=image_source,
+            annotation_storage=annotation_storage,
+            annotations_existing=annotations_existing,
+            options=options
+            )
+        self.selection_mode = selection_mode
+        self.thumbnails = ThumbnailCache(
+            size=options.thumbnail_size,
+            cache_dir=options.thumbnail_cache_dir,
+            large_image_min_pixels=image_source.large_image_min_pixels
+            )
+        self.page = 0
+        self.aio_id = aio_id or str(uuid.uuid4())
+
+        super().__init__(self._create_layout()) # Equivalent to `html.Div([...])`
+        self._define_callbacks()
+
+    @property
+    def no_pages(self) -> int:
+        return max(1, -(-self.controller.no_images // self.options.gallery_page_size))
+
+    def _page_idxs(self, page: int) -> List[int]:
+        start = page * self.options.gallery_page_size
+        return list(range(start, min(start + self.options.gallery_page_size, self.controller.no_images)))
+
+    def _create_layout(self):
+        """Create layout for component
+        """
+        dropdown = label_dropdown(
+            self.controller.label_set,
+            self.ids.dropdown(self.aio_id),
+            multi=self.selection_mode == SelectionMode.MULTIPLE,
+            placeholder="Label for the selected images"
+            )
+        return html.Div([
+            dbc.Row([
+                dbc.Col(html.H4(id=self.ids.page_label(self.aio_id)), md=6),
+                dbc.Col(dbc.ButtonGroup([
+                    dbc.Button("Previous page", color="secondary", id=self.ids.prev(self.aio_id)),
+                    dbc.Button("Next page", color="secondary", id=self.ids.next(self.aio_id))
+                    ]), md=6, class_name="text-end")
+                ], class_name="mb-2"),
+            html.Div(id=self.ids.alert(self.aio_id)),
+            html.P(self.options.instructions_custom or "Select images, then apply a label to all of them at once."),
+            dbc.Row([
+                dbc.Col(dropdown, md=6),
+                dbc.Col(dbc.ButtonGroup([
+                    dbc.Button("Apply to selected", color="primary", id=self.ids.apply(self.aio_id)),
+                    dbc.Button("Select all", color="light", id=self.ids.select_all(self.aio_id)),
+                    dbc.Button("Select none", color="light", id=self.ids.select_none(self.aio_id))
+                    ]), md=6)
+                ], class_name="mb-2"),
+            dcc.Checklist(
+                id=self.ids.gallery(self.aio_id),
+                options=[],
+                value=[],
+                inline=True,
+                labelStyle={
+                    "display": "inline-block",
+                    "verticalAlign": "top",
+                    "width": f"{self.options.thumbnail_size + 24}px",
+                    "margin": "4px"
+                    }
+                )
+            ])
+
+    def _define_callbacks(self):
+        """Define callbacks, called in constructor
+        """
+        @callback(
+            Output(self.ids.gallery(MATCH), 'options'),
+            Output(self.ids.gallery(MATCH), 'value'),
+            Output(self.ids.page_label(MATCH), 'children'),
+            Output(self.ids.alert(MATCH), 'children'),
+            Input(self.ids.prev(MATCH), 'n_clicks'),
+            Input(self.ids.next(MATCH), 'n_clicks'),
+            Input(self.ids.apply(MATCH), 'n_clicks'),
+            Input(self.ids.select_all(MATCH), 'n_clicks'),
+            Input(self.ids.select_none(MATCH), 'n_clicks'),
+            State(self.ids.gallery(MATCH), 'value'),
+            State(self.ids.dropdown(MATCH), 'value')
+            )
+        @metrics.instrument_callback("AnnotateImageGalleryAIO.update")
+        def update(prev_n_clicks, next_n_clicks, apply_n_clicks, select_all_n_clicks, select_none_n_clicks, selected, dropdown_value):
+            trigger_id, _ = get_trigger_id()
+            logger.debug(f"Trigger: '{trigger_id}'")
+            selected = selected or []
+
+            try:
+                if trigger_id == self.ids.select_all(MATCH)["subcomponent"]:
+                    return no_update, self._page_idxs(self.page), no_update, None
+
+                elif trigger_id == self.ids.select_none(MATCH)["subcomponent"]:
+                    return no_update, [], no_update, None
+
+                elif trigger_id == self.ids.prev(MATCH)["subcomponent"]:
+                    self.page = max(0, self.page - 1)
+                    return self._create_gallery_options(), [], self._create_page_label(), None
+
+                elif trigger_id == self.ids.next(MATCH)["subcomponent"]:
+                    self.page = min(self.no_pages - 1, self.page + 1)
+                    return self._create_gallery_options(), [], self._create_page_label(), None
+
+                elif trigger_id == self.ids.apply(MATCH)["subcomponent"]:
+                    alert = self._apply_label(selected, dropdown_value)
+                    return self._create_gallery_options(), [], self._create_page_label(), alert
+
+                else:
+                    # Initial state
+                    return self._create_gallery_options(), [], self._create_page_label(), None
+
+            except InvalidLabelError as e:
+                logger.error(f"Invalid label: {e}")
+                return no_update, no_update, no_update, dbc.Alert(f"Invalid label: {e}", color="danger")
+
+            except UnknownError as e:
+                logger.error(f"Unknown error: {e}")
+                return no_update, no_update, no_update, dbc.Alert(f"Unknown error: {e}", color="danger")
+
+        define_label_search_callback(self.ids.dropdown(MATCH), self.controller.label_set, "AnnotateImageGalleryAIO.search_labels")
+
+    def _apply_label(self, selected: List[int], dropdown_value: Any) -> dbc.Alert:
+        if len(selected) == 0:
+            return dbc.Alert("Select at least one image", color="warning")
+        if dropdown_value is None or dropdown_value == []:
+            return dbc.Alert("Choose a label to apply", color="warning")
+
+        image_names = [ self.controller.image_name_at_idx(idx) for idx in sorted(selected) ]
+        if self.selection_mode == SelectionMode.SINGLE:
+            if type(dropdown_value) == list:
+                dropdown_value = dropdown_value[0]
+            self.controller.store_label_single(dropdown_value, image_names=image_names)
+        elif self.selection_mode == SelectionMode.MULTIPLE:
+            self.controller.store_label_multiple(dropdown_value, image_names=image_names)
+        else:
+            raise NotImplementedError(f"Unknown selection mode: {self.selection_mode}")
+        logger.debug(f"Labeled {len(image_names)} images as {dropdown_value}")
+        return dbc.Alert(f"Labeled {len(image_names)} images as {dropdown_value}", color="success", duration=4000)
+
+    def _create_page_label(self) -> str:
+        idxs = self._page_idxs(self.page)
+        if len(idxs) == 0:
+            return "No images"
+        return f"Images {idxs[0]+1}-{idxs[-1]+1} of {self.controller.no_images}"
+
+    def _create_gallery_options(self) -> List[Dict]:
+        idxs = self._page_idxs(self.page)
+        idxs_next = self._page_idxs(self.page + 1)
+
+        # Download remote images of the page concurrently rather than one by one
+        self.controller.prefetch_images(idxs)
+        thumbnails = self.thumbnails.get_many(
+            [ self.controller.thumbnail_source_at_idx(idx) for idx in idxs ],
+            [ self.controller.image_name_at_idx(idx) for idx in idxs ]
+            )
+
+        # Generate the next page in the background while this one is annotated
+        if self.controller.image_source.source_type == ImageSource.Type.REMOTE:
+            # Resolving remote sources waits for their download: only download them, thumbnails follow when the page is shown
+            self.controller.prefetch_images(idxs_next)
+        else:
+            self.thumbnails.prefetch([ self.controller.thumbnail_source_at_idx(idx) for idx in idxs_next ])
+
+        return [
+            {"label": self._create_thumbnail_layout(idx, thumbnail), "value": idx}
+            for idx, thumbnail in zip(idxs, thumbnails)
+            ]
+
+    def _create_thumbnail_layout(self, idx: int, thumbnail: Optional[bytes]):
+        image_name = self.controller.image_name_at_idx(idx)
+        size = self.options.thumbnail_size
+        if thumbnail is not None:
+            image = html.Img(src=thumbnail_data_uri(thumbnail), style={"maxWidth": f"{size}px", "maxHeight": f"{size}px", "display": "block"})
+        else:
+            image = html.Div("Could not load image", style={"width": f"{size}px", "height": f"{size}px"}, className="text-danger small")
+
+        label = self.controller.label_for_image(image_name)
+        if label is not None and label.single is not None:
+            label_txt = label.single
+        elif label is not None and label.multiple is not None:
+            label_txt = ", ".join(label.multiple)
+        else:
+            label_txt = None
+
+        return html.Div([
+            image,
+            html.Div(os.path.basename(image_name), className="small text-truncate", title=image_name),
+            dbc.Badge(label_txt, color="primary") if label_txt is not None else dbc.Badge("unlabeled", color="light", text_color="dark")
+            ], style={"display": "inline-block", "marginLeft": "4px"})
@@ -1,13 +1,19 @@
 from dash_annotate_cv.annotate_image_controller import AnnotateImageController, AnnotateImageOptions, InvalidLabelError
 from dash_annotate_cv.annotate_image_controls import AnnotateImageControlsAIO
 from dash_annotate_cv.helpers import get_trigger_id, UnknownError
-from dash_annotate_cv.image_source import ImageSource
+from dash_annotate_cv.image_source import ImageSource, IndexAboveError, IndexBelowError
 from dash_annotate_cv.label_source import LabelSource
+from dash_annotate_cv.label_dropdown import label_dropdown, define_label_search_callback
 from dash_annotate_cv.formats.image_annotations import ImageAnnotations
 from dash_annotate_cv.annotation_storage import AnnotationStorage
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.jobs import JobRunner
+from dash_annotate_cv.large_image import LargeImage
+from dash_annotate_cv.thumbnails import ThumbnailCache, thumbnail_data_uri
+from dash_annotate_cv.keyboard import KEYBOARD_JS, label_keys, keyboard_legend
 
-from dash import Output, Input, html, dcc, callback, MATCH, no_update
-from typing import Optional
+from dash import Output, Input, html, dcc, callback, clientside_callback, MATCH, no_update
+from typing import Optional, Dict, Any
 import plotly.express as px
 import dash_bootstrap_components as dbc
 import logging
@@ -43,6 +49,31 @@ class AnnotateImageLabelsAIO(html.Div):
             'subcomponent': 'alert_label',
             'aio_id': aio_id
         }
+        kb_image = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'kb_image',
+            'aio_id': aio_id
+        }
+        kb_caption = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'kb_caption',
+            'aio_id': aio_id
+        }
+        kb_alert = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'kb_alert',
+            'aio_id': aio_id
+        }
+        kb_window = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'kb_window',
+            'aio_id': aio_id
+        }
+        kb_flush = lambda aio_id: {
+            'component': 'AnnotateImageLabelsAIO',
+            'subcomponent': 'kb_flush',
+            'aio_id': aio_id
+        }
 
     ids = ids
 
@@ -54,7 +85,8 @@ class AnnotateImageLabelsAIO(html.Div):
         annotations_existing: Optional[ImageAnnotations] = None,
         aio_id: Optional[str] = None,
         options: AnnotateImageOptions = AnnotateImageOptions(),
-        selection_mode: SelectionMode = SelectionMode.SINGLE
+        selection_mode: SelectionMode = SelectionMode.SINGLE,
+        job_runner: Optional[JobRunner] = None
         ):
         """Constructor
 
@@ -66,6 +98,7 @@ class AnnotateImageLabelsAIO(html.Div):
             aio_id (Optional[str], optional): IDs for components. Defaults to None.
             options (Options, optional): Options. Defaults to Options().
             selection_mode (SelectionMode): Selection mode. Defaults to SelectionMode.SINGLE.
+            job_runner (Optional[JobRunner], optional): Runner for export, import and validation jobs; their controls are shown if set. Defaults to None.
         """
         options.check_valid()
         self.options = options
@@ -77,10 +110,21 @@ class AnnotateImageLabelsAIO(html.Div):
             options=options
             )
         self.selection_mode = selection_mode
+        enable_buttons = None
+        if options.keyboard_shortcuts:
+            # Navigation is done with the keyboard in the browser; the server position lags behind until a flush
+            enable_buttons = AnnotateImageControlsAIO.EnableButtons(prev_btn=False, next_btn=False, skip_btn=False, skip_to_next_btn=False)
+            self.keyboard_images = ThumbnailCache(
+                size=options.keyboard_image_size,
+                cache_dir=options.thumbnail_cache_dir,
+                large_image_min_pixels=image_source.large_image_min_pixels
+                )
         self.controls = AnnotateImageControlsAIO(
             controller=self.controller,
             refresh_layout_callback=self._create_layout,
-            aio_id=aio_id
+            aio_id=aio_id,
+            enable_buttons=enable_buttons,
+            job_runner=job_runner
             )
         self.aio_id = self.controls.aio_id
 
@@ -95,6 +139,7 @@ class AnnotateImageLabelsAIO(html.Div):
             Output(self.ids.alert_label(MATCH), 'children'),
             Input(self.ids.dropdown(MATCH), 'value')
             )
+        @metrics.instrument_callback("AnnotateImageLabelsAIO.change_label")
         def change_label(dropdown_value):
             try:
                 trigger_id, _ = get_trigger_id()
@@ -116,6 +161,7 @@ class AnnotateImageLabelsAIO(html.Div):
                         self.controller.store_label_multiple(dropdown_value)
                     else:
                         raise NotImplementedError(f"Unknown selection mode: {self.selection_mode}")
+                    self.controls.refresh_progress()
                     return no_update, no_update
 
                 else:
@@ -129,10 +175,110 @@ class AnnotateImageLabelsAIO(html.Div):
             except UnknownError as e:
                 logger.error(f"Unknown error: {e}")
                 return no_update, dbc.Alert(f"Unknown error: {e}", color="danger")
+
+        clientside_callback(
+            KEYBOARD_JS,
+            Output(self.ids.kb_image(MATCH), 'src'),
+            Input(self.ids.kb_window(MATCH), 'data')
+            )
+
+        @callback(
+            Output(self.ids.kb_window(MATCH), 'data'),
+            Output(self.ids.kb_alert(MATCH), 'children'),
+            Output(self.controls.ids.progress(MATCH), 'children', allow_duplicate=True),
+            Input(self.ids.kb_flush(MATCH), 'data'),
+            prevent_initial_call=True
+            )
+        @metrics.instrument_callback("AnnotateImageLabelsAIO.flush_keyboard")
+        def flush_keyboard(flush):
+            logger.debug(f"Keyboard flush: {flush}")
+            alert = None
+            try:
+                self.controller.store_labels_batch([ (image_name, label_value) for image_name, label_value in flush["labels"] ])
+            except InvalidLabelError as e:
+                logger.error(f"Invalid label: {e}")
+                alert = dbc.Alert(f"Invalid label: {e}", color="danger")
+
+            try:
+                self.controller.go_to_image(flush["idx"])
+            except (IndexAboveError, IndexBelowError):
+                pass
+
+            window = self._create_keyboard_window(flush["idx"], seq=flush["seq"])
+            return window, alert, self.controls._create_progress_layout()
+
+        define_label_search_callback(self.ids.dropdown(MATCH), self.controller.label_set, "AnnotateImageLabelsAIO.search_labels")
+
+    def _create_keyboard_window(self, start: int, seq: int = 0, reset: bool = False) -> Dict[str,Any]:
+        """Preloaded images from an index on, for the clientside keyboard callback
+
+        Args:
+            start (int): Index of the first image
+            seq (int, optional): Sequence number of the flush this window answers. Defaults to 0.
+            reset (bool, optional): Whether the browser should discard its position and decisions. Defaults to False.
+
+        Returns:
+            Dict[str,Any]: Window
+        """
+        batch_size = self.options.keyboard_batch_size
+        idxs = list(range(max(start, 0), min(start + 2*batch_size, self.controller.no_images)))
+        images = self.keyboard_images.get_many(
+            [ self.controller.thumbnail_source_at_idx(idx) for idx in idxs ],
+            [ self.controller.image_name_at_idx(idx) for idx in idxs ]
+            )
+        idxs_next = range(idxs[-1] + 1, min(idxs[-1] + 1 + batch_size, self.controller.no_images)) if len(idxs) > 0 else []
+        self.keyboard_images.prefetch([ self.controller.thumbnail_source_at_idx(idx) for idx in idxs_next ])
+
+        items = []
+        for idx, image in zip(idxs, images):
+            image_name = self.controller.image_name_at_idx(idx)
+            label = self.controller.label_for_image(image_name)
+            label_value = None
+            if label is not None:
+                label_value = label.single if self.selection_mode == SelectionMode.SINGLE else label.multiple
+            items.append({
+                "name": image_name,
+                "src": thumbnail_data_uri(image) if image is not None else "",
+                "label": label_value
+                })
+
+        return {
+            "aio_id": self.aio_id,
+            "start": start,
+            "no_images": self.controller.no_images,
+            "items": items,
+            "keys": label_keys(self.controller.label_set.labels),
+            "multiple": self.selection_mode == SelectionMode.MULTIPLE,
+            "batch_size": batch_size,
+            "seq": seq,
+            "reset": reset
+            }
+
+    def _create_keyboard_layout(self):
+        """Create layout for labeling with keyboard shortcuts
+        """
+        start = self.controller.curr.image_idx if self.controller.curr is not None else self.controller.no_images
+        instructions_txt = self.options.instructions_custom or "Label images with the keyboard:"
+        return dbc.Row([
+            dbc.Col(id=self.ids.kb_alert(self.aio_id), xs=12),
+            dbc.Col([
+                html.Img(id=self.ids.kb_image(self.aio_id), style={"maxWidth": "100%"})
+            ], md=6),
+            dbc.Col([
+                html.P(instructions_txt),
+                html.P(keyboard_legend(self.controller.label_set.labels, self.selection_mode == SelectionMode.MULTIPLE)),
+                html.H5(id=self.ids.kb_caption(self.aio_id))
+            ], md=6, class_name="align-self-center"),
+            dcc.Store(id=self.ids.kb_window(self.aio_id), data=self._create_keyboard_window(start, reset=True)),
+            dcc.Store(id=self.ids.kb_flush(self.aio_id))
+        ])
     
     def _create_layout(self):
         """Create layout for component
         """
+        if self.options.keyboard_shortcuts:
+            return self._create_keyboard_layout()
+
         label = None
         if self.controller.curr is not None:
             if self.selection_mode == SelectionMode.SINGLE:
@@ -145,10 +291,10 @@ class AnnotateImageLabelsAIO(html.Div):
         instructions_txt = self.options.instructions_custom or "Label this image from the following options:"
         instructions = html.P(instructions_txt)
 
-        dropdown = dcc.Dropdown(
-            self.controller.labels, 
-            value=label, 
-            id=self.ids.dropdown(self.aio_id), 
+        dropdown = label_dropdown(
+            self.controller.label_set,
+            self.ids.dropdown(self.aio_id),
+            value=label,
             multi=self.selection_mode == SelectionMode.MULTIPLE
             )
 
@@ -176,9 +322,9 @@ class AnnotateImageLabelsAIO(html.Div):
                 raise NotImplementedError(f"Unknown selection mode: {self.selection_mode}")
 
         if existing_label is not None:
-            if type(existing_label) == str and existing_label in self.controller.labels:
+            if type(existing_label) == str and existing_label in self.controller.label_set:
                 return dbc.Alert(f"Existing annotation: {existing_label}", color="primary")
-            elif type(existing_label) == list and all([l in self.controller.labels for l in existing_label]):
+            elif type(existing_label) == list and all([l in self.controller.label_set for l in existing_label]):
                 return dbc.Alert(f"Existing annotation: {existing_label}", color="primary")
             else:
                 return dbc.Alert(f"Existing unknown annotation: {existing_label}", color="danger")
@@ -193,6 +339,12 @@ class AnnotateImageLabelsAIO(html.Div):
             image = self.controller.curr.image
         if image is None:
             return []
+        if isinstance(image, LargeImage):
+            # Labels apply to the whole image: show an overview read from a coarse level
+            image = image.overview(self.options.large_image_viewport_size)
+        else:
+            with metrics.timer("image_decode_duration_seconds", {"component": "AnnotateImageLabelsAIO"}):
+                image.load()
         fig = px.imshow(image)
         fig.update_layout(margin=dict(l=0, r=0, b=0, t=0))
         return dcc.Graph(id="graph-styled-annotations", figure=fig)
\ No newline at end of file
@@ -0,0 +1,364 @@
+from dash_annotate_cv.annotate_image_controller import AnnotateImageController, AnnotateImageOptions, InvalidMaskError
+from dash_annotate_cv.annotate_image_controls import AnnotateImageControlsAIO
+from dash_annotate_cv.annotate_image_bboxs import _image_to_data_uri
+from dash_annotate_cv.helpers import get_trigger_id
+from dash_annotate_cv.image_source import ImageSource
+from dash_annotate_cv.label_source import LabelSource
+from dash_annotate_cv.label_dropdown import label_dropdown, define_label_search_callback
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.annotation_storage import AnnotationStorage
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.jobs import JobRunner
+from dash_annotate_cv.large_image import LargeImage
+from dash_annotate_cv.rle import rle_from_polygon, rle_overlay, path_to_polygon
+
+import plotly.express as px
+import plotly.graph_objects as go
+from dash import Output, Input, State, html, dcc, callback, MATCH, ALL, no_update
+from typing import Optional, List, Dict, Any
+import dash_bootstrap_components as dbc
+from dataclasses import dataclass
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class AnnotateImageMasksAIO(html.Div):
+    """Segmentation mask annotation component for images
+
+    Masks are drawn as closed outlines and stored run-length encoded. They are shown as a single overlay image at a reduced resolution
+    (`mask_overlay_size`), so neither the browser nor the server holds dense full resolution masks.
+    """
+
+    # A set of functions that create pattern-matching callbacks of the subcomponents
+    class ids:
+        mask_labeling = lambda aio_id: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'mask_labeling',
+            'aio_id': aio_id
+        }
+        image = lambda aio_id: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'image',
+            'aio_id': aio_id
+        }
+        graph_picture = lambda aio_id: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'graph_picture',
+            'aio_id': aio_id
+        }
+        delete_button = lambda aio_id, idx: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'delete_button',
+            'aio_id': aio_id,
+            'idx': idx
+        }
+        dropdown = lambda aio_id, idx: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'dropdown',
+            'aio_id': aio_id,
+            'idx': idx
+        }
+        alert = lambda aio_id: {
+            'component': 'AnnotateImageMasksAIO',
+            'subcomponent': 'alert',
+            'aio_id': aio_id
+        }
+
+    ids = ids
+
+    def __init__(self,
+        label_source: LabelSource,
+        image_source: ImageSource,
+        annotation_storage: AnnotationStorage = AnnotationStorage(),
+        annotations_existing: Optional[ImageAnnotations] = None,
+        aio_id: Optional[str] = None,
+        options: AnnotateImageOptions = AnnotateImageOptions(),
+        job_runner: Optional[JobRunner] = None
+        ):
+        """Constructor
+
+        Args:
+            label_source (LabelSource): Label source
+            image_source (ImageSource): Image source
+            annotation_storage (AnnotationStorage, optional): Storage. Defaults to AnnotationStorage().
+            annotations_existing (Optional[ImageAnnotations], optional): Existing annotations. Defaults to None.
+            aio_id (Optional[str], optional): AIO Id to use for components. Defaults to None.
+            options (AnnotateImageOptions, optional): Options. Defaults to AnnotateImageOptions().
+            job_runner (Optional[JobRunner], optional): Runner for export, import and validation jobs; their controls are shown if set. Defaults to None.
+        """
+        options.check_valid()
+
+        self.options = options
+        self.controller = AnnotateImageController(
+            label_source=label_source,
+            image_source=image_source,
+            annotation_storage=annotation_storage,
+            annotations_existing=annotations_existing,
+            options=options
+            )
+        self.controls = AnnotateImageControlsAIO(
+            controller=self.controller,
+            refresh_layout_callback=self._create_layout,
+            aio_id=aio_id,
+            job_runner=job_runner
+            )
+        self.aio_id = self.controls.aio_id
+
+        super().__init__(self.controls) # Equivalent to `html.Div([...])`
+        self._define_callbacks()
+
+    def _create_layout(self):
+        """Create layout for component
+        """
+        logger.debug("Creating layout for component")
+
+        curr_image_layout = self._create_layout_for_curr_image()
+
+        instructions_txt = self.options.instructions_custom or "Draw the outline of each object on the image, and label the classes."
+        instructions = html.P(instructions_txt)
+
+        return dbc.Row([
+            dbc.Col([
+                html.Div(curr_image_layout, id=self.ids.image(self.aio_id))
+            ], md=6),
+            dbc.Col([
+                html.Div(self._create_alert_layout(), id=self.ids.alert(self.aio_id)),
+                instructions,
+                html.Div(self._create_mask_layout(), id=self.ids.mask_labeling(self.aio_id))
+                ], md=6, class_name="align-self-center")
+        ])
+
+    def _create_layout_for_curr_image(self):
+        """Create layout for the image
+        """
+        image = self.controller.curr.image if self.controller.curr is not None else None
+        if image is None:
+            return []
+        if isinstance(image, LargeImage):
+            fig = self._create_large_image_figure(image)
+        else:
+            with metrics.timer("image_decode_duration_seconds", {"component": "AnnotateImageMasksAIO"}):
+                image.load()
+            fig = px.imshow(image)
+        rgb = self.options.default_bbox_color
+        fig.update_layout(
+            dragmode="drawclosedpath",
+            newshape=dict(line_color='rgba(%d,%d,%d,1)' % rgb, fillcolor='rgba(%d,%d,%d,0.3)' % rgb),
+            margin=dict(l=0, r=0, b=0, t=0)
+            )
+        figure = fig.to_dict()
+        self._refresh_figure_masks(figure)
+        return dcc.Graph(id=self.ids.graph_picture(self.aio_id), figure=figure)
+
+    def _create_large_image_figure(self, image: LargeImage) -> go.Figure:
+        """Figure for a large image: an overview at `large_image_viewport_size` as a layout image, in base image coordinates
+        """
+        overview, xyxy = image.viewport([0, 0, image.width, image.height], self.options.large_image_viewport_size)
+        fig = go.Figure(go.Scatter(
+            x=[0, image.width],
+            y=[0, image.height],
+            mode="markers",
+            marker=dict(opacity=0),
+            hoverinfo="skip",
+            showlegend=False
+            ))
+        fig.update_xaxes(showgrid=False, zeroline=False, constrain="domain")
+        fig.update_yaxes(showgrid=False, zeroline=False, autorange="reversed", scaleanchor="x", constrain="domain")
+        fig.update_layout(
+            images=[dict(
+                source=_image_to_data_uri(overview),
+                xref="x",
+                yref="y",
+                x=xyxy[0],
+                y=xyxy[1],
+                sizex=xyxy[2] - xyxy[0],
+                sizey=xyxy[3] - xyxy[1],
+                xanchor="left",
+                yanchor="top",
+                sizing="stretch",
+                layer="below"
+                )],
+            plot_bgcolor="white"
+            )
+        return fig
+
+    def _pixel_offset(self) -> float:
+        # `px.imshow` puts pixel centers at integers, the large image figure puts pixel edges at integers
+        if self.controller.curr is not None and isinstance(self.controller.curr.image, LargeImage):
+            return 0.0
+        return 0.5
+
+    def _mask_color(self, class_name: Optional[str]):
+        if class_name is None:
+            return self.options.default_bbox_color
+        return self.options.get_assign_color_for_class(class_name)
+
+    def _refresh_figure_masks(self, figure: Dict):
+        """Replace the overlay of the masks in the figure, and drop drawn outlines
+        """
+        images = [ image for image in figure['layout'].get('images', []) if image.get('name') != 'masks' ]
+        masks = self.controller.curr_masks
+        if self.controller.curr is not None and len(masks) > 0:
+            with metrics.timer("mask_overlay_duration_seconds"):
+                overlay = rle_overlay(
+                    [ mask.rle for mask in masks ],
+                    [ self._mask_color(mask.class_name) for mask in masks ],
+                    self.options.mask_overlay_size
+                    )
+            offset = self._pixel_offset()
+            height, width = masks[0].size
+            images.append(dict(
+                name="masks",
+                source=_image_to_data_uri(overlay),
+                xref="x",
+                yref="y",
+                x=-offset,
+                y=-offset,
+                sizex=width,
+                sizey=height,
+                xanchor="left",
+                yanchor="top",
+                sizing="stretch",
+                layer="above"
+                ))
+        figure['layout']['images'] = images
+        figure['layout']['shapes'] = []
+
+    def _create_mask_layout(self):
+        if self.controller.curr is None:
+            logger.debug("Creating mask layout - no curr image")
+            return no_update
+        return dbc.ListGroup([
+            self._create_list_group_for_mask_layout(mask, idx)
+            for idx, mask in enumerate(self.controller.curr_masks)
+            ])
+
+    def _create_list_group_for_mask_layout(self, mask: ImageAnnotations.Annotation.Mask, mask_idx: int):
+        xyxy_label = "%d px (%s)" % (mask.area, ",".join([str(int(x)) for x in mask.xyxy]))
+        dropdown = label_dropdown(
+            self.controller.label_set,
+            self.ids.dropdown(self.aio_id, mask_idx),
+            value=mask.class_name
+            )
+
+        button_delete = dbc.Button(
+            "Delete",
+            color="danger",
+            size="sm",
+            className="mr-1",
+            id=self.ids.delete_button(self.aio_id, mask_idx)
+            )
+
+        return dbc.ListGroupItem([
+            dbc.Row([
+                dbc.Col(dropdown, lg=5, md=6),
+                dbc.Col(xyxy_label, lg=5, md=6),
+                dbc.Col(button_delete, lg=2, md=6)
+                ])
+            ])
+
+    def _create_alert_layout(self, message: Optional[str] = None):
+        alerts = []
+        if message is not None:
+            alerts.append(dbc.Alert(message, color="warning"))
+
+        # No masks
+        if len(self.controller.curr_masks) == 0:
+            alerts.append(dbc.Alert("Start by drawing the outline of an object", color="primary"))
+
+        # Masks without labels
+        if any(mask.class_name is None for mask in self.controller.curr_masks):
+            alerts.append(dbc.Alert("All masks must have labels", color="warning"))
+
+        return alerts
+
+    def _define_callbacks(self):
+        """Define callbacks
+        """
+        logger.debug("Defining callbacks")
+        @callback(
+            Output(self.ids.mask_labeling(MATCH), 'children'),
+            Output(self.ids.graph_picture(MATCH), "figure"),
+            Output(self.ids.alert(MATCH), "children"),
+            Input(self.ids.graph_picture(MATCH), "relayoutData"),
+            Input(self.ids.delete_button(MATCH, ALL), "n_clicks"),
+            Input(self.ids.dropdown(MATCH, ALL), "value"),
+            State(self.ids.graph_picture(MATCH), "figure"),
+            prevent_initial_call=True
+            )
+        @metrics.instrument_callback("AnnotateImageMasksAIO.update")
+        def update(relayout_data, n_clicks_delete, dropdown_value, figure):
+
+            trigger_id, idx = get_trigger_id()
+            logger.debug(f"Update: trigger ID: {trigger_id} idx: {idx}")
+
+            if trigger_id == "delete_button":
+                assert idx is not None, "idx should not be None"
+                if not n_clicks_delete[idx]:
+                    # Button was just created
+                    return no_update, no_update, no_update
+                update = self._handle_delete_button_pressed(idx, figure)
+
+            elif trigger_id == "dropdown":
+                assert idx is not None, "idx should not be None"
+                update = self._handle_dropdown_changed(idx, dropdown_value[idx], figure)
+
+            elif trigger_id == "graph_picture" and relayout_data is not None and "shapes" in relayout_data:
+                update = self._handle_outline_drawn(relayout_data, figure)
+
+            else:
+                # Zoom, pan, or an unrecognized trigger
+                return no_update, no_update, no_update
+
+            self.controls.refresh_progress()
+            return update.mask_layout, update.figure, update.alert
+
+        define_label_search_callback(self.ids.dropdown(MATCH, MATCH), self.controller.label_set, "AnnotateImageMasksAIO.search_labels")
+        logger.debug("Defined callbacks")
+
+    @dataclass
+    class Update:
+        mask_layout: Any
+        figure: Any
+        alert: Any
+
+    def _handle_delete_button_pressed(self, idx: int, figure: Dict) -> Update:
+        logger.debug(f"Deleting mask idx: {idx}")
+        self.controller.delete_mask(idx)
+        self._refresh_figure_masks(figure)
+        return AnnotateImageMasksAIO.Update(self._create_mask_layout(), figure, self._create_alert_layout())
+
+    def _handle_dropdown_changed(self, idx: int, dropdown_value_new: Any, figure: Dict) -> Update:
+        if type(dropdown_value_new) == list:
+            logger.warning("Dropdown value is list, expected string")
+            return AnnotateImageMasksAIO.Update(no_update, no_update, self._create_alert_layout())
+        masks = self.controller.curr_masks
+        if dropdown_value_new is None or idx >= len(masks) or masks[idx].class_name == dropdown_value_new:
+            # Dropdown was just created with the stored class
+            return AnnotateImageMasksAIO.Update(no_update, no_update, no_update)
+        self.controller.update_mask_class(idx, dropdown_value_new)
+        self._refresh_figure_masks(figure)
+        return AnnotateImageMasksAIO.Update(no_update, figure, self._create_alert_layout())
+
+    def _handle_outline_drawn(self, relayout_data: Dict, figure: Dict) -> Update:
+        assert self.controller.curr is not None, "curr should not be None"
+        shape = relayout_data["shapes"][-1]
+        if shape.get("type") != "path":
+            logger.warning(f"Ignoring drawn shape of type {shape.get('type')}")
+            self._refresh_figure_masks(figure)
+            return AnnotateImageMasksAIO.Update(no_update, figure, no_update)
+
+        image = self.controller.curr.image
+        offset = self._pixel_offset()
+        xy = [ (x + offset, y + offset) for x, y in path_to_polygon(shape["path"]) ]
+        message = None
+        try:
+            self.controller.add_mask(rle_from_polygon(xy, image.height, image.width))
+        except InvalidMaskError as e:
+            logger.info(f"Rejected mask: {e}")
+            message = "The outline does not enclose any pixels of the image"
+
+        self._refresh_figure_masks(figure)
+        return AnnotateImageMasksAIO.Update(self._create_mask_layout(), figure, self._create_alert_layout(message))
@@ -0,0 +1,304 @@
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+
+from dataclasses import dataclass, field
+from typing import Optional, Dict, Any
+from mashumaro import DataClassDictMixin
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ProgressSnapshot(DataClassDictMixin):
+    """Point-in-time dataset statistics
+    """
+
+    # Number of images in the image source, if known
+    no_images_total: Optional[int]
+
+    # Number of images with a label, at least one bbox or at least one mask
+    no_images_done: int
+
+    # Number of images with a label
+    no_images_labeled: int
+
+    # Number of images with at least one bbox
+    no_images_with_bboxs: int
+
+    # Number of bboxs
+    no_bboxs: int
+
+    # Number of bboxs without a class
+    no_bboxs_unlabeled: int
+
+    # Class name to number of bboxs
+    bboxs_per_class: Dict[str,int] = field(default_factory=dict)
+
+    # Author to number of bboxs (bboxs without author are not counted)
+    bboxs_per_author: Dict[str,int] = field(default_factory=dict)
+
+    # Label to number of images with that label (single or among multiple labels)
+    labels_per_class: Dict[str,int] = field(default_factory=dict)
+
+    # Author to number of labeled images (labels without author are not counted)
+    labels_per_author: Dict[str,int] = field(default_factory=dict)
+
+    # Number of images with at least one mask
+    no_images_with_masks: int = 0
+
+    # Number of masks
+    no_masks: int = 0
+
+    # Class name to number of bboxs of the class or its descendants, if labels come from a taxonomy
+    bboxs_per_class_rolled_up: Dict[str,int] = field(default_factory=dict)
+
+    # Label to the summed image counts of the label and its descendants, if labels come from a taxonomy
+    labels_per_class_rolled_up: Dict[str,int] = field(default_factory=dict)
+
+    @property
+    def fraction_done(self) -> Optional[float]:
+        """Fraction of images in the image source that are done, if the total is known
+        """
+        if self.no_images_total is None or self.no_images_total == 0:
+            return None
+        return self.no_images_done / self.no_images_total
+
+
+# Per-image state flags
+_LABELED = 1
+_WITH_BBOXS = 2
+_WITH_MASKS = 4
+
+
+class AnnotationStats:
+    """Aggregate statistics over annotations, updated in O(1) per mutation
+
+    Built once from existing annotations with `from_annotations`, then kept up to date by the controller
+    calling the `bbox_*`, `mask_*`, `label_changed` and `image_changed` hooks, so reading progress never rescans the dataset.
+    """
+
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._image_flags: Dict[str,int] = {}
+        self._no_images_done = 0
+        self._no_images_labeled = 0
+        self._no_images_with_bboxs = 0
+        self._no_images_with_masks = 0
+        self._no_masks = 0
+        self._no_bboxs = 0
+        self._no_bboxs_unlabeled = 0
+        self._bboxs_per_class: Dict[str,int] = {}
+        self._bboxs_per_author: Dict[str,int] = {}
+        self._labels_per_class: Dict[str,int] = {}
+        self._labels_per_author: Dict[str,int] = {}
+
+
+    @classmethod
+    def from_annotations(cls, annotations: ImageAnnotations) -> "AnnotationStats":
+        """Build statistics with a single pass over existing annotations
+
+        Args:
+            annotations (ImageAnnotations): Annotations
+
+        Returns:
+            AnnotationStats: Statistics
+        """
+        stats = cls()
+        for entry in annotations.image_to_entry.values():
+            for bbox in entry.bboxs or []:
+                stats.bbox_added(bbox)
+            for mask in entry.masks or []:
+                stats.mask_added(mask)
+            if entry.label is not None:
+                stats.label_changed(None, entry.label)
+            stats.image_changed(entry)
+        return stats
+
+
+    @staticmethod
+    def _add(counts: Dict[str,int], key: Optional[str], amount: int):
+        if key is None:
+            return
+        value = counts.get(key, 0) + amount
+        if value == 0:
+            del counts[key]
+        else:
+            counts[key] = value
+
+
+    def bbox_added(self, bbox: ImageAnnotations.Annotation.Bbox):
+        """Record that a bbox was added
+
+        Args:
+            bbox (ImageAnnotations.Annotation.Bbox): Added bbox
+        """
+        with self._lock:
+            self._no_bboxs += 1
+            if bbox.class_name is None:
+                self._no_bboxs_unlabeled += 1
+            self._add(self._bboxs_per_class, bbox.class_name, 1)
+            self._add(self._bboxs_per_author, bbox.author, 1)
+
+
+    def bbox_removed(self, bbox: ImageAnnotations.Annotation.Bbox):
+        """Record that a bbox was removed
+
+        Args:
+            bbox (ImageAnnotations.Annotation.Bbox): Removed bbox
+        """
+        with self._lock:
+            self._no_bboxs -= 1
+            if bbox.class_name is None:
+                self._no_bboxs_unlabeled -= 1
+            self._add(self._bboxs_per_class, bbox.class_name, -1)
+            self._add(self._bboxs_per_author, bbox.author, -1)
+
+
+    def bbox_changed(self, class_name_old: Optional[str], author_old: Optional[str], bbox: ImageAnnotations.Annotation.Bbox):
+        """Record that the class or author of a bbox changed
+
+        Args:
+            class_name_old (Optional[str]): Class name before the change
+            author_old (Optional[str]): Author before the change
+            bbox (ImageAnnotations.Annotation.Bbox): Bbox after the change
+        """
+        self.bbox_removed(ImageAnnotations.Annotation.Bbox(xyxy=bbox.xyxy, class_name=class_name_old, author=author_old))
+        self.bbox_added(bbox)
+
+
+    def mask_added(self, mask: ImageAnnotations.Annotation.Mask):
+        """Record that a mask was added
+
+        Args:
+            mask (ImageAnnotations.Annotation.Mask): Added mask
+        """
+        with self._lock:
+            self._no_masks += 1
+
+
+    def mask_removed(self, mask: ImageAnnotations.Annotation.Mask):
+        """Record that a mask was removed
+
+        Args:
+            mask (ImageAnnotations.Annotation.Mask): Removed mask
+        """
+        with self._lock:
+            self._no_masks -= 1
+
+
+    def label_changed(self, label_old: Optional[ImageAnnotations.Annotation.Label], label_new: Optional[ImageAnnotations.Annotation.Label]):
+        """Record that the label of an image changed
+
+        Args:
+            label_old (Optional[ImageAnnotations.Annotation.Label]): Label before the change
+            label_new (Optional[ImageAnnotations.Annotation.Label]): Label after the change
+        """
+        with self._lock:
+            for label, amount in [(label_old, -1), (label_new, 1)]:
+                if label is None:
+                    continue
+                self._add(self._labels_per_class, label.single, amount)
+                for label_value in label.multiple or []:
+                    self._add(self._labels_per_class, label_value, amount)
+                self._add(self._labels_per_author, label.author, amount)
+
+
+    def image_changed(self, entry: ImageAnnotations.Annotation):
+        """Update the per-image counts (done, labeled, with bboxs, with masks) after an image's annotation changed
+
+        Args:
+            entry (ImageAnnotations.Annotation): Annotation of the image
+        """
+        flags = (_LABELED if entry.label is not None else 0) | (_WITH_BBOXS if entry.bboxs else 0) | (_WITH_MASKS if entry.masks else 0)
+        with self._lock:
+            flags_old = self._image_flags.get(entry.image_name, 0)
+            if flags == flags_old:
+                return
+            if flags == 0:
+                del self._image_flags[entry.image_name]
+            else:
+                self._image_flags[entry.image_name] = flags
+            self._no_images_done += (flags != 0) - (flags_old != 0)
+            self._no_images_labeled += bool(flags & _LABELED) - bool(flags_old & _LABELED)
+            self._no_images_with_bboxs += bool(flags & _WITH_BBOXS) - bool(flags_old & _WITH_BBOXS)
+            self._no_images_with_masks += bool(flags & _WITH_MASKS) - bool(flags_old & _WITH_MASKS)
+
+
+    def entry_replaced(self, entry_old: Optional[ImageAnnotations.Annotation], entry_new: ImageAnnotations.Annotation):
+        """Record that the annotation of an image was replaced as a whole, e.g. by one written by another process
+
+        Args:
+            entry_old (Optional[ImageAnnotations.Annotation]): Annotation before, or None if the image had none
+            entry_new (ImageAnnotations.Annotation): Annotation after
+        """
+        if entry_old is not None:
+            for bbox in entry_old.bboxs or []:
+                self.bbox_removed(bbox)
+            for mask in entry_old.masks or []:
+                self.mask_removed(mask)
+        for bbox in entry_new.bboxs or []:
+            self.bbox_added(bbox)
+        for mask in entry_new.masks or []:
+            self.mask_added(mask)
+        self.label_changed(entry_old.label if entry_old is not None else None, entry_new.label)
+        self.image_changed(entry_new)
+
+
+    def is_done(self, image_name: str) -> bool:
+        """Whether an image has a label, at least one bbox or at least one mask
+
+        Args:
+            image_name (str): Image name
+
+        Returns:
+            bool: True if done
+        """
+        return image_name in self._image_flags
+
+
+    def snapshot(self, no_images_total: Optional[int] = None) -> ProgressSnapshot:
+        """Current statistics
+
+        Args:
+            no_images_total (Optional[int], optional): Number of images in the image source. Defaults to None.
+
+        Returns:
+            ProgressSnapshot: Statistics
+        """
+        with self._lock:
+            return ProgressSnapshot(
+                no_images_total=no_images_total,
+                no_images_done=self._no_images_done,
+                no_images_labeled=self._no_images_labeled,
+                no_images_with_bboxs=self._no_images_with_bboxs,
+                no_bboxs=self._no_bboxs,
+                no_bboxs_unlabeled=self._no_bboxs_unlabeled,
+                bboxs_per_class=dict(self._bboxs_per_class),
+                bboxs_per_author=dict(self._bboxs_per_author),
+                labels_per_class=dict(self._labels_per_class),
+                labels_per_author=dict(self._labels_per_author),
+                no_images_with_masks=self._no_images_with_masks,
+                no_masks=self._no_masks
+                )
+
+
+def register_progress_route(app: Any, progress: Any, path: str = "/progress"):
+    """Expose progress as JSON on the Flask server of a Dash app
+
+    Args:
+        app (Any): Dash app or Flask server
+        progress (Any): Object with a `progress()` method returning a `ProgressSnapshot`, e.g. an `AnnotateImageController`
+        path (str, optional): Route. Defaults to "/progress".
+    """
+    from flask import jsonify
+
+    server = getattr(app, "server", app)
+
+    def progress_view():
+        snapshot = progress.progress()
+        return jsonify(dict(snapshot.to_dict(), fraction_done=snapshot.fraction_done))
+    server.add_url_rule(path, endpoint="dacv_progress", view_func=progress_view)
+    logger.debug(f"Registered progress route {path}")
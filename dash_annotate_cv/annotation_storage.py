@@ -1,8 +1,12 @@
 from dash_annotate_cv.formats import ImageAnnotations
+from dash_annotate_cv.metrics import registry as metrics, BYTES_BUCKETS
+from dash_annotate_cv.file_lock import FileLock
+from dash_annotate_cv.checkpoints import CheckpointStore
 from dataclasses import dataclass, field
 from mashumaro import DataClassDictMixin
-from typing import Optional, Any, List
+from typing import Optional, Any, Dict, List, Iterable, Iterator, Set, Tuple
 from enum import Enum
+import os
 import logging
 
 
@@ -38,50 +42,192 @@ class AnnotationStorage(DataClassDictMixin):
     # Storage frequency (if storage_frequency is StorageFrequency.EVERY_N_IMAGES)
     storage_frequency_every_n: int = 10
 
+    # Whether several processes (e.g. gunicorn workers) share the files. Each write then takes a file lock,
+    # reads the JSON file, keeps the images other processes changed and writes back the images this process changed
+    multi_process: bool = False
+
+    # Directory for versioned checkpoints of the annotations, holding only the images changed since the previous one. None = no checkpoints
+    checkpoint_dir: Optional[str] = None
+
+    # Checkpoints: write one every this many writes, regardless of the storage frequency
+    checkpoint_every_n: int = 100
+
+    # Checkpoints: minimum number of most recent checkpoints kept
+    checkpoint_keep: int = 20
+
     def __post_init__(self):
         if StorageType.JSON in self.storage_types:
             assert self.json_file is not None, "json_file must be set if storage_type is JSON"
         if StorageType.COCO in self.storage_types:
             assert self.coco_file is not None, "coco_file must be set if storage_type is COCO"
+        if self.multi_process:
+            # COCO does not store timestamps or history, so it cannot be merged with without losing them
+            assert StorageType.JSON in self.storage_types, "JSON storage must be used if multi_process is set"
+        assert self.checkpoint_every_n > 0, "checkpoint_every_n must be positive"
+        assert self.checkpoint_keep > 0, "checkpoint_keep must be positive"
 
 class AnnotationWriter:
     """Annotation writer
     """
 
-    def __init__(self, storage: AnnotationStorage):
+    def __init__(self, storage: AnnotationStorage, supercategories: Optional[Dict[str,str]] = None):
+        """Constructor
+
+        Args:
+            storage (AnnotationStorage): Where to write
+            supercategories (Optional[Dict[str,str]], optional): Class name to COCO supercategory, e.g. from a `Taxonomy`. Defaults to None.
+        """
         self.storage = storage
+        self.supercategories = supercategories
         self._ctr_write = 0
 
-    def write(self, annotations: Any):
+        # Multiple processes: images changed since the last write, and the state of the shared file after it
+        self._dirty: Set[str] = set()
+        self._dirty_all = False
+        self._shared_stat: Optional[Tuple[int,int,int]] = None
+
+        # Checkpoints: only the names of changed images are recorded per write
+        self.checkpoints = CheckpointStore(storage.checkpoint_dir, keep=storage.checkpoint_keep) if storage.checkpoint_dir is not None else None
+        self._ctr_checkpoint = 0
+
+    def write(self, annotations: Any, image_names: Optional[Iterable[str]] = None) -> List[Tuple[Optional[ImageAnnotations.Annotation],ImageAnnotations.Annotation]]:
         """Write annotations
 
         Args:
             annotations (Any): Annotations to write
+            image_names (Optional[Iterable[str]], optional): Images changed since the previous call. Only used if the storage is shared by multiple processes: these images are written, all others are taken from the file. Defaults to None, i.e. all images were changed.
+
+        Returns:
+            List[Tuple[Optional[ImageAnnotations.Annotation],ImageAnnotations.Annotation]]: Entries replaced in `annotations` by newer ones from the file (old entry, or None if the image was new, and new entry). Always empty unless the storage is shared by multiple processes.
         """               
+        if self.checkpoints is not None:
+            self._update_checkpoints(annotations, image_names)
+
         # Check if any storage types requested         
         if len(self.storage.storage_types) == 0:
-            return
+            return []
 
         # Update ctr
         self._ctr_write += 1
+        if image_names is None:
+            self._dirty_all = True
+        else:
+            self._dirty.update(image_names)
         
         # Check if frequency matches
         write_every = self.storage.storage_frequency == AnnotationStorage.StorageFrequency.EVERY_OPERATION
         write_every_n = self.storage.storage_frequency == AnnotationStorage.StorageFrequency.EVERY_N_OPERATIONS and self._ctr_write % self.storage.storage_frequency_every_n == 0
         write = write_every or write_every_n
         if not write:
-            return
-        
-        # Write
+            return []
+
+        if not self.storage.multi_process:
+            self._write_all(annotations)
+            self._dirty, self._dirty_all = set(), False
+            return []
+
+        assert self.storage.json_file is not None, "json_file must be set if multi_process is set"
+        with FileLock(self.storage.json_file):
+            replaced = self._merge_from_file(annotations, self.storage.json_file)
+            if self.checkpoints is not None:
+                self.checkpoints.mark_changed([ entry_new.image_name for _, entry_new in replaced ])
+            self._write_all(annotations)
+            self._shared_stat = _stat(self.storage.json_file)
+        self._dirty, self._dirty_all = set(), False
+        return replaced
+
+    def _update_checkpoints(self, annotations: ImageAnnotations, image_names: Optional[Iterable[str]]):
+        assert self.checkpoints is not None
+        self.checkpoints.mark_changed(image_names if image_names is not None else annotations.image_to_entry.keys())
+        self._ctr_checkpoint += 1
+        if self._ctr_checkpoint % self.storage.checkpoint_every_n == 0:
+            self.checkpoints.checkpoint(annotations)
+
+    def _merge_from_file(self, annotations: ImageAnnotations, fname: str) -> List[Tuple[Optional[ImageAnnotations.Annotation],ImageAnnotations.Annotation]]:
+        """Take the entries of images not changed by this process from the shared JSON file; the lock must be held
+        """
+        if self._dirty_all or _stat(fname) is None or _stat(fname) == self._shared_stat:
+            # No other process wrote since this one did
+            return []
+
+        replaced = []
+        for entry in iter_image_anns(StorageType.JSON, fname):
+            if entry.image_name in self._dirty:
+                continue
+            entry_old = annotations.image_to_entry.get(entry.image_name)
+            if entry_old != entry:
+                annotations.image_to_entry[entry.image_name] = entry
+                replaced.append((entry_old, entry))
+        if len(replaced) > 0:
+            logger.debug(f"Took {len(replaced)} entries written by other processes from {fname}")
+            metrics.inc("storage_entries_merged_total", len(replaced))
+        return replaced
+
+    def _write_all(self, annotations: ImageAnnotations):
         if StorageType.JSON in self.storage.storage_types:
             assert self.storage.json_file is not None, "json_file must be set if storage_type is JSON"
             from dash_annotate_cv.formats.default import write_default_json
-            write_default_json(annotations, self.storage.json_file)
+            with metrics.timer("storage_write_duration_seconds", {"storage_type": StorageType.JSON.value}):
+                write_default_json(annotations, self.storage.json_file)
+            self._record_bytes_written(StorageType.JSON, self.storage.json_file)
 
         if StorageType.COCO in self.storage.storage_types:
             assert self.storage.coco_file is not None, "coco_file must be set if storage_type is COCO"
             from dash_annotate_cv.formats.coco import write_to_coco
-            write_to_coco(annotations, self.storage.coco_file)
+            with metrics.timer("storage_write_duration_seconds", {"storage_type": StorageType.COCO.value}):
+                write_to_coco(annotations, self.storage.coco_file, self.supercategories)
+            self._record_bytes_written(StorageType.COCO, self.storage.coco_file)
+
+    def write_stream(self, entries: Iterable[ImageAnnotations.Annotation]) -> int:
+        """Write annotations one image at a time to every storage type, regardless of the storage frequency
+
+        Only one entry is held in memory at a time, so this can export datasets that do not fit in memory.
+
+        Args:
+            entries (Iterable[ImageAnnotations.Annotation]): Annotation for each image
+
+        Returns:
+            int: Number of images written
+        """
+        from dash_annotate_cv.formats.default import DefaultJsonStreamWriter
+        from dash_annotate_cv.formats.coco import CocoStreamWriter
+
+        writers = []
+        if StorageType.JSON in self.storage.storage_types:
+            assert self.storage.json_file is not None, "json_file must be set if storage_type is JSON"
+            writers.append((StorageType.JSON, self.storage.json_file, DefaultJsonStreamWriter(self.storage.json_file)))
+        if StorageType.COCO in self.storage.storage_types:
+            assert self.storage.coco_file is not None, "coco_file must be set if storage_type is COCO"
+            writers.append((StorageType.COCO, self.storage.coco_file, CocoStreamWriter(self.storage.coco_file, supercategories=self.supercategories)))
+
+        no_written = 0
+        try:
+            for entry in entries:
+                for _, _, writer in writers:
+                    writer.write(entry)
+                no_written += 1
+        except BaseException:
+            for _, _, writer in writers:
+                writer.abort()
+            raise
+
+        for storage_type, fname, writer in writers:
+            writer.close()
+            self._record_bytes_written(storage_type, fname)
+        return no_written
+
+    def _record_bytes_written(self, storage_type: StorageType, fname: str):
+        no_bytes = os.path.getsize(fname)
+        metrics.observe("storage_write_bytes", no_bytes, {"storage_type": storage_type.value}, buckets=BYTES_BUCKETS)
+        metrics.inc("storage_bytes_written_total", no_bytes, {"storage_type": storage_type.value})
+
+
+def _stat(fname: str) -> Optional[Tuple[int,int,int]]:
+    try:
+        stat = os.stat(fname)
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_size, stat.st_mtime_ns
 
 
 def load_image_anns_from_storage(storage: AnnotationStorage) -> Optional[ImageAnnotations]:
@@ -114,4 +260,42 @@ def load_image_anns_if_exist(storage_type: StorageType, json_file: Optional[str]
         from dash_annotate_cv.formats.coco import load_from_coco_if_exist
         return load_from_coco_if_exist(coco_file)
     else:
-        raise NotImplementedError(f"storage_type {storage_type} not implemented")
\ No newline at end of file
+        raise NotImplementedError(f"storage_type {storage_type} not implemented")
+
+
+def iter_image_anns(storage_type: StorageType, fname: str) -> Iterator[ImageAnnotations.Annotation]:
+    """Stream the annotations in a file one image at a time
+
+    Args:
+        storage_type (StorageType): Storage type of the file
+        fname (str): File
+
+    Returns:
+        Iterator[ImageAnnotations.Annotation]: Annotation for each image
+    """    
+    if storage_type == StorageType.JSON:
+        from dash_annotate_cv.formats.default import iter_default_json
+        return iter_default_json(fname)
+    elif storage_type == StorageType.COCO:
+        from dash_annotate_cv.formats.coco import iter_coco
+        return iter_coco(fname)
+    else:
+        raise NotImplementedError(f"storage_type {storage_type} not implemented")
+
+
+def detect_storage_type(fname: str) -> StorageType:
+    """Detect the storage type of a file from its top-level keys, without loading it
+
+    Args:
+        fname (str): File
+
+    Returns:
+        StorageType: Storage type
+    """    
+    from dash_annotate_cv.formats.json_stream import top_level_keys
+    for key in top_level_keys(fname):
+        if key == "image_to_entry":
+            return StorageType.JSON
+        if key in ("images", "annotations", "categories"):
+            return StorageType.COCO
+    raise ValueError(f"Could not detect the storage type of {fname}")
@@ -0,0 +1,227 @@
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.metrics import registry as metrics
+
+from dataclasses import dataclass, field
+from mashumaro import DataClassDictMixin
+from typing import Optional, List, Dict, Iterable, Set
+import datetime
+import gzip
+import json
+import os
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+INDEX_FNAME = "checkpoints.json"
+
+
+@dataclass
+class CheckpointInfo(DataClassDictMixin):
+    """A checkpoint in a `CheckpointStore`
+    """
+
+    # Number, increasing from 1
+    checkpoint_id: int
+
+    # Time the checkpoint was written, ISO format
+    timestamp: str
+
+    # Whether the checkpoint holds all entries, rather than the entries changed since the previous checkpoint
+    is_base: bool
+
+    # Number of entries stored
+    no_entries: int
+
+    # Images whose entries were removed since the previous checkpoint
+    no_deleted: int
+
+    # Compressed size in bytes
+    no_bytes: int
+
+
+@dataclass
+class _Index(DataClassDictMixin):
+    checkpoints: List[CheckpointInfo] = field(default_factory=list)
+
+
+class CheckpointStore:
+    """Versioned, gzip compressed checkpoints of annotations in a directory
+
+    The first checkpoint written by a store holds all entries, since changes made before it was opened are unknown; later ones only
+    the entries of images changed since the previous checkpoint, as reported with `mark_changed`. Restoring a checkpoint applies the changes since the last base checkpoint before it. When more
+    than twice `keep` checkpoints exist, the oldest kept one is rewritten as a base and older ones are deleted, so full copies
+    are only written once every `keep` checkpoints.
+    """
+
+
+    def __init__(self, directory: str, keep: int = 20):
+        """Constructor
+
+        Args:
+            directory (str): Directory of the checkpoint files
+            keep (int, optional): Minimum number of most recent checkpoints kept. Defaults to 20.
+        """
+        assert keep > 0, "keep must be positive"
+        self.directory = directory
+        self.keep = keep
+        os.makedirs(directory, exist_ok=True)
+        self._lock = threading.Lock()
+        self._changed: Set[str] = set()
+        self._index = self._load_index()
+        self._needs_base = True
+
+
+    def _fname(self, checkpoint_id: int) -> str:
+        return os.path.join(self.directory, f"checkpoint_{checkpoint_id:06d}.json.gz")
+
+
+    def _load_index(self) -> _Index:
+        fname = os.path.join(self.directory, INDEX_FNAME)
+        if not os.path.exists(fname):
+            return _Index()
+        with open(fname) as f:
+            return _Index.from_dict(json.load(f))
+
+
+    def _write_index(self):
+        fname = os.path.join(self.directory, INDEX_FNAME)
+        fname_tmp = fname + ".tmp"
+        with open(fname_tmp, "w") as f:
+            json.dump(self._index.to_dict(), f, indent=3)
+        os.replace(fname_tmp, fname)
+
+
+    def _write_file(self, checkpoint_id: int, entries: Dict[str,Dict], deleted: List[str]) -> int:
+        fname = self._fname(checkpoint_id)
+        fname_tmp = fname + ".tmp"
+        with gzip.open(fname_tmp, "wt") as f:
+            json.dump({"entries": entries, "deleted": deleted}, f)
+        os.replace(fname_tmp, fname)
+        return os.path.getsize(fname)
+
+
+    def _read_file(self, checkpoint_id: int) -> Dict:
+        with gzip.open(self._fname(checkpoint_id), "rt") as f:
+            return json.load(f)
+
+
+    def checkpoints(self) -> List[CheckpointInfo]:
+        """Checkpoints, oldest first
+
+        Returns:
+            List[CheckpointInfo]: Checkpoints
+        """
+        with self._lock:
+            return list(self._index.checkpoints)
+
+
+    def mark_changed(self, image_names: Iterable[str]):
+        """Record that the entries of images changed since the previous checkpoint. Cheap: called for every edit
+
+        Args:
+            image_names (Iterable[str]): Images
+        """
+        with self._lock:
+            self._changed.update(image_names)
+
+
+    @property
+    def no_changed(self) -> int:
+        """Number of images changed since the previous checkpoint
+        """
+        return len(self._changed)
+
+
+    def checkpoint(self, annotations: ImageAnnotations, base: bool = False) -> Optional[CheckpointInfo]:
+        """Write a checkpoint of the entries changed since the previous one
+
+        Args:
+            annotations (ImageAnnotations): Current annotations
+            base (bool, optional): Store all entries, e.g. after the annotations were replaced as a whole. Defaults to False.
+
+        Returns:
+            Optional[CheckpointInfo]: New checkpoint, or None if nothing changed
+        """
+        with self._lock:
+            base = base or self._needs_base
+            if not base and len(self._changed) == 0:
+                return None
+
+            with metrics.timer("checkpoint_write_duration_seconds"):
+                if base:
+                    names = list(annotations.image_to_entry.keys())
+                else:
+                    names = sorted(self._changed)
+                entries = { name: annotations.image_to_entry[name].to_dict() for name in names if name in annotations.image_to_entry }
+                deleted = [ name for name in names if name not in annotations.image_to_entry ]
+                checkpoint_id = self._index.checkpoints[-1].checkpoint_id + 1 if len(self._index.checkpoints) > 0 else 1
+                no_bytes = self._write_file(checkpoint_id, entries, deleted)
+
+                info = CheckpointInfo(
+                    checkpoint_id=checkpoint_id,
+                    timestamp=datetime.datetime.now().isoformat(),
+                    is_base=base,
+                    no_entries=len(entries),
+                    no_deleted=len(deleted),
+                    no_bytes=no_bytes
+                    )
+                self._index.checkpoints.append(info)
+                self._changed = set()
+                self._needs_base = False
+                self._apply_retention()
+                self._write_index()
+
+            logger.debug(f"Wrote checkpoint {checkpoint_id} with {len(entries)} entries ({no_bytes} bytes)")
+            metrics.inc("checkpoints_written_total")
+            return info
+
+
+    def _apply_retention(self):
+        """Drop checkpoints older than the last `keep` once there are twice as many; the lock must be held
+        """
+        checkpoints = self._index.checkpoints
+        if len(checkpoints) <= 2 * self.keep:
+            return
+        oldest_kept = checkpoints[-self.keep]
+        if not oldest_kept.is_base:
+            entries = { name: entry.to_dict() for name, entry in self._restore(oldest_kept.checkpoint_id).image_to_entry.items() }
+            oldest_kept.no_bytes = self._write_file(oldest_kept.checkpoint_id, entries, [])
+            oldest_kept.is_base = True
+            oldest_kept.no_entries = len(entries)
+            oldest_kept.no_deleted = 0
+        for info in checkpoints[:-self.keep]:
+            os.remove(self._fname(info.checkpoint_id))
+        self._index.checkpoints = checkpoints[-self.keep:]
+        logger.debug(f"Kept checkpoints from {oldest_kept.checkpoint_id} on")
+
+
+    def _restore(self, checkpoint_id: int) -> ImageAnnotations:
+        ids = [ info.checkpoint_id for info in self._index.checkpoints ]
+        assert checkpoint_id in ids, f"No checkpoint {checkpoint_id}; available: {ids}"
+        chain = self._index.checkpoints[:ids.index(checkpoint_id)+1]
+        start = max([ idx for idx, info in enumerate(chain) if info.is_base ])
+
+        entries: Dict[str,Dict] = {}
+        for info in chain[start:]:
+            data = self._read_file(info.checkpoint_id)
+            entries.update(data["entries"])
+            for name in data["deleted"]:
+                entries.pop(name, None)
+        return ImageAnnotations(image_to_entry={ name: ImageAnnotations.Annotation.from_dict(entry) for name, entry in entries.items() })
+
+
+    def restore(self, checkpoint_id: int) -> ImageAnnotations:
+        """Annotations as they were at a checkpoint
+
+        Args:
+            checkpoint_id (int): Checkpoint
+
+        Returns:
+            ImageAnnotations: Annotations
+        """
+        with self._lock:
+            with metrics.timer("checkpoint_restore_duration_seconds"):
+                return self._restore(checkpoint_id)
@@ -2,11 +2,10 @@
 import dash_annotate_cv as dacv
 
 # Other imports
-from dash import Dash, html
-import dash_bootstrap_components as dbc
 import logging
 import sys
 import argparse
+import os
 from dataclasses import dataclass, field
 from mashumaro import DataClassDictMixin
 import yaml
@@ -38,6 +37,8 @@ class Conf(DataClassDictMixin):
     class Mode(Enum):
         IMAGE_LABELS = "image_labels"
         BBOXS = "bboxs"
+        GALLERY = "gallery"
+        MASKS = "masks"
 
     
     mode: Mode
@@ -51,11 +52,25 @@ class Conf(DataClassDictMixin):
         pass
 
 
+SUBCOMMANDS = ["convert", "export", "agreement", "merge", "validate", "checkpoints"]
+
+
 def cli():
+    argv = sys.argv[1:]
+    if len(argv) > 0 and argv[0] in SUBCOMMANDS:
+        cli_subcommand(argv)
+    else:
+        cli_launch_app(argv)
+
 
-    parser = argparse.ArgumentParser(description="Command line utility to launch a simple dash app to annotate images")
+def cli_launch_app(argv):
+
+    parser = argparse.ArgumentParser(
+        description="Command line utility to launch a simple dash app to annotate images",
+        epilog=f"Subcommands for working with annotation files without launching the app: {', '.join(SUBCOMMANDS)}. Use 'dacv <subcommand> -h' for details."
+        )
     parser.add_argument("conf", type=str, help="Path to the configuration file YAML file. See docs for details on the format.")
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Load conf
     with open(args.conf,"r") as f:
@@ -66,15 +81,19 @@ def cli():
     annotations_existing = dacv.load_image_anns_from_storage(conf.storage)
 
     # Dash app
+    from dash import Dash, html
+    import dash_bootstrap_components as dbc
     app = Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
-
+    dacv.register_metrics_route(app)
+    job_runner = dacv.JobRunner()
     if conf.mode == Conf.Mode.IMAGE_LABELS:
         aio = dacv.AnnotateImageLabelsAIO(
             label_source=conf.label_source, 
             image_source=conf.image_source, 
             annotation_storage=conf.storage, 
             annotations_existing=annotations_existing, 
-            options=conf.options
+            options=conf.options,
+            job_runner=job_runner
             )
         app.layout = dbc.Container([
             html.H1("Annotate Images"),
@@ -86,13 +105,233 @@ def cli():
             image_source=conf.image_source, 
             annotation_storage=conf.storage, 
             annotations_existing=annotations_existing, 
-            options=conf.options
+            options=conf.options,
+            job_runner=job_runner
             )
         app.layout = dbc.Container([
             html.H1("Annotate Bounding Boxes"),
             aio
             ])
+    elif conf.mode == Conf.Mode.MASKS:
+        aio = dacv.AnnotateImageMasksAIO(
+            label_source=conf.label_source, 
+            image_source=conf.image_source, 
+            annotation_storage=conf.storage, 
+            annotations_existing=annotations_existing, 
+            options=conf.options,
+            job_runner=job_runner
+            )
+        app.layout = dbc.Container([
+            html.H1("Annotate Segmentation Masks"),
+            aio
+            ])
+    elif conf.mode == Conf.Mode.GALLERY:
+        aio = dacv.AnnotateImageGalleryAIO(
+            label_source=conf.label_source, 
+            image_source=conf.image_source, 
+            annotation_storage=conf.storage, 
+            annotations_existing=annotations_existing, 
+            options=conf.options
+            )
+        app.layout = dbc.Container([
+            html.H1("Annotate Images"),
+            aio
+            ])
     else:
         raise NotImplementedError(f"Unrecognized mode: '{conf.mode}'.")
+    dacv.register_progress_route(app, aio.controller)
         
-    app.run(debug=False)
\ No newline at end of file
+    app.run(debug=False)
+
+
+def cli_subcommand(argv):
+
+    parser = argparse.ArgumentParser(prog="dacv", description="Work with annotation files without launching the app")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+    storage_types = [ t.value for t in dacv.StorageType ]
+
+    parser_convert = subparsers.add_parser("convert", help="Convert an annotation file between storage formats")
+    parser_convert.add_argument("input", type=str, help="Input annotation file")
+    parser_convert.add_argument("output", type=str, help="Output annotation file")
+    parser_convert.add_argument("--from", dest="input_type", type=str, choices=storage_types, default=None, help="Input format. Default: detected from the file.")
+    parser_convert.add_argument("--to", dest="output_type", type=str, choices=storage_types, required=True, help="Output format")
+
+    parser_export = subparsers.add_parser("export", help="Export the annotations of a config file's storage to another format")
+    parser_export.add_argument("conf", type=str, help="Path to the configuration file YAML file")
+    parser_export.add_argument("output", type=str, help="Output annotation file")
+    parser_export.add_argument("--to", dest="output_type", type=str, choices=storage_types, required=True, help="Output format")
+
+    parser_merge = subparsers.add_parser("merge", help="Merge several annotation files by image name")
+    parser_merge.add_argument("inputs", type=str, nargs="+", help="Input annotation files; earlier inputs win ties")
+    parser_merge.add_argument("output", type=str, help="Output annotation file")
+    parser_merge.add_argument("--to", dest="output_type", type=str, choices=storage_types, required=True, help="Output format")
+    parser_merge.add_argument("--iou", type=float, default=0.5, help="Bboxs of different inputs with at least this IoU are the same object. Default: 0.5.")
+    parser_merge.add_argument("--policy", type=str, choices=[ p.value for p in dacv.ConflictPolicy ], default=dacv.ConflictPolicy.LATEST.value, help="How to resolve conflicting bboxs and labels. Default: latest.")
+    parser_merge.add_argument("--author-priority", type=str, default="", help="Comma separated authors, highest priority first, for --policy author_priority")
+    parser_merge.add_argument("--no-history", action="store_true", help="Do not keep the history of the inputs")
+
+    for subparser in [parser_convert, parser_export, parser_merge]:
+        subparser.add_argument("--workers", type=int, default=1, help="Number of worker processes. Default: 1.")
+        subparser.add_argument("--max-memory-mb", type=float, default=None, help="Approximate memory ceiling; larger inputs are processed in shards on disk.")
+        subparser.add_argument("--tmp-dir", type=str, default=None, help="Directory for shard files. Default: system temporary directory.")
+
+    parser_agreement = subparsers.add_parser("agreement", help="Compute agreement between the annotation files of several annotators")
+    parser_agreement.add_argument("files", type=str, nargs="+", help="Annotation files, one per annotator, as 'file' or 'name=file'")
+    parser_agreement.add_argument("--iou", type=float, default=0.5, help="Minimum IoU for bboxs to match. Default: 0.5.")
+    parser_agreement.add_argument("--workers", type=int, default=1, help="Number of worker processes. Default: 1.")
+    parser_agreement.add_argument("--output", type=str, default=None, help="Write the full report as JSON to this file")
+
+    parser_validate = subparsers.add_parser("validate", help="Check an annotation file for disallowed labels, invalid bboxs and duplicates")
+    parser_validate.add_argument("input", type=str, help="Annotation file")
+    parser_validate.add_argument("--labels", type=str, default=None, help="Comma separated allowed labels. Default: any label.")
+    parser_validate.add_argument("--iou", type=float, default=None, help="Report bboxs of compatible classes with at least this IoU as duplicates. Default: no check.")
+
+    parser_checkpoints = subparsers.add_parser("checkpoints", help="List the checkpoints in a checkpoint directory, or restore one to a file")
+    parser_checkpoints.add_argument("dir", type=str, help="Checkpoint directory")
+    parser_checkpoints.add_argument("--restore", type=int, default=None, help="Checkpoint to restore")
+    parser_checkpoints.add_argument("--output", type=str, default=None, help="Output annotation file for --restore")
+    parser_checkpoints.add_argument("--to", dest="output_type", type=str, choices=storage_types, default=dacv.StorageType.JSON.value, help="Output format for --restore. Default: json.")
+
+    args = parser.parse_args(argv)
+
+    # Less verbose logging than the app
+    handler.setLevel(logging.INFO)
+
+    if args.subcommand == "agreement":
+        cli_agreement(args)
+    elif args.subcommand == "merge":
+        cli_merge(args)
+    elif args.subcommand == "validate":
+        cli_validate(args)
+    elif args.subcommand == "checkpoints":
+        cli_checkpoints(args)
+    else:
+        cli_convert(args)
+
+
+def _output_storage(output: str, output_type: str) -> dacv.AnnotationStorage:
+    storage_type = dacv.StorageType(output_type)
+    return dacv.AnnotationStorage(
+        storage_types=[storage_type],
+        json_file=output if storage_type == dacv.StorageType.JSON else None,
+        coco_file=output if storage_type == dacv.StorageType.COCO else None
+        )
+
+
+def _report_progress(progress):
+    total = f"/{progress.total}" if progress.total is not None else ""
+    logging.getLogger("dacv").info(f"{progress.stage}: {progress.done}{total}")
+
+
+def cli_convert(args):
+    if args.subcommand == "convert":
+        input_file = args.input
+        input_type = dacv.StorageType(args.input_type) if args.input_type is not None else None
+    elif args.subcommand == "export":
+        with open(args.conf,"r") as f:
+            conf = Conf.from_dict(yaml.safe_load(f))
+        input_file, input_type = None, None
+        for storage_type in conf.storage.storage_types:
+            fname = conf.storage.json_file if storage_type == dacv.StorageType.JSON else conf.storage.coco_file
+            if fname is not None and os.path.exists(fname):
+                input_file, input_type = fname, storage_type
+                break
+        if input_file is None:
+            raise FileNotFoundError(f"No existing annotation file in the storage of {args.conf}")
+    else:
+        raise NotImplementedError(f"Unrecognized subcommand: '{args.subcommand}'.")
+
+    from dash_annotate_cv.convert import convert_annotations
+
+    result = convert_annotations(
+        input_file=input_file,
+        output_storage=_output_storage(args.output, args.output_type),
+        input_type=input_type,
+        workers=args.workers,
+        max_memory_mb=args.max_memory_mb,
+        progress=_report_progress,
+        tmp_dir=args.tmp_dir
+        )
+    logging.getLogger("dacv").info(f"Wrote {result.no_images} images with {result.no_bboxs} bboxs to {args.output} ({result.no_shards} shards)")
+
+
+def cli_agreement(args):
+    import json
+
+    log = logging.getLogger("dacv")
+    report = dacv.compute_agreement(dacv.load_annotators(args.files), iou_threshold=args.iou, workers=args.workers)
+    for pair in report.pairs:
+        kappa = f"{pair.label_kappa:.3f}" if pair.label_kappa is not None else "n/a"
+        mean_iou = f"{pair.mean_iou:.3f}" if pair.mean_iou is not None else "n/a"
+        log.info(f"{pair.annotator_a} vs {pair.annotator_b}: {pair.no_images_common} common images, label kappa {kappa} ({pair.no_images_labeled_both} labeled by both), {pair.no_bboxs_matched}/{pair.no_bboxs_a}/{pair.no_bboxs_b} bboxs matched/a/b, mean IoU {mean_iou}")
+        for class_name, agreement in pair.per_class.items():
+            precision = f"{agreement.precision:.3f}" if agreement.precision is not None else "n/a"
+            recall = f"{agreement.recall:.3f}" if agreement.recall is not None else "n/a"
+            log.info(f"    {class_name or '(no class)'}: precision {precision} recall {recall} (tp {agreement.tp} fp {agreement.fp} fn {agreement.fn})")
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(report.to_dict(), f, indent=2)
+        log.info(f"Wrote agreement report to {args.output}")
+
+
+
+def cli_merge(args):
+    options = dacv.MergeOptions(
+        iou_threshold=args.iou,
+        conflict_policy=dacv.ConflictPolicy(args.policy),
+        author_priority=[ author.strip() for author in args.author_priority.split(",") if author.strip() != "" ],
+        preserve_history=not args.no_history
+        )
+    result = dacv.merge_annotations(
+        input_files=args.inputs,
+        output_storage=_output_storage(args.output, args.output_type),
+        options=options,
+        workers=args.workers,
+        max_memory_mb=args.max_memory_mb,
+        progress=_report_progress,
+        tmp_dir=args.tmp_dir
+        )
+    logging.getLogger("dacv").info(f"Wrote {result.no_images} images with {result.no_bboxs} bboxs to {args.output}, resolved {result.no_conflicts} conflicts ({result.no_shards} shards)")
+
+
+def cli_validate(args):
+    log = logging.getLogger("dacv")
+    labels = [ label.strip() for label in args.labels.split(",") if label.strip() != "" ] if args.labels is not None else None
+
+    # Run as a background job, reporting its progress while waiting
+    runner = dacv.JobRunner()
+    job_id = runner.submit(f"Validate {args.input}", dacv.validate_job(input_file=args.input, labels=labels, duplicate_iou_threshold=args.iou))
+    stage = None
+    while True:
+        try:
+            job = runner.wait(job_id, timeout=1.0)
+            break
+        except TimeoutError:
+            job = runner.get(job_id)
+            if job is not None and job.stage is not None and (job.stage, job.done) != stage:
+                stage = (job.stage, job.done)
+                log.info(f"{job.stage}: {job.done}")
+    runner.shutdown()
+
+    for detail in job.details:
+        log.info(f"    {detail}")
+    if job.status != dacv.JobStatus.SUCCEEDED:
+        raise RuntimeError(f"Validation failed: {job.message}")
+    log.info(job.message)
+
+
+def cli_checkpoints(args):
+    log = logging.getLogger("dacv")
+    store = dacv.CheckpointStore(args.dir)
+    if args.restore is None:
+        for info in store.checkpoints():
+            kind = "base" if info.is_base else "delta"
+            log.info(f"{info.checkpoint_id}: {info.timestamp} {kind}, {info.no_entries} images, {info.no_deleted} removed, {info.no_bytes} bytes")
+        return
+
+    if args.output is None:
+        raise ValueError("--output must be set with --restore")
+    annotations = store.restore(args.restore)
+    dacv.AnnotationWriter(_output_storage(args.output, args.output_type)).write(annotations)
+    log.info(f"Wrote checkpoint {args.restore} with {len(annotations.image_to_entry)} images to {args.output}")
@@ -0,0 +1,199 @@
+from dash_annotate_cv.annotation_storage import AnnotationStorage, AnnotationWriter, StorageType, iter_image_anns, detect_storage_type
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.formats.coco import CocoStreamWriter, coco_dicts_for_annotation
+from dash_annotate_cv.formats.default import DefaultJsonStreamWriter, default_json_item
+from dash_annotate_cv.shards import ConvertProgress, ProgressCallback, PROGRESS_EVERY, choose_no_shards, report_progress, partition_annotations, iter_shard_entries
+
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, List, Dict, Tuple, Iterator
+import json
+import os
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ConvertResult:
+    """Result of a conversion
+    """
+
+    # Number of images read
+    no_images: int
+
+    # Number of bboxs read
+    no_bboxs: int
+
+    # Number of shards the input was split into
+    no_shards: int
+
+
+def convert_annotations(
+    input_file: str,
+    output_storage: AnnotationStorage,
+    input_type: Optional[StorageType] = None,
+    workers: int = 1,
+    max_memory_mb: Optional[float] = None,
+    progress: Optional[ProgressCallback] = None,
+    tmp_dir: Optional[str] = None
+    ) -> ConvertResult:
+    """Convert an annotation file to every storage type in `output_storage` without loading it fully
+
+    Small inputs are converted in a single streaming pass. Otherwise the images are partitioned into shards on disk
+    (sized from `max_memory_mb`), the shards are converted by `workers` processes, and the outputs are concatenated.
+    With sharding, images are written grouped by shard rather than in input order.
+
+    Args:
+        input_file (str): Input file
+        output_storage (AnnotationStorage): Output files and storage types
+        input_type (Optional[StorageType], optional): Storage type of the input. Defaults to None, i.e. detected from the file.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        max_memory_mb (Optional[float], optional): Approximate memory ceiling across all workers. Defaults to None.
+        progress (Optional[ProgressCallback], optional): Called with progress updates. Defaults to None.
+        tmp_dir (Optional[str], optional): Directory for shard files. Defaults to None, i.e. the system default.
+
+    Returns:
+        ConvertResult: Result
+    """
+    if input_type is None:
+        input_type = detect_storage_type(input_file)
+        logger.info(f"Detected storage type {input_type.value} for {input_file}")
+    assert len(output_storage.storage_types) > 0, "output_storage must have at least one storage type"
+
+    no_shards = choose_no_shards(os.path.getsize(input_file), workers, max_memory_mb)
+    if no_shards == 1:
+        return _convert_single_pass(input_file, input_type, output_storage, progress)
+
+    with tempfile.TemporaryDirectory(prefix="dacv_convert_", dir=tmp_dir) as work_dir:
+        return _convert_sharded(input_file, input_type, output_storage, no_shards, workers, work_dir, progress)
+
+
+def _convert_single_pass(input_file: str, input_type: StorageType, output_storage: AnnotationStorage, progress: Optional[ProgressCallback]) -> ConvertResult:
+    result = ConvertResult(no_images=0, no_bboxs=0, no_shards=1)
+
+    def entries() -> Iterator[ImageAnnotations.Annotation]:
+        for entry in iter_image_anns(input_type, input_file):
+            result.no_images += 1
+            result.no_bboxs += len(entry.bboxs or [])
+            report_progress(progress, "stream", result.no_images)
+            yield entry
+
+    AnnotationWriter(output_storage).write_stream(entries())
+    report_progress(progress, "stream", result.no_images, result.no_images, force=True)
+    return result
+
+
+@dataclass
+class _ShardTask:
+    shard_file: str
+    input_type: StorageType
+    output_types: List[StorageType]
+    output_prefix: str
+    category_ids: Dict[str,int]
+    coco_category_names: Dict[int,str]
+    image_id_start: int
+    ann_id_start: int
+
+
+def _convert_shard(task: _ShardTask) -> Tuple[int,int]:
+    """Convert one shard into output fragments: one serialized item per line
+
+    Runs in a worker process.
+    """
+    f_json = open(task.output_prefix + ".json.frag", "w") if StorageType.JSON in task.output_types else None
+    f_coco_images = open(task.output_prefix + ".coco_images.frag", "w") if StorageType.COCO in task.output_types else None
+    f_coco_anns = open(task.output_prefix + ".coco_annotations.frag", "w") if StorageType.COCO in task.output_types else None
+
+    no_images, no_bboxs = 0, 0
+    image_id, ann_id = task.image_id_start, task.ann_id_start
+    try:
+        for entry in iter_shard_entries(task.shard_file, task.input_type, task.coco_category_names):
+            no_images += 1
+            no_bboxs += len(entry.bboxs or [])
+            if f_json is not None:
+                f_json.write(default_json_item(entry) + "\n")
+            if f_coco_images is not None and f_coco_anns is not None:
+                img, ann_dcts = coco_dicts_for_annotation(entry, image_id, ann_id, task.category_ids.__getitem__)
+                if img is not None:
+                    f_coco_images.write(json.dumps(img) + "\n")
+                    image_id += 1
+                for ann_dct in ann_dcts:
+                    f_coco_anns.write(json.dumps(ann_dct) + "\n")
+                ann_id += len(ann_dcts)
+    finally:
+        for f in [f_json, f_coco_images, f_coco_anns]:
+            if f is not None:
+                f.close()
+    return no_images, no_bboxs
+
+
+def _iter_fragment_lines(fnames: List[str]) -> Iterator[str]:
+    for fname in fnames:
+        with open(fname, "r") as f:
+            for line in f:
+                yield line.rstrip("\n")
+
+
+def _convert_sharded(
+    input_file: str,
+    input_type: StorageType,
+    output_storage: AnnotationStorage,
+    no_shards: int,
+    workers: int,
+    work_dir: str,
+    progress: Optional[ProgressCallback]
+    ) -> ConvertResult:
+    logger.info(f"Converting {input_file} in {no_shards} shards with {workers} workers")
+    shard_files = [ os.path.join(work_dir, f"shard_{i}.jsonl") for i in range(no_shards) ]
+    category_ids, coco_category_names, counts = partition_annotations(input_file, input_type, shard_files, progress)
+
+    # Ids are preassigned per shard from the partition counts, so shards can be converted independently
+    tasks: List[_ShardTask] = []
+    image_id_start, ann_id_start = 1, 1
+    for i in range(no_shards):
+        tasks.append(_ShardTask(
+            shard_file=shard_files[i],
+            input_type=input_type,
+            output_types=list(output_storage.storage_types),
+            output_prefix=os.path.join(work_dir, f"out_{i}"),
+            category_ids=category_ids,
+            coco_category_names=coco_category_names,
+            image_id_start=image_id_start,
+            ann_id_start=ann_id_start
+            ))
+        image_id_start += counts[i].no_images
+        ann_id_start += counts[i].no_bboxs + counts[i].no_masks
+
+    result = ConvertResult(no_images=0, no_bboxs=0, no_shards=no_shards)
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for done, (no_images, no_bboxs) in enumerate(executor.map(_convert_shard, tasks)):
+                result.no_images += no_images
+                result.no_bboxs += no_bboxs
+                report_progress(progress, "convert", done+1, no_shards, force=True)
+    else:
+        for done, task in enumerate(tasks):
+            no_images, no_bboxs = _convert_shard(task)
+            result.no_images += no_images
+            result.no_bboxs += no_bboxs
+            report_progress(progress, "convert", done+1, no_shards, force=True)
+
+    # Concatenate fragments
+    if StorageType.JSON in output_storage.storage_types:
+        assert output_storage.json_file is not None, "json_file must be set if storage_type is JSON"
+        with DefaultJsonStreamWriter(output_storage.json_file) as writer:
+            for text in _iter_fragment_lines([ task.output_prefix + ".json.frag" for task in tasks ]):
+                writer.write_item_json(text)
+    if StorageType.COCO in output_storage.storage_types:
+        assert output_storage.coco_file is not None, "coco_file must be set if storage_type is COCO"
+        with CocoStreamWriter(output_storage.coco_file, category_ids=category_ids) as coco_writer:
+            for text in _iter_fragment_lines([ task.output_prefix + ".coco_images.frag" for task in tasks ]):
+                coco_writer.write_image_json(text)
+            for text in _iter_fragment_lines([ task.output_prefix + ".coco_annotations.frag" for task in tasks ]):
+                coco_writer.write_annotation_json(text)
+    report_progress(progress, "assemble", no_shards, no_shards, force=True)
+
+    return result
@@ -0,0 +1,92 @@
+from dash_annotate_cv.metrics import registry as metrics
+
+from typing import Optional
+import os
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class FileLock:
+    """Advisory exclusive lock held across processes, on a lock file next to the locked file
+
+    Uses `fcntl.flock` on POSIX and `msvcrt.locking` on Windows. Only processes that also take the lock are excluded.
+    """
+
+
+    def __init__(self, fname: str):
+        """Constructor
+
+        Args:
+            fname (str): File to lock. The lock file is `fname` + ".lock"
+        """
+        self.fname_lock = fname + ".lock"
+        self._fd: Optional[int] = None
+
+
+    def acquire(self):
+        """Block until the lock is held
+        """
+        if self._fd is not None:
+            raise RuntimeError(f"Lock {self.fname_lock} is already held")
+        if os.path.dirname(self.fname_lock) != "":
+            os.makedirs(os.path.dirname(self.fname_lock), exist_ok=True)
+        fd = os.open(self.fname_lock, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            with metrics.timer("storage_lock_wait_seconds"):
+                _lock(fd)
+        except BaseException:
+            os.close(fd)
+            raise
+        self._fd = fd
+        logger.debug(f"Acquired lock {self.fname_lock}")
+
+
+    def release(self):
+        """Release the lock
+        """
+        if self._fd is None:
+            return
+        try:
+            _unlock(self._fd)
+        finally:
+            os.close(self._fd)
+            self._fd = None
+        logger.debug(f"Released lock {self.fname_lock}")
+
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+
+
+try:
+    import fcntl
+
+    def _lock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd: int):
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+except ImportError:
+    import msvcrt
+
+    def _lock(fd: int):
+        # Lock the first byte; LK_LOCK retries for 10 seconds before raising
+        os.lseek(fd, 0, os.SEEK_SET)
+        while True:
+            try:
+                msvcrt.locking(fd, msvcrt.LK_LOCK, 1) # type: ignore
+                return
+            except OSError:
+                continue
+
+    def _unlock(fd: int):
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1) # type: ignore
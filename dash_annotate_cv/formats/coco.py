@@ -1,82 +1,294 @@
 from dash_annotate_cv.helpers import xywh_to_xyxy, normalize_xywh, unnormalize_xywh
 from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.formats.json_stream import iter_json_array_member
+from dash_annotate_cv.rle import counts_to_string
 
 import json
 import os
-from typing import Dict, Optional
+import tempfile
+import shutil
+from typing import Dict, Optional, Iterator, List, Tuple, Callable
 import logging
 
 
 logger = logging.getLogger(__name__)
 
 
-def write_to_coco(anns: ImageAnnotations, fname_output_json: str):
-    assert os.path.splitext(fname_output_json)[1] == '.json', "fname_output_json must be a json file"
+def write_to_coco(anns: ImageAnnotations, fname_output_json: str, supercategories: Optional[Dict[str,str]] = None):
+    with CocoStreamWriter(fname_output_json, supercategories=supercategories) as writer:
+        for ann in anns.image_to_entry.values():
+            writer.write(ann)
 
-    image_id_next = 1
-    ann_id_next = 1
-    cat_id_next = 1
-    coco_dct: Dict = {"images": [], "annotations": [], "categories": []}
-    for ann in anns.image_to_entry.values():
 
-        # Only write if width and height specified
-        if ann.image_width is None or ann.image_height is None:
-            logger.warning(f"Skipping writing image with no specified width or height to COCO format: {ann}")
+class CocoStreamWriter:
+    """Write the COCO format one image at a time
+
+    Images are written directly to the output, annotations are spooled (in memory up to a limit, then on disk) and appended on `close`,
+    so only the categories are held in memory. The output is moved into place on `close`.
+    """
+
+
+    def __init__(self, 
+        fname_output_json: str, 
+        spool_max_bytes: int = 64 * 1024 * 1024,
+        category_ids: Optional[Dict[str,int]] = None,
+        supercategories: Optional[Dict[str,str]] = None
+        ):
+        """Constructor
+
+        Args:
+            fname_output_json (str): Output file
+            spool_max_bytes (int, optional): Size above which spooled annotations are moved to disk. Defaults to 64MB.
+            category_ids (Optional[Dict[str,int]], optional): Predefined class name to category id. Defaults to None, i.e. assigned as classes are encountered.
+            supercategories (Optional[Dict[str,str]], optional): Class name to COCO supercategory, e.g. from a `Taxonomy`. Defaults to None, i.e. "none" for all.
+        """        
+        assert os.path.splitext(fname_output_json)[1] == '.json', "fname_output_json must be a json file"
+        self.fname_output_json = fname_output_json
+        if os.path.dirname(fname_output_json) != "":
+            os.makedirs(os.path.dirname(fname_output_json), exist_ok=True)
+            logger.debug(f"Created directory {os.path.dirname(fname_output_json)}")
+        self._fname_tmp = fname_output_json + ".tmp"
+        self._f = open(self._fname_tmp, 'w')
+        self._f.write('{\n"images": [')
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_max_bytes, mode='w+')
+        self._category_ids: Dict[str,int] = dict(category_ids or {})
+        self._supercategories = supercategories
+        self.image_id_next = 1
+        self.ann_id_next = 1
+        self._no_images_written = 0
+        self._no_anns_written = 0
+
+
+    def write(self, ann: ImageAnnotations.Annotation):
+        """Write the annotation for one image
+
+        Args:
+            ann (ImageAnnotations.Annotation): Annotation
+        """        
+        img, ann_dcts = coco_dicts_for_annotation(ann, self.image_id_next, self.ann_id_next, self._category_id)
+        if img is None:
+            return
+        self.write_image_json(json.dumps(img))
+        self.image_id_next += 1
+        for ann_dct in ann_dcts:
+            self.write_annotation_json(json.dumps(ann_dct))
+            self.ann_id_next += 1
+
+
+    def write_image_json(self, text: str):
+        """Write an already serialized COCO image dict
+
+        Args:
+            text (str): JSON text
+        """        
+        self._f.write(("\n" if self._no_images_written == 0 else ",\n") + text)
+        self._no_images_written += 1
+
+
+    def write_annotation_json(self, text: str):
+        """Write an already serialized COCO annotation dict
+
+        Args:
+            text (str): JSON text
+        """        
+        self._spool.write(("\n" if self._no_anns_written == 0 else ",\n") + text)
+        self._no_anns_written += 1
+
+
+    def _category_id(self, class_name: str) -> int:
+        cat_id = self._category_ids.get(class_name)
+        if cat_id is None:
+            cat_id = len(self._category_ids) + 1
+            self._category_ids[class_name] = cat_id
+        return cat_id
+
+
+    def close(self):
+        """Append the annotations and categories and move the file into place
+        """        
+        self._f.write('\n],\n"annotations": [')
+        self._spool.seek(0)
+        shutil.copyfileobj(self._spool, self._f)
+        self._spool.close()
+        self._f.write('\n],\n"categories": ' + json.dumps(coco_categories(self._category_ids, self._supercategories), indent=3) + '\n}\n')
+        self._f.close()
+        os.replace(self._fname_tmp, self.fname_output_json)
+        logger.debug(f"Wrote to {self.fname_output_json}")
+
+
+    def abort(self):
+        """Discard the partially written file
+        """        
+        self._spool.close()
+        self._f.close()
+        os.remove(self._fname_tmp)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def coco_dicts_for_annotation(
+    ann: ImageAnnotations.Annotation, 
+    image_id: int, 
+    ann_id_start: int, 
+    category_id: Callable[[str],int]
+    ) -> Tuple[Optional[Dict],List[Dict]]:
+    """Convert the annotation for one image to COCO image and annotation dicts
+
+    Args:
+        ann (ImageAnnotations.Annotation): Annotation
+        image_id (int): Id to give the image
+        ann_id_start (int): Id to give the first annotation, subsequent annotations are numbered consecutively
+        category_id (Callable[[str],int]): Category id for a class name
+
+    Returns:
+        Tuple[Optional[Dict],List[Dict]]: Image dict (None if the image cannot be written) and annotation dicts
+    """    
+    # Only write if width and height specified
+    if ann.image_width is None or ann.image_height is None:
+        logger.warning(f"Skipping writing image with no specified width or height to COCO format: {ann}")
+        return None, []
+
+    img = {
+        "id": image_id,
+        "width": ann.image_width,
+        "height": ann.image_height,
+        "file_name": ann.image_name
+        }
+
+    ann_dcts = []
+    for bbox in ann.bboxs or []:
+
+        # Skip bboxs with no class name
+        if bbox.class_name is None:
+            logger.warning(f"Skipping writing bbox with no class name to COCO format: {bbox}")
+            continue
+            
+        # Skip bboxs with area <= 0
+        if bbox.area_normalized(ann.image_width, ann.image_height) <= 0:
+            logger.warning(f"Skipping writing bbox with area <= 0 to COCO format: {bbox}")
+            continue
+
+        ann_dcts.append({
+            "id": ann_id_start + len(ann_dcts),
+            "image_id": image_id,
+            "category_id": category_id(bbox.class_name),
+            "segmentation": [],
+            "bbox": normalize_xywh(bbox.xyxy, ann.image_width, ann.image_height),
+            "area": bbox.area_normalized(ann.image_width, ann.image_height),
+            "iscrowd": 0
+            })
+
+    for mask in ann.masks or []:
+        if mask.class_name is None:
+            logger.warning(f"Skipping writing mask with no class name to COCO format: {mask.xyxy}")
+            continue
+        area = mask.area
+        if area <= 0:
+            logger.warning("Skipping writing empty mask to COCO format")
             continue
 
-        # Add image
-        img = {
-            "id": image_id_next,
-            "width": ann.image_width,
-            "height": ann.image_height,
-            "file_name": ann.image_name
-            }
-        coco_dct["images"].append(img)
-        image_id_next += 1
-        image_id = image_id_next - 1
-
-        # Add annotations
-        for bbox in ann.bboxs or []:
-
-            # Skip bboxs with no class name
-            if bbox.class_name is None:
-                logger.warning(f"Skipping writing bbox with no class name to COCO format: {bbox}")
-                continue
-                
-            # Skip bboxs with area <= 0
-            if bbox.area_normalized(ann.image_width, ann.image_height) <= 0:
-                logger.warning(f"Skipping writing bbox with area <= 0 to COCO format: {bbox}")
-                continue
-
-            # Add category if needed or get category id
-            if bbox.class_name not in [cat["name"] for cat in coco_dct["categories"]]:
-                cat = {
-                    "id": cat_id_next,
-                    "name": bbox.class_name,
-                    "supercategory": "none"
-                    }
-                coco_dct["categories"].append(cat)
-                cat_id_next += 1
-            cat_id = [ cat["id"] for cat in coco_dct["categories"] if cat["name"] == bbox.class_name ][0]
-
-            ann_dct = {
-                "id": ann_id_next,
-                "image_id": image_id,
-                "category_id": cat_id,
-                "segmentation": [],
-                "bbox": normalize_xywh(bbox.xyxy, ann.image_width, ann.image_height),
-                "area": bbox.area_normalized(ann.image_width, ann.image_height),
-                "iscrowd": 0
-                }
-            coco_dct["annotations"].append(ann_dct)
-            ann_id_next += 1
-
-    if os.path.dirname(fname_output_json) != "":
-        os.makedirs(os.path.dirname(fname_output_json), exist_ok=True)
-        logger.debug(f"Created directory {os.path.dirname(fname_output_json)}")
-    with open(fname_output_json,'w') as f:        
-        json.dump(coco_dct, f, indent=3)
-        logger.debug(f"Wrote to {fname_output_json}")
+        # Bbox and area as for bboxs; the segmentation is the RLE in pixels
+        ann_dcts.append({
+            "id": ann_id_start + len(ann_dcts),
+            "image_id": image_id,
+            "category_id": category_id(mask.class_name),
+            "segmentation": mask.rle,
+            "bbox": normalize_xywh(mask.xyxy, ann.image_width, ann.image_height),
+            "area": area / (ann.image_width * ann.image_height),
+            "iscrowd": 0
+            })
+    return img, ann_dcts
+
+
+def coco_categories(category_ids: Dict[str,int], supercategories: Optional[Dict[str,str]] = None) -> List[Dict]:
+    """COCO categories
+
+    Args:
+        category_ids (Dict[str,int]): Class name to category id
+        supercategories (Optional[Dict[str,str]], optional): Class name to supercategory. Defaults to None, i.e. "none" for all.
+
+    Returns:
+        List[Dict]: COCO category dicts
+    """    
+    supercategories = supercategories or {}
+    return [ {"id": cat_id, "name": name, "supercategory": supercategories.get(name, "none")} for name, cat_id in category_ids.items() ]
+
+
+def coco_image_to_annotation(img: Dict) -> ImageAnnotations.Annotation:
+    """Create an (empty) annotation from a COCO image entry
+
+    Args:
+        img (Dict): COCO image dict
+
+    Returns:
+        ImageAnnotations.Annotation: Annotation without bboxs
+    """    
+    return ImageAnnotations.Annotation(
+        image_name=img["file_name"],
+        image_width=img["width"],
+        image_height=img["height"]
+        )
+
+
+def coco_annotation_to_bbox(ann: Dict, img: Dict, category_names: Dict[int,str]) -> ImageAnnotations.Annotation.Bbox:
+    """Create a bbox from a COCO annotation entry
+
+    Args:
+        ann (Dict): COCO annotation dict
+        img (Dict): COCO image dict the annotation belongs to
+        category_names (Dict[int,str]): Category id to name
+
+    Returns:
+        ImageAnnotations.Annotation.Bbox: Bbox
+    """    
+    cat_id = ann["category_id"]
+    assert cat_id in category_names, f"Cound not find category with id {cat_id}"
+
+    # Bounding box
+    xywh_normalized = ann["bbox"]
+    xywh_unnormalized = unnormalize_xywh(xywh_normalized, img["width"], img["height"])
+    xyxy_unnormalized = xywh_to_xyxy(xywh_unnormalized)
+
+    return ImageAnnotations.Annotation.Bbox(
+        xyxy=xyxy_unnormalized,
+        class_name=category_names[cat_id]
+        )
+
+
+def is_coco_rle_annotation(ann: Dict) -> bool:
+    """Whether a COCO annotation is a run-length encoded mask rather than a bbox
+    """
+    return isinstance(ann.get("segmentation"), dict)
+
+
+def coco_annotation_to_mask(ann: Dict, category_names: Dict[int,str]) -> ImageAnnotations.Annotation.Mask:
+    """Create a mask from a COCO annotation entry with a run-length encoded segmentation
+
+    Args:
+        ann (Dict): COCO annotation dict
+        category_names (Dict[int,str]): Category id to name
+
+    Returns:
+        ImageAnnotations.Annotation.Mask: Mask
+    """    
+    cat_id = ann["category_id"]
+    assert cat_id in category_names, f"Cound not find category with id {cat_id}"
+    segmentation = ann["segmentation"]
+    counts = segmentation["counts"]
+    return ImageAnnotations.Annotation.Mask(
+        size=list(segmentation["size"]),
+        counts=counts if isinstance(counts, str) else counts_to_string(counts),
+        class_name=category_names[cat_id]
+        )
 
 
 def load_from_coco_if_exist(fname_json: str) -> Optional[ImageAnnotations]:
@@ -88,41 +300,63 @@ def load_from_coco_if_exist(fname_json: str) -> Optional[ImageAnnotations]:
     anns = ImageAnnotations.new()
 
     # Add all images
+    images = { img["id"]: img for img in coco_dct["images"] }
     for img in coco_dct["images"]:
         anns.get_or_add_image(
             image_name=img["file_name"],
             img_width=img["width"],
             img_height=img["height"]
             )
+    category_names = { cat["id"]: cat["name"] for cat in coco_dct["categories"] }
     
     for ann in coco_dct["annotations"]:
 
         # Get image obj
         image_id = ann["image_id"]
-        img_dct_cands = [ img for img in coco_dct["images"] if img["id"] == image_id ]
-        assert len(img_dct_cands) == 1, f"Cound not find image with id {image_id}"
-        img_dct = img_dct_cands[0]
+        assert image_id in images, f"Cound not find image with id {image_id}"
+        img_dct = images[image_id]
         image = anns.get_or_add_image(image_name=img_dct["file_name"])
 
-        # Get category name
-        cat_id = ann["category_id"]
-        cat_dct_cands = [ cat for cat in coco_dct["categories"] if cat["id"] == cat_id ]
-        assert len(cat_dct_cands) == 1, f"Cound not find category with id {cat_id}"
-        cat_dct = cat_dct_cands[0]
-        class_name = cat_dct["name"]
-
-        # Bounding box
-        xywh_normalized = ann["bbox"]
-        xywh_unnormalized = unnormalize_xywh(xywh_normalized, img_dct["width"], img_dct["height"])
-        xyxy_unnormalized = xywh_to_xyxy(xywh_unnormalized)
+        if is_coco_rle_annotation(ann):
+            image.masks = (image.masks or []) + [coco_annotation_to_mask(ann, category_names)]
+            continue
 
         # Add bounding box
-        bbox = ImageAnnotations.Annotation.Bbox(
-            xyxy=xyxy_unnormalized,
-            class_name=class_name
-            )
+        bbox = coco_annotation_to_bbox(ann, img_dct, category_names)
         if image.bboxs is None:
             image.bboxs = []
         image.bboxs.append(bbox)
 
-    return anns
\ No newline at end of file
+    return anns
+
+
+def iter_coco(fname_json: str) -> Iterator[ImageAnnotations.Annotation]:
+    """Stream the images of a COCO file as annotations
+
+    The file is never decoded as a whole: images and categories are read in a first pass, annotations in a second pass.
+    The bboxs and masks are grouped by image in memory; use `dash_annotate_cv.convert` to shard very large files.
+
+    Args:
+        fname_json (str): COCO file
+
+    Yields:
+        ImageAnnotations.Annotation: Annotation for each image
+    """    
+    images = { img["id"]: img for img in iter_json_array_member(fname_json, "images") }
+    category_names = { cat["id"]: cat["name"] for cat in iter_json_array_member(fname_json, "categories") }
+
+    bboxs_for_image: Dict[int,List[ImageAnnotations.Annotation.Bbox]] = {}
+    masks_for_image: Dict[int,List[ImageAnnotations.Annotation.Mask]] = {}
+    for ann in iter_json_array_member(fname_json, "annotations"):
+        image_id = ann["image_id"]
+        assert image_id in images, f"Cound not find image with id {image_id}"
+        if is_coco_rle_annotation(ann):
+            masks_for_image.setdefault(image_id, []).append(coco_annotation_to_mask(ann, category_names))
+        else:
+            bboxs_for_image.setdefault(image_id, []).append(coco_annotation_to_bbox(ann, images[image_id], category_names))
+
+    for image_id, img in images.items():
+        entry = coco_image_to_annotation(img)
+        entry.bboxs = bboxs_for_image.pop(image_id, None)
+        entry.masks = masks_for_image.pop(image_id, None)
+        yield entry
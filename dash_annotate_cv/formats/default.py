@@ -1,8 +1,9 @@
 from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.formats.json_stream import iter_json_object_member
 
 import json
 import os
-from typing import Optional
+from typing import Optional, Iterator
 import logging
 
 
@@ -14,9 +15,12 @@ def write_default_json(anns: ImageAnnotations, fname_output_json: str):
     if os.path.dirname(fname_output_json) != "":
         os.makedirs(os.path.dirname(fname_output_json), exist_ok=True)
         logger.debug(f"Created directory {os.path.dirname(fname_output_json)}")
-    with open(fname_output_json,'w') as f:        
+    # Write to a temporary file first, so readers never see a partially written file
+    fname_tmp = f"{fname_output_json}.{os.getpid()}.tmp"
+    with open(fname_tmp,'w') as f:        
         json.dump(anns.to_dict(), f, indent=3)
-        logger.debug(f"Wrote to {fname_output_json}")
+    os.replace(fname_tmp, fname_output_json)
+    logger.debug(f"Wrote to {fname_output_json}")
 
 
 def load_from_default_json_if_exist(fname_json: str) -> Optional[ImageAnnotations]:
@@ -24,3 +28,98 @@ def load_from_default_json_if_exist(fname_json: str) -> Optional[ImageAnnotation
         return None
     with open(fname_json,'r') as f:
         return ImageAnnotations.from_dict(json.load(f))
+
+
+def iter_default_json(fname_json: str) -> Iterator[ImageAnnotations.Annotation]:
+    """Stream the entries of a default JSON file without loading the whole file
+
+    Args:
+        fname_json (str): Default JSON file
+
+    Yields:
+        ImageAnnotations.Annotation: Annotation for each image
+    """    
+    for _, entry in iter_json_object_member(fname_json, "image_to_entry"):
+        yield ImageAnnotations.Annotation.from_dict(entry)
+
+
+def default_json_item(ann: ImageAnnotations.Annotation) -> str:
+    """Serialize one image as a `"image_name": {...}` member of `image_to_entry`
+
+    Args:
+        ann (ImageAnnotations.Annotation): Annotation
+
+    Returns:
+        str: JSON text of the member
+    """    
+    return json.dumps(ann.image_name) + ": " + json.dumps(ann.to_dict())
+
+
+class DefaultJsonStreamWriter:
+    """Write the default JSON format one image at a time
+
+    The output is written to a temporary file and moved into place on `close`, so an interrupted write never leaves a truncated file behind.
+    """
+
+
+    def __init__(self, fname_output_json: str):
+        """Constructor
+
+        Args:
+            fname_output_json (str): Output file
+        """        
+        self.fname_output_json = fname_output_json
+        if os.path.dirname(fname_output_json) != "":
+            os.makedirs(os.path.dirname(fname_output_json), exist_ok=True)
+        self._fname_tmp = fname_output_json + ".tmp"
+        self._f = open(self._fname_tmp, 'w')
+        self._f.write('{"image_to_entry": {')
+        self._no_written = 0
+
+
+    def write(self, ann: ImageAnnotations.Annotation):
+        """Write the annotation for one image
+
+        Args:
+            ann (ImageAnnotations.Annotation): Annotation
+        """        
+        self.write_item_json(default_json_item(ann))
+
+
+    def write_item_json(self, text: str):
+        """Write an already serialized `"image_name": {...}` member, see `default_json_item`
+
+        Args:
+            text (str): JSON text of the member
+        """        
+        if self._no_written > 0:
+            self._f.write(",")
+        self._f.write("\n" + text)
+        self._no_written += 1
+
+
+    def close(self):
+        """Finish the file and move it into place
+        """        
+        self._f.write("\n}}\n")
+        self._f.close()
+        os.replace(self._fname_tmp, self.fname_output_json)
+        logger.debug(f"Wrote {self._no_written} images to {self.fname_output_json}")
+
+
+    def abort(self):
+        """Discard the partially written file
+        """        
+        self._f.close()
+        os.remove(self._fname_tmp)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -1,4 +1,5 @@
 from dash_annotate_cv.helpers import Xyxy, Xywh, xyxy_to_xywh
+from dash_annotate_cv.rle import Rle, rle_area, rle_to_xyxy
 
 from typing import List, Optional, Dict, Union
 from dataclasses import dataclass
@@ -124,6 +125,58 @@ class ImageAnnotations(DataClassDictMixin):
                 omit_none = True
 
 
+        @dataclass
+        class Mask(DataClassDictMixin):
+            """Segmentation mask, run-length encoded as in COCO
+            """
+
+            # Image [height, width]
+            size: List[int]
+
+            # Run lengths of background and foreground in column-major order, compressed to a string as in the COCO API
+            counts: str
+
+            # Label
+            class_name: Optional[str] = None
+
+            # Timestamp
+            timestamp: Optional[float] = None
+
+            # Author
+            author: Optional[str] = None
+
+            # Equality
+            def __eq__(self, other):
+                if not isinstance(other, ImageAnnotations.Annotation.Mask):
+                    return False
+                return self.size == other.size and self.counts == other.counts and self.class_name == other.class_name
+
+
+            @property
+            def rle(self) -> Rle:
+                """COCO RLE dict
+                """
+                return {"size": self.size, "counts": self.counts}
+
+
+            @property
+            def area(self) -> int:
+                """Number of pixels, computed from the runs
+                """
+                return rle_area(self.rle)
+
+
+            @property
+            def xyxy(self) -> Xyxy:
+                """Bounding box, computed from the runs
+                """
+                return rle_to_xyxy(self.rle) # type: ignore
+
+
+            class Config(BaseConfig):
+                omit_none = True
+
+
         @dataclass
         class BboxHistory(DataClassDictMixin):
 
@@ -158,6 +211,9 @@ class ImageAnnotations(DataClassDictMixin):
         # Height
         image_height: Optional[int] = None
 
+        # Segmentation masks
+        masks: Optional[List[Mask]] = None
+
         class Config(BaseConfig):
             omit_none = True
 
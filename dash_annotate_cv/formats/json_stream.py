@@ -0,0 +1,210 @@
+from typing import Any, Iterator, Optional, TextIO, Tuple
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+_WHITESPACE = " \t\n\r"
+_DELIMITERS = _WHITESPACE + ",:]}"
+
+
+class JsonStreamReader:
+    """Incremental reader for large JSON documents
+
+    Only the members of the top-level object that are requested are decoded, one element at a time,
+    so memory stays bounded by the largest single element rather than the whole document.
+    """
+
+
+    def __init__(self, f: TextIO, chunk_size: int = 1 << 20):
+        """Constructor
+
+        Args:
+            f (TextIO): File opened in text mode
+            chunk_size (int, optional): Number of characters to read at a time. Defaults to 1 << 20.
+        """
+        self._f = f
+        self._chunk_size = chunk_size
+        self._buf = ""
+        self._pos = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+
+    def _fill(self, size: Optional[int] = None) -> bool:
+        if self._eof:
+            return False
+        # Drop consumed prefix
+        if self._pos > self._chunk_size:
+            self._buf = self._buf[self._pos:]
+            self._pos = 0
+        chunk = self._f.read(size or self._chunk_size)
+        if chunk == "":
+            self._eof = True
+            return False
+        self._buf += chunk
+        return True
+
+
+    def _peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it, or "" at EOF
+        """
+        while True:
+            while self._pos < len(self._buf) and self._buf[self._pos] in _WHITESPACE:
+                self._pos += 1
+            if self._pos < len(self._buf):
+                return self._buf[self._pos]
+            if not self._fill():
+                return ""
+
+
+    def _expect(self, char: str):
+        c = self._peek()
+        if c != char:
+            raise ValueError(f"Expected '{char}' in JSON stream but found '{c}'")
+        self._pos += 1
+
+
+    def decode_value(self) -> Any:
+        """Decode the next complete JSON value
+        """
+        self._peek()
+        read_size = self._chunk_size
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(self._buf, self._pos)
+                # Numbers and literals may continue in the next chunk: only accept once followed by a delimiter or EOF
+                if (end == len(self._buf) or self._buf[end] not in _DELIMITERS) and not self._eof and self._fill():
+                    continue
+                self._pos = end
+                return value
+            except json.JSONDecodeError:
+                if not self._fill(read_size):
+                    raise
+                read_size *= 2
+
+
+    def iter_object(self) -> Iterator[str]:
+        """Iterate the members of the object at the current position
+
+        Yields the key of each member; the caller must consume the value (`decode_value` or `skip_value`) before advancing.
+        """
+        self._expect("{")
+        if self._peek() == "}":
+            self._pos += 1
+            return
+        while True:
+            key = self.decode_value()
+            self._expect(":")
+            yield key
+            c = self._peek()
+            self._pos += 1
+            if c == "}":
+                return
+            if c != ",":
+                raise ValueError(f"Expected ',' or '}}' in JSON stream but found '{c}'")
+
+
+    def iter_array(self) -> Iterator[None]:
+        """Iterate the elements of the array at the current position
+
+        Yields once per element; the caller must consume the element before advancing.
+        """
+        self._expect("[")
+        if self._peek() == "]":
+            self._pos += 1
+            return
+        while True:
+            yield None
+            c = self._peek()
+            self._pos += 1
+            if c == "]":
+                return
+            if c != ",":
+                raise ValueError(f"Expected ',' or ']' in JSON stream but found '{c}'")
+
+
+    def skip_value(self):
+        """Skip the value at the current position, streaming through the elements of containers
+        """
+        c = self._peek()
+        if c == "[":
+            for _ in self.iter_array():
+                self.decode_value()
+        elif c == "{":
+            for _ in self.iter_object():
+                self.decode_value()
+        else:
+            self.decode_value()
+
+
+    def seek_member(self, member: str) -> bool:
+        """Starting from the beginning of the document, advance to the value of a top-level member
+
+        Args:
+            member (str): Member name
+
+        Returns:
+            bool: True if found, False if the top-level object has no such member
+        """
+        for key in self.iter_object():
+            if key == member:
+                return True
+            self.skip_value()
+        return False
+
+
+def iter_json_object_member(fname_json: str, member: str) -> Iterator[Tuple[str, Any]]:
+    """Stream the (key, value) pairs of an object that is a member of the top-level object
+
+    Args:
+        fname_json (str): JSON file
+        member (str): Name of the top-level member
+
+    Yields:
+        Tuple[str,Any]: Key and decoded value
+    """
+    with open(fname_json, "r") as f:
+        reader = JsonStreamReader(f)
+        if not reader.seek_member(member):
+            logger.debug(f"No member '{member}' in {fname_json}")
+            return
+        for key in reader.iter_object():
+            yield key, reader.decode_value()
+
+
+def iter_json_array_member(fname_json: str, member: str) -> Iterator[Any]:
+    """Stream the elements of an array that is a member of the top-level object
+
+    Args:
+        fname_json (str): JSON file
+        member (str): Name of the top-level member
+
+    Yields:
+        Any: Decoded element
+    """
+    with open(fname_json, "r") as f:
+        reader = JsonStreamReader(f)
+        if not reader.seek_member(member):
+            logger.debug(f"No member '{member}' in {fname_json}")
+            return
+        for _ in reader.iter_array():
+            yield reader.decode_value()
+
+
+def top_level_keys(fname_json: str) -> Iterator[str]:
+    """Stream the keys of the top-level object without decoding their values
+
+    Args:
+        fname_json (str): JSON file
+
+    Yields:
+        str: Key
+    """
+    with open(fname_json, "r") as f:
+        reader = JsonStreamReader(f)
+        for key in reader.iter_object():
+            yield key
+            reader.skip_value()
@@ -1,4 +1,3 @@
-import dash
 import json
 import logging
 from typing import Tuple, Optional, List, Union
@@ -54,6 +53,7 @@ class UnknownError(Exception):
 def get_trigger_id() -> Tuple[str,Optional[int]]:
     """Get the trigger ID from the callback context
     """
+    import dash
     ctx = dash.callback_context
     
     # ctx.triggered = [{'prop_id': '<ID>.n_clicks', 'value': 1}]
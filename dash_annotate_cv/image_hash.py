@@ -0,0 +1,354 @@
+from dash_annotate_cv.metrics import registry as metrics
+
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+from typing import Optional, List, Dict, Tuple, Union, Any, Iterable
+from PIL import Image
+import numpy as np
+import json
+import os
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+HashSource = Union[str,Image.Image]
+
+
+class HashMethod(Enum):
+    """Perceptual hash of an image
+    """
+
+    # Bits set where the downscaled grayscale image is brighter than its mean
+    AVERAGE = "average"
+
+    # Bits set where a pixel of the downscaled grayscale image is brighter than its right neighbour. More robust to brightness and contrast changes
+    DIFFERENCE = "difference"
+
+
+class DuplicateImageAction(Enum):
+    """What to do with near-duplicates of annotated images
+    """
+
+    # Pass over them when going to the next or previous image
+    SKIP = "skip"
+
+    # Store labels given to an image for its duplicates without annotations too
+    PROPAGATE = "propagate"
+
+
+def _grayscale(image: Image.Image, width: int, height: int) -> np.ndarray:
+    # convert() returns a new image: the given one, which may be shown for annotation, is not changed
+    image = image.convert("L").resize((width, height), Image.BILINEAR)
+    return np.asarray(image, dtype=np.float32)
+
+
+def _bits_to_int(bits: np.ndarray) -> int:
+    value = 0
+    for bit in bits.ravel():
+        value = (value << 1) | int(bit)
+    return value
+
+
+def average_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """Average hash of an image
+
+    Args:
+        image (Image.Image): Image
+        hash_size (int, optional): Side of the downscaled image; the hash has hash_size^2 bits. Defaults to 8.
+
+    Returns:
+        int: Hash
+    """
+    pixels = _grayscale(image, hash_size, hash_size)
+    return _bits_to_int(pixels > pixels.mean())
+
+
+def difference_hash(image: Image.Image, hash_size: int = 8) -> int:
+    """Difference hash of an image
+
+    Args:
+        image (Image.Image): Image
+        hash_size (int, optional): Side of the downscaled image; the hash has hash_size^2 bits. Defaults to 8.
+
+    Returns:
+        int: Hash
+    """
+    pixels = _grayscale(image, hash_size + 1, hash_size)
+    return _bits_to_int(pixels[:,:-1] > pixels[:,1:])
+
+
+def image_hash(image: Image.Image, method: HashMethod = HashMethod.DIFFERENCE, hash_size: int = 8) -> int:
+    """Perceptual hash of an image
+
+    Args:
+        image (Image.Image): Image
+        method (HashMethod, optional): Method. Defaults to HashMethod.DIFFERENCE.
+        hash_size (int, optional): Side of the downscaled image. Defaults to 8.
+
+    Returns:
+        int: Hash
+    """
+    if method == HashMethod.AVERAGE:
+        return average_hash(image, hash_size)
+    return difference_hash(image, hash_size)
+
+
+def hamming_distance(hash1: int, hash2: int) -> int:
+    """Number of bits in which two hashes differ
+    """
+    return bin(hash1 ^ hash2).count("1")
+
+
+def _hash_file(fname: str, method: str, hash_size: int, large_image_min_pixels: Optional[int]) -> Tuple[Optional[int],Optional[str]]:
+    """Hash of an image file, or the error reading it
+
+    Runs in a worker process.
+    """
+    from dash_annotate_cv.large_image import LargeImage, is_large_image
+    try:
+        if large_image_min_pixels is not None and is_large_image(fname, large_image_min_pixels):
+            large = LargeImage(fname)
+            try:
+                return image_hash(large.overview(hash_size * 4), HashMethod(method), hash_size), None
+            finally:
+                large.close()
+        with Image.open(fname) as image:
+            if image.format == "JPEG":
+                # Decode at a reduced scale; the image was opened here, so no one else sees it shrink
+                image.draft("L", (hash_size * 4, hash_size * 4))
+            return image_hash(image, HashMethod(method), hash_size), None
+    except Exception as e:
+        return None, str(e)
+
+
+class BKTree:
+    """BK-tree of hashes for finding those within a Hamming distance of a hash without comparing to all of them
+    """
+
+
+    def __init__(self):
+        # Node: [hash, items with the hash, children by distance to the hash]
+        self._root: Optional[List[Any]] = None
+        self._len = 0
+
+
+    def __len__(self) -> int:
+        return self._len
+
+
+    def add(self, hash: int, item: Any):
+        """Add an item with a hash
+
+        Args:
+            hash (int): Hash
+            item (Any): Item, e.g. an image index
+        """
+        self._len += 1
+        if self._root is None:
+            self._root = [hash, [item], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming_distance(hash, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [hash, [item], {}]
+                return
+            node = child
+
+
+    def search(self, hash: int, max_distance: int) -> List[Tuple[Any,int]]:
+        """Items with hashes within a Hamming distance of a hash
+
+        Args:
+            hash (int): Hash
+            max_distance (int): Maximum distance, inclusive
+
+        Returns:
+            List[Tuple[Any,int]]: Items and their distances, closest first
+        """
+        found: List[Tuple[Any,int]] = []
+        stack = [self._root] if self._root is not None else []
+        while len(stack) > 0:
+            node = stack.pop()
+            distance = hamming_distance(hash, node[0])
+            if distance <= max_distance:
+                found += [ (item, distance) for item in node[1] ]
+            # Triangle inequality: only children at distances in this range can match
+            for child_distance, child in node[2].items():
+                if distance - max_distance <= child_distance <= distance + max_distance:
+                    stack.append(child)
+        found.sort(key=lambda x: x[1])
+        return found
+
+
+class ImageHashIndex:
+    """Perceptual hashes of the images of a source, for finding near-duplicates
+
+    Hashes of image files are computed in a process pool and cached in a JSON file keyed by path, size and modification time,
+    so only new or changed files are decoded again. In-memory images are hashed in-process.
+    """
+
+
+    def __init__(self, method: HashMethod = HashMethod.DIFFERENCE, hash_size: int = 8, cache_file: Optional[str] = None, workers: Optional[int] = None, large_image_min_pixels: Optional[int] = None):
+        """Constructor
+
+        Args:
+            method (HashMethod, optional): Hash method. Defaults to HashMethod.DIFFERENCE.
+            hash_size (int, optional): Side of the downscaled image; hashes have hash_size^2 bits. Defaults to 8.
+            cache_file (Optional[str], optional): JSON file of cached hashes. Defaults to None, i.e. a file per method and size in the system temporary directory.
+            workers (Optional[int], optional): Number of worker processes. Defaults to None, i.e. up to 4 depending on the CPU count.
+            large_image_min_pixels (Optional[int], optional): Files with at least this many pixels are read as `LargeImage`, as in the image source. Defaults to None.
+        """
+        assert hash_size >= 2, "hash_size must be at least 2"
+        self.method = method
+        self.hash_size = hash_size
+        self.cache_file = cache_file or os.path.join(tempfile.gettempdir(), f"dacv_image_hashes_{method.value}_{hash_size}.json")
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.large_image_min_pixels = large_image_min_pixels
+        self.hashes: List[Optional[int]] = []
+        self._tree = BKTree()
+
+
+    def _load_cache(self) -> Dict[str,List]:
+        if not os.path.exists(self.cache_file):
+            return {}
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring unreadable hash cache {self.cache_file}: {e}")
+            return {}
+        if data.get("method") != self.method.value or data.get("hash_size") != self.hash_size:
+            return {}
+        return data["hashes"]
+
+
+    def _write_cache(self, cache: Dict[str,List]):
+        fname_tmp = f"{self.cache_file}.{os.getpid()}.tmp"
+        with open(fname_tmp, "w") as f:
+            json.dump({"method": self.method.value, "hash_size": self.hash_size, "hashes": cache}, f)
+        os.replace(fname_tmp, self.cache_file)
+
+
+    def _hash_files(self, executor: ProcessPoolExecutor, files: List[Tuple[int,str,str,List]], cache: Dict[str,List]):
+        """Hash a batch of files in the pool, storing the hashes and adding them to the cache
+        """
+        n = len(files)
+        fnames = [ fname for _, fname, _, _ in files ]
+        args = ([self.method.value] * n, [self.hash_size] * n, [self.large_image_min_pixels] * n)
+        results = executor.map(_hash_file, fnames, *args, chunksize=max(1, n // (4 * self.workers)))
+        for (idx, fname, key, stat_key), (hash, error) in zip(files, results):
+            if hash is None:
+                logger.warning(f"Could not hash {fname}: {error}")
+                continue
+            self.hashes[idx] = hash
+            cache[key] = stat_key + [format(hash, "x")]
+
+
+    def build(self, sources: Iterable[HashSource], batch_size: int = 256):
+        """Hash the images of a source, replacing previous hashes
+
+        Sources are consumed one at a time and only their hashes are kept: in-memory images are hashed in-process as they come,
+        files not in the cache are hashed in the pool in batches.
+
+        Args:
+            sources (Iterable[HashSource]): File name or in-memory image at each index, e.g. from a generator
+            batch_size (int, optional): Number of files hashed in the pool at a time. Defaults to 256.
+        """
+        no_images, no_missing = 0, 0
+        executor: Optional[ProcessPoolExecutor] = None
+        with metrics.timer("image_hash_duration_seconds"):
+            cache = self._load_cache()
+            self.hashes = []
+            missing: List[Tuple[int,str,str,List]] = []
+            try:
+                for idx, source in enumerate(sources):
+                    no_images += 1
+                    self.hashes.append(None)
+                    if not isinstance(source, str):
+                        self.hashes[idx] = image_hash(source, self.method, self.hash_size)
+                        continue
+                    try:
+                        stat = os.stat(source)
+                    except OSError as e:
+                        logger.warning(f"Could not hash {source}: {e}")
+                        continue
+                    key = os.path.abspath(source)
+                    stat_key = [stat.st_size, stat.st_mtime_ns]
+                    cached = cache.get(key)
+                    hit = cached is not None and cached[:2] == stat_key
+                    metrics.record_cache("image_hashes", hit)
+                    if hit:
+                        self.hashes[idx] = int(cached[2], 16) # type: ignore
+                        continue
+                    missing.append((idx, source, key, stat_key))
+                    if len(missing) >= batch_size:
+                        executor = executor or ProcessPoolExecutor(max_workers=self.workers)
+                        self._hash_files(executor, missing, cache)
+                        no_missing += len(missing)
+                        missing = []
+                if len(missing) > 0:
+                    executor = executor or ProcessPoolExecutor(max_workers=self.workers)
+                    self._hash_files(executor, missing, cache)
+                    no_missing += len(missing)
+            finally:
+                if executor is not None:
+                    executor.shutdown()
+            if no_missing > 0:
+                self._write_cache(cache)
+
+            self._tree = BKTree()
+            for idx, hash in enumerate(self.hashes):
+                if hash is not None:
+                    self._tree.add(hash, idx)
+        logger.info(f"Hashed {no_images} images ({no_missing} files not cached)")
+
+
+    def duplicates_of(self, idx: int, max_distance: int) -> List[int]:
+        """Indexes of near-duplicates of an image, closest first
+
+        Args:
+            idx (int): Index of the image
+            max_distance (int): Maximum Hamming distance between hashes, inclusive
+
+        Returns:
+            List[int]: Indexes of other images; empty if the image could not be hashed
+        """
+        hash = self.hashes[idx]
+        if hash is None:
+            return []
+        return [ other for other, _ in self._tree.search(hash, max_distance) if other != idx ]
+
+
+    def groups(self, max_distance: int) -> List[List[int]]:
+        """Groups of images that are near-duplicates of each other, directly or through other images in the group
+
+        Args:
+            max_distance (int): Maximum Hamming distance between hashes, inclusive
+
+        Returns:
+            List[List[int]]: Indexes of each group with more than one image, ascending
+        """
+        group_of: Dict[int,int] = {}
+        groups: List[List[int]] = []
+        for idx in range(len(self.hashes)):
+            if idx in group_of or self.hashes[idx] is None:
+                continue
+            group = [idx]
+            group_of[idx] = len(groups)
+            stack = [idx]
+            while len(stack) > 0:
+                for other in self.duplicates_of(stack.pop(), max_distance):
+                    if other not in group_of:
+                        group_of[other] = len(groups)
+                        group.append(other)
+                        stack.append(other)
+            groups.append(sorted(group))
+        return [ group for group in groups if len(group) > 1 ]
@@ -0,0 +1,215 @@
+from typing import Optional, List, Tuple, Dict
+import numpy as np
+import heapq
+import csv
+import json
+import math
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ImageOrder:
+    """Order in which the images of a source are visited: maps positions in the order to indexes in the source and back
+
+    Orders store permutations as integer arrays, never copies of the image names.
+    """
+
+
+    def __init__(self, no_images: int):
+        self.no_images = no_images
+
+
+    def idx_at(self, pos: int) -> int:
+        """Index in the source of the image at a position, 0 <= pos < no_images
+        """
+        return pos
+
+
+    def pos_of(self, idx: int) -> int:
+        """Position of the image at an index in the source
+        """
+        return idx
+
+
+class PermutationOrder(ImageOrder):
+    """Fixed order given by a permutation of the indexes
+    """
+
+
+    def __init__(self, order: np.ndarray):
+        """Constructor
+
+        Args:
+            order (np.ndarray): Index in the source at each position
+        """
+        super().__init__(len(order))
+        self._order = order.astype(np.int64, copy=False)
+        self._pos = np.empty_like(self._order)
+        self._pos[self._order] = np.arange(len(self._order))
+
+
+    def idx_at(self, pos: int) -> int:
+        return int(self._order[pos])
+
+
+    def pos_of(self, idx: int) -> int:
+        return int(self._pos[idx])
+
+
+def shuffled_order(no_images: int, seed: int = 0) -> PermutationOrder:
+    """Random order, the same for the same seed
+
+    Args:
+        no_images (int): Number of images
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        PermutationOrder: Order
+    """
+    return PermutationOrder(np.random.default_rng(seed).permutation(no_images))
+
+
+def stratified_order(groups: np.ndarray, seed: int = 0) -> PermutationOrder:
+    """Random order in which every group, e.g. folder, is represented in proportion to its size from the start
+
+    Images of each group are shuffled, and the i-th of a group of size n is placed at a random point between i/n and (i+1)/n of the order.
+
+    Args:
+        groups (np.ndarray): Group number of each image, from 0
+        seed (int, optional): Random seed. Defaults to 0.
+
+    Returns:
+        PermutationOrder: Order
+    """
+    rng = np.random.default_rng(seed)
+    no_images = len(groups)
+    shuffled = rng.permutation(no_images)
+    by_group = shuffled[np.argsort(groups[shuffled], kind="stable")]
+    sizes = np.bincount(groups)
+    sizes = sizes[sizes > 0]
+    starts = np.cumsum(sizes) - sizes
+    ranks = np.arange(no_images) - np.repeat(starts, sizes)
+    keys = (ranks + rng.random(no_images)) / np.repeat(sizes, sizes)
+    return PermutationOrder(by_group[np.argsort(keys, kind="stable")])
+
+
+class PriorityOrder(ImageOrder):
+    """Highest scores first, with scores that can change while images are visited
+
+    The order is decided one position at a time, when a position is first needed: the positions visited so far stay fixed, and the rest
+    follow the current scores. Initial scores are sorted once; updated scores go into a heap, with entries made stale by later updates
+    discarded when they reach the top. Images without a score come last, in index order.
+    """
+
+
+    def __init__(self, scores: np.ndarray):
+        """Constructor
+
+        Args:
+            scores (np.ndarray): Score of each image, NaN for none
+        """
+        super().__init__(len(scores))
+        self._scores = scores.astype(np.float64)
+        self._initial = self._scores.copy()
+        # Stable sort of the negated scores: NaN last
+        self._sorted = np.argsort(-self._scores, kind="stable")
+        self._sorted_pos = 0
+        self._heap: List[Tuple[float,int]] = []
+        self._order = np.empty(self.no_images, dtype=np.int64)
+        self._pos = np.full(self.no_images, -1, dtype=np.int64)
+        self._no_fixed = 0
+
+
+    def score(self, idx: int) -> Optional[float]:
+        """Current score of an image, None if it has none
+        """
+        score = float(self._scores[idx])
+        return None if math.isnan(score) else score
+
+
+    def update(self, idx: int, score: float):
+        """Change the score of an image. Only affects its position if it was not visited yet
+
+        Args:
+            idx (int): Index in the source
+            score (float): New score
+        """
+        assert not math.isnan(score), "score must not be NaN"
+        self._scores[idx] = score
+        if self._pos[idx] < 0:
+            heapq.heappush(self._heap, (-score, idx))
+
+
+    def _sorted_head(self) -> Optional[int]:
+        while self._sorted_pos < self.no_images:
+            idx = int(self._sorted[self._sorted_pos])
+            # Stale once placed or updated
+            initial, score = self._initial[idx], self._scores[idx]
+            unchanged = score == initial or (np.isnan(initial) and np.isnan(score))
+            if self._pos[idx] < 0 and unchanged:
+                return idx
+            self._sorted_pos += 1
+        return None
+
+
+    def _heap_head(self) -> Optional[int]:
+        while len(self._heap) > 0:
+            score, idx = self._heap[0]
+            if self._pos[idx] < 0 and self._scores[idx] == -score:
+                return idx
+            heapq.heappop(self._heap)
+        return None
+
+
+    def _fix(self, idx: int):
+        self._order[self._no_fixed] = idx
+        self._pos[idx] = self._no_fixed
+        self._no_fixed += 1
+
+
+    def _fix_next(self):
+        idx_sorted = self._sorted_head()
+        idx_heap = self._heap_head()
+        if idx_heap is not None and (idx_sorted is None or np.isnan(self._scores[idx_sorted]) or self._scores[idx_heap] > self._scores[idx_sorted]):
+            self._fix(idx_heap)
+        else:
+            assert idx_sorted is not None, "No images left to order"
+            self._fix(idx_sorted)
+
+
+    def idx_at(self, pos: int) -> int:
+        while self._no_fixed <= pos:
+            self._fix_next()
+        return int(self._order[pos])
+
+
+    def pos_of(self, idx: int) -> int:
+        # Images gone to directly take the next free position
+        if self._pos[idx] < 0:
+            self._fix(idx)
+        return int(self._pos[idx])
+
+
+def load_priority_file(fname: str) -> Dict[str,float]:
+    """Scores of images from a JSON object of image names to scores, a JSON list of objects with "image_name" and "score",
+    or a CSV file with "image_name" and "score" columns
+
+    Args:
+        fname (str): File name
+
+    Returns:
+        Dict[str,float]: Score of each image name
+    """
+    if fname.endswith(".json"):
+        with open(fname) as f:
+            data = json.load(f)
+        if isinstance(data, dict):
+            return { name: float(score) for name, score in data.items() }
+        return { row["image_name"]: float(row["score"]) for row in data }
+
+    with open(fname, newline="") as f:
+        reader = csv.DictReader(f)
+        assert reader.fieldnames is not None and "image_name" in reader.fieldnames and "score" in reader.fieldnames, f"{fname} must have image_name and score columns"
+        return { row["image_name"]: float(row["score"]) for row in reader }
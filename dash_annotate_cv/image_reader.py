@@ -0,0 +1,97 @@
+from PIL import Image
+from typing import Iterable, Union, Optional, Callable
+import numpy as np
+
+
+def _name_hash(name: str) -> int:
+    # Only compared within the process, so Python's string hash will do
+    return hash(name) & 0xFFFFFFFFFFFFFFFF
+
+
+class ImageNameIndex:
+    """Index of image names by hash, for finding the index of a name without holding all names as strings
+
+    Only a sorted 64-bit hash and an index per image are kept; names with a matching hash are read again to confirm.
+    """
+
+
+    def __init__(self, no_images: int, name_at_idx: Callable[[int],str]):
+        """Constructor
+
+        Args:
+            no_images (int): Number of images
+            name_at_idx (Callable[[int],str]): Image name at an index
+        """
+        hashes = np.fromiter((_name_hash(name_at_idx(idx)) for idx in range(no_images)), dtype=np.uint64, count=no_images)
+        self._order = np.argsort(hashes, kind="stable")
+        self._hashes = hashes[self._order]
+        self._name_at_idx = name_at_idx
+
+
+    def idx_of_name(self, name: str) -> Optional[int]:
+        """Index of an image name
+
+        Args:
+            name (str): Image name
+
+        Returns:
+            Optional[int]: First index with the name, or None if there is none
+        """
+        hash = np.uint64(_name_hash(name))
+        start = int(np.searchsorted(self._hashes, hash, side="left"))
+        end = int(np.searchsorted(self._hashes, hash, side="right"))
+        for pos in range(start, end):
+            idx = int(self._order[pos])
+            if self._name_at_idx(idx) == name:
+                return idx
+        return None
+
+
+class ImageReader:
+    """Random access to the images of an image source type not backed by local image files, e.g. remote objects
+
+    `ImageIterator` delegates to a reader for these source types.
+    """
+
+
+    @property
+    def no_images(self) -> int:
+        raise NotImplementedError
+
+
+    def name_at_idx(self, idx: int) -> str:
+        """Stable image name at an index, used as the key of its annotation, without reading the image
+        """
+        raise NotImplementedError
+
+
+    def idx_of_name(self, name: str) -> Optional[int]:
+        """Index of an image name, or None if it is not in the source. By default from an `ImageNameIndex` built on first use
+        """
+        if getattr(self, "_name_index", None) is None:
+            self._name_index = ImageNameIndex(self.no_images, self.name_at_idx)
+        return self._name_index.idx_of_name(name)
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        """Image at an index
+        """
+        raise NotImplementedError
+
+
+    def source_at_idx(self, idx: int) -> Union[str,Image.Image]:
+        """Local file with the image at an index, or the image itself, e.g. for thumbnails
+        """
+        return self.image_at_idx(idx)
+
+
+    def prefetch(self, idxs: Iterable[int]):
+        """Start reading images in the background that are likely needed soon
+        """
+        pass
+
+
+    def close(self):
+        """Release files, connections and worker threads
+        """
+        pass
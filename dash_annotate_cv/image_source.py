@@ -1,7 +1,15 @@
+from dash_annotate_cv.metrics import registry as metrics
+from dash_annotate_cv.large_image import LargeImage, is_large_image
+from dash_annotate_cv.image_reader import ImageReader, ImageNameIndex
+from dash_annotate_cv.image_hash import ImageHashIndex, HashMethod, DuplicateImageAction
+from dash_annotate_cv.image_source_manifest import ManifestFileList
+from dash_annotate_cv.image_order import ImageOrder, PriorityOrder, shuffled_order, stratified_order, load_priority_file
+
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Optional, List, Tuple
+from typing import Optional, List, Tuple, Union, Dict, Iterable, Callable, Any, Sequence, Iterator
 from PIL import Image
+import numpy as np
 import os
 import logging
 from mashumaro import DataClassDictMixin
@@ -27,6 +35,24 @@ class ImageSource(DataClassDictMixin):
         DEFAULT = "default"
         FOLDER = "folder"
         LIST_OF_FILES = "list_of_files"
+        REMOTE = "remote"
+        ARCHIVE = "archive"
+        VIDEO = "video"
+        LOADER = "loader"
+        ARRAY = "array"
+        SHARED_MEMORY = "shared_memory"
+        NPY = "npy"
+        MANIFEST = "manifest"
+
+    class Order(Enum):
+        # Index order of the source
+        INDEX = "index"
+        # Highest scores first, from order_priority_file and updates while the app runs
+        PRIORITY = "priority"
+        # Random order with order_seed
+        SHUFFLE = "shuffle"
+        # Random order with order_seed in which every folder is represented in proportion to its size from the start
+        STRATIFIED = "stratified"
 
     # Source type
     source_type: Type = Type.DEFAULT
@@ -37,12 +63,126 @@ class ImageSource(DataClassDictMixin):
     # Folder source
     folder_name: Optional[str] = None
 
-    # Folder source: pattern to match
+    # Folder source: pattern to match. Remote and archive sources: pattern that keys or members must match
     folder_pattern: str = "*.jpg"
 
     # List of files source
     list_of_files: Optional[List[str]] = None
 
+    # Manifest source: text file with one image file per line, for lists too long to give inline. Lines are read on access through a cached index of their offsets
+    manifest_file: Optional[str] = None
+
+    # Manifest source: directory for cached line indexes. None = system temporary directory
+    manifest_index_dir: Optional[str] = None
+
+    # Folder, list of files and manifest sources: TIFFs with at least this many pixels are read by region as `LargeImage` (requires tifffile). None = never
+    large_image_min_pixels: Optional[int] = None
+
+    # Directory for image pyramids built for large images without one. None = system temporary directory
+    large_image_cache_dir: Optional[str] = None
+
+    # Remote source: base URL that object keys are appended to, e.g. the bucket URL of an S3-compatible store (requires requests)
+    remote_url: Optional[str] = None
+
+    # Remote source: object keys. None = list them with the S3 ListObjectsV2 API, keeping those matching folder_pattern
+    remote_keys: Optional[List[str]] = None
+
+    # Remote source: when listing, only keys with this prefix
+    remote_prefix: str = ""
+
+    # Remote source: headers sent with every request, e.g. for authorization
+    remote_headers: Optional[Dict[str,str]] = None
+
+    # Remote source: directory for downloaded images. None = system temporary directory
+    remote_cache_dir: Optional[str] = None
+
+    # Remote source: maximum size of the download cache in MB; least recently used images are evicted
+    remote_cache_max_mb: float = 1024
+
+    # Remote source: number of images downloaded in the background ahead of the one shown, in the order images are visited in
+    remote_prefetch: int = 4
+
+    # Remote source: number of concurrent downloads
+    remote_workers: int = 4
+
+    # Archive source: zip or uncompressed tar file. Images are read from it without extracting it
+    archive_file: Optional[str] = None
+
+    # Archive source: directory for cached member indexes. None = system temporary directory
+    archive_index_dir: Optional[str] = None
+
+    # Video source: video file whose frames are shown as images (requires av). Frames are named "<video_file>#<frame number>"
+    video_file: Optional[str] = None
+
+    # Video source: show every this many frames
+    video_stride: int = 1
+
+    # Video source: number of decoded frames kept around the current frame
+    video_buffer_size: int = 32
+
+    # Loader source: function returning the image, or an H x W (x C) array, at an index. Images are loaded when needed instead of up front
+    images_loader: Optional[Callable[[int],Any]] = field(default=None, metadata={"serialize": lambda x: None, "deserialize": lambda x: None})
+
+    # Loader source: alternative to images_loader, a function returning a new iterable of image names and images (or arrays), in the same order each time
+    images_factory: Optional[Callable[[],Iterable[Tuple[str,Any]]]] = field(default=None, metadata={"serialize": lambda x: None, "deserialize": lambda x: None})
+
+    # Loader source with images_loader, array, shared memory and npy sources: image names. None for array and shared memory sources = index, zero-padded
+    image_names: Optional[List[str]] = None
+
+    # Loader source: number of recently loaded images kept in memory
+    images_cache_size: int = 8
+
+    # Array source: N x H x W or N x H x W x C array, e.g. uint8. Images are views into it, so it is never copied
+    images_array: Optional[np.ndarray] = field(default=None, metadata={"serialize": lambda x: None, "deserialize": lambda x: None})
+
+    # Shared memory source: name of a multiprocessing.shared_memory block holding the images, e.g. from create_shared_image_stack
+    shared_memory_name: Optional[str] = None
+
+    # Shared memory source: shape of the array in the block, N x H x W or N x H x W x C
+    shared_memory_shape: Optional[List[int]] = None
+
+    # Shared memory source: data type of the array in the block
+    shared_memory_dtype: str = "uint8"
+
+    # Npy source: .npy file of an N x H x W or N x H x W x C array of any numeric type, memory-mapped. Images are named "<npy_file>#<index>" unless image_names is set
+    npy_file: Optional[str] = None
+
+    # Npy source: values shown as black and white, [low, high]. None = percentiles of each image
+    npy_window: Optional[List[float]] = None
+
+    # Npy source: lower and upper percentiles of each channel used as the window if npy_window is not set
+    npy_percentiles: List[float] = field(default_factory=lambda: [1.0, 99.0])
+
+    # Npy source: gamma applied after windowing; below 1 brightens dark values
+    npy_gamma: float = 1.0
+
+    # Npy source: one channel shown as grayscale or three shown as RGB. None = all of one or three channels, else the first
+    npy_channels: Optional[List[int]] = None
+
+    # Npy source: number of display renditions kept in memory
+    npy_cache_size: int = 16
+
+    # Near-duplicate images: Hamming distance between perceptual hashes at or below which images are duplicates, out of 64 bits. None = no hashing
+    duplicate_max_distance: Optional[int] = None
+
+    # Near-duplicate images: hash method
+    duplicate_hash_method: HashMethod = HashMethod.DIFFERENCE
+
+    # Near-duplicate images: JSON file of cached hashes of image files. None = system temporary directory
+    duplicate_hash_cache_file: Optional[str] = None
+
+    # Near-duplicate images: what to do with duplicates of annotated images
+    duplicate_action: DuplicateImageAction = DuplicateImageAction.SKIP
+
+    # Order in which images are visited
+    order: Order = Order.INDEX
+
+    # Priority order: CSV file with image_name and score columns, or JSON object of image names to scores. Names are matched in full or by basename
+    order_priority_file: Optional[str] = None
+
+    # Shuffle and stratified orders: random seed
+    order_seed: int = 0
+
 
     def __post_init__(self):
         if self.source_type == ImageSource.Type.DEFAULT:
@@ -51,8 +191,51 @@ class ImageSource(DataClassDictMixin):
             assert self.folder_name is not None, "folder_name must be set if source_type is FOLDER"
         elif self.source_type == ImageSource.Type.LIST_OF_FILES:
             assert self.list_of_files is not None, "list_of_files must be set if source_type is LIST_OF_FILES"
+        elif self.source_type == ImageSource.Type.MANIFEST:
+            assert self.manifest_file is not None, "manifest_file must be set if source_type is MANIFEST"
+        elif self.source_type == ImageSource.Type.REMOTE:
+            assert self.remote_url is not None, "remote_url must be set if source_type is REMOTE"
+            assert self.remote_cache_max_mb > 0, "remote_cache_max_mb must be positive"
+            assert self.remote_workers >= 1, "remote_workers must be at least 1"
+        elif self.source_type == ImageSource.Type.ARCHIVE:
+            assert self.archive_file is not None, "archive_file must be set if source_type is ARCHIVE"
+        elif self.source_type == ImageSource.Type.VIDEO:
+            assert self.video_file is not None, "video_file must be set if source_type is VIDEO"
+            assert self.video_stride >= 1, "video_stride must be at least 1"
+            assert self.video_buffer_size >= 1, "video_buffer_size must be at least 1"
+        elif self.source_type == ImageSource.Type.LOADER:
+            assert (self.images_loader is not None and self.image_names is not None) or self.images_factory is not None, "images_loader and image_names, or images_factory, must be set if source_type is LOADER"
+            assert self.images_cache_size >= 1, "images_cache_size must be at least 1"
+        elif self.source_type == ImageSource.Type.ARRAY:
+            assert self.images_array is not None, "images_array must be set if source_type is ARRAY"
+        elif self.source_type == ImageSource.Type.SHARED_MEMORY:
+            assert self.shared_memory_name is not None and self.shared_memory_shape is not None, "shared_memory_name and shared_memory_shape must be set if source_type is SHARED_MEMORY"
+        elif self.source_type == ImageSource.Type.NPY:
+            assert self.npy_file is not None, "npy_file must be set if source_type is NPY"
+            assert self.npy_window is None or (len(self.npy_window) == 2 and self.npy_window[0] < self.npy_window[1]), "npy_window must be [low, high] with low < high"
+            assert len(self.npy_percentiles) == 2 and 0 <= self.npy_percentiles[0] < self.npy_percentiles[1] <= 100, "npy_percentiles must be [low, high] in [0, 100]"
+            assert self.npy_gamma > 0, "npy_gamma must be positive"
+            assert self.npy_cache_size >= 1, "npy_cache_size must be at least 1"
         else:
             raise NotImplementedError
+        if self.duplicate_max_distance is not None:
+            assert self.duplicate_max_distance >= 0, "duplicate_max_distance must not be negative"
+
+
+# Images of remote sources downloaded ahead at a time when hashing
+HASH_READ_AHEAD = 32
+
+
+# Source types read through an `ImageReader`
+READER_SOURCE_TYPES = (
+    ImageSource.Type.REMOTE,
+    ImageSource.Type.ARCHIVE,
+    ImageSource.Type.VIDEO,
+    ImageSource.Type.LOADER,
+    ImageSource.Type.ARRAY,
+    ImageSource.Type.SHARED_MEMORY,
+    ImageSource.Type.NPY
+    )
 
 
 class ImageIterator:
@@ -60,11 +243,22 @@ class ImageIterator:
     """
     
 
-    def __init__(self, image_source: ImageSource):
+    def __init__(self, image_source: ImageSource, skip: Optional[Callable[[int],bool]] = None):
+        """Constructor
+
+        Args:
+            image_source (ImageSource): Source of images
+            skip (Optional[Callable[[int],bool]], optional): Indexes for which this returns True are passed over by `next` and `prev`, e.g. duplicates of annotated images. Defaults to None.
+        """
         self.image_source = image_source
         self.idx_of_curr_img = -1
+        self.pos_of_curr_img = -1
+        self.skip = skip
+        self.hash_index: Optional[ImageHashIndex] = None
 
-        self._file_names = None
+        self._file_names: Optional[Sequence[str]] = None
+        self._reader: Optional[ImageReader] = None
+        self._name_index: Optional[ImageNameIndex] = None
         if image_source.source_type == ImageSource.Type.FOLDER:
             import glob
             assert image_source.folder_name is not None, "folder_name must be set if source_type is FOLDER"
@@ -74,42 +268,267 @@ class ImageIterator:
             assert image_source.list_of_files is not None, "list_of_files must be set if source_type is LIST_OF_FILES"
             self._file_names = image_source.list_of_files
             self.no_images = len(self._file_names)
+        elif image_source.source_type == ImageSource.Type.MANIFEST:
+            assert image_source.manifest_file is not None, "manifest_file must be set if source_type is MANIFEST"
+            self._file_names = ManifestFileList(image_source.manifest_file, index_dir=image_source.manifest_index_dir)
+            self.no_images = len(self._file_names)
+        elif image_source.source_type in READER_SOURCE_TYPES:
+            self._reader = self._create_reader(image_source)
+            self.no_images = self._reader.no_images
         else:
             assert image_source.images is not None, "images must be set if source_type is DEFAULT"
             self.no_images = len(image_source.images)
+
+        if image_source.duplicate_max_distance is not None:
+            self.hash_index = ImageHashIndex(
+                method=image_source.duplicate_hash_method,
+                cache_file=image_source.duplicate_hash_cache_file,
+                large_image_min_pixels=image_source.large_image_min_pixels
+                )
+            self.hash_index.build(self._hash_sources())
+
+        self.order = self._create_order()
     
 
-    def _image_at_idx(self, idx: int) -> Tuple[int,str,Image.Image]:
+    def _hash_sources(self) -> Iterator[Union[str,Image.Image]]:
+        """Sources of the images one at a time, so that decoded images are not all held at once. Remote images are downloaded ahead concurrently
+        """
+        for idx in range(self.no_images):
+            if idx % HASH_READ_AHEAD == 0:
+                self.prefetch(range(idx, idx + HASH_READ_AHEAD))
+            yield self.source_at_idx(idx)
+
+
+    def _create_order(self) -> ImageOrder:
+        order = self.image_source.order
+        if order == ImageSource.Order.SHUFFLE:
+            return shuffled_order(self.no_images, self.image_source.order_seed)
+
+        if order == ImageSource.Order.STRATIFIED:
+            folder_to_group: Dict[str,int] = {}
+            groups = np.empty(self.no_images, dtype=np.int64)
+            for idx in range(self.no_images):
+                groups[idx] = folder_to_group.setdefault(os.path.dirname(self.name_at_idx(idx)), len(folder_to_group))
+            return stratified_order(groups, self.image_source.order_seed)
+
+        if order == ImageSource.Order.PRIORITY:
+            scores = np.full(self.no_images, np.nan)
+            if self.image_source.order_priority_file is not None:
+                name_to_score = load_priority_file(self.image_source.order_priority_file)
+                for idx in range(self.no_images):
+                    name = self.name_at_idx(idx)
+                    score = name_to_score.get(name, name_to_score.get(os.path.basename(name)))
+                    if score is not None:
+                        scores[idx] = score
+                logger.info(f"Loaded scores of {np.count_nonzero(~np.isnan(scores))}/{self.no_images} images from {self.image_source.order_priority_file}")
+            return PriorityOrder(scores)
+
+        return ImageOrder(self.no_images)
+
+
+    def update_priority(self, idx: int, score: float):
+        """Change the score of an image in the priority order. Images already visited keep their position
+
+        Args:
+            idx (int): Index in the source
+            score (float): New score
+        """
+        assert isinstance(self.order, PriorityOrder), "order must be PRIORITY to update scores"
+        self.order.update(idx, score)
+
+
+    @staticmethod
+    def _create_reader(image_source: ImageSource) -> ImageReader:
+        if image_source.source_type == ImageSource.Type.ARCHIVE:
+            from dash_annotate_cv.image_source_archive import ArchiveImageReader
+            assert image_source.archive_file is not None, "archive_file must be set if source_type is ARCHIVE"
+            return ArchiveImageReader(image_source.archive_file, pattern=image_source.folder_pattern, index_dir=image_source.archive_index_dir)
+
+        if image_source.source_type == ImageSource.Type.VIDEO:
+            from dash_annotate_cv.image_source_video import VideoImageReader
+            assert image_source.video_file is not None, "video_file must be set if source_type is VIDEO"
+            return VideoImageReader(image_source.video_file, stride=image_source.video_stride, buffer_size=image_source.video_buffer_size)
+
+        if image_source.source_type == ImageSource.Type.LOADER:
+            from dash_annotate_cv.image_source_memory import LoaderImageReader, GeneratorImageReader
+            if image_source.images_loader is not None:
+                assert image_source.image_names is not None, "image_names must be set with images_loader"
+                return LoaderImageReader(image_source.images_loader, image_source.image_names, cache_size=image_source.images_cache_size)
+            assert image_source.images_factory is not None, "images_loader or images_factory must be set if source_type is LOADER"
+            return GeneratorImageReader(image_source.images_factory, cache_size=image_source.images_cache_size)
+
+        if image_source.source_type == ImageSource.Type.ARRAY:
+            from dash_annotate_cv.image_source_memory import ArrayImageReader
+            assert image_source.images_array is not None, "images_array must be set if source_type is ARRAY"
+            return ArrayImageReader(image_source.images_array, image_source.image_names)
+
+        if image_source.source_type == ImageSource.Type.SHARED_MEMORY:
+            from dash_annotate_cv.image_source_memory import SharedMemoryImageReader
+            assert image_source.shared_memory_name is not None and image_source.shared_memory_shape is not None, "shared_memory_name and shared_memory_shape must be set if source_type is SHARED_MEMORY"
+            return SharedMemoryImageReader(image_source.shared_memory_name, tuple(image_source.shared_memory_shape), image_source.shared_memory_dtype, image_source.image_names)
+
+        if image_source.source_type == ImageSource.Type.NPY:
+            from dash_annotate_cv.image_source_npy import NpyImageReader
+            assert image_source.npy_file is not None, "npy_file must be set if source_type is NPY"
+            return NpyImageReader(
+                image_source.npy_file,
+                names=image_source.image_names,
+                window=(image_source.npy_window[0], image_source.npy_window[1]) if image_source.npy_window is not None else None,
+                percentiles=(image_source.npy_percentiles[0], image_source.npy_percentiles[1]),
+                gamma=image_source.npy_gamma,
+                channels=image_source.npy_channels,
+                cache_size=image_source.npy_cache_size
+                )
+
+        from dash_annotate_cv.image_source_remote import RemoteImageReader
+        assert image_source.remote_url is not None, "remote_url must be set if source_type is REMOTE"
+        return RemoteImageReader(
+            url=image_source.remote_url,
+            keys=image_source.remote_keys,
+            prefix=image_source.remote_prefix,
+            pattern=image_source.folder_pattern,
+            headers=image_source.remote_headers,
+            cache_dir=image_source.remote_cache_dir,
+            cache_max_mb=image_source.remote_cache_max_mb,
+            workers=image_source.remote_workers
+            )
+
+
+    def _image_at_idx(self, idx: int) -> Tuple[int,str,Union[Image.Image,LargeImage]]:
         logger.debug(f"Loading image at index {idx}")
+        if self._reader is not None:
+            with metrics.timer("image_load_duration_seconds", {"source_type": self.image_source.source_type.value}):
+                image = self._reader.image_at_idx(idx)
+            return idx, self._reader.name_at_idx(idx), image
         if self.image_source.source_type == ImageSource.Type.DEFAULT:
             assert self.image_source.images is not None, "images must be set if source_type is DEFAULT"
             ret = self.image_source.images[idx]
             return idx, ret[0], ret[1]
         else:
             assert self._file_names is not None, "file_names must be set if source_type is not DEFAULT"
-            return idx, self._file_names[idx], Image.open(self._file_names[idx])
+            fname = self._file_names[idx]
+            if self.image_source.large_image_min_pixels is not None and is_large_image(fname, self.image_source.large_image_min_pixels):
+                return idx, fname, LargeImage(fname, cache_dir=self.image_source.large_image_cache_dir)
+            with metrics.timer("image_load_duration_seconds", {"source_type": self.image_source.source_type.value}):
+                image = Image.open(fname)
+            return idx, fname, image
+
+
+    def name_at_idx(self, idx: int) -> str:
+        """Image name at an index, without loading the image
+        """
+        if self._reader is not None:
+            return self._reader.name_at_idx(idx)
+        if self.image_source.source_type == ImageSource.Type.DEFAULT:
+            assert self.image_source.images is not None, "images must be set if source_type is DEFAULT"
+            return self.image_source.images[idx][0]
+        assert self._file_names is not None, "file_names must be set if source_type is not DEFAULT"
+        return self._file_names[idx]
 
 
-    def next(self) -> Tuple[int,str,Image.Image]:
-        if self.idx_of_curr_img >= self.no_images-1:
-            self.idx_of_curr_img = self.no_images
+    def idx_of_name(self, name: str) -> Optional[int]:
+        """Index of an image name, or None if it is not in the source. Names are indexed by hash on first use, without holding them all
+        """
+        if self._reader is not None:
+            return self._reader.idx_of_name(name)
+        if self._name_index is None:
+            self._name_index = ImageNameIndex(self.no_images, self.name_at_idx)
+        return self._name_index.idx_of_name(name)
+
+
+    def source_at_idx(self, idx: int) -> Union[str,Image.Image]:
+        """File name at an index, or the image itself for the default source
+        """
+        if self._reader is not None:
+            return self._reader.source_at_idx(idx)
+        if self.image_source.source_type == ImageSource.Type.DEFAULT:
+            assert self.image_source.images is not None, "images must be set if source_type is DEFAULT"
+            return self.image_source.images[idx][1]
+        assert self._file_names is not None, "file_names must be set if source_type is not DEFAULT"
+        return self._file_names[idx]
+
+
+    def duplicates_of(self, idx: int) -> List[int]:
+        """Indexes of near-duplicates of the image at an index, closest first. Empty unless `duplicate_max_distance` is set
+        """
+        if self.hash_index is None:
+            return []
+        assert self.image_source.duplicate_max_distance is not None
+        return self.hash_index.duplicates_of(idx, self.image_source.duplicate_max_distance)
+
+
+    def prefetch(self, idxs: Iterable[int]):
+        """Start reading images in the background that are likely needed soon. Only remote sources read ahead; for others this does nothing
+        """
+        if self._reader is not None:
+            self._reader.prefetch([ idx for idx in idxs if 0 <= idx < self.no_images ])
+
+
+    def close(self):
+        """Release files, connections and worker threads held for the source
+        """
+        if self._reader is not None:
+            self._reader.close()
+        if isinstance(self._file_names, ManifestFileList):
+            self._file_names.close()
+
+
+    def go_to(self, idx: int) -> Tuple[int,str,Union[Image.Image,LargeImage]]:
+        if idx < 0:
+            raise IndexBelowError
+        if idx >= self.no_images:
             raise IndexAboveError
-        
-        self.idx_of_curr_img += 1
-        if self.idx_of_curr_img >= self.no_images:
+        self.pos_of_curr_img = self.order.pos_of(idx)
+        self.idx_of_curr_img = idx
+        result = self._image_at_idx(idx)
+        self._read_ahead(1)
+        return result
+
+
+    def _read_ahead(self, step: int):
+        """Start reading the images at the next positions in the order, in the direction of travel
+        """
+        if self._reader is None:
+            return
+        positions = range(self.pos_of_curr_img + step, self.pos_of_curr_img + step * (self.image_source.remote_prefetch + 1), step)
+        self.prefetch([ self.order.idx_at(pos) for pos in positions if 0 <= pos < self.no_images ])
+
+
+    def _skipped(self, idx: int) -> bool:
+        return self.skip is not None and self.skip(idx)
+
+
+    def next(self) -> Tuple[int,str,Union[Image.Image,LargeImage]]:
+        """Next image in the order, passing over skipped ones
+        """
+        pos = self.pos_of_curr_img + 1
+        while pos < self.no_images and self._skipped(self.order.idx_at(pos)):
+            pos += 1
+        if pos >= self.no_images:
+            self.pos_of_curr_img = self.idx_of_curr_img = self.no_images
             raise IndexAboveError
+        
+        self.pos_of_curr_img = pos
+        self.idx_of_curr_img = self.order.idx_at(pos)
         result = self._image_at_idx(self.idx_of_curr_img)
-
+        self._read_ahead(1)
         return result
 
 
-    def prev(self) -> Tuple[int,str,Image.Image]:
-        if self.idx_of_curr_img <= 0:
-            self.idx_of_curr_img = -1
+    def prev(self) -> Tuple[int,str,Union[Image.Image,LargeImage]]:
+        """Previous image in the order, passing over skipped ones
+        """
+        pos = min(self.pos_of_curr_img, self.no_images) - 1
+        while pos >= 0 and self._skipped(self.order.idx_at(pos)):
+            pos -= 1
+        if pos < 0:
+            self.pos_of_curr_img = self.idx_of_curr_img = -1
             raise IndexBelowError
         
-        self.idx_of_curr_img -= 1
+        self.pos_of_curr_img = pos
+        self.idx_of_curr_img = self.order.idx_at(pos)
         result = self._image_at_idx(self.idx_of_curr_img)
+        self._read_ahead(-1)
         return result
 
 
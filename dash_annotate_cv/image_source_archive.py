@@ -0,0 +1,215 @@
+from dash_annotate_cv.image_reader import ImageReader
+from dash_annotate_cv.metrics import registry as metrics
+
+from dataclasses import dataclass
+from mashumaro import DataClassDictMixin
+from typing import Optional, List, BinaryIO
+from PIL import Image
+import fnmatch
+import hashlib
+import io
+import json
+import os
+import struct
+import tarfile
+import tempfile
+import threading
+import zipfile
+import zlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Size of the fixed part of a zip local file header
+_ZIP_LOCAL_HEADER_SIZE = 30
+
+
+@dataclass
+class ArchiveMember(DataClassDictMixin):
+    """Location of a member's data in an archive
+    """
+
+    # Member name
+    name: str
+
+    # Offset of the (possibly compressed) data
+    offset: int
+
+    # Size of the data in the archive
+    size: int
+
+    # Zip compression method (zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED). Always stored for tar
+    compression: int = zipfile.ZIP_STORED
+
+
+@dataclass
+class ArchiveIndex(DataClassDictMixin):
+    """Member offsets of an archive, valid while the archive is unchanged
+    """
+
+    # Size of the archive when indexed
+    archive_size: int
+
+    # Modification time of the archive in ns when indexed
+    archive_mtime_ns: int
+
+    # Members, sorted by name
+    members: List[ArchiveMember]
+
+
+def _index_zip(fname: str) -> List[ArchiveMember]:
+    members = []
+    with open(fname, "rb") as f, zipfile.ZipFile(f) as zf:
+        for info in zf.infolist():
+            if info.is_dir():
+                continue
+            if info.compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+                raise ValueError(f"Member {info.filename} of {fname} uses an unsupported compression method {info.compress_type}")
+            if info.flag_bits & 0x1:
+                raise ValueError(f"Member {info.filename} of {fname} is encrypted")
+
+            # The data follows the local header, whose name and extra field lengths may differ from the central directory
+            f.seek(info.header_offset)
+            header = f.read(_ZIP_LOCAL_HEADER_SIZE)
+            name_len, extra_len = struct.unpack("<HH", header[26:30])
+            offset = info.header_offset + _ZIP_LOCAL_HEADER_SIZE + name_len + extra_len
+            members.append(ArchiveMember(info.filename, offset, info.compress_size, info.compress_type))
+    return members
+
+
+def _index_tar(fname: str) -> List[ArchiveMember]:
+    members = []
+    try:
+        with tarfile.open(fname, "r:") as tf:
+            for info in tf:
+                if info.isfile():
+                    members.append(ArchiveMember(info.name, info.offset_data, info.size))
+    except tarfile.ReadError:
+        raise ValueError(f"{fname} is not an uncompressed tar or zip archive. Compressed tars cannot be read by seeking: decompress to .tar first")
+    return members
+
+
+def build_archive_index(fname: str) -> ArchiveIndex:
+    """Index the members of a zip or uncompressed tar archive
+
+    Args:
+        fname (str): Archive
+
+    Returns:
+        ArchiveIndex: Index
+    """
+    stat = os.stat(fname)
+    with metrics.timer("archive_index_duration_seconds"):
+        members = _index_zip(fname) if zipfile.is_zipfile(fname) else _index_tar(fname)
+    members.sort(key=lambda m: m.name)
+    logger.debug(f"Indexed {len(members)} members of {fname}")
+    return ArchiveIndex(stat.st_size, stat.st_mtime_ns, members)
+
+
+def load_archive_index(fname: str, index_dir: Optional[str] = None) -> ArchiveIndex:
+    """Index of an archive, from the cache if the archive is unchanged since it was indexed
+
+    Args:
+        fname (str): Archive
+        index_dir (Optional[str], optional): Directory for cached indexes. Defaults to None, i.e. a "dacv_archive_index" folder in the system temporary directory.
+
+    Returns:
+        ArchiveIndex: Index
+    """
+    index_dir = index_dir or os.path.join(tempfile.gettempdir(), "dacv_archive_index")
+    fname_index = os.path.join(index_dir, hashlib.sha1(os.path.abspath(fname).encode("utf-8")).hexdigest() + ".json")
+    stat = os.stat(fname)
+
+    if os.path.exists(fname_index):
+        try:
+            with open(fname_index, "r") as f:
+                index = ArchiveIndex.from_dict(json.load(f))
+            if (index.archive_size, index.archive_mtime_ns) == (stat.st_size, stat.st_mtime_ns):
+                metrics.record_cache("archive_index", True)
+                return index
+        except (ValueError, KeyError):
+            logger.warning(f"Ignoring unreadable archive index {fname_index}")
+    metrics.record_cache("archive_index", False)
+
+    index = build_archive_index(fname)
+    os.makedirs(index_dir, exist_ok=True)
+    fname_tmp = f"{fname_index}.{os.getpid()}.tmp"
+    with open(fname_tmp, "w") as f:
+        json.dump(index.to_dict(), f)
+    os.replace(fname_tmp, fname_index)
+    return index
+
+
+class ArchiveImageReader(ImageReader):
+    """Images stored as members of a zip or uncompressed tar archive, read without extracting it
+
+    Member offsets are indexed once and cached. Each thread reads through its own file handle, so concurrent sessions do not share a
+    file position.
+    """
+
+
+    def __init__(self, fname: str, pattern: str = "*", index_dir: Optional[str] = None):
+        """Constructor
+
+        Args:
+            fname (str): Archive
+            pattern (str, optional): Only members matching this glob pattern. Defaults to "*".
+            index_dir (Optional[str], optional): Directory for cached indexes. Defaults to None, i.e. the system temporary directory.
+        """
+        self.fname = fname
+        index = load_archive_index(fname, index_dir)
+        self.members = [ m for m in index.members if fnmatch.fnmatch(m.name, pattern) ]
+        self._local = threading.local()
+        self._handles: List[BinaryIO] = []
+        self._lock = threading.Lock()
+
+
+    @property
+    def no_images(self) -> int:
+        return len(self.members)
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return self.members[idx].name
+
+
+    def _handle(self) -> BinaryIO:
+        f = getattr(self._local, "f", None)
+        if f is None:
+            f = open(self.fname, "rb")
+            self._local.f = f
+            with self._lock:
+                self._handles.append(f)
+        return f
+
+
+    def read_member(self, idx: int) -> bytes:
+        """Uncompressed data of the member at an index
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            bytes: Data
+        """
+        member = self.members[idx]
+        f = self._handle()
+        f.seek(member.offset)
+        data = f.read(member.size)
+        if member.compression == zipfile.ZIP_DEFLATED:
+            data = zlib.decompress(data, -zlib.MAX_WBITS)
+        return data
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        return Image.open(io.BytesIO(self.read_member(idx)))
+
+
+    def close(self):
+        with self._lock:
+            for f in self._handles:
+                f.close()
+            self._handles = []
+        self._local = threading.local()
@@ -0,0 +1,150 @@
+from dash_annotate_cv.metrics import registry as metrics
+
+from typing import Optional, List, Iterator, Sequence, overload, Union
+import numpy as np
+import hashlib
+import mmap
+import os
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bytes of the manifest scanned at a time when indexing
+_CHUNK_SIZE = 64 * 1024 * 1024
+
+
+def build_manifest_index(fname: str) -> np.ndarray:
+    """Byte offsets of the start and end of each non-empty line of a newline-delimited manifest, found without decoding the lines
+
+    Args:
+        fname (str): Manifest
+
+    Returns:
+        np.ndarray: N x 2 uint64 array of start and end offsets of each line, excluding the line ending
+    """
+    starts: List[np.ndarray] = []
+    ends: List[np.ndarray] = []
+    offset = 0
+    line_start = 0
+    last_byte = -1
+    with metrics.timer("manifest_index_duration_seconds"), open(fname, "rb") as f:
+        while True:
+            chunk = np.frombuffer(f.read(_CHUNK_SIZE), dtype=np.uint8)
+            if len(chunk) == 0:
+                break
+            positions = np.flatnonzero(chunk == ord("\n"))
+            if len(positions) > 0:
+                # Lines end before the newline, and before a "\r" of Windows line endings
+                before = np.where(positions > 0, chunk[np.maximum(positions - 1, 0)], last_byte)
+                newlines = positions.astype(np.uint64) + np.uint64(offset)
+                starts.append(np.concatenate([np.array([line_start], dtype=np.uint64), newlines[:-1] + np.uint64(1)]))
+                ends.append(newlines - (before == ord("\r")).astype(np.uint64))
+                line_start = int(newlines[-1]) + 1
+            offset += len(chunk)
+            last_byte = int(chunk[-1])
+        if line_start < offset:
+            # Last line without a newline
+            starts.append(np.array([line_start], dtype=np.uint64))
+            ends.append(np.array([offset - (1 if last_byte == ord("\r") else 0)], dtype=np.uint64))
+
+    if len(starts) == 0:
+        return np.zeros((0, 2), dtype=np.uint64)
+    index = np.stack([np.concatenate(starts), np.concatenate(ends)], axis=1)
+
+    # Drop empty lines
+    index = index[index[:,1] > index[:,0]]
+    logger.debug(f"Indexed {len(index)} lines of {fname}")
+    return index
+
+
+def load_manifest_index(fname: str, index_dir: Optional[str] = None) -> np.ndarray:
+    """Line offsets of a manifest, memory-mapped from the cache if the manifest is unchanged since it was indexed
+
+    Args:
+        fname (str): Manifest
+        index_dir (Optional[str], optional): Directory for cached indexes. Defaults to None, i.e. a "dacv_manifest_index" folder in the system temporary directory.
+
+    Returns:
+        np.ndarray: N x 2 uint64 array of start and end offsets of each line
+    """
+    index_dir = index_dir or os.path.join(tempfile.gettempdir(), "dacv_manifest_index")
+    stat = os.stat(fname)
+    key = f"{os.path.abspath(fname)}:{stat.st_size}:{stat.st_mtime_ns}"
+    fname_index = os.path.join(index_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".npy")
+
+    if os.path.exists(fname_index):
+        try:
+            index = np.load(fname_index, mmap_mode="r")
+            metrics.record_cache("manifest_index", True)
+            return index
+        except ValueError:
+            logger.warning(f"Ignoring unreadable manifest index {fname_index}")
+    metrics.record_cache("manifest_index", False)
+
+    index = build_manifest_index(fname)
+    os.makedirs(index_dir, exist_ok=True)
+    fname_tmp = f"{fname_index}.{os.getpid()}.tmp"
+    with open(fname_tmp, "wb") as f:
+        np.save(f, index)
+    os.replace(fname_tmp, fname_index)
+    return np.load(fname_index, mmap_mode="r")
+
+
+class ManifestFileList(Sequence[str]):
+    """File names of a newline-delimited manifest, read by line on access
+
+    Only the line offsets are held, memory-mapped from a cached index, so the length is known and any line is read in O(1) without
+    loading all names as Python strings.
+    """
+
+
+    def __init__(self, fname: str, index_dir: Optional[str] = None):
+        """Constructor
+
+        Args:
+            fname (str): Manifest, one file name per line, UTF-8. Empty lines are ignored
+            index_dir (Optional[str], optional): Directory for cached line indexes. Defaults to None, i.e. the system temporary directory.
+        """
+        self.fname = fname
+        self._index = load_manifest_index(fname, index_dir)
+        self._file = open(fname, "rb")
+        self._data = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if len(self._index) > 0 else None
+
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+    @overload
+    def __getitem__(self, idx: int) -> str: ...
+
+    @overload
+    def __getitem__(self, idx: slice) -> List[str]: ...
+
+    def __getitem__(self, idx: Union[int,slice]) -> Union[str,List[str]]:
+        if isinstance(idx, slice):
+            return [ self[i] for i in range(*idx.indices(len(self))) ]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(f"Line {idx} out of range for {len(self)} lines of {self.fname}")
+        assert self._data is not None
+        start, end = self._index[idx]
+        return self._data[int(start):int(end)].decode("utf-8")
+
+
+    def __iter__(self) -> Iterator[str]:
+        for idx in range(len(self)):
+            yield self[idx]
+
+
+    def close(self):
+        """Unmap and close the manifest
+        """
+        if self._data is not None:
+            self._data.close()
+            self._data = None
+        self._file.close()
@@ -0,0 +1,259 @@
+from dash_annotate_cv.image_reader import ImageReader
+from dash_annotate_cv.metrics import registry as metrics
+
+from collections import OrderedDict
+from multiprocessing import shared_memory
+from typing import Optional, List, Tuple, Union, Callable, Iterable, Iterator, Set
+from PIL import Image
+import numpy as np
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+ImageOrArray = Union[Image.Image,np.ndarray]
+
+
+def to_image(image: ImageOrArray) -> Image.Image:
+    """Image from an H x W or H x W x C array, or the image itself
+
+    Args:
+        image (ImageOrArray): Image or array
+
+    Returns:
+        Image.Image: Image
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if image.ndim == 3 and image.shape[2] == 1:
+        image = image[:,:,0]
+    return Image.fromarray(image)
+
+
+def default_image_names(no_images: int) -> List[str]:
+    """Names of images in an array without names: their index, zero-padded
+    """
+    return [ f"{idx:06d}" for idx in range(no_images) ]
+
+
+class LruImageCache:
+    """Recently loaded images by index
+    """
+
+
+    def __init__(self, capacity: int, name: str = "loaded_images"):
+        """Constructor
+
+        Args:
+            capacity (int): Number of images kept
+            name (str, optional): Cache name for metrics. Defaults to "loaded_images".
+        """
+        self.capacity = capacity
+        self.name = name
+        self._images: "OrderedDict[int,Image.Image]" = OrderedDict()
+
+
+    def get(self, idx: int) -> Optional[Image.Image]:
+        image = self._images.get(idx)
+        metrics.record_cache(self.name, image is not None)
+        if image is not None:
+            self._images.move_to_end(idx)
+        return image
+
+
+    def put(self, idx: int, image: Image.Image):
+        self._images[idx] = image
+        self._images.move_to_end(idx)
+        while len(self._images) > self.capacity:
+            self._images.popitem(last=False)
+
+
+class LoaderImageReader(ImageReader):
+    """Images loaded on demand by a function, rather than all decoded up front
+    """
+
+
+    def __init__(self, loader: Callable[[int],ImageOrArray], names: List[str], cache_size: int = 8):
+        """Constructor
+
+        Args:
+            loader (Callable[[int],ImageOrArray]): Function returning the image, or array, at an index
+            names (List[str]): Image names
+            cache_size (int, optional): Number of recently loaded images kept. Defaults to 8.
+        """
+        self.loader = loader
+        self.names = names
+        self._cache = LruImageCache(cache_size)
+        self._lock = threading.Lock()
+
+
+    @property
+    def no_images(self) -> int:
+        return len(self.names)
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return self.names[idx]
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        with self._lock:
+            image = self._cache.get(idx)
+            if image is None:
+                with metrics.timer("image_load_duration_seconds", {"source_type": "loader"}):
+                    image = to_image(self.loader(idx))
+                self._cache.put(idx, image)
+            return image
+
+
+class GeneratorImageReader(ImageReader):
+    """Images from a generator that can be restarted, e.g. over a database query or a decoded stream
+
+    The generator is run once to list the names, dropping the images. Images are then read by running it forwards, restarting it
+    to go back; recently read images are kept, so stepping back a few images does not restart it.
+    """
+
+
+    def __init__(self, factory: Callable[[],Iterable[Tuple[str,ImageOrArray]]], cache_size: int = 8):
+        """Constructor
+
+        Args:
+            factory (Callable[[],Iterable[Tuple[str,ImageOrArray]]]): Function returning a new iterable of image names and images, or arrays, in the same order each time
+            cache_size (int, optional): Number of recently read images kept. Defaults to 8.
+        """
+        self.factory = factory
+        self.names = [ name for name, _ in factory() ]
+        self._cache = LruImageCache(cache_size)
+        self._lock = threading.Lock()
+        self._iterator: Optional[Iterator[Tuple[str,ImageOrArray]]] = None
+        self._next_idx = 0
+
+
+    @property
+    def no_images(self) -> int:
+        return len(self.names)
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return self.names[idx]
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        with self._lock:
+            image = self._cache.get(idx)
+            if image is not None:
+                return image
+
+            if self._iterator is None or idx < self._next_idx:
+                logger.debug(f"Restarting the image generator to read image {idx}")
+                self._iterator = iter(self.factory())
+                self._next_idx = 0
+            with metrics.timer("image_load_duration_seconds", {"source_type": "loader"}):
+                while self._next_idx <= idx:
+                    name, image_next = next(self._iterator)
+                    assert name == self.names[self._next_idx], f"Image generator changed order: {name} at index {self._next_idx} was {self.names[self._next_idx]}"
+                    # Keep the images just before the requested one for stepping back
+                    if idx - self._next_idx < self._cache.capacity:
+                        self._cache.put(self._next_idx, to_image(image_next))
+                    self._next_idx += 1
+            image = self._cache.get(idx)
+            assert image is not None
+            return image
+
+
+class ArrayImageReader(ImageReader):
+    """Images of an N x H x W or N x H x W x C array. Each image is a view into the array, so the stack is never copied
+    """
+
+
+    def __init__(self, array: np.ndarray, names: Optional[List[str]] = None):
+        """Constructor
+
+        Args:
+            array (np.ndarray): Array of images, e.g. uint8
+            names (Optional[List[str]], optional): Image names. Defaults to None, i.e. the index, zero-padded.
+        """
+        assert array.ndim in (3, 4), f"array must be N x H x W or N x H x W x C, got shape {array.shape}"
+        self.array = array
+        self.names = names if names is not None else default_image_names(len(array))
+        assert len(self.names) == len(array), f"Got {len(self.names)} names for {len(array)} images"
+
+
+    @property
+    def no_images(self) -> int:
+        return len(self.array)
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return self.names[idx]
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        return to_image(self.array[idx])
+
+
+# Blocks created by this process, or by its parent before it was forked; these share the resource tracker of the creator
+_created_blocks: Set[str] = set()
+
+
+def create_shared_image_stack(shape: Tuple[int,...], dtype: str = "uint8", name: Optional[str] = None) -> Tuple[shared_memory.SharedMemory,np.ndarray]:
+    """Allocate an array of images in shared memory, for a `SHARED_MEMORY` image source in several worker processes
+
+    The creating process fills the array, and must `close()` and `unlink()` the block when all processes are done.
+
+    Args:
+        shape (Tuple[int,...]): N x H x W or N x H x W x C
+        dtype (str, optional): Data type. Defaults to "uint8".
+        name (Optional[str], optional): Name of the block. Defaults to None, i.e. a random name, see `.name` of the block.
+
+    Returns:
+        Tuple[shared_memory.SharedMemory,np.ndarray]: Block and the array backed by it
+    """
+    no_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+    block = shared_memory.SharedMemory(name=name, create=True, size=no_bytes)
+    _created_blocks.add(block.name)
+    return block, np.ndarray(shape, dtype=dtype, buffer=block.buf)
+
+
+def _attach_shared_memory(name: str) -> shared_memory.SharedMemory:
+    if name in _created_blocks:
+        return shared_memory.SharedMemory(name=name)
+    try:
+        return shared_memory.SharedMemory(name=name, track=False) # type: ignore
+    except TypeError:
+        # Before Python 3.13, attaching registers the block with the resource tracker of this process, which would unlink it when this process exits
+        from multiprocessing import resource_tracker
+        block = shared_memory.SharedMemory(name=name)
+        resource_tracker.unregister(block._name, "shared_memory") # type: ignore
+        return block
+
+
+class SharedMemoryImageReader(ArrayImageReader):
+    """Images of an array in a `multiprocessing.shared_memory` block, so that worker processes share one copy of the pixels
+    """
+
+
+    def __init__(self, name: str, shape: Tuple[int,...], dtype: str = "uint8", names: Optional[List[str]] = None):
+        """Constructor
+
+        Args:
+            name (str): Name of the block, e.g. from `create_shared_image_stack`
+            shape (Tuple[int,...]): N x H x W or N x H x W x C
+            dtype (str, optional): Data type. Defaults to "uint8".
+            names (Optional[List[str]], optional): Image names. Defaults to None, i.e. the index, zero-padded.
+        """
+        self._block = _attach_shared_memory(name)
+        no_bytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        assert self._block.size >= no_bytes, f"Shared memory block {name} has {self._block.size} bytes, need {no_bytes} for shape {shape}"
+        super().__init__(np.ndarray(shape, dtype=dtype, buffer=self._block.buf), names)
+
+
+    def close(self):
+        # The array must be released before the block can be closed
+        self.array = np.empty((0, 0, 0), dtype=self.array.dtype)
+        try:
+            self._block.close()
+        except BufferError:
+            logger.warning(f"Shared memory block {self._block.name} is still used by images; it is closed when they are released")
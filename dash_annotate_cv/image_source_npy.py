@@ -0,0 +1,155 @@
+from dash_annotate_cv.image_source_memory import ArrayImageReader, LruImageCache
+from dash_annotate_cv.metrics import registry as metrics
+
+from typing import Optional, List, Tuple
+from PIL import Image
+import numpy as np
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Pixels sampled per channel to find the percentiles of the automatic window
+WINDOW_SAMPLES = 1_000_000
+
+
+def stack_image_name(fname: str, idx: int) -> str:
+    """Stable image name of an image in a stack file
+
+    Args:
+        fname (str): Stack file
+        idx (int): Index in the stack
+
+    Returns:
+        str: Image name
+    """
+    return f"{fname}#{idx:06d}"
+
+
+def auto_window(channel: np.ndarray, percentiles: Tuple[float,float]) -> Tuple[float,float]:
+    """Display window of a channel from percentiles of its values, sampled with a stride for large images
+
+    Args:
+        channel (np.ndarray): H x W values
+        percentiles (Tuple[float,float]): Lower and upper percentile
+
+    Returns:
+        Tuple[float,float]: Values shown as black and white
+    """
+    values = channel.ravel()
+    stride = max(1, len(values) // WINDOW_SAMPLES)
+    low, high = np.percentile(values[::stride], percentiles)
+    return float(low), float(high)
+
+
+def window_to_uint8(channel: np.ndarray, window: Tuple[float,float], gamma: float = 1.0) -> np.ndarray:
+    """Map values of a channel to 8 bits for display: the window is stretched to 0-255, values outside are clipped
+
+    Args:
+        channel (np.ndarray): H x W values of any numeric type
+        window (Tuple[float,float]): Values shown as black and white
+        gamma (float, optional): Gamma applied after windowing; below 1 brightens dark values. Defaults to 1.0.
+
+    Returns:
+        np.ndarray: H x W uint8
+    """
+    low, high = window
+    scaled = (channel.astype(np.float32) - low) / max(high - low, 1e-12)
+    np.clip(scaled, 0.0, 1.0, out=scaled)
+    if gamma != 1.0:
+        np.power(scaled, gamma, out=scaled)
+    return (scaled * 255.0 + 0.5).astype(np.uint8)
+
+
+class NpyImageReader(ArrayImageReader):
+    """Images of a memory-mapped .npy stack, N x H x W or N x H x W x C, of any numeric type, e.g. 16-bit microscopy channels
+
+    Opening the file only reads its header; each image is a view into the mapped file. Pixel values are windowed to 8 bits for
+    display only, and the display renditions of recent images are cached. The stored values are never changed; use `array_at_idx` for them.
+    """
+
+
+    def __init__(
+        self,
+        fname: str,
+        names: Optional[List[str]] = None,
+        window: Optional[Tuple[float,float]] = None,
+        percentiles: Tuple[float,float] = (1.0, 99.0),
+        gamma: float = 1.0,
+        channels: Optional[List[int]] = None,
+        cache_size: int = 16
+        ):
+        """Constructor
+
+        Args:
+            fname (str): .npy file
+            names (Optional[List[str]], optional): Image names. Defaults to None, i.e. "<fname>#<index>".
+            window (Optional[Tuple[float,float]], optional): Values shown as black and white for all images. Defaults to None, i.e. from percentiles of each image.
+            percentiles (Tuple[float,float], optional): Percentiles of each channel of an image used as its window, if no window is given. Defaults to (1.0, 99.0).
+            gamma (float, optional): Gamma applied after windowing. Defaults to 1.0.
+            channels (Optional[List[int]], optional): One channel shown as grayscale or three shown as RGB. Defaults to None, i.e. all of one or three channels, else the first.
+            cache_size (int, optional): Number of display renditions kept. Defaults to 16.
+        """
+        array = np.load(fname, mmap_mode="r")
+        super().__init__(array, names if names is not None else [ stack_image_name(fname, idx) for idx in range(len(array)) ])
+        self.fname = fname
+        self.window = window
+        self.percentiles = percentiles
+        self.gamma = gamma
+        no_channels = array.shape[3] if array.ndim == 4 else 1
+        if channels is None:
+            channels = list(range(no_channels)) if no_channels in (1, 3) else [0]
+        assert len(channels) in (1, 3), "channels must be one channel for grayscale or three for RGB"
+        assert all(0 <= c < no_channels for c in channels), f"channels must be in [0, {no_channels})"
+        self.channels = channels
+        self._cache = LruImageCache(cache_size, name="npy_renditions")
+        self._lock = threading.Lock()
+        logger.debug(f"Mapped {fname}: {array.shape} {array.dtype}")
+
+
+    def array_at_idx(self, idx: int) -> np.ndarray:
+        """Stored values of the image at an index, as a read-only view into the file
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            np.ndarray: H x W or H x W x C values
+        """
+        return self.array[idx]
+
+
+    def render(self, array: np.ndarray) -> Image.Image:
+        """Display rendition of stored values
+
+        Args:
+            array (np.ndarray): H x W or H x W x C values
+
+        Returns:
+            Image.Image: 8-bit grayscale or RGB image
+        """
+        channels = []
+        for c in self.channels:
+            channel = array[:,:,c] if array.ndim == 3 else array
+            window = self.window or auto_window(channel, self.percentiles)
+            channels.append(window_to_uint8(channel, window, self.gamma))
+        if len(channels) == 1:
+            return Image.fromarray(channels[0])
+        return Image.fromarray(np.stack(channels, axis=-1))
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        with self._lock:
+            image = self._cache.get(idx)
+            if image is None:
+                with metrics.timer("image_decode_duration_seconds", {"source_type": "npy"}):
+                    image = self.render(self.array[idx])
+                self._cache.put(idx, image)
+            return image
+
+
+    def close(self):
+        # Unmap the file
+        self.array = np.empty((0, 0, 0), dtype=self.array.dtype)
@@ -0,0 +1,290 @@
+from dash_annotate_cv.image_reader import ImageReader
+from dash_annotate_cv.metrics import registry as metrics
+
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from typing import Optional, List, Dict, Iterable
+from urllib.parse import quote
+from PIL import Image
+import fnmatch
+import hashlib
+import os
+import tempfile
+import threading
+import xml.etree.ElementTree as ET
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _import_requests():
+    try:
+        import requests
+        return requests
+    except ImportError:
+        raise ImportError("Remote image sources require requests: pip install dash_annotate_cv[remote]")
+
+
+class DiskLRUCache:
+    """Files on disk up to a total size, evicting the least recently used
+
+    Recency survives restarts: hits touch the file's modification time, and the index is rebuilt from it.
+    """
+
+
+    def __init__(self, cache_dir: str, max_bytes: int):
+        """Constructor
+
+        Args:
+            cache_dir (str): Directory
+            max_bytes (int): Maximum total size of the files
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes: "OrderedDict[str,int]" = OrderedDict()
+        self._no_bytes = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+        entries = []
+        for name in os.listdir(cache_dir):
+            if name.endswith(".tmp"):
+                continue
+            stat = os.stat(os.path.join(cache_dir, name))
+            entries.append((stat.st_mtime_ns, name, stat.st_size))
+        for _, name, size in sorted(entries):
+            self._sizes[name] = size
+            self._no_bytes += size
+
+
+    @staticmethod
+    def _name(key: str) -> str:
+        return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+    def get(self, key: str) -> Optional[str]:
+        """Cached file for a key, if any
+
+        Args:
+            key (str): Key
+
+        Returns:
+            Optional[str]: File name
+        """
+        name = self._name(key)
+        with self._lock:
+            if name not in self._sizes:
+                return None
+            self._sizes.move_to_end(name)
+        fname = os.path.join(self.cache_dir, name)
+        try:
+            os.utime(fname)
+        except FileNotFoundError:
+            # Removed by another process sharing the directory
+            with self._lock:
+                self._no_bytes -= self._sizes.pop(name, 0)
+            return None
+        return fname
+
+
+    def put(self, key: str, data: bytes) -> str:
+        """Store data for a key, evicting old files if needed
+
+        Args:
+            key (str): Key
+            data (bytes): Data
+
+        Returns:
+            str: File name
+        """
+        name = self._name(key)
+        fname = os.path.join(self.cache_dir, name)
+        fname_tmp = f"{fname}.{threading.get_ident()}.tmp"
+        with open(fname_tmp, "wb") as f:
+            f.write(data)
+        os.replace(fname_tmp, fname)
+
+        to_remove = []
+        with self._lock:
+            self._no_bytes -= self._sizes.pop(name, 0)
+            self._sizes[name] = len(data)
+            self._no_bytes += len(data)
+            while self._no_bytes > self.max_bytes and len(self._sizes) > 1:
+                name_old, size_old = self._sizes.popitem(last=False)
+                self._no_bytes -= size_old
+                to_remove.append(name_old)
+        for name_old in to_remove:
+            try:
+                os.remove(os.path.join(self.cache_dir, name_old))
+            except FileNotFoundError:
+                pass
+        return fname
+
+
+    @property
+    def no_bytes(self) -> int:
+        return self._no_bytes
+
+
+class RemoteImageReader(ImageReader):
+    """Images stored as objects behind an HTTP base URL, e.g. a bucket of an S3-compatible object store
+
+    Objects are downloaded over a pooled keep-alive session into an on-disk LRU cache. Reading an image starts downloading the next few
+    in the background. Image sizes can be read from a range request for the header only.
+    """
+
+
+    def __init__(self,
+        url: str,
+        keys: Optional[List[str]] = None,
+        prefix: str = "",
+        pattern: str = "*",
+        headers: Optional[Dict[str,str]] = None,
+        cache_dir: Optional[str] = None,
+        cache_max_mb: float = 1024,
+        workers: int = 4,
+        timeout: float = 30
+        ):
+        """Constructor
+
+        Args:
+            url (str): Base URL; object keys are appended to it. For S3-compatible stores, the bucket URL, e.g. "https://s3.example.com/bucket"
+            keys (Optional[List[str]], optional): Object keys. Defaults to None, i.e. listed with the S3 ListObjectsV2 API.
+            prefix (str, optional): When listing, only keys starting with this prefix. Defaults to "".
+            pattern (str, optional): When listing, only keys matching this glob pattern. Defaults to "*".
+            headers (Optional[Dict[str,str]], optional): Headers sent with every request, e.g. for authorization. Defaults to None.
+            cache_dir (Optional[str], optional): Directory for downloaded images. Defaults to None, i.e. a "dacv_remote" folder in the system temporary directory.
+            cache_max_mb (float, optional): Maximum size of the cache. Defaults to 1024.
+            workers (int, optional): Number of concurrent downloads, and of pooled connections. Defaults to 4.
+            timeout (float, optional): Timeout of requests in seconds. Defaults to 30.
+        """
+        requests = _import_requests()
+        from requests.adapters import HTTPAdapter
+        from urllib3.util.retry import Retry
+
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.cache = DiskLRUCache(cache_dir or os.path.join(tempfile.gettempdir(), "dacv_remote"), int(cache_max_mb * 1024 * 1024))
+
+        self._session = requests.Session()
+        self._session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers, max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504]))
+        self._session.mount("http://", adapter)
+        self._session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="dacv_remote")
+        self._lock = threading.Lock()
+        self._pending: Dict[str,Future] = {}
+
+        self.keys = keys if keys is not None else self.list_keys(prefix, pattern)
+
+
+    @property
+    def no_images(self) -> int:
+        return len(self.keys)
+
+
+    def list_keys(self, prefix: str = "", pattern: str = "*") -> List[str]:
+        """List object keys with the S3 ListObjectsV2 API
+
+        Args:
+            prefix (str, optional): Only keys starting with this prefix. Defaults to "".
+            pattern (str, optional): Only keys matching this glob pattern. Defaults to "*".
+
+        Returns:
+            List[str]: Sorted keys
+        """
+        keys: List[str] = []
+        params = {"list-type": "2", "prefix": prefix}
+        while True:
+            response = self._session.get(self.url + "/", params=params, timeout=self.timeout)
+            response.raise_for_status()
+            root = ET.fromstring(response.content)
+            # Ignore the S3 XML namespace
+            for elem in root.iter():
+                elem.tag = elem.tag.split("}")[-1]
+            keys += [ elem.text for elem in root.iter("Key") if elem.text is not None ]
+            token = root.findtext("NextContinuationToken")
+            if root.findtext("IsTruncated") != "true" or not token:
+                break
+            params["continuation-token"] = token
+        keys = sorted([ key for key in keys if fnmatch.fnmatch(key, pattern) ])
+        logger.debug(f"Listed {len(keys)} keys at {self.url} with prefix '{prefix}'")
+        return keys
+
+
+    def _url(self, key: str) -> str:
+        return self.url + "/" + quote(key)
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return self.keys[idx]
+
+
+    def _download(self, key: str) -> str:
+        with metrics.timer("remote_image_download_duration_seconds"):
+            response = self._session.get(self._url(key), timeout=self.timeout)
+            response.raise_for_status()
+        metrics.inc("remote_image_bytes_downloaded_total", len(response.content))
+        return self.cache.put(key, response.content)
+
+
+    def _submit(self, key: str) -> Optional[Future]:
+        """Start downloading an object unless it is cached or pending
+
+        Returns:
+            Optional[Future]: Download, or None if cached
+        """
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            if self.cache.get(key) is not None:
+                return None
+            future = self._executor.submit(self._download, key)
+            self._pending[key] = future
+        future.add_done_callback(lambda _: self._pop_pending(key))
+        return future
+
+
+    def _pop_pending(self, key: str):
+        with self._lock:
+            self._pending.pop(key, None)
+
+
+    def fetch(self, idx: int) -> str:
+        """Local file with the image at an index, downloading it if needed
+
+        Args:
+            idx (int): Index
+
+        Returns:
+            str: File name in the cache
+        """
+        key = self.keys[idx]
+        fname = self.cache.get(key)
+        metrics.record_cache("remote_images", fname is not None)
+        if fname is not None:
+            return fname
+        future = self._submit(key)
+        if future is not None:
+            return future.result()
+        fname = self.cache.get(key)
+        return fname if fname is not None else self._download(key)
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        return Image.open(self.fetch(idx))
+
+
+    def source_at_idx(self, idx: int) -> str:
+        return self.fetch(idx)
+
+
+    def prefetch(self, idxs: Iterable[int]):
+        for idx in idxs:
+            self._submit(self.keys[idx])
+
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._session.close()
@@ -0,0 +1,223 @@
+from dash_annotate_cv.image_reader import ImageReader
+from dash_annotate_cv.metrics import registry as metrics
+
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Iterator, Any
+from PIL import Image
+import bisect
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+def _import_av():
+    try:
+        import av
+        return av
+    except ImportError:
+        raise ImportError("Video sources require PyAV: pip install dash_annotate_cv[video]")
+
+
+def frame_name(fname: str, frame_no: int) -> str:
+    """Stable image name of a video frame, independent of the stride it is shown with
+
+    Args:
+        fname (str): Video file
+        frame_no (int): Frame number in presentation order
+
+    Returns:
+        str: Image name
+    """
+    return f"{fname}#{frame_no:06d}"
+
+
+@dataclass
+class VideoIndex:
+    """Presentation timestamps of all frames of a video stream, and which frames are keyframes
+    """
+
+    # Timestamp of each frame, in presentation order
+    frame_pts: List[int]
+
+    # Frame numbers of keyframes, sorted
+    keyframes: List[int]
+
+
+    @property
+    def no_frames(self) -> int:
+        return len(self.frame_pts)
+
+
+    def keyframe_before(self, frame_no: int) -> int:
+        """Last keyframe at or before a frame, where decoding the frame must start
+
+        Args:
+            frame_no (int): Frame number
+
+        Returns:
+            int: Frame number of the keyframe
+        """
+        idx = bisect.bisect_right(self.keyframes, frame_no) - 1
+        return self.keyframes[idx] if idx >= 0 else 0
+
+
+def build_video_index(container: Any, stream: Any) -> VideoIndex:
+    """Index a video stream by demuxing its packets, without decoding them
+
+    Args:
+        container (Any): Open PyAV container
+        stream (Any): Video stream of the container
+
+    Returns:
+        VideoIndex: Index
+    """
+    packets = []
+    with metrics.timer("video_index_duration_seconds"):
+        for packet in container.demux(stream):
+            # Flush packets have no timestamp
+            if packet.pts is not None:
+                packets.append((packet.pts, packet.is_keyframe))
+    packets.sort()
+    keyframes = [ frame_no for frame_no, (_, is_keyframe) in enumerate(packets) if is_keyframe ]
+    return VideoIndex([ pts for pts, _ in packets ], keyframes or [0])
+
+
+class FrameBuffer:
+    """Decoded frames near the cursor. When full, the frame farthest from the cursor is dropped
+    """
+
+
+    def __init__(self, capacity: int):
+        """Constructor
+
+        Args:
+            capacity (int): Maximum number of frames
+        """
+        self.capacity = capacity
+        self.cursor = 0
+        self._frames: Dict[int,Image.Image] = {}
+
+
+    def __contains__(self, frame_no: int) -> bool:
+        return frame_no in self._frames
+
+
+    def __len__(self) -> int:
+        return len(self._frames)
+
+
+    def get(self, frame_no: int) -> Optional[Image.Image]:
+        return self._frames.get(frame_no)
+
+
+    def put(self, frame_no: int, image: Image.Image):
+        self._frames[frame_no] = image
+        while len(self._frames) > self.capacity:
+            del self._frames[max(self._frames.keys(), key=lambda f: abs(f - self.cursor))]
+
+
+    def wants(self, frame_no: int) -> bool:
+        """Whether a frame would be kept if it were decoded now
+        """
+        if frame_no in self._frames:
+            return False
+        if len(self._frames) < self.capacity:
+            return True
+        return abs(frame_no - self.cursor) < max(abs(f - self.cursor) for f in self._frames.keys())
+
+
+class VideoImageReader(ImageReader):
+    """Frames of a video file as images, every `stride`-th frame
+
+    Jumps seek to the last keyframe before the frame rather than decoding from the start. Frames decoded on the way, and a few after
+    the requested one, are kept in a buffer around the cursor, so that stepping forwards and backwards rarely decodes.
+    """
+
+
+    def __init__(self, fname: str, stride: int = 1, buffer_size: int = 32, read_ahead: Optional[int] = None):
+        """Constructor
+
+        Args:
+            fname (str): Video file
+            stride (int, optional): Show every this many frames. Defaults to 1.
+            buffer_size (int, optional): Number of decoded frames kept around the cursor. Defaults to 32.
+            read_ahead (Optional[int], optional): Number of shown frames decoded after the requested one. Defaults to None, i.e. a quarter of the buffer.
+        """
+        av = _import_av()
+        self.fname = fname
+        self.stride = stride
+        self.read_ahead = read_ahead if read_ahead is not None else max(buffer_size // 4, 0)
+        self.buffer = FrameBuffer(buffer_size)
+
+        self._container = av.open(fname)
+        self._stream = self._container.streams.video[0]
+        self.index = build_video_index(self._container, self._stream)
+        self._pts_to_frame = { pts: frame_no for frame_no, pts in enumerate(self.index.frame_pts) }
+        logger.debug(f"Indexed {self.index.no_frames} frames and {len(self.index.keyframes)} keyframes of {fname}")
+
+        self._lock = threading.Lock()
+        self._frames: Optional[Iterator[Any]] = None
+        self._decoded_to: Optional[int] = None
+
+
+    @property
+    def no_images(self) -> int:
+        return (self.index.no_frames + self.stride - 1) // self.stride
+
+
+    def name_at_idx(self, idx: int) -> str:
+        return frame_name(self.fname, idx * self.stride)
+
+
+    def _seek(self, frame_no: int):
+        keyframe = self.index.keyframe_before(frame_no)
+        self._container.seek(self.index.frame_pts[keyframe], stream=self._stream, backward=True, any_frame=False)
+        self._frames = iter(self._container.decode(self._stream))
+        self._decoded_to = None
+        metrics.inc("video_seeks_total")
+
+
+    def _decode_to(self, frame_no: int):
+        """Decode up to a frame and the read-ahead after it, buffering the shown frames that are near the cursor
+        """
+        # Continue decoding rather than seeking if the decoder is already between the keyframe and the frame
+        keyframe = self.index.keyframe_before(frame_no)
+        if self._frames is None or self._decoded_to is None or not (keyframe - 1 <= self._decoded_to < frame_no):
+            self._seek(frame_no)
+
+        last = min(frame_no + self.read_ahead * self.stride, self.index.no_frames - 1)
+        assert self._frames is not None
+        for frame in self._frames:
+            decoded = self._pts_to_frame.get(frame.pts)
+            if decoded is None:
+                continue
+            self._decoded_to = decoded
+            if decoded % self.stride == 0 and self.buffer.wants(decoded):
+                with metrics.timer("image_decode_duration_seconds", {"source_type": "video"}):
+                    self.buffer.put(decoded, frame.to_image())
+            if decoded >= last:
+                return
+        # End of the stream
+        self._frames = None
+
+
+    def image_at_idx(self, idx: int) -> Image.Image:
+        frame_no = idx * self.stride
+        with self._lock:
+            self.buffer.cursor = frame_no
+            image = self.buffer.get(frame_no)
+            metrics.record_cache("video_frames", image is not None)
+            if image is None:
+                self._decode_to(frame_no)
+                image = self.buffer.get(frame_no)
+                if image is None:
+                    raise ValueError(f"Frame {frame_no} of {self.fname} could not be decoded")
+        return image
+
+
+    def close(self):
+        with self._lock:
+            self._frames = None
+            self._container.close()
@@ -0,0 +1,394 @@
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.annotation_storage import AnnotationStorage, AnnotationWriter, StorageType, iter_image_anns, detect_storage_type
+from dash_annotate_cv.convert import ConvertProgress, PROGRESS_EVERY, convert_annotations
+from dash_annotate_cv.merge import MergeOptions
+from dash_annotate_cv.validation import ValidationIssue, validate_entries
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from mashumaro import DataClassDictMixin
+from typing import Optional, List, Dict, Callable, Any, Collection
+from enum import Enum
+import copy
+import datetime
+import threading
+import time
+import uuid
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Maximum number of validation issues kept in a job's details
+MAX_DETAILS = 100
+
+
+class JobStatus(Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+
+class JobCancelledError(Exception):
+    """Raised inside a job when it was cancelled
+    """
+    pass
+
+
+@dataclass
+class JobState(DataClassDictMixin):
+    """State of a background job
+    """
+
+    # Job ID
+    job_id: str
+
+    # Description
+    name: str
+
+    # Status
+    status: JobStatus = JobStatus.PENDING
+
+    # Current stage, as reported by the job
+    stage: Optional[str] = None
+
+    # Items done in the current stage
+    done: int = 0
+
+    # Total items in the current stage, if known
+    total: Optional[int] = None
+
+    # Summary of the result, or the error if the job failed
+    message: Optional[str] = None
+
+    # Details of the result, e.g. validation issues
+    details: List[str] = field(default_factory=list)
+
+    # Timestamps
+    submitted: float = 0.0
+    started: Optional[float] = None
+    finished: Optional[float] = None
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in (JobStatus.PENDING, JobStatus.RUNNING)
+
+    @property
+    def fraction_done(self) -> Optional[float]:
+        if self.status == JobStatus.SUCCEEDED:
+            return 1.0
+        if self.total is None or self.total == 0:
+            return None
+        return min(self.done / self.total, 1.0)
+
+
+class JobContext:
+    """Handle passed to a running job to report progress and check for cancellation
+    """
+
+
+    def __init__(self, runner: "JobRunner", job_id: str):
+        self._runner = runner
+        self.job_id = job_id
+
+
+    def report(self, stage: str, done: int, total: Optional[int] = None):
+        """Report progress; raises `JobCancelledError` if the job was cancelled
+
+        Args:
+            stage (str): Stage
+            done (int): Items done in this stage
+            total (Optional[int], optional): Total items in this stage, if known. Defaults to None.
+        """
+        self._runner._update(self.job_id, stage=stage, done=done, total=total)
+        if self._runner._is_cancel_requested(self.job_id):
+            raise JobCancelledError
+
+
+    def progress(self, progress: ConvertProgress):
+        """Progress callback for `convert_annotations` and `merge_annotations`
+        """
+        self.report(progress.stage, progress.done, progress.total)
+
+
+    def add_details(self, details: List[str]):
+        self._runner._update(self.job_id, details=details[:MAX_DETAILS])
+
+
+JobFunction = Callable[[JobContext], Optional[str]]
+
+
+class JobRunner:
+    """Runs long operations such as exports, imports and validation in background threads
+
+    Jobs are functions taking a `JobContext` and returning a summary message. Their state can be polled with `get` and `jobs`,
+    e.g. from a `dcc.Interval` callback. Jobs can use process pools themselves, like `convert_annotations` with several workers.
+    """
+
+
+    def __init__(self, max_workers: int = 1, max_finished: int = 50):
+        """Constructor
+
+        Args:
+            max_workers (int, optional): Number of jobs run at the same time. Defaults to 1.
+            max_finished (int, optional): Number of finished jobs whose state is kept. Defaults to 50.
+        """
+        self.max_finished = max_finished
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dacv_job")
+        self._lock = threading.Lock()
+        self._jobs: Dict[str,JobState] = {}
+        self._cancel_requested: set = set()
+
+
+    def submit(self, name: str, fn: JobFunction) -> str:
+        """Start a job
+
+        Args:
+            name (str): Description
+            fn (JobFunction): Job
+
+        Returns:
+            str: Job ID
+        """
+        job_id = str(uuid.uuid4())
+        with self._lock:
+            self._jobs[job_id] = JobState(job_id=job_id, name=name, submitted=datetime.datetime.now().timestamp())
+            self._prune()
+        self._executor.submit(self._run, job_id, fn)
+        logger.info(f"Submitted job {name} ({job_id})")
+        return job_id
+
+
+    def get(self, job_id: str) -> Optional[JobState]:
+        """State of a job
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            Optional[JobState]: Copy of the state, or None if unknown
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return copy.deepcopy(job) if job is not None else None
+
+
+    def jobs(self) -> List[JobState]:
+        """States of all known jobs, newest first
+        """
+        with self._lock:
+            return [ copy.deepcopy(job) for job in sorted(self._jobs.values(), key=lambda job: job.submitted, reverse=True) ]
+
+
+    def cancel(self, job_id: str) -> bool:
+        """Request cancellation of a job. Pending jobs do not start; running jobs stop at their next progress report
+
+        Args:
+            job_id (str): Job ID
+
+        Returns:
+            bool: False if the job is unknown or already finished
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or not job.is_active:
+                return False
+            self._cancel_requested.add(job_id)
+            return True
+
+
+    def wait(self, job_id: str, timeout: Optional[float] = None, poll_interval: float = 0.1) -> JobState:
+        """Block until a job has finished
+
+        Args:
+            job_id (str): Job ID
+            timeout (Optional[float], optional): Maximum time to wait in seconds. Defaults to None, i.e. no limit.
+            poll_interval (float, optional): Time between checks in seconds. Defaults to 0.1.
+
+        Returns:
+            JobState: Final state
+
+        Raises:
+            TimeoutError: If the job did not finish in time
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None:
+                raise KeyError(f"Unknown job {job_id}")
+            if not job.is_active:
+                return job
+            if deadline is not None and time.monotonic() > deadline:
+                raise TimeoutError(f"Job {job_id} did not finish within {timeout} seconds")
+            time.sleep(poll_interval)
+
+
+    def shutdown(self, wait: bool = True):
+        """Stop accepting jobs and cancel pending ones
+        """
+        self._executor.shutdown(wait=wait, cancel_futures=True)
+
+
+    def _run(self, job_id: str, fn: JobFunction):
+        if self._is_cancel_requested(job_id):
+            status, message = JobStatus.CANCELLED, None
+        else:
+            self._update(job_id, status=JobStatus.RUNNING, started=datetime.datetime.now().timestamp())
+            try:
+                status, message = JobStatus.SUCCEEDED, fn(JobContext(self, job_id))
+            except JobCancelledError:
+                logger.info(f"Job {job_id} was cancelled")
+                status, message = JobStatus.CANCELLED, None
+            except Exception as e:
+                logger.exception(f"Job {job_id} failed")
+                status, message = JobStatus.FAILED, f"{type(e).__name__}: {e}"
+        self._update(job_id, status=status, message=message, finished=datetime.datetime.now().timestamp())
+        with self._lock:
+            self._cancel_requested.discard(job_id)
+
+
+    def _update(self, job_id: str, **changes: Any):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            for key, value in changes.items():
+                setattr(job, key, value)
+
+
+    def _is_cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            return job_id in self._cancel_requested
+
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond `max_finished`; the lock must be held
+        """
+        finished = sorted([ job for job in self._jobs.values() if not job.is_active ], key=lambda job: job.submitted)
+        for job in finished[:max(0, len(finished) - self.max_finished)]:
+            del self._jobs[job.job_id]
+
+
+def export_job(annotations: ImageAnnotations, output_storage: AnnotationStorage, supercategories: Optional[Dict[str,str]] = None) -> JobFunction:
+    """Job writing annotations to storage, e.g. a COCO file
+
+    The annotations are copied when the job is created, so they can keep changing while it runs.
+
+    Args:
+        annotations (ImageAnnotations): Annotations
+        output_storage (AnnotationStorage): Where to write
+        supercategories (Optional[Dict[str,str]], optional): Class name to COCO supercategory. Defaults to None.
+
+    Returns:
+        JobFunction: Job
+    """
+    entries = copy.deepcopy(list(annotations.image_to_entry.values()))
+
+    def run(context: JobContext) -> str:
+        def iter_entries():
+            for idx, entry in enumerate(entries):
+                if idx % PROGRESS_EVERY == 0:
+                    context.report("export", idx, len(entries))
+                yield entry
+        no_images = AnnotationWriter(output_storage, supercategories).write_stream(iter_entries())
+        context.report("export", no_images, len(entries))
+        return f"Exported {no_images} images"
+
+    return run
+
+
+def convert_job(input_file: str, output_storage: AnnotationStorage, input_type: Optional[StorageType] = None, workers: int = 1, max_memory_mb: Optional[float] = None) -> JobFunction:
+    """Job converting an annotation file, see `convert_annotations`
+
+    Returns:
+        JobFunction: Job
+    """
+    def run(context: JobContext) -> str:
+        result = convert_annotations(
+            input_file=input_file,
+            output_storage=output_storage,
+            input_type=input_type,
+            workers=workers,
+            max_memory_mb=max_memory_mb,
+            progress=context.progress
+            )
+        return f"Converted {result.no_images} images with {result.no_bboxs} bboxs"
+
+    return run
+
+
+def import_job(controller: Any, input_file: str, options: Optional[MergeOptions] = None) -> JobFunction:
+    """Job importing an annotation file into a controller, merging images annotated in both with `merge_image_entries`
+
+    The file is read in the background; the entries are applied to the controller in one step at the end, merged against the annotations at that time.
+
+    Args:
+        controller (AnnotateImageController): Controller to import into
+        input_file (str): Annotation file
+        options (Optional[MergeOptions], optional): How to merge images annotated in both. Defaults to None, i.e. MergeOptions().
+
+    Returns:
+        JobFunction: Job
+    """
+    def run(context: JobContext) -> str:
+        storage_type = detect_storage_type(input_file)
+        entries: List[ImageAnnotations.Annotation] = []
+        for idx, entry in enumerate(iter_image_anns(storage_type, input_file)):
+            if idx % PROGRESS_EVERY == 0:
+                context.report("import", idx)
+            entries.append(entry)
+        context.report("apply", 0, len(entries))
+        no_conflicts = controller.import_entries(entries, options)
+        context.report("apply", len(entries), len(entries))
+        return f"Imported {len(entries)} images, resolved {no_conflicts} conflicts"
+
+    return run
+
+
+def validate_job(
+    annotations: Optional[ImageAnnotations] = None,
+    input_file: Optional[str] = None,
+    labels: Optional[Collection[str]] = None,
+    duplicate_iou_threshold: Optional[float] = None
+    ) -> JobFunction:
+    """Job checking annotations with `validate_entries`, either in memory (copied when the job is created) or streamed from a file
+
+    Args:
+        annotations (Optional[ImageAnnotations], optional): Annotations. Defaults to None.
+        input_file (Optional[str], optional): Annotation file, if no annotations are given. Defaults to None.
+        labels (Optional[Collection[str]], optional): Allowed labels. Defaults to None, i.e. any label is allowed.
+        duplicate_iou_threshold (Optional[float], optional): IoU at or above which two bboxs are duplicates. Defaults to None, i.e. no check.
+
+    Returns:
+        JobFunction: Job; the issues are in the job's details
+    """
+    assert (annotations is None) != (input_file is None), "Exactly one of annotations and input_file must be set"
+    entries = copy.deepcopy(list(annotations.image_to_entry.values())) if annotations is not None else None
+
+    def run(context: JobContext) -> str:
+        if entries is not None:
+            source, total = entries, len(entries)
+        else:
+            assert input_file is not None
+            source, total = iter_image_anns(detect_storage_type(input_file), input_file), None
+        no_checked = 0
+        def on_entry(no: int):
+            nonlocal no_checked
+            no_checked = no
+            if no % PROGRESS_EVERY == 0:
+                context.report("validate", no, total)
+        issues: List[ValidationIssue] = validate_entries(source, labels, duplicate_iou_threshold, on_entry=on_entry)
+        context.report("validate", no_checked, total)
+        context.add_details([ _format_issue(issue) for issue in issues ])
+        no_images = len(set([ issue.image_name for issue in issues ]))
+        return f"Checked {no_checked} images: {len(issues)} issues in {no_images} images"
+
+    return run
+
+
+def _format_issue(issue: ValidationIssue) -> str:
+    bbox = f" (bbox {issue.bbox_idx})" if issue.bbox_idx is not None else ""
+    return f"{issue.image_name}{bbox}: {issue.message}"
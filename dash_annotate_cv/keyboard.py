@@ -0,0 +1,182 @@
+from typing import List, Dict
+
+
+# Number keys in the order they are assigned to labels
+LABEL_KEYS = ["1", "2", "3", "4", "5", "6", "7", "8", "9", "0"]
+
+
+def label_keys(labels: List[str]) -> Dict[str,str]:
+    """Number keys for the first ten labels
+
+    Args:
+        labels (List[str]): Labels
+
+    Returns:
+        Dict[str,str]: Key to label
+    """
+    return { key: label for key, label in zip(LABEL_KEYS, labels) }
+
+
+def keyboard_legend(labels: List[str], multiple: bool) -> str:
+    """Description of the keyboard shortcuts
+
+    Args:
+        labels (List[str]): Labels
+        multiple (bool): Whether multiple labels can be selected per image
+
+    Returns:
+        str: Legend
+    """
+    keys = ", ".join([ f"{key}: {label}" for key, label in label_keys(labels).items() ])
+    if multiple:
+        return f"{keys}. Number keys toggle labels, → saves them and moves on, ← goes back, Enter sends decisions to the server now."
+    else:
+        return f"{keys}. Number keys label and move on, → skips, ← goes back, Enter sends decisions to the server now."
+
+
+# Clientside callback for `AnnotateImageLabelsAIO` when `keyboard_shortcuts` is set.
+#
+# Runs whenever the server sends a window of preloaded images. Keeps the position and the label decisions
+# not yet sent in the browser; a keydown listener labels and navigates without server round trips. Decisions
+# are sent by writing to the flush store once `batch_size` are pending, when half the window has been
+# used, when going back past its start, after the last image, when the page is hidden, or on Enter. The server stores them with a single write and replies
+# with a new window starting at the position of the flush; replies to older flushes are ignored.
+KEYBOARD_JS = """
+function(win) {
+    const dc = window.dash_clientside;
+    if (!win) {
+        return dc.no_update;
+    }
+    const ns = window.dash_annotate_cv_keyboard = window.dash_annotate_cv_keyboard || {};
+    let s = ns[win.aio_id];
+    if (s === undefined) {
+        s = ns[win.aio_id] = {win: null, idx: 0, pending: [], decided: {}, selected: [], selected_for: null, sent: 0};
+        const id = (subcomponent) => ({component: "AnnotateImageLabelsAIO", subcomponent: subcomponent, aio_id: win.aio_id});
+
+        s.item = function() {
+            const pos = s.idx - s.win.start;
+            return (pos >= 0 && pos < s.win.items.length) ? s.win.items[pos] : null;
+        };
+        s.label = function(item) {
+            return (item.name in s.decided) ? s.decided[item.name] : item.label;
+        };
+        s.sync = function() {
+            // Selection of multiple labels starts from the stored label when arriving at an image
+            const item = s.item();
+            if (item !== null && item.name !== s.selected_for) {
+                const label = s.label(item);
+                s.selected = Array.isArray(label) ? label.slice() : [];
+                s.selected_for = item.name;
+            }
+        };
+        s.render = function() {
+            const item = s.item();
+            let caption = "Loading...";
+            if (s.idx >= s.win.no_images) {
+                caption = "Finished all images";
+                dc.set_props(id("kb_image"), {src: ""});
+            } else if (item !== null) {
+                const label = s.label(item);
+                if (s.win.multiple) {
+                    caption = `${item.name}: ${s.selected.length > 0 ? s.selected.join(", ") : "no labels selected"}`;
+                } else {
+                    caption = `${item.name}: ${label !== null ? label : "not labeled"}`;
+                }
+                dc.set_props(id("kb_image"), {src: item.src});
+            }
+            dc.set_props(id("kb_caption"), {children: caption});
+            const title = `Image ${Math.min(s.idx, s.win.no_images - 1) + 1}/${s.win.no_images}`;
+            dc.set_props(id("title"), {children: {type: "H2", namespace: "dash_html_components", props: {children: title}}});
+        };
+        s.flush = function() {
+            s.sent += 1;
+            dc.set_props(id("kb_flush"), {data: {seq: s.sent, idx: s.idx, labels: s.pending}});
+            s.pending = [];
+        };
+        s.record = function(item, value) {
+            s.decided[item.name] = value;
+            s.pending = s.pending.filter((p) => p[0] !== item.name);
+            s.pending.push([item.name, value]);
+        };
+        s.move = function(delta) {
+            const idx = Math.min(Math.max(s.idx + delta, 0), s.win.no_images);
+            if (idx === s.idx) {
+                return;
+            }
+            s.idx = idx;
+            s.sync();
+            const inflight = s.sent > s.win.seq;
+            if (s.pending.length >= s.win.batch_size || s.idx < s.win.start || s.idx >= s.win.no_images || (!inflight && s.idx - s.win.start >= s.win.batch_size)) {
+                s.flush();
+            }
+        };
+        s.onkey = function(e) {
+            if (e.ctrlKey || e.metaKey || e.altKey) {
+                return;
+            }
+            const tag = e.target && e.target.tagName;
+            if (tag === "INPUT" || tag === "TEXTAREA" || tag === "SELECT") {
+                return;
+            }
+            const item = s.item();
+            if (e.key in s.win.keys) {
+                if (item === null) {
+                    return;
+                }
+                const value = s.win.keys[e.key];
+                if (s.win.multiple) {
+                    const i = s.selected.indexOf(value);
+                    if (i >= 0) {
+                        s.selected.splice(i, 1);
+                    } else {
+                        s.selected.push(value);
+                    }
+                } else {
+                    s.record(item, value);
+                    s.move(1);
+                }
+            } else if (e.key === "ArrowRight") {
+                if (item !== null && s.win.multiple && s.selected.length > 0) {
+                    const label = s.label(item);
+                    if (!Array.isArray(label) || label.join("\\n") !== s.selected.join("\\n")) {
+                        s.record(item, s.selected.slice());
+                    }
+                }
+                s.move(1);
+            } else if (e.key === "ArrowLeft") {
+                s.move(-1);
+            } else if (e.key === "Enter") {
+                if (s.pending.length > 0) {
+                    s.flush();
+                }
+            } else {
+                return;
+            }
+            e.preventDefault();
+            s.render();
+        };
+        document.addEventListener("keydown", (e) => s.onkey(e));
+        document.addEventListener("visibilitychange", () => {
+            if (document.visibilityState === "hidden" && s.pending.length > 0) {
+                s.flush();
+            }
+        });
+    }
+
+    if (win.reset) {
+        // New layout: start from the server position
+        s.idx = win.start;
+        s.pending = [];
+        s.decided = {};
+        s.selected_for = null;
+        s.sent = win.seq;
+    } else if (win.seq < s.sent) {
+        // A newer flush is in flight
+        return dc.no_update;
+    }
+    s.win = win;
+    s.sync();
+    s.render();
+    return dc.no_update;
+}
+"""
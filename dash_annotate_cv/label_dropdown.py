@@ -0,0 +1,78 @@
+from dash_annotate_cv.label_source import LabelSet
+from dash_annotate_cv.metrics import registry as metrics
+
+from dash import Output, Input, State, dcc, callback, no_update
+from typing import Optional, List, Dict, Union, Any
+
+
+# Taxonomies up to this size are sent to the browser with every dropdown; larger ones are searched on the server
+FULL_OPTIONS_MAX = 200
+
+# Maximum number of labels returned by a search
+SEARCH_LIMIT = 50
+
+
+LabelValue = Optional[Union[str,List[str]]]
+
+
+def _values(value: LabelValue) -> List[str]:
+    if value is None:
+        return []
+    return [value] if isinstance(value, str) else list(value)
+
+
+def label_options(label_set: LabelSet, value: LabelValue = None, search_value: Optional[str] = None) -> List[str]:
+    """Options of a label dropdown: all labels for small taxonomies, otherwise the selected labels and the search results
+
+    Args:
+        label_set (LabelSet): Labels
+        value (LabelValue, optional): Selected label or labels, which must stay among the options. Defaults to None.
+        search_value (Optional[str], optional): Text typed into the dropdown. Defaults to None, i.e. no search yet.
+
+    Returns:
+        List[str]: Options
+    """
+    if len(label_set) <= FULL_OPTIONS_MAX:
+        return label_set.labels
+    selected = _values(value)
+    found = label_set.search(search_value, SEARCH_LIMIT) if search_value else []
+    return selected + [ label for label in found if label not in selected ]
+
+
+def label_dropdown(label_set: LabelSet, id: Dict[str,Any], value: LabelValue = None, **kwargs) -> dcc.Dropdown:
+    """Dropdown for choosing labels. For large taxonomies, only the selected labels are sent with the layout;
+    the rest are found as the user types by the callback defined with `define_label_search_callback`
+
+    Args:
+        label_set (LabelSet): Labels
+        id (Dict[str,Any]): Component id
+        value (LabelValue, optional): Selected label or labels. Defaults to None.
+        **kwargs: Further arguments of `dcc.Dropdown`
+
+    Returns:
+        dcc.Dropdown: Dropdown
+    """
+    if len(label_set) > FULL_OPTIONS_MAX and "placeholder" not in kwargs:
+        kwargs["placeholder"] = "Type to search labels"
+    return dcc.Dropdown(label_options(label_set, value), value=value, id=id, **kwargs)
+
+
+def define_label_search_callback(id: Dict[str,Any], label_set: LabelSet, name: str):
+    """Define the callback filling the options of label dropdowns from the text typed into them
+
+    Args:
+        id (Dict[str,Any]): Pattern-matching id of the dropdowns
+        label_set (LabelSet): Labels
+        name (str): Callback name for metrics
+    """
+    @callback(
+        Output(id, "options"),
+        Input(id, "search_value"),
+        State(id, "value"),
+        prevent_initial_call=True
+        )
+    @metrics.instrument_callback(name)
+    def search_labels(search_value, value):
+        if len(label_set) <= FULL_OPTIONS_MAX:
+            return no_update
+        return label_options(label_set, value, search_value)
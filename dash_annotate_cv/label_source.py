@@ -1,9 +1,122 @@
+from dash_annotate_cv.taxonomy import Taxonomy
+
 from dataclasses import dataclass
 from enum import Enum
-from typing import Optional, List
+from typing import Optional, List, Dict, Iterator
 from mashumaro import DataClassDictMixin
 
 
+# Prefixes longer than this are not indexed: longer queries filter the labels found for their first characters
+_MAX_PREFIX = 12
+
+
+def _word_starts(label: str) -> List[int]:
+    """Start of the label and of each word in it
+    """
+    return [0] + [ i for i in range(1, len(label)) if label[i].isalnum() and not label[i-1].isalnum() ]
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: Dict[str,"_TrieNode"] = {}
+        # Indexes of the labels with this prefix, in taxonomy order
+        self.ids: List[int] = []
+
+
+class LabelSet:
+    """Allowed labels, indexed for constant time membership checks and prefix search in large taxonomies
+
+    Search ignores case and matches the start of the label or of any word in it, e.g. "run" matches "Trail running shoes".
+    """
+
+
+    def __init__(self, labels: List[str]):
+        """Constructor
+
+        Args:
+            labels (List[str]): Labels, in the order they are shown
+        """
+        self.labels = list(labels)
+        self._idxs: Dict[str,int] = {}
+        self._lower = [ label.lower() for label in self.labels ]
+        self._root = _TrieNode()
+        for idx, label in enumerate(self.labels):
+            self._idxs.setdefault(label, idx)
+            lower = self._lower[idx]
+            for start in _word_starts(lower):
+                node = self._root
+                for c in lower[start:start+_MAX_PREFIX]:
+                    node = node.children.setdefault(c, _TrieNode())
+                    # Words of a label are inserted one after another, so a repeated index is the last one
+                    if len(node.ids) == 0 or node.ids[-1] != idx:
+                        node.ids.append(idx)
+
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._idxs
+
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.labels)
+
+
+    def __str__(self) -> str:
+        if len(self.labels) <= 10:
+            return str(self.labels)
+        return "[%s, ... %d more]" % (", ".join([ repr(label) for label in self.labels[:10] ]), len(self.labels) - 10)
+
+
+    def index(self, label: str) -> int:
+        """Position of a label in the taxonomy
+
+        Args:
+            label (str): Label
+
+        Returns:
+            int: Index
+        """
+        return self._idxs[label]
+
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[str]:
+        """Labels matching a query, in taxonomy order
+
+        Args:
+            query (str): Start of the label or of a word in it
+            limit (Optional[int], optional): Maximum number of labels returned. Defaults to None, i.e. all.
+
+        Returns:
+            List[str]: Matching labels
+        """
+        query = query.strip().lower()
+        if query == "":
+            return self.labels[:limit]
+
+        node = self._root
+        for c in query[:_MAX_PREFIX]:
+            child = node.children.get(c)
+            if child is None:
+                return []
+            node = child
+
+        if len(query) <= _MAX_PREFIX:
+            return [ self.labels[idx] for idx in node.ids[:limit] ]
+        found = []
+        for idx in node.ids:
+            lower = self._lower[idx]
+            if any(lower.startswith(query, start) for start in _word_starts(lower)):
+                found.append(self.labels[idx])
+                if limit is not None and len(found) >= limit:
+                    break
+        return found
+
+
 @dataclass
 class LabelSource(DataClassDictMixin):
     """Specification for where to get labels from
@@ -13,6 +126,7 @@ class LabelSource(DataClassDictMixin):
         DEFAULT = "default"
         JSON_FILE = "json_file"
         TXT_FILE = "txt_file"
+        TAXONOMY_FILE = "taxonomy_file"
 
     # Source type
     source_type: Type = Type.DEFAULT
@@ -26,6 +140,12 @@ class LabelSource(DataClassDictMixin):
     # TXT file source
     txt_file: Optional[str] = None
 
+    # Taxonomy file source: JSON tree of nodes {"name": ..., "children": [...]}; every node is a label
+    taxonomy_file: Optional[str] = None
+
+    # Taxonomy file source: only allow this label and its descendants. None allows the whole tree
+    taxonomy_root: Optional[str] = None
+
     def __post_init__(self):
         if self.source_type == LabelSource.Type.DEFAULT:
             assert self.labels is not None, "labels must be set if source_type is DEFAULT"
@@ -33,6 +153,8 @@ class LabelSource(DataClassDictMixin):
             assert self.json_file is not None, "json_file must be set if source_type is JSON_FILE"
         elif self.source_type == LabelSource.Type.TXT_FILE:
             assert self.txt_file is not None, "txt_file must be set if source_type is TXT_FILE"
+        elif self.source_type == LabelSource.Type.TAXONOMY_FILE:
+            assert self.taxonomy_file is not None, "taxonomy_file must be set if source_type is TAXONOMY_FILE"
         else:
             raise NotImplementedError
 
@@ -60,5 +182,31 @@ class LabelSource(DataClassDictMixin):
                 assert type(data) == list, "TXT file must contain a list of strings"
                 assert all([type(item) == str for item in data]), "TXT file must contain a list of strings"
                 return data
+        elif self.source_type == LabelSource.Type.TAXONOMY_FILE:
+            taxonomy = self.get_taxonomy()
+            assert taxonomy is not None
+            if self.taxonomy_root is not None:
+                assert self.taxonomy_root in taxonomy, f"taxonomy_root {self.taxonomy_root} not in taxonomy"
+                return taxonomy.descendants(self.taxonomy_root)
+            return taxonomy.labels
         else:
-            raise NotImplementedError
\ No newline at end of file
+            raise NotImplementedError
+
+    def get_taxonomy(self) -> Optional[Taxonomy]:
+        """Get the label tree, if labels come from a taxonomy
+
+        Returns:
+            Optional[Taxonomy]: Taxonomy, or None for flat label lists
+        """
+        if self.source_type == LabelSource.Type.TAXONOMY_FILE:
+            assert self.taxonomy_file is not None, "taxonomy_file must be set if source_type is TAXONOMY_FILE"
+            return Taxonomy.from_file(self.taxonomy_file)
+        return None
+
+    def get_label_set(self) -> LabelSet:
+        """Get the possible labels, indexed for lookup and search
+
+        Returns:
+            LabelSet: Possible labels
+        """
+        return LabelSet(self.get_labels())
@@ -0,0 +1,399 @@
+from dash_annotate_cv.helpers import Xyxy
+from dash_annotate_cv.metrics import registry as metrics
+
+from collections import OrderedDict
+from typing import Optional, List, Tuple, Dict, Any, Iterator
+from PIL import Image
+import numpy as np
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# File extensions that are checked for the large image path
+LARGE_IMAGE_EXTENSIONS = (".tif", ".tiff", ".svs", ".ndpi", ".scn", ".btf")
+
+# Tile size of pyramids built on disk
+PYRAMID_TILE_SIZE = 256
+
+
+def _import_tifffile():
+    try:
+        import tifffile
+    except ImportError:
+        raise ImportError("Large images require tifffile: pip install tifffile")
+    return tifffile
+
+
+def large_image_shape(fname: str) -> Optional[Tuple[int,int]]:
+    """Width and height of a TIFF from its header, without reading pixel data
+
+    Args:
+        fname (str): File name
+
+    Returns:
+        Optional[Tuple[int,int]]: Width and height, or None if not a readable TIFF
+    """
+    if not fname.lower().endswith(LARGE_IMAGE_EXTENSIONS):
+        return None
+    tifffile = _import_tifffile()
+    try:
+        with tifffile.TiffFile(fname) as tf:
+            page = tf.series[0].keyframe
+            return int(page.imagewidth), int(page.imagelength)
+    except Exception as e:
+        logger.debug(f"Not reading {fname} as large image: {e}")
+        return None
+
+
+def is_large_image(fname: str, min_pixels: int) -> bool:
+    """Whether a file should be opened as a `LargeImage`
+
+    Args:
+        fname (str): File name
+        min_pixels (int): Minimum width * height
+
+    Returns:
+        bool: True for TIFFs with at least `min_pixels` pixels
+    """
+    shape = large_image_shape(fname)
+    return shape is not None and shape[0] * shape[1] >= min_pixels
+
+
+class _Level:
+    """One resolution level: a TIFF page read segment (tile or strip) by segment
+    """
+
+    def __init__(self, tf: Any, page: Any, downsample: float):
+        self.tf = tf
+        self.page = page
+        self.key = f"{tf.filehandle.path}:{page.index}"
+        self.downsample = downsample
+        self.width = int(page.imagewidth)
+        self.height = int(page.imagelength)
+        self.samples = int(page.samplesperpixel)
+        self.dtype = page.dtype
+        self.chunk_height, self.chunk_width = int(page.chunks[0]), int(page.chunks[1])
+        self.no_chunks_y, self.no_chunks_x = int(page.chunked[0]), int(page.chunked[1])
+        # Segment decoding only for pixel-interleaved 2D images; otherwise the whole page is read once
+        self.segmented = page.planarconfig == 1 and len(page.dataoffsets) == self.no_chunks_y * self.no_chunks_x
+
+
+class LargeImage:
+    """Image that is read by region rather than decoded in full
+
+    Wraps a TIFF: regions are assembled from the tiles (or strips) that intersect them, at the resolution level that
+    matches the requested output size. Pyramid levels stored in the file are used; otherwise a pyramid is built once
+    from the base image, tile by tile, and cached on disk.
+
+    Has `width` and `height` like a PIL image, so it can be used wherever only the size of the current image is needed.
+    Coordinates are always in base image pixels.
+    """
+
+
+    def __init__(self, fname: str, cache_dir: Optional[str] = None, tile_cache_bytes: int = 256 * 1024 * 1024):
+        """Constructor
+
+        Args:
+            fname (str): TIFF file
+            cache_dir (Optional[str], optional): Directory for built pyramids. Defaults to None, i.e. a "dacv_pyramids" folder in the system temporary directory.
+            tile_cache_bytes (int, optional): Memory for decoded tiles and strips. Defaults to 256 MB.
+        """
+        tifffile = _import_tifffile()
+        self.fname = fname
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "dacv_pyramids")
+        self._lock = threading.RLock()
+        self._tile_cache: "OrderedDict[Tuple[str,int],np.ndarray]" = OrderedDict()
+        self._tile_cache_bytes = tile_cache_bytes
+        self._tile_cache_used = 0
+        self._pyramid_tfs: List[Any] = []
+
+        self._tf = tifffile.TiffFile(fname)
+        series = self._tf.series[0]
+        base = series.keyframe
+        self.width = int(base.imagewidth)
+        self.height = int(base.imagelength)
+        self._levels: List[_Level] = [
+            _Level(self._tf, level.keyframe, self.width / level.keyframe.imagewidth)
+            for level in series.levels
+            ]
+        self._pyramid_checked = len(self._levels) > 1
+        logger.debug(f"Opened large image {fname} ({self.width}x{self.height}, {len(self._levels)} levels)")
+
+
+    @property
+    def size(self) -> Tuple[int,int]:
+        return self.width, self.height
+
+
+    def load(self):
+        """Nothing to load: regions are read on demand
+        """
+        pass
+
+
+    def close(self):
+        with self._lock:
+            self._tf.close()
+            for tf in self._pyramid_tfs:
+                tf.close()
+            self._tile_cache.clear()
+            self._tile_cache_used = 0
+
+
+    @property
+    def levels(self) -> List[_Level]:
+        """Resolution levels, finest first; builds the pyramid on first access if the file has none
+        """
+        with self._lock:
+            if not self._pyramid_checked:
+                self._pyramid_checked = True
+                self._open_or_build_pyramid()
+            return self._levels
+
+
+    def _pyramid_dir(self) -> str:
+        stat = os.stat(self.fname)
+        key = f"{os.path.abspath(self.fname)}:{stat.st_size}:{stat.st_mtime_ns}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest())
+
+
+    def _open_or_build_pyramid(self):
+        base = self._levels[0]
+        if max(base.width, base.height) <= PYRAMID_TILE_SIZE:
+            return
+        dirname = self._pyramid_dir()
+        if not os.path.isdir(dirname):
+            self._build_pyramid(dirname)
+        tifffile = _import_tifffile()
+        idx = 1
+        while os.path.exists(os.path.join(dirname, f"level_{idx}.tif")):
+            tf = tifffile.TiffFile(os.path.join(dirname, f"level_{idx}.tif"))
+            self._pyramid_tfs.append(tf)
+            self._levels.append(_Level(tf, tf.series[0].keyframe, self.width / tf.series[0].keyframe.imagewidth))
+            idx += 1
+        logger.debug(f"Using pyramid {dirname} with {len(self._levels)} levels for {self.fname}")
+
+
+    def _build_pyramid(self, dirname: str):
+        """Write levels downsampled by 2 until they fit in one tile, one file per level
+
+        Each tile is computed from a region of the previous level, so memory stays bounded by a few tiles.
+        The pyramid is built in a temporary directory and moved into place when complete.
+        """
+        tifffile = _import_tifffile()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        logger.info(f"Building image pyramid for {self.fname} in {dirname}")
+        dirname_tmp = tempfile.mkdtemp(prefix="building_", dir=self.cache_dir)
+        tile = PYRAMID_TILE_SIZE
+        tfs = []
+        try:
+            with metrics.timer("pyramid_build_duration_seconds"):
+                prev = self._levels[0]
+                idx = 1
+                while max(prev.width, prev.height) > tile:
+                    width, height = (prev.width + 1) // 2, (prev.height + 1) // 2
+                    fname = os.path.join(dirname_tmp, f"level_{idx}.tif")
+                    with tifffile.TiffWriter(fname, bigtiff=True) as writer:
+                        writer.write(
+                            self._iter_downsampled_tiles(prev, width, height, tile),
+                            shape=(height, width, prev.samples),
+                            dtype=prev.dtype,
+                            tile=(tile, tile),
+                            photometric="rgb" if prev.samples == 3 else "minisblack",
+                            compression="zlib"
+                            )
+                    tf = tifffile.TiffFile(fname)
+                    tfs.append(tf)
+                    prev = _Level(tf, tf.series[0].keyframe, self.width / width)
+                    idx += 1
+        finally:
+            for tf in tfs:
+                tf.close()
+            self._tile_cache.clear()
+            self._tile_cache_used = 0
+        try:
+            os.replace(dirname_tmp, dirname)
+        except OSError:
+            # Built at the same time by another process
+            shutil.rmtree(dirname_tmp, ignore_errors=True)
+
+
+    def _iter_downsampled_tiles(self, prev: _Level, width: int, height: int, tile: int) -> Iterator[np.ndarray]:
+        for y0 in range(0, height, tile):
+            for x0 in range(0, width, tile):
+                region = self._read_level(prev, 2*x0, 2*y0, min(2*(x0+tile), prev.width), min(2*(y0+tile), prev.height))
+                out = np.zeros((tile, tile, prev.samples), dtype=prev.dtype)
+                small = _downsample_2x(region)
+                out[:small.shape[0], :small.shape[1]] = small
+                yield out
+
+
+    def _segment(self, level: _Level, idx: int) -> np.ndarray:
+        key = (level.key, idx)
+        cached = self._tile_cache.get(key)
+        metrics.record_cache("tiles", cached is not None)
+        if cached is not None:
+            self._tile_cache.move_to_end(key)
+            return cached
+        fh = level.tf.filehandle
+        fh.seek(level.page.dataoffsets[idx])
+        data = fh.read(level.page.databytecounts[idx])
+        segment, _, shape = level.page.decode(data, idx, jpegtables=level.page.jpegtables)
+        if segment is None:
+            # Missing segment
+            segment = np.zeros((level.chunk_height, level.chunk_width, level.samples), dtype=level.dtype)
+        else:
+            segment = segment.reshape(segment.shape[-3], segment.shape[-2], -1)
+        self._tile_cache[key] = segment
+        self._tile_cache_used += segment.nbytes
+        while self._tile_cache_used > self._tile_cache_bytes and len(self._tile_cache) > 1:
+            _, evicted = self._tile_cache.popitem(last=False)
+            self._tile_cache_used -= evicted.nbytes
+        return segment
+
+
+    def _read_level(self, level: _Level, x0: int, y0: int, x1: int, y1: int) -> np.ndarray:
+        """Pixels [y0:y1, x0:x1] of a level, as (H,W,samples)
+        """
+        out = np.zeros((y1 - y0, x1 - x0, level.samples), dtype=level.dtype)
+        if not level.segmented:
+            whole = level.page.asarray().reshape(level.height, level.width, -1)
+            out[:] = whole[y0:y1, x0:x1]
+            return out
+        for cy in range(y0 // level.chunk_height, min(level.no_chunks_y, (y1 - 1) // level.chunk_height + 1)):
+            for cx in range(x0 // level.chunk_width, min(level.no_chunks_x, (x1 - 1) // level.chunk_width + 1)):
+                segment = self._segment(level, cy * level.no_chunks_x + cx)
+                sy, sx = cy * level.chunk_height, cx * level.chunk_width
+                # Intersection in level coordinates
+                iy0, iy1 = max(y0, sy), min(y1, sy + segment.shape[0], level.height)
+                ix0, ix1 = max(x0, sx), min(x1, sx + segment.shape[1], level.width)
+                if iy1 <= iy0 or ix1 <= ix0:
+                    continue
+                out[iy0-y0:iy1-y0, ix0-x0:ix1-x0] = segment[iy0-sy:iy1-sy, ix0-sx:ix1-sx]
+        return out
+
+
+    def choose_level(self, region_width: float, region_height: float, max_size: int) -> int:
+        """Coarsest level that still shows the region with at least `max_size` pixels along its longer side
+
+        Args:
+            region_width (float): Region width in base pixels
+            region_height (float): Region height in base pixels
+            max_size (int): Output size along the longer side
+
+        Returns:
+            int: Level index, 0 = base image
+        """
+        downsample = max(region_width, region_height) / max_size
+        levels = self.levels
+        chosen = 0
+        for idx, level in enumerate(levels):
+            if level.downsample <= downsample:
+                chosen = idx
+        return chosen
+
+
+    def read_region(self, xyxy: Xyxy, level: int = 0) -> np.ndarray:
+        """Read a region at a resolution level
+
+        Args:
+            xyxy (Xyxy): Region in base image pixels; clipped to the image
+            level (int, optional): Level index. Defaults to 0.
+
+        Returns:
+            np.ndarray: Pixels (H,W) or (H,W,samples) at the level's resolution
+        """
+        with self._lock:
+            lvl = self.levels[level]
+            x0, y0, x1, y1 = self._clip(xyxy)
+            ds_x, ds_y = self.width / lvl.width, self.height / lvl.height
+            lx0, ly0 = int(x0 // ds_x), int(y0 // ds_y)
+            lx1 = max(lx0 + 1, min(lvl.width, int(np.ceil(x1 / ds_x))))
+            ly1 = max(ly0 + 1, min(lvl.height, int(np.ceil(y1 / ds_y))))
+            with metrics.timer("image_load_duration_seconds", {"source_type": "large_image"}):
+                region = self._read_level(lvl, lx0, ly0, lx1, ly1)
+        return region[:,:,0] if region.shape[2] == 1 else region
+
+
+    def _clip(self, xyxy: Xyxy) -> Tuple[int,int,int,int]:
+        x0 = int(max(0, min(self.width - 1, np.floor(min(xyxy[0], xyxy[2])))))
+        y0 = int(max(0, min(self.height - 1, np.floor(min(xyxy[1], xyxy[3])))))
+        x1 = int(max(x0 + 1, min(self.width, np.ceil(max(xyxy[0], xyxy[2])))))
+        y1 = int(max(y0 + 1, min(self.height, np.ceil(max(xyxy[1], xyxy[3])))))
+        return x0, y0, x1, y1
+
+
+    def viewport(self, xyxy: Xyxy, max_size: int = 1024) -> Tuple[Image.Image, Xyxy]:
+        """Image of a region for display, read from the level matching `max_size`
+
+        Args:
+            xyxy (Xyxy): Region in base image pixels
+            max_size (int, optional): Maximum output size along the longer side. Defaults to 1024.
+
+        Returns:
+            Tuple[Image.Image,Xyxy]: Image, and the region it covers in base image pixels (clipped to the image)
+        """
+        x0, y0, x1, y1 = self._clip(xyxy)
+        level = self.choose_level(x1 - x0, y1 - y0, max_size)
+        with metrics.timer("image_decode_duration_seconds", {"component": "LargeImage"}):
+            pixels = self.read_region([x0, y0, x1, y1], level)
+            image = Image.fromarray(_to_uint8(pixels))
+            if max(image.width, image.height) > max_size:
+                image.thumbnail((max_size, max_size))
+        return image, [x0, y0, x1, y1]
+
+
+    def overview(self, max_size: int = 1024) -> Image.Image:
+        """Whole image downsampled to at most `max_size` along the longer side
+        """
+        return self.viewport([0, 0, self.width, self.height], max_size)[0]
+
+
+def _downsample_2x(region: np.ndarray) -> np.ndarray:
+    """Average 2x2 blocks, replicating the last row/column for odd sizes
+    """
+    h, w = region.shape[:2]
+    if h % 2 == 1 or w % 2 == 1:
+        region = np.pad(region, ((0, h % 2), (0, w % 2), (0, 0)), mode="edge")
+    blocks = region.reshape(region.shape[0] // 2, 2, region.shape[1] // 2, 2, region.shape[2]).astype(np.float64)
+    return blocks.mean(axis=(1, 3)).round().astype(region.dtype)
+
+
+def _to_uint8(pixels: np.ndarray) -> np.ndarray:
+    if pixels.dtype == np.uint8:
+        return pixels
+    pixels = pixels.astype(np.float64)
+    lo, hi = float(pixels.min()), float(pixels.max())
+    scaled = (pixels - lo) / (hi - lo) * 255 if hi > lo else np.zeros_like(pixels)
+    return scaled.astype(np.uint8)
+
+
+def viewport_from_relayout(relayout_data: Dict, width: int, height: int) -> Optional[Xyxy]:
+    """Viewport in base image pixels from a zoom, pan or reset in a graph's `relayoutData`
+
+    Args:
+        relayout_data (Dict): Relayout data
+        width (int): Image width
+        height (int): Image height
+
+    Returns:
+        Optional[Xyxy]: Viewport, or None if the relayout did not change the axes
+    """
+    if relayout_data.get("xaxis.autorange") or relayout_data.get("yaxis.autorange"):
+        return [0, 0, width, height]
+    keys = ["xaxis.range[0]", "xaxis.range[1]", "yaxis.range[0]", "yaxis.range[1]"]
+    if all(key in relayout_data for key in keys):
+        x0, x1, y0, y1 = [ float(relayout_data[key]) for key in keys ]
+    elif "xaxis.range" in relayout_data and "yaxis.range" in relayout_data:
+        (x0, x1), (y0, y1) = relayout_data["xaxis.range"], relayout_data["yaxis.range"]
+    else:
+        return None
+    # The y axis is reversed, so the range may come in either order
+    return [min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1)]
@@ -0,0 +1,302 @@
+from dash_annotate_cv.annotation_storage import AnnotationStorage, AnnotationWriter, StorageType, iter_image_anns, detect_storage_type
+from dash_annotate_cv.shards import ProgressCallback, choose_no_shards, partition_annotations, iter_shard_entries, report_progress
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+
+from dataclasses import dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from mashumaro import DataClassDictMixin
+from enum import Enum
+from typing import Optional, List, Dict, Tuple, Iterator, Sequence, Any
+import copy
+import os
+import tempfile
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class ConflictPolicy(Enum):
+    """How to choose between conflicting bboxs or labels from different inputs
+    """
+
+    # Latest timestamp wins; ties go to the earlier input
+    LATEST = "latest"
+
+    # Author earliest in `author_priority` wins (unlisted authors last); ties are broken as for LATEST
+    AUTHOR_PRIORITY = "author_priority"
+
+    # Earlier input wins
+    FIRST = "first"
+
+
+@dataclass
+class MergeOptions(DataClassDictMixin):
+    """Options for merging annotations
+    """
+
+    # Bboxs of different inputs with at least this IoU are the same object
+    iou_threshold: float = 0.5
+
+    # Policy for conflicting bboxs (same object, different xyxy or class) and labels
+    conflict_policy: ConflictPolicy = ConflictPolicy.LATEST
+
+    # Authors in order of priority for ConflictPolicy.AUTHOR_PRIORITY
+    author_priority: List[str] = field(default_factory=list)
+
+    # Keep the history of all inputs, and record the losing side of each conflict as a deletion
+    preserve_history: bool = True
+
+
+@dataclass
+class MergeResult:
+    """Result of a merge
+    """
+
+    # Number of images written
+    no_images: int
+
+    # Number of bboxs written
+    no_bboxs: int
+
+    # Number of conflicting bboxs and labels resolved by the policy
+    no_conflicts: int
+
+    # Number of shards the inputs were split into
+    no_shards: int
+
+
+def _rank(timestamp: Optional[float], author: Optional[str], input_idx: int, options: MergeOptions) -> Tuple:
+    """Sort key: the candidate with the highest key wins
+    """
+    latest = (timestamp if timestamp is not None else float("-inf"), -input_idx)
+    if options.conflict_policy == ConflictPolicy.LATEST:
+        return latest
+    elif options.conflict_policy == ConflictPolicy.AUTHOR_PRIORITY:
+        priority = options.author_priority.index(author) if author in options.author_priority else len(options.author_priority)
+        return (-priority,) + latest
+    elif options.conflict_policy == ConflictPolicy.FIRST:
+        return (-input_idx,)
+    else:
+        raise NotImplementedError(f"Unrecognized conflict policy: {options.conflict_policy}")
+
+
+def _history_key(op: ImageAnnotations.Annotation.BboxHistory) -> Tuple:
+    return (op.operation, tuple(op.bbox.xyxy), op.bbox.class_name, op.bbox.timestamp, op.bbox.author)
+
+
+def _label_key(label: ImageAnnotations.Annotation.Label) -> Tuple:
+    return (label.single, tuple(label.multiple) if label.multiple is not None else None, label.timestamp, label.author)
+
+
+def _newest_first(items: List[Any], timestamp) -> List[Any]:
+    # Stable, so items without timestamp keep their order at the end
+    return sorted(items, key=lambda item: -timestamp(item) if timestamp(item) is not None else float("inf"))
+
+
+def merge_image_entries(entries: Sequence[ImageAnnotations.Annotation], options: Optional[MergeOptions] = None) -> Tuple[ImageAnnotations.Annotation,int]:
+    """Merge the annotations of one image from several inputs
+
+    Bboxs of each input are matched to the bboxs merged so far by optimal IoU assignment. Matched bboxs that differ
+    are a conflict resolved by `options.conflict_policy`; unmatched bboxs are added. Labels that differ are resolved
+    by the same policy. The inputs are not modified.
+
+    Args:
+        entries (Sequence[ImageAnnotations.Annotation]): Annotations of the image, in input order
+        options (Optional[MergeOptions], optional): Options. Defaults to None, i.e. default options.
+
+    Returns:
+        Tuple[ImageAnnotations.Annotation,int]: Merged annotation and number of conflicts
+    """
+    from dash_annotate_cv.agreement import match_bboxs
+    assert len(entries) > 0, "Need at least one entry to merge"
+    options = options or MergeOptions()
+    merged = ImageAnnotations.Annotation(
+        image_name=entries[0].image_name,
+        image_width=next((entry.image_width for entry in entries if entry.image_width is not None), None),
+        image_height=next((entry.image_height for entry in entries if entry.image_height is not None), None)
+        )
+    no_conflicts = 0
+    losers_bboxs: List[ImageAnnotations.Annotation.Bbox] = []
+    losers_labels: List[ImageAnnotations.Annotation.Label] = []
+
+    # Labels
+    candidates = [ (input_idx, entry.label) for input_idx, entry in enumerate(entries) if entry.label is not None ]
+    if len(candidates) > 0:
+        winner_idx, winner = max(candidates, key=lambda c: _rank(c[1].timestamp, c[1].author, c[0], options))
+        merged.label = copy.deepcopy(winner)
+        for input_idx, label in candidates:
+            if input_idx != winner_idx and label != winner:
+                no_conflicts += 1
+                losers_labels.append(label)
+
+    # Bboxs, with the index of the input each came from
+    bboxs: List[ImageAnnotations.Annotation.Bbox] = []
+    bbox_inputs: List[int] = []
+    for input_idx, entry in enumerate(entries):
+        if entry.bboxs is None:
+            continue
+        if merged.bboxs is None:
+            merged.bboxs = bboxs
+        match = match_bboxs(bboxs, entry.bboxs, options.iou_threshold)
+        for idx_merged, idx_new, _ in match.matches:
+            existing, new = bboxs[idx_merged], entry.bboxs[idx_new]
+            if existing == new:
+                continue
+            no_conflicts += 1
+            rank_existing = _rank(existing.timestamp, existing.author, bbox_inputs[idx_merged], options)
+            if _rank(new.timestamp, new.author, input_idx, options) > rank_existing:
+                losers_bboxs.append(existing)
+                bboxs[idx_merged] = copy.deepcopy(new)
+                bbox_inputs[idx_merged] = input_idx
+            else:
+                losers_bboxs.append(new)
+        for idx_new in match.unmatched_b:
+            bboxs.append(copy.deepcopy(entry.bboxs[idx_new]))
+            bbox_inputs.append(input_idx)
+
+    # Masks: union of the distinct masks of the inputs
+    for entry in entries:
+        for mask in entry.masks or []:
+            if mask not in (merged.masks or []):
+                merged.masks = (merged.masks or []) + [copy.deepcopy(mask)]
+
+    if options.preserve_history:
+        # Union of the inputs' histories without repeating the same event, newest first, after the merge deletions
+        seen = set()
+        history_bboxs: List[ImageAnnotations.Annotation.BboxHistory] = []
+        for entry in entries:
+            for op in entry.history_bboxs or []:
+                if _history_key(op) not in seen:
+                    seen.add(_history_key(op))
+                    history_bboxs.append(copy.deepcopy(op))
+        history_bboxs = [
+            ImageAnnotations.Annotation.BboxHistory(
+                operation=ImageAnnotations.Annotation.BboxHistory.Operation.DELETE,
+                bbox=copy.deepcopy(bbox)
+                )
+            for bbox in losers_bboxs
+            ] + _newest_first(history_bboxs, lambda op: op.bbox.timestamp)
+        if len(history_bboxs) > 0:
+            merged.history_bboxs = history_bboxs
+
+        seen = set()
+        history_labels: List[ImageAnnotations.Annotation.Label] = []
+        for label in [ label for entry in entries for label in entry.history_labels or [] ] + losers_labels:
+            if _label_key(label) not in seen:
+                seen.add(_label_key(label))
+                history_labels.append(copy.deepcopy(label))
+        if len(history_labels) > 0:
+            merged.history_labels = _newest_first(history_labels, lambda label: label.timestamp)
+
+    return merged, no_conflicts
+
+
+def _merge_grouped(image_to_entries: Dict[str,List[ImageAnnotations.Annotation]], options: MergeOptions) -> Tuple[List[ImageAnnotations.Annotation],int]:
+    merged: List[ImageAnnotations.Annotation] = []
+    no_conflicts = 0
+    for entries in image_to_entries.values():
+        if len(entries) == 1:
+            # Nothing to resolve: pass the entry through, only dropping its history if not preserved
+            entry = entries[0]
+            if not options.preserve_history:
+                entry = copy.copy(entry)
+                entry.history_bboxs = None
+                entry.history_labels = None
+            merged.append(entry)
+            continue
+        entry, no = merge_image_entries(entries, options)
+        merged.append(entry)
+        no_conflicts += no
+    return merged, no_conflicts
+
+
+@dataclass
+class _MergeShardTask:
+    # Per input: shard file, storage type, COCO category id to name
+    inputs: List[Tuple[str,StorageType,Dict[int,str]]]
+    options: MergeOptions
+
+
+def _merge_shard(task: _MergeShardTask) -> Tuple[List[ImageAnnotations.Annotation],int]:
+    """Merge the images of one shard across all inputs
+
+    Runs in a worker process.
+    """
+    image_to_entries: Dict[str,List[ImageAnnotations.Annotation]] = {}
+    for shard_file, input_type, coco_category_names in task.inputs:
+        for entry in iter_shard_entries(shard_file, input_type, coco_category_names):
+            image_to_entries.setdefault(entry.image_name, []).append(entry)
+    return _merge_grouped(image_to_entries, task.options)
+
+
+def merge_annotations(
+    input_files: Sequence[str],
+    output_storage: AnnotationStorage,
+    options: Optional[MergeOptions] = None,
+    workers: int = 1,
+    max_memory_mb: Optional[float] = None,
+    progress: Optional[ProgressCallback] = None,
+    tmp_dir: Optional[str] = None
+    ) -> MergeResult:
+    """Merge several annotation files (JSON or COCO, detected from the files) by image name
+
+    Small inputs are merged in memory. Otherwise every input is partitioned by image name into the same shards on disk
+    (sized from `max_memory_mb`), so that each shard holds all entries of its images across inputs; the shards are
+    merged by `workers` processes and streamed to the output in a single pass.
+
+    Args:
+        input_files (Sequence[str]): Input files, in order (earlier inputs win ties)
+        output_storage (AnnotationStorage): Output files and storage types
+        options (Optional[MergeOptions], optional): Options. Defaults to None, i.e. default options.
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        max_memory_mb (Optional[float], optional): Approximate memory ceiling across all workers. Defaults to None.
+        progress (Optional[ProgressCallback], optional): Called with progress updates. Defaults to None.
+        tmp_dir (Optional[str], optional): Directory for shard files. Defaults to None, i.e. the system default.
+
+    Returns:
+        MergeResult: Result
+    """
+    assert len(input_files) > 0, "Need at least one input file"
+    assert len(output_storage.storage_types) > 0, "output_storage must have at least one storage type"
+    options = options or MergeOptions()
+    input_types = [ detect_storage_type(fname) for fname in input_files ]
+    no_shards = choose_no_shards(sum(os.path.getsize(fname) for fname in input_files), workers, max_memory_mb)
+    result = MergeResult(no_images=0, no_bboxs=0, no_conflicts=0, no_shards=no_shards)
+
+    def write(merged_shards: Iterator[Tuple[List[ImageAnnotations.Annotation],int]]):
+        def entries() -> Iterator[ImageAnnotations.Annotation]:
+            for done, (merged, no_conflicts) in enumerate(merged_shards):
+                result.no_conflicts += no_conflicts
+                for entry in merged:
+                    result.no_images += 1
+                    result.no_bboxs += len(entry.bboxs or [])
+                    yield entry
+                report_progress(progress, "merge", done+1, no_shards, force=True)
+        AnnotationWriter(output_storage).write_stream(entries())
+
+    if no_shards == 1:
+        image_to_entries: Dict[str,List[ImageAnnotations.Annotation]] = {}
+        for fname, input_type in zip(input_files, input_types):
+            for entry in iter_image_anns(input_type, fname):
+                image_to_entries.setdefault(entry.image_name, []).append(entry)
+        write(iter([ _merge_grouped(image_to_entries, options) ]))
+        return result
+
+    logger.info(f"Merging {len(input_files)} inputs in {no_shards} shards with {workers} workers")
+    with tempfile.TemporaryDirectory(prefix="dacv_merge_", dir=tmp_dir) as work_dir:
+        shard_inputs: List[List[Tuple[str,StorageType,Dict[int,str]]]] = [ [] for _ in range(no_shards) ]
+        for input_idx, (fname, input_type) in enumerate(zip(input_files, input_types)):
+            shard_files = [ os.path.join(work_dir, f"input_{input_idx}_shard_{i}.jsonl") for i in range(no_shards) ]
+            _, coco_category_names, _ = partition_annotations(fname, input_type, shard_files, progress)
+            for i, shard_file in enumerate(shard_files):
+                shard_inputs[i].append((shard_file, input_type, coco_category_names))
+
+        tasks = [ _MergeShardTask(inputs=inputs, options=options) for inputs in shard_inputs ]
+        if workers > 1:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                write(executor.map(_merge_shard, tasks))
+        else:
+            write(map(_merge_shard, tasks))
+
+    return result
@@ -0,0 +1,394 @@
+from dataclasses import dataclass, field
+from typing import Optional, List, Dict, Tuple, Callable, Any, Iterator
+from contextlib import contextmanager
+import bisect
+import functools
+import threading
+import time
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Default histogram buckets
+DURATION_BUCKETS: Tuple[float, ...] = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS: Tuple[float, ...] = (1e2, 1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _label_values(labels: Optional[Dict[str, str]]) -> LabelValues:
+    if not labels:
+        return ()
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(labels: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    items = list(labels) + ([extra] if extra is not None else [])
+    if len(items) == 0:
+        return ""
+    escaped = [ (k, v.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')) for k, v in items ]
+    return "{" + ",".join('%s="%s"' % (k, v) for k, v in escaped) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value))
+
+
+@dataclass
+class Histogram:
+    """Cumulative histogram of observed values
+    """
+
+    # Upper bounds of the buckets
+    buckets: Tuple[float, ...]
+
+    # Number of observations in each bucket (non-cumulative), last entry is +Inf
+    counts: List[int] = field(default_factory=list)
+
+    # Sum of observations
+    sum: float = 0.0
+
+    # Number of observations
+    count: int = 0
+
+    def __post_init__(self):
+        if len(self.counts) == 0:
+            self.counts = [0] * (len(self.buckets) + 1)
+
+    def observe(self, value: float):
+        """Add an observation
+
+        Args:
+            value (float): Value
+        """
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    @property
+    def mean(self) -> Optional[float]:
+        """Mean of the observations, or None if there are none
+        """
+        return self.sum / self.count if self.count > 0 else None
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate a quantile from the buckets (upper bound of the bucket containing it)
+
+        Args:
+            q (float): Quantile in [0,1]
+
+        Returns:
+            Optional[float]: Estimated quantile, or None if there are no observations
+        """
+        if self.count == 0:
+            return None
+        target = q * self.count
+        cumulative = 0
+        for upper, count in zip(list(self.buckets) + [float("inf")], self.counts):
+            cumulative += count
+            if cumulative >= target:
+                return upper
+        return float("inf")
+
+
+class MetricsRegistry:
+    """Thread-safe registry of counters and histograms, renderable in the Prometheus text format
+    """
+
+
+    def __init__(self, prefix: str = "dacv"):
+        """Constructor
+
+        Args:
+            prefix (str, optional): Prefix for all metric names. Defaults to "dacv".
+        """
+        self.prefix = prefix
+        self.enabled = True
+        self._lock = threading.Lock()
+        self._counters: Dict[str, Dict[LabelValues, float]] = {}
+        self._histograms: Dict[str, Dict[LabelValues, Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._help: Dict[str, str] = {}
+
+
+    def _full_name(self, name: str) -> str:
+        return f"{self.prefix}_{name}" if self.prefix else name
+
+
+    def describe(self, name: str, help_text: str):
+        """Set the help text of a metric
+
+        Args:
+            name (str): Metric name (without prefix)
+            help_text (str): Help text
+        """
+        self._help[self._full_name(name)] = help_text
+
+
+    def inc(self, name: str, amount: float = 1.0, labels: Optional[Dict[str, str]] = None):
+        """Increment a counter
+
+        Args:
+            name (str): Metric name (without prefix)
+            amount (float, optional): Amount. Defaults to 1.0.
+            labels (Optional[Dict[str,str]], optional): Labels. Defaults to None.
+        """
+        if not self.enabled:
+            return
+        key = _label_values(labels)
+        with self._lock:
+            series = self._counters.setdefault(self._full_name(name), {})
+            series[key] = series.get(key, 0.0) + amount
+
+
+    def observe(self, name: str, value: float, labels: Optional[Dict[str, str]] = None, buckets: Tuple[float, ...] = DURATION_BUCKETS):
+        """Add an observation to a histogram
+
+        Args:
+            name (str): Metric name (without prefix)
+            value (float): Observed value
+            labels (Optional[Dict[str,str]], optional): Labels. Defaults to None.
+            buckets (Tuple[float,...], optional): Buckets, used when the histogram is first created. Defaults to DURATION_BUCKETS.
+        """
+        if not self.enabled:
+            return
+        key = _label_values(labels)
+        full_name = self._full_name(name)
+        with self._lock:
+            buckets = self._buckets.setdefault(full_name, buckets)
+            series = self._histograms.setdefault(full_name, {})
+            if key not in series:
+                series[key] = Histogram(buckets=buckets)
+            series[key].observe(value)
+
+
+    @contextmanager
+    def timer(self, name: str, labels: Optional[Dict[str, str]] = None) -> Iterator[None]:
+        """Context manager observing the duration of the block in seconds
+
+        Args:
+            name (str): Metric name (without prefix)
+            labels (Optional[Dict[str,str]], optional): Labels. Defaults to None.
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, labels)
+
+
+    def record_cache(self, cache: str, hit: bool):
+        """Record a cache lookup
+
+        Args:
+            cache (str): Cache name
+            hit (bool): Whether the lookup was a hit
+        """
+        self.inc("cache_requests_total", labels={"cache": cache, "result": "hit" if hit else "miss"})
+
+
+    def cache_hit_rate(self, cache: str) -> Optional[float]:
+        """Hit rate of a cache
+
+        Args:
+            cache (str): Cache name
+
+        Returns:
+            Optional[float]: Fraction of lookups that were hits, or None if there were no lookups
+        """
+        hits = self.counter_value("cache_requests_total", {"cache": cache, "result": "hit"})
+        misses = self.counter_value("cache_requests_total", {"cache": cache, "result": "miss"})
+        total = hits + misses
+        return hits / total if total > 0 else None
+
+
+    def counter_value(self, name: str, labels: Optional[Dict[str, str]] = None) -> float:
+        """Current value of a counter
+
+        Args:
+            name (str): Metric name (without prefix)
+            labels (Optional[Dict[str,str]], optional): Labels. Defaults to None.
+
+        Returns:
+            float: Value, zero if never incremented
+        """
+        with self._lock:
+            return self._counters.get(self._full_name(name), {}).get(_label_values(labels), 0.0)
+
+
+    def histogram(self, name: str, labels: Optional[Dict[str, str]] = None) -> Optional[Histogram]:
+        """Copy of a histogram
+
+        Args:
+            name (str): Metric name (without prefix)
+            labels (Optional[Dict[str,str]], optional): Labels. Defaults to None.
+
+        Returns:
+            Optional[Histogram]: Histogram, or None if nothing was observed
+        """
+        with self._lock:
+            hist = self._histograms.get(self._full_name(name), {}).get(_label_values(labels))
+            if hist is None:
+                return None
+            return Histogram(buckets=hist.buckets, counts=list(hist.counts), sum=hist.sum, count=hist.count)
+
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Snapshot of all metrics as a plain dictionary
+
+        Returns:
+            Dict[str,Any]: Metric name to list of series with labels and values
+        """
+        snap: Dict[str, Any] = {}
+        with self._lock:
+            for name, series in self._counters.items():
+                snap[name] = [ {"labels": dict(labels), "value": value} for labels, value in series.items() ]
+            for name, hists in self._histograms.items():
+                snap[name] = [ {
+                    "labels": dict(labels),
+                    "count": hist.count,
+                    "sum": hist.sum,
+                    "mean": hist.mean,
+                    "p50": hist.quantile(0.5),
+                    "p95": hist.quantile(0.95),
+                    "p99": hist.quantile(0.99)
+                    } for labels, hist in hists.items() ]
+        return snap
+
+
+    def render_prometheus(self) -> str:
+        """Render all metrics in the Prometheus text exposition format
+
+        Returns:
+            str: Text
+        """
+        lines: List[str] = []
+        with self._lock:
+            for name in sorted(self._counters.keys()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(self._counters[name].items()):
+                    lines.append(f"{name}{_format_labels(labels)} {_format_value(value)}")
+            for name in sorted(self._histograms.keys()):
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, hist in sorted(self._histograms[name].items(), key=lambda x: x[0]):
+                    cumulative = 0
+                    for upper, count in zip(list(hist.buckets) + [float("inf")], hist.counts):
+                        cumulative += count
+                        lines.append(f"{name}_bucket{_format_labels(labels, ('le', _format_value(upper)))} {cumulative}")
+                    lines.append(f"{name}_sum{_format_labels(labels)} {_format_value(hist.sum)}")
+                    lines.append(f"{name}_count{_format_labels(labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+
+    def reset(self):
+        """Clear all recorded values
+        """
+        with self._lock:
+            self._counters.clear()
+            self._histograms.clear()
+            self._buckets.clear()
+
+
+    def instrument_callback(self, name: str) -> Callable:
+        """Decorator recording latency, errors and request payload size of a Dash callback
+
+        The response payload size is recorded by the hook installed with `register_metrics_route`.
+
+        Args:
+            name (str): Callback name used as the `callback` label
+        """
+        def decorator(func: Callable) -> Callable:
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                labels = {"callback": name}
+                _record_request_payload(self, labels)
+                start = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                except Exception:
+                    self.inc("callback_errors_total", labels=labels)
+                    raise
+                finally:
+                    self.observe("callback_duration_seconds", time.perf_counter() - start, labels)
+            return wrapper
+        return decorator
+
+
+def _record_request_payload(registry: MetricsRegistry, labels: Dict[str, str]):
+    # Only available when running inside a Flask request, e.g. not in unit tests
+    try:
+        from flask import request, g, has_request_context
+    except ImportError:
+        return
+    if not has_request_context():
+        return
+    g.dacv_callback_name = labels["callback"]
+    if request.content_length is not None:
+        registry.observe("callback_request_bytes", request.content_length, labels, buckets=BYTES_BUCKETS)
+
+
+# Default registry used throughout the library
+registry = MetricsRegistry()
+registry.describe("callback_duration_seconds", "Latency of Dash callbacks")
+registry.describe("callback_errors_total", "Dash callbacks that raised an exception")
+registry.describe("callback_request_bytes", "Request payload size of Dash callbacks")
+registry.describe("callback_response_bytes", "Response payload size of Dash callbacks")
+registry.describe("storage_write_duration_seconds", "Duration of writing annotations per storage type")
+registry.describe("storage_write_bytes", "Size of written annotation files per storage type")
+registry.describe("storage_bytes_written_total", "Total bytes of annotation files written per storage type")
+registry.describe("storage_lock_wait_seconds", "Time spent waiting for the lock on shared annotation files")
+registry.describe("storage_entries_merged_total", "Image annotations taken from the shared annotation file, written by other processes")
+registry.describe("image_load_duration_seconds", "Duration of opening an image from the image source")
+registry.describe("image_decode_duration_seconds", "Duration of decoding image pixels for display")
+registry.describe("cache_requests_total", "Cache lookups by cache and result")
+registry.describe("pyramid_build_duration_seconds", "Duration of building an image pyramid on disk for a large image")
+registry.describe("remote_image_download_duration_seconds", "Duration of downloading an image from a remote image source")
+registry.describe("archive_index_duration_seconds", "Duration of indexing the member offsets of an image archive")
+registry.describe("mask_overlay_duration_seconds", "Duration of rendering the overlay of segmentation masks for display")
+registry.describe("video_index_duration_seconds", "Duration of indexing the frames and keyframes of a video")
+registry.describe("video_seeks_total", "Seeks to a keyframe when reading video frames")
+registry.describe("remote_image_bytes_downloaded_total", "Total bytes downloaded from remote image sources, including header range reads")
+registry.describe("checkpoint_write_duration_seconds", "Time to write a checkpoint of the annotations")
+registry.describe("checkpoint_restore_duration_seconds", "Time to restore annotations from a checkpoint")
+registry.describe("checkpoints_written_total", "Total checkpoints written")
+registry.describe("image_hash_duration_seconds", "Duration of hashing the images of a source for near-duplicate detection")
+registry.describe("manifest_index_duration_seconds", "Duration of indexing the line offsets of an image manifest")
+registry.describe("duplicate_labels_propagated_total", "Labels stored for near-duplicates of labeled images")
+
+
+def register_metrics_route(app: Any, path: str = "/metrics", metrics_registry: Optional[MetricsRegistry] = None):
+    """Expose metrics in the Prometheus text format on the Flask server of a Dash app
+
+    Also records the response payload size of instrumented callbacks.
+
+    Args:
+        app (Any): Dash app or Flask server
+        path (str, optional): Route. Defaults to "/metrics".
+        metrics_registry (Optional[MetricsRegistry], optional): Registry to expose. Defaults to the library registry.
+    """
+    from flask import Response, g
+
+    reg = metrics_registry or registry
+    server = getattr(app, "server", app)
+
+    def metrics_view():
+        return Response(reg.render_prometheus(), mimetype="text/plain; version=0.0.4")
+    server.add_url_rule(path, endpoint="dacv_metrics", view_func=metrics_view)
+
+    @server.after_request
+    def record_response_payload(response):
+        name = g.pop("dacv_callback_name", None)
+        if name is not None and response.content_length is not None:
+            reg.observe("callback_response_bytes", response.content_length, {"callback": name}, buckets=BYTES_BUCKETS)
+        return response
+
+    logger.debug(f"Registered metrics route {path}")
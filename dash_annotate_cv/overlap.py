@@ -0,0 +1,214 @@
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.helpers import Xyxy
+
+from dataclasses import dataclass
+from enum import Enum
+from typing import Optional, List, Sequence, Tuple, Dict
+import numpy as np
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class DuplicatePolicy(Enum):
+    """What to do when a bbox duplicates an existing one
+    """
+
+    # Do not store the new bbox
+    REJECT = "reject"
+
+    # Keep the existing bbox, taking over the class of the new one if the existing one has none
+    MERGE = "merge"
+
+    # Store the new bbox and log a warning
+    WARN = "warn"
+
+
+@dataclass
+class DuplicatePair:
+    """Two bboxs of the same image that overlap above the threshold
+    """
+
+    # Image name
+    image_name: str
+
+    # Index of the first bbox
+    idx_a: int
+
+    # Index of the second bbox (idx_b > idx_a)
+    idx_b: int
+
+    # Intersection over union
+    iou: float
+
+
+def xyxy_array(xyxys: Sequence[Xyxy]) -> np.ndarray:
+    """Stack bboxs into an array
+
+    Args:
+        xyxys (Sequence[Xyxy]): Bboxs in xyxy format
+
+    Returns:
+        np.ndarray: Array of shape (N,4)
+    """
+    if len(xyxys) == 0:
+        return np.zeros((0,4), dtype=np.float64)
+    return np.asarray(xyxys, dtype=np.float64).reshape(-1,4)
+
+
+def iou_matrix(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """Pairwise intersection over union
+
+    Args:
+        a (np.ndarray): Bboxs of shape (...,N,4) in xyxy format
+        b (np.ndarray): Bboxs of shape (...,M,4) in xyxy format
+
+    Returns:
+        np.ndarray: IoU of shape (...,N,M); zero where the union is empty
+    """
+    a = a[...,:,None,:]
+    b = b[...,None,:,:]
+    w = np.clip(np.minimum(a[...,2], b[...,2]) - np.maximum(a[...,0], b[...,0]), 0, None)
+    h = np.clip(np.minimum(a[...,3], b[...,3]) - np.maximum(a[...,1], b[...,1]), 0, None)
+    intersection = w * h
+    area_a = (a[...,2] - a[...,0]) * (a[...,3] - a[...,1])
+    area_b = (b[...,2] - b[...,0]) * (b[...,3] - b[...,1])
+    union = area_a + area_b - intersection
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(union > 0, intersection / union, 0.0)
+
+
+def iou_one_to_many(xyxy: Xyxy, others: np.ndarray) -> np.ndarray:
+    """Intersection over union of one bbox with many
+
+    Args:
+        xyxy (Xyxy): Bbox
+        others (np.ndarray): Bboxs of shape (M,4)
+
+    Returns:
+        np.ndarray: IoU of shape (M,)
+    """
+    return iou_matrix(xyxy_array([xyxy]), others)[0]
+
+
+def classes_compatible(class_name_a: Optional[str], class_name_b: Optional[str]) -> bool:
+    """Whether two bboxs can be duplicates of each other: same class, or either has no class yet
+    """
+    return class_name_a is None or class_name_b is None or class_name_a == class_name_b
+
+
+def find_duplicate(
+    bboxs: Sequence[ImageAnnotations.Annotation.Bbox],
+    xyxy: Xyxy,
+    class_name: Optional[str],
+    iou_threshold: float,
+    exclude_idx: Optional[int] = None
+    ) -> Optional[Tuple[int,float]]:
+    """Find the existing bbox that a bbox duplicates, if any
+
+    Args:
+        bboxs (Sequence[ImageAnnotations.Annotation.Bbox]): Existing bboxs of the image
+        xyxy (Xyxy): New bbox
+        class_name (Optional[str]): Class of the new bbox
+        iou_threshold (float): IoU at or above which bboxs of compatible classes are duplicates
+        exclude_idx (Optional[int], optional): Index of an existing bbox to ignore, e.g. the one being updated. Defaults to None.
+
+    Returns:
+        Optional[Tuple[int,float]]: Index of the best matching existing bbox and its IoU, or None
+    """
+    if len(bboxs) == 0:
+        return None
+    ious = iou_one_to_many(xyxy, xyxy_array([ bbox.xyxy for bbox in bboxs ]))
+    compatible = np.array([ classes_compatible(class_name, bbox.class_name) for bbox in bboxs ])
+    ious = np.where(compatible, ious, -1.0)
+    if exclude_idx is not None:
+        ious[exclude_idx] = -1.0
+    idx = int(np.argmax(ious))
+    if ious[idx] >= iou_threshold:
+        return idx, float(ious[idx])
+    return None
+
+
+def find_duplicates(
+    annotations: ImageAnnotations,
+    iou_threshold: float,
+    max_batch_elements: int = 1 << 22
+    ) -> List[DuplicatePair]:
+    """Find all duplicate bbox pairs in a dataset
+
+    Images are grouped by number of bboxs and processed in padded batches of shape (B,K,K), so the work is done in array operations
+    rather than Python loops over pairs.
+
+    Args:
+        annotations (ImageAnnotations): Annotations
+        iou_threshold (float): IoU at or above which bboxs of compatible classes are duplicates
+        max_batch_elements (int, optional): Maximum B*K*K per batch, bounds memory. Defaults to 1 << 22.
+
+    Returns:
+        List[DuplicatePair]: Duplicate pairs
+    """
+    entries = [ entry for entry in annotations.image_to_entry.values() if entry.bboxs is not None and len(entry.bboxs) >= 2 ]
+    entries.sort(key=lambda entry: len(entry.bboxs or []))
+
+    # Class names to integer codes, -1 = no class
+    class_codes: Dict[str,int] = {}
+
+    pairs: List[DuplicatePair] = []
+    start = 0
+    while start < len(entries):
+        # Entries are sorted by size, so the last one in the batch sets the padding
+        end = start + 1
+        while end < len(entries) and (end - start + 1) * len(entries[end].bboxs or []) ** 2 <= max_batch_elements:
+            end += 1
+        batch = entries[start:end]
+        no_max = len(batch[-1].bboxs or [])
+
+        xyxys = np.zeros((len(batch), no_max, 4), dtype=np.float64)
+        classes = np.full((len(batch), no_max), -1, dtype=np.int64)
+        valid = np.zeros((len(batch), no_max), dtype=bool)
+        for i, entry in enumerate(batch):
+            bboxs = entry.bboxs or []
+            xyxys[i,:len(bboxs)] = xyxy_array([ bbox.xyxy for bbox in bboxs ])
+            classes[i,:len(bboxs)] = [ -1 if bbox.class_name is None else class_codes.setdefault(bbox.class_name, len(class_codes)) for bbox in bboxs ]
+            valid[i,:len(bboxs)] = True
+
+        ious = iou_matrix(xyxys, xyxys)
+        ca, cb = classes[:,:,None], classes[:,None,:]
+        mask = (ious >= iou_threshold) \
+            & valid[:,:,None] & valid[:,None,:] \
+            & ((ca == cb) | (ca == -1) | (cb == -1)) \
+            & np.triu(np.ones((no_max,no_max), dtype=bool), k=1)[None,:,:]
+        for i, idx_a, idx_b in zip(*np.nonzero(mask)):
+            pairs.append(DuplicatePair(image_name=batch[i].image_name, idx_a=int(idx_a), idx_b=int(idx_b), iou=float(ious[i,idx_a,idx_b])))
+        start = end
+
+    return pairs
+
+
+def merge_duplicates(annotations: ImageAnnotations, pairs: List[DuplicatePair]) -> int:
+    """Remove the second bbox of each duplicate pair, passing its class to the first if that has none
+
+    Args:
+        annotations (ImageAnnotations): Annotations, modified in place
+        pairs (List[DuplicatePair]): Pairs from `find_duplicates`
+
+    Returns:
+        int: Number of bboxs removed
+    """
+    to_remove: Dict[str,set] = {}
+    for pair in pairs:
+        removed = to_remove.setdefault(pair.image_name, set())
+        if pair.idx_a in removed or pair.idx_b in removed:
+            continue
+        bboxs = annotations.image_to_entry[pair.image_name].bboxs or []
+        if bboxs[pair.idx_a].class_name is None:
+            bboxs[pair.idx_a].class_name = bboxs[pair.idx_b].class_name
+        removed.add(pair.idx_b)
+
+    no_removed = 0
+    for image_name, removed in to_remove.items():
+        entry = annotations.image_to_entry[image_name]
+        entry.bboxs = [ bbox for idx, bbox in enumerate(entry.bboxs or []) if idx not in removed ]
+        no_removed += len(removed)
+    return no_removed
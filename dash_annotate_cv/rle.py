@@ -0,0 +1,261 @@
+from typing import Dict, List, Tuple, Union, Any, Sequence
+from PIL import Image, ImageDraw
+import numpy as np
+import re
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Run-length encoded mask in the COCO format: {"size": [height, width], "counts": ...}. Counts are the lengths of alternating runs
+# of background and foreground pixels in column-major order, starting with background, either as a list or compressed to a string
+Rle = Dict[str,Any]
+
+
+def counts_to_string(counts: Sequence[int]) -> str:
+    """Compress run lengths to a string as in the COCO API: differences to the count two before, in 5-bit chunks
+
+    Args:
+        counts (Sequence[int]): Run lengths
+
+    Returns:
+        str: Compressed counts
+    """
+    chars = []
+    for idx, count in enumerate(counts):
+        x = int(count) - (int(counts[idx-2]) if idx > 2 else 0)
+        more = True
+        while more:
+            c = x & 0x1f
+            x >>= 5
+            more = (x != -1) if (c & 0x10) else (x != 0)
+            if more:
+                c |= 0x20
+            chars.append(chr(c + 48))
+    return "".join(chars)
+
+
+def counts_from_string(s: str) -> np.ndarray:
+    """Decompress run lengths compressed with `counts_to_string`
+
+    Args:
+        s (str): Compressed counts
+
+    Returns:
+        np.ndarray: Run lengths
+    """
+    counts: List[int] = []
+    p = 0
+    while p < len(s):
+        x = 0
+        k = 0
+        more = True
+        while more:
+            c = ord(s[p]) - 48
+            x |= (c & 0x1f) << (5 * k)
+            more = bool(c & 0x20)
+            p += 1
+            k += 1
+            if not more and (c & 0x10):
+                x |= -1 << (5 * k)
+        if len(counts) > 2:
+            x += counts[-2]
+        counts.append(x)
+    return np.array(counts, dtype=np.int64)
+
+
+def rle_counts(rle: Rle) -> np.ndarray:
+    """Run lengths of a mask, whether compressed or not
+    """
+    counts = rle["counts"]
+    if isinstance(counts, str):
+        return counts_from_string(counts)
+    return np.asarray(counts, dtype=np.int64)
+
+
+def _rle(counts: np.ndarray, height: int, width: int) -> Rle:
+    return {"size": [int(height), int(width)], "counts": counts_to_string(counts.tolist())}
+
+
+def rle_encode(mask: np.ndarray) -> Rle:
+    """Run-length encode a dense mask
+
+    Args:
+        mask (np.ndarray): Mask of shape (height, width); nonzero is foreground
+
+    Returns:
+        Rle: Mask with compressed counts
+    """
+    height, width = mask.shape
+    flat = np.asarray(mask, dtype=bool).ravel(order="F")
+    if flat.size == 0:
+        return _rle(np.zeros(0, dtype=np.int64), height, width)
+    changes = np.flatnonzero(flat[1:] != flat[:-1]) + 1
+    counts = np.diff(np.concatenate(([0], changes, [flat.size])))
+    if flat[0]:
+        counts = np.concatenate(([0], counts))
+    return _rle(counts, height, width)
+
+
+def rle_from_positions(positions: np.ndarray, height: int, width: int) -> Rle:
+    """Run-length encode a mask given the sorted column-major indices of its foreground pixels, without a dense mask
+
+    Args:
+        positions (np.ndarray): Sorted indices `x * height + y` of foreground pixels
+        height (int): Image height
+        width (int): Image width
+
+    Returns:
+        Rle: Mask with compressed counts
+    """
+    n = height * width
+    if positions.size == 0:
+        return _rle(np.array([n], dtype=np.int64), height, width)
+    breaks = np.flatnonzero(np.diff(positions) != 1) + 1
+    starts = positions[np.concatenate(([0], breaks))]
+    ends = positions[np.concatenate((breaks - 1, [positions.size - 1]))] + 1
+    bounds = np.empty(2 * starts.size + 2, dtype=np.int64)
+    bounds[0] = 0
+    bounds[1:-1:2] = starts
+    bounds[2:-1:2] = ends
+    bounds[-1] = n
+    counts = np.diff(bounds)
+    if counts[-1] == 0:
+        counts = counts[:-1]
+    return _rle(counts, height, width)
+
+
+def rle_decode(rle: Rle) -> np.ndarray:
+    """Decode to a dense mask. Avoid for large images: the other functions work on the runs directly
+
+    Args:
+        rle (Rle): Mask
+
+    Returns:
+        np.ndarray: Boolean mask of shape (height, width)
+    """
+    height, width = rle["size"]
+    counts = rle_counts(rle)
+    values = np.arange(counts.size) % 2 == 1
+    return np.repeat(values, counts).reshape((height, width), order="F")
+
+
+def rle_area(rle: Rle) -> int:
+    """Number of foreground pixels
+    """
+    return int(rle_counts(rle)[1::2].sum())
+
+
+def rle_to_xyxy(rle: Rle) -> List[int]:
+    """Bounding box of the foreground in [xlower,ylower,xupper,yupper] format, computed from the runs
+
+    Args:
+        rle (Rle): Mask
+
+    Returns:
+        List[int]: Bounding box, or [0,0,0,0] if the mask is empty
+    """
+    height = rle["size"][0]
+    counts = rle_counts(rle)
+    bounds = np.cumsum(counts)
+    starts = bounds[0:-1:2]
+    ends = bounds[1::2] - 1 # Inclusive
+    lengths = counts[1::2]
+    keep = lengths > 0
+    starts, ends = starts[:ends.size][keep], ends[keep]
+    if starts.size == 0:
+        return [0, 0, 0, 0]
+
+    # Runs spanning several columns cover the whole height
+    spans = (ends // height) > (starts // height)
+    y0 = int(np.where(spans, 0, starts % height).min())
+    y1 = int(np.where(spans, height - 1, ends % height).max()) + 1
+    x0 = int(starts[0] // height)
+    x1 = int(ends[-1] // height) + 1
+    return [x0, y0, x1, y1]
+
+
+def rle_sample(rle: Rle, height_out: int, width_out: int) -> np.ndarray:
+    """Downsampled mask, by looking up the pixel at the center of each output cell in the runs, without a dense mask
+
+    Args:
+        rle (Rle): Mask
+        height_out (int): Output height
+        width_out (int): Output width
+
+    Returns:
+        np.ndarray: Boolean mask of shape (height_out, width_out)
+    """
+    height, width = rle["size"]
+    ys = ((np.arange(height_out) + 0.5) * height / height_out).astype(np.int64)
+    xs = ((np.arange(width_out) + 0.5) * width / width_out).astype(np.int64)
+    bounds = np.cumsum(rle_counts(rle))
+    run = np.searchsorted(bounds, xs[None,:] * height + ys[:,None], side="right")
+    return run % 2 == 1
+
+
+def rle_from_polygon(xy: Sequence[Tuple[float,float]], height: int, width: int) -> Rle:
+    """Rasterize a polygon to a mask. Only the polygon's bounding box is rasterized
+
+    Args:
+        xy (Sequence[Tuple[float,float]]): Vertices in pixel coordinates, with pixel edges at integers
+        height (int): Image height
+        width (int): Image width
+
+    Returns:
+        Rle: Mask
+    """
+    if len(xy) < 3:
+        return rle_from_positions(np.zeros(0, dtype=np.int64), height, width)
+    pts = np.asarray(xy, dtype=float)
+    x0 = max(int(np.floor(pts[:,0].min())), 0)
+    y0 = max(int(np.floor(pts[:,1].min())), 0)
+    x1 = min(int(np.ceil(pts[:,0].max())), width)
+    y1 = min(int(np.ceil(pts[:,1].max())), height)
+    if x1 <= x0 or y1 <= y0:
+        return rle_from_positions(np.zeros(0, dtype=np.int64), height, width)
+
+    # PIL fills pixels whose centers are inside, with pixel centers at integers
+    crop = Image.new("1", (x1 - x0, y1 - y0))
+    ImageDraw.Draw(crop).polygon([ (x - x0 - 0.5, y - y0 - 0.5) for x, y in pts ], fill=1)
+
+    # Nonzero of the transpose is sorted by column, then row: column-major order
+    cx, cy = np.nonzero(np.array(crop).T)
+    return rle_from_positions((cx.astype(np.int64) + x0) * height + cy + y0, height, width)
+
+
+def path_to_polygon(path: str) -> List[Tuple[float,float]]:
+    """Vertices of a closed SVG path as drawn in a Plotly figure, e.g. "M10,20L30,40L50,60Z"
+
+    Args:
+        path (str): SVG path with only straight segments
+
+    Returns:
+        List[Tuple[float,float]]: Vertices
+    """
+    numbers = [ float(x) for x in re.findall(r"[-+]?(?:\d+\.?\d*|\.\d+)(?:[eE][-+]?\d+)?", path) ]
+    return list(zip(numbers[0::2], numbers[1::2]))
+
+
+def rle_overlay(rles: Sequence[Rle], colors: Sequence[Tuple[int,int,int]], max_size: int, opacity: float = 0.5) -> Image.Image:
+    """Color overlay of masks at a reduced resolution, for display over the image
+
+    Args:
+        rles (Sequence[Rle]): Masks of the same size
+        colors (Sequence[Tuple[int,int,int]]): Color of each mask
+        max_size (int): Maximum size in pixels along the longer side
+        opacity (float, optional): Opacity of the masks. Defaults to 0.5.
+
+    Returns:
+        Image.Image: RGBA overlay, transparent outside the masks
+    """
+    assert len(rles) > 0, "Need at least one mask"
+    height, width = rles[0]["size"]
+    scale = min(max_size / max(height, width), 1.0)
+    height_out, width_out = max(int(round(height * scale)), 1), max(int(round(width * scale)), 1)
+    overlay = np.zeros((height_out, width_out, 4), dtype=np.uint8)
+    for rle, color in zip(rles, colors):
+        sampled = rle_sample(rle, height_out, width_out)
+        overlay[sampled] = (*color, int(255 * opacity))
+    return Image.fromarray(overlay, mode="RGBA")
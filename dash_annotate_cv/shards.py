@@ -0,0 +1,195 @@
+from dash_annotate_cv.annotation_storage import StorageType
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.formats.json_stream import iter_json_array_member, iter_json_object_member
+from dash_annotate_cv.formats.coco import coco_image_to_annotation, coco_annotation_to_bbox, coco_annotation_to_mask, is_coco_rle_annotation
+
+from dataclasses import dataclass
+from typing import Optional, List, Dict, Tuple, Callable, Iterator, Any
+import json
+import math
+import zlib
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+# Rough ratio of the in-memory size of decoded annotations to their size as JSON text
+MEMORY_PER_JSON_BYTE = 10
+
+# Report progress every this many items
+PROGRESS_EVERY = 10000
+
+
+@dataclass
+class ConvertProgress:
+    """Progress of a conversion
+    """
+
+    # Stage: "stream" (single pass), "partition", "convert" (shards) or "assemble"; "merge" (shards) when merging
+    stage: str
+
+    # Items done in this stage: images for "stream" and "partition", shards for "convert" and "assemble"
+    done: int
+
+    # Total items in this stage, if known
+    total: Optional[int] = None
+
+
+ProgressCallback = Callable[[ConvertProgress], None]
+
+
+def choose_no_shards(input_bytes: int, workers: int = 1, max_memory_mb: Optional[float] = None) -> int:
+    """Number of shards so that each worker holds at most its share of the memory ceiling
+
+    Args:
+        input_bytes (int): Size of the input file
+        workers (int, optional): Number of worker processes. Defaults to 1.
+        max_memory_mb (Optional[float], optional): Memory ceiling across all workers. Defaults to None.
+
+    Returns:
+        int: Number of shards, 1 means a single streaming pass
+    """
+    no_shards = max(1, workers)
+    if max_memory_mb is not None:
+        budget_per_worker = max_memory_mb * 1024 * 1024 / max(1, workers)
+        no_shards = max(no_shards, math.ceil(input_bytes * MEMORY_PER_JSON_BYTE / budget_per_worker))
+    return no_shards
+
+
+def report_progress(progress: Optional[ProgressCallback], stage: str, done: int, total: Optional[int] = None, force: bool = False):
+    """Call the progress callback, if any, every `PROGRESS_EVERY` items or if forced
+    """
+    if progress is not None and (force or done % PROGRESS_EVERY == 0):
+        progress(ConvertProgress(stage=stage, done=done, total=total))
+
+
+@dataclass
+class ShardCounts:
+    """Number of records in a shard, from which ids are preassigned
+    """
+
+    no_images: int = 0
+    no_bboxs: int = 0
+    no_masks: int = 0
+
+
+def shard_of(key: Any, no_shards: int) -> int:
+    """Shard of an image name, the same across inputs and runs
+    """
+    return zlib.crc32(str(key).encode("utf-8")) % no_shards
+
+
+def partition_annotations(
+    input_file: str,
+    input_type: StorageType,
+    shard_files: List[str],
+    progress: Optional[ProgressCallback]
+    ) -> Tuple[Dict[str,int],Dict[int,str],List[ShardCounts]]:
+    """Split the input into shard files of JSON lines, keeping all records of an image in the same shard
+
+    Args:
+        input_file (str): Input file
+        input_type (StorageType): Storage type of the input
+        shard_files (List[str]): Shard files to write
+        progress (Optional[ProgressCallback]): Called with progress updates
+
+    Returns:
+        Tuple[Dict[str,int],Dict[int,str],List[ShardCounts]]: Class name to category id, COCO category id to name of the input, counts per shard
+    """
+    no_shards = len(shard_files)
+    counts = [ ShardCounts() for _ in range(no_shards) ]
+    category_ids: Dict[str,int] = {}
+    coco_category_names: Dict[int,str] = {}
+    handles = [ open(fname, "w") for fname in shard_files ]
+    no_read = 0
+    try:
+        if input_type == StorageType.JSON:
+            for image_name, entry in iter_json_object_member(input_file, "image_to_entry"):
+                shard = shard_of(image_name, no_shards)
+                handles[shard].write(json.dumps(entry) + "\n")
+                bboxs = entry.get("bboxs") or []
+                masks = entry.get("masks") or []
+                counts[shard].no_images += 1
+                counts[shard].no_bboxs += len(bboxs)
+                counts[shard].no_masks += len(masks)
+                for item in bboxs + masks:
+                    class_name = item.get("class_name")
+                    if class_name is not None and class_name not in category_ids:
+                        category_ids[class_name] = len(category_ids) + 1
+                no_read += 1
+                report_progress(progress, "partition", no_read)
+
+        elif input_type == StorageType.COCO:
+            for cat in iter_json_array_member(input_file, "categories"):
+                coco_category_names[cat["id"]] = cat["name"]
+                if cat["name"] not in category_ids:
+                    category_ids[cat["name"]] = len(category_ids) + 1
+            # Shard by file name like the JSON input, so the same image lands in the same shard across inputs
+            image_id_to_shard: Dict[Any,int] = {}
+            for img in iter_json_array_member(input_file, "images"):
+                shard = shard_of(img["file_name"], no_shards)
+                image_id_to_shard[img["id"]] = shard
+                handles[shard].write(json.dumps({"image": img}) + "\n")
+                counts[shard].no_images += 1
+                no_read += 1
+                report_progress(progress, "partition", no_read)
+            for ann in iter_json_array_member(input_file, "annotations"):
+                assert ann["image_id"] in image_id_to_shard, f"Could not find image with id {ann['image_id']}"
+                shard = image_id_to_shard[ann["image_id"]]
+                handles[shard].write(json.dumps({"annotation": ann}) + "\n")
+                if is_coco_rle_annotation(ann):
+                    counts[shard].no_masks += 1
+                else:
+                    counts[shard].no_bboxs += 1
+
+        else:
+            raise NotImplementedError(f"storage_type {input_type} not implemented")
+    finally:
+        for handle in handles:
+            handle.close()
+
+    report_progress(progress, "partition", no_read, no_read, force=True)
+    return category_ids, coco_category_names, counts
+
+
+def iter_shard_entries(shard_file: str, input_type: StorageType, coco_category_names: Dict[int,str]) -> Iterator[ImageAnnotations.Annotation]:
+    """Annotations of the images of a shard written by `partition_annotations`
+
+    Args:
+        shard_file (str): Shard file
+        input_type (StorageType): Storage type of the input the shard was split from
+        coco_category_names (Dict[int,str]): COCO category id to name of the input
+
+    Yields:
+        ImageAnnotations.Annotation: Annotation for each image
+    """
+    if input_type == StorageType.JSON:
+        with open(shard_file, "r") as f:
+            for line in f:
+                yield ImageAnnotations.Annotation.from_dict(json.loads(line))
+
+    elif input_type == StorageType.COCO:
+        # Only this shard's images and annotations are held in memory
+        images: Dict[Any,Dict] = {}
+        anns_for_image: Dict[Any,List[Dict]] = {}
+        with open(shard_file, "r") as f:
+            for line in f:
+                record = json.loads(line)
+                if "image" in record:
+                    images[record["image"]["id"]] = record["image"]
+                else:
+                    anns_for_image.setdefault(record["annotation"]["image_id"], []).append(record["annotation"])
+        for image_id, img in images.items():
+            entry = coco_image_to_annotation(img)
+            anns = anns_for_image.pop(image_id, None)
+            if anns is not None:
+                bboxs = [ coco_annotation_to_bbox(ann, img, coco_category_names) for ann in anns if not is_coco_rle_annotation(ann) ]
+                masks = [ coco_annotation_to_mask(ann, coco_category_names) for ann in anns if is_coco_rle_annotation(ann) ]
+                entry.bboxs = bboxs if len(bboxs) > 0 else None
+                entry.masks = masks if len(masks) > 0 else None
+            yield entry
+        assert len(anns_for_image) == 0, f"Could not find images with ids {list(anns_for_image.keys())[:10]}"
+
+    else:
+        raise NotImplementedError(f"storage_type {input_type} not implemented")
@@ -0,0 +1,156 @@
+from typing import Optional, List, Dict, Tuple, Any
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+class Taxonomy:
+    """Tree of labels with a precomputed ancestry index
+
+    Every label's ancestors are stored, and labels are numbered in depth-first order so that the descendants of a label
+    are a contiguous range. Ancestry checks are then O(1) and roll-ups O(depth) per label.
+    """
+
+
+    def __init__(self, roots: List[Dict[str,Any]]):
+        """Constructor
+
+        Args:
+            roots (List[Dict[str,Any]]): Top-level nodes of the tree, each `{"name": str, "children": [...]}`; children are optional
+        """
+        # Label to parent, depth-first order, and the end of each label's subtree in that order
+        self._parent: Dict[str,Optional[str]] = {}
+        self._ancestors: Dict[str,Tuple[str,...]] = {}
+        self._pos: Dict[str,int] = {}
+        self._end: Dict[str,int] = {}
+        self.labels: List[str] = []
+
+        # Iterative, so that deep trees do not hit the recursion limit
+        stack: List[Tuple[Dict[str,Any],Optional[str],bool]] = [ (node, None, False) for node in reversed(roots) ]
+        while len(stack) > 0:
+            node, parent, done = stack.pop()
+            name = node["name"]
+            if done:
+                self._end[name] = len(self.labels)
+                continue
+            assert type(name) == str, "Taxonomy node names must be strings"
+            assert name not in self._parent, f"Taxonomy node names must be unique: {name}"
+            self._parent[name] = parent
+            self._ancestors[name] = (self._ancestors[parent] + (parent,)) if parent is not None else ()
+            self._pos[name] = len(self.labels)
+            self.labels.append(name)
+            stack.append((node, parent, True))
+            stack += [ (child, name, False) for child in reversed(node.get("children") or []) ]
+
+        logger.debug(f"Indexed taxonomy with {len(self.labels)} labels")
+
+
+    @classmethod
+    def from_json(cls, data: Any) -> "Taxonomy":
+        """Taxonomy from parsed JSON: a node `{"name": str, "children": [...]}` or a list of nodes
+
+        Args:
+            data (Any): Root node or list of root nodes
+
+        Returns:
+            Taxonomy: Taxonomy
+        """
+        if type(data) == dict:
+            data = [data]
+        assert type(data) == list, "Taxonomy must be a node or a list of nodes"
+        return cls(data)
+
+
+    @classmethod
+    def from_file(cls, fname: str) -> "Taxonomy":
+        """Taxonomy from a JSON file, see `from_json`
+
+        Args:
+            fname (str): JSON file
+
+        Returns:
+            Taxonomy: Taxonomy
+        """
+        with open(fname) as f:
+            return cls.from_json(json.load(f))
+
+
+    def __contains__(self, label: object) -> bool:
+        return label in self._parent
+
+
+    def __len__(self) -> int:
+        return len(self.labels)
+
+
+    def parent(self, label: str) -> Optional[str]:
+        """Parent of a label, or None for a top-level label
+        """
+        return self._parent[label]
+
+
+    def ancestors(self, label: str) -> Tuple[str,...]:
+        """Ancestors of a label, from the top level down to its parent
+        """
+        return self._ancestors[label]
+
+
+    def depth(self, label: str) -> int:
+        """Number of ancestors of a label
+        """
+        return len(self._ancestors[label])
+
+
+    def is_descendant(self, label: str, ancestor: str) -> bool:
+        """Whether a label descends from an ancestor, or is the ancestor itself
+
+        Args:
+            label (str): Label
+            ancestor (str): Possible ancestor
+
+        Returns:
+            bool: True if `label` is in the subtree of `ancestor`
+        """
+        pos = self._pos.get(label)
+        if pos is None or ancestor not in self._pos:
+            return False
+        return self._pos[ancestor] <= pos < self._end[ancestor]
+
+
+    def descendants(self, label: str) -> List[str]:
+        """A label and all its descendants, in depth-first order
+
+        Args:
+            label (str): Label
+
+        Returns:
+            List[str]: Labels in the subtree
+        """
+        return self.labels[self._pos[label]:self._end[label]]
+
+
+    def supercategories(self) -> Dict[str,str]:
+        """Label to parent, for all labels that have one, as the COCO `supercategory`
+
+        Returns:
+            Dict[str,str]: Label to parent
+        """
+        return { label: parent for label, parent in self._parent.items() if parent is not None }
+
+
+    def roll_up(self, counts: Dict[str,int]) -> Dict[str,int]:
+        """Add the counts of each label to its ancestors
+
+        Args:
+            counts (Dict[str,int]): Label to count; labels not in the taxonomy are kept as they are
+
+        Returns:
+            Dict[str,int]: Label to the count of the label and its descendants
+        """
+        rolled_up: Dict[str,int] = {}
+        for label, count in counts.items():
+            for ancestor in self._ancestors.get(label, ()) + (label,):
+                rolled_up[ancestor] = rolled_up.get(ancestor, 0) + count
+        return rolled_up
@@ -0,0 +1,195 @@
+from dash_annotate_cv.metrics import registry as metrics
+
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, Future
+from typing import Optional, List, Dict, Union
+from PIL import Image
+import base64
+import hashlib
+import io
+import os
+import tempfile
+import threading
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+ThumbnailSource = Union[str,Image.Image]
+
+
+def make_thumbnail(image: Image.Image, size: int) -> bytes:
+    """JPEG thumbnail of an image, at most `size` pixels along the longer side
+
+    Args:
+        image (Image.Image): Image
+        size (int): Maximum size
+
+    Returns:
+        bytes: JPEG data
+    """
+    # Never changes the given image, which may be the one being annotated
+    image = image.copy() if image.mode == "RGB" else image.convert("RGB")
+    image.thumbnail((size, size))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def _make_thumbnail_file(fname: str, fname_out: str, size: int, large_image_min_pixels: Optional[int]):
+    """Write the thumbnail of an image file
+
+    Runs in a worker process.
+    """
+    from dash_annotate_cv.large_image import LargeImage, is_large_image
+    if large_image_min_pixels is not None and is_large_image(fname, large_image_min_pixels):
+        large = LargeImage(fname)
+        try:
+            data = make_thumbnail(large.overview(size), size)
+        finally:
+            large.close()
+    else:
+        with Image.open(fname) as image:
+            if image.format == "JPEG":
+                # Decode at a reduced scale; the image was opened here, so no one else sees it shrink
+                image.draft("RGB", (size, size))
+            data = make_thumbnail(image, size)
+    fname_tmp = f"{fname_out}.{os.getpid()}.tmp"
+    with open(fname_tmp, "wb") as f:
+        f.write(data)
+    os.replace(fname_tmp, fname_out)
+
+
+def thumbnail_data_uri(data: bytes) -> str:
+    return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+
+class ThumbnailCache:
+    """Thumbnails of image files, generated in a process pool and cached on disk
+
+    Thumbnails are keyed by file path, size and modification time, so they are regenerated when a file changes.
+    In-memory images (e.g. the default image source) are thumbnailed in-process and cached in memory by image name, keeping the most recently used.
+    """
+
+
+    def __init__(self, size: int = 160, cache_dir: Optional[str] = None, workers: Optional[int] = None, large_image_min_pixels: Optional[int] = None, memory_max_items: int = 1024):
+        """Constructor
+
+        Args:
+            size (int, optional): Maximum thumbnail size along the longer side. Defaults to 160.
+            cache_dir (Optional[str], optional): Directory for thumbnails. Defaults to None, i.e. a "dacv_thumbnails" folder in the system temporary directory.
+            workers (Optional[int], optional): Number of worker processes. Defaults to None, i.e. up to 4 depending on the CPU count.
+            large_image_min_pixels (Optional[int], optional): Files with at least this many pixels are read as `LargeImage`, as in the image source. Defaults to None.
+            memory_max_items (int, optional): Maximum number of thumbnails of in-memory images kept. Defaults to 1024.
+        """
+        assert memory_max_items >= 1, "memory_max_items must be at least 1"
+        self.size = size
+        self.memory_max_items = memory_max_items
+        self.cache_dir = cache_dir or os.path.join(tempfile.gettempdir(), "dacv_thumbnails")
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.large_image_min_pixels = large_image_min_pixels
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._pending: Dict[str,Future] = {}
+        self._memory: "OrderedDict[str,bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+
+    def _fname_cache(self, fname: str) -> str:
+        stat = os.stat(fname)
+        key = f"{os.path.abspath(fname)}:{stat.st_size}:{stat.st_mtime_ns}:{self.size}"
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".jpg")
+
+
+    def _submit(self, fname: str) -> Optional[Future]:
+        """Start generating the thumbnail of a file unless it is cached or pending; the lock must be held
+        """
+        try:
+            fname_cache = self._fname_cache(fname)
+        except OSError:
+            # Reported when the thumbnail is read
+            return None
+        if fname_cache in self._pending:
+            return self._pending[fname_cache]
+        if os.path.exists(fname_cache):
+            return None
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        future = self._executor.submit(_make_thumbnail_file, fname, fname_cache, self.size, self.large_image_min_pixels)
+        self._pending[fname_cache] = future
+        future.add_done_callback(lambda _: self._pending.pop(fname_cache, None))
+        return future
+
+
+    def prefetch(self, sources: List[ThumbnailSource]):
+        """Start generating thumbnails in the background without waiting for them
+
+        Args:
+            sources (List[ThumbnailSource]): File names or in-memory images
+        """
+        with self._lock:
+            for source in sources:
+                if isinstance(source, str):
+                    self._submit(source)
+
+
+    def get_many(self, sources: List[ThumbnailSource], names: Optional[List[str]] = None) -> List[Optional[bytes]]:
+        """JPEG thumbnails, generating missing ones in parallel
+
+        Args:
+            sources (List[ThumbnailSource]): File names or in-memory images
+            names (Optional[List[str]], optional): Image name of each source, under which thumbnails of in-memory images are cached. Defaults to None, i.e. in-memory images are not cached.
+
+        Returns:
+            List[Optional[bytes]]: JPEG data, None for files that could not be read
+        """
+        with self._lock:
+            futures = [ self._submit(source) if isinstance(source, str) else None for source in sources ]
+
+        assert names is None or len(names) == len(sources), "names must have one name per source"
+        results: List[Optional[bytes]] = []
+        for idx, (source, future) in enumerate(zip(sources, futures)):
+            if not isinstance(source, str):
+                results.append(self._get_memory(source, names[idx] if names is not None else None))
+                continue
+
+            metrics.record_cache("thumbnails", future is None)
+            try:
+                if future is not None:
+                    future.result()
+                with open(self._fname_cache(source), "rb") as f:
+                    results.append(f.read())
+            except Exception as e:
+                logger.warning(f"Could not create thumbnail for {source}: {e}")
+                results.append(None)
+        return results
+
+
+    def _get_memory(self, image: Image.Image, name: Optional[str]) -> bytes:
+        """Thumbnail of an in-memory image, cached by name
+        """
+        with self._lock:
+            data = self._memory.get(name) if name is not None else None
+            if data is not None:
+                self._memory.move_to_end(name) # type: ignore
+        metrics.record_cache("thumbnails", data is not None)
+        if data is not None:
+            return data
+
+        data = make_thumbnail(image, self.size)
+        if name is not None:
+            with self._lock:
+                self._memory[name] = data
+                while len(self._memory) > self.memory_max_items:
+                    self._memory.popitem(last=False)
+        return data
+
+
+    def close(self):
+        """Shut down the worker processes
+        """
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
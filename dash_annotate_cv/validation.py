@@ -0,0 +1,106 @@
+from dash_annotate_cv.formats.image_annotations import ImageAnnotations
+from dash_annotate_cv.overlap import find_duplicate
+
+from dataclasses import dataclass
+from mashumaro import DataClassDictMixin
+from typing import Optional, List, Iterable, Callable, Collection
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class ValidationIssue(DataClassDictMixin):
+    """Problem found in the annotation of an image
+    """
+
+    # Image name
+    image_name: str
+
+    # Description
+    message: str
+
+    # Index of the bbox, if the issue concerns one
+    bbox_idx: Optional[int] = None
+
+
+def validate_entry(
+    entry: ImageAnnotations.Annotation,
+    labels: Optional[Collection[str]] = None,
+    duplicate_iou_threshold: Optional[float] = None
+    ) -> List[ValidationIssue]:
+    """Check the annotation of an image
+
+    Checks that labels, bbox and mask classes are allowed, that bboxs have positive size and lie within the image if its size is known,
+    that masks match the image size, and optionally that no two bboxs duplicate each other.
+
+    Args:
+        entry (ImageAnnotations.Annotation): Annotation of the image
+        labels (Optional[Collection[str]], optional): Allowed labels. Defaults to None, i.e. any label is allowed.
+        duplicate_iou_threshold (Optional[float], optional): IoU at or above which two bboxs are duplicates. Defaults to None, i.e. no check.
+
+    Returns:
+        List[ValidationIssue]: Issues found
+    """
+    issues: List[ValidationIssue] = []
+    name = entry.image_name
+
+    if entry.label is not None and labels is not None:
+        for value in ([entry.label.single] if entry.label.single is not None else []) + (entry.label.multiple or []):
+            if value not in labels:
+                issues.append(ValidationIssue(name, f"Label '{value}' is not allowed"))
+
+    bboxs = entry.bboxs or []
+    for idx, bbox in enumerate(bboxs):
+        if bbox.class_name is not None and labels is not None and bbox.class_name not in labels:
+            issues.append(ValidationIssue(name, f"Class '{bbox.class_name}' is not allowed", idx))
+        x0, y0, x1, y1 = bbox.xyxy
+        if x1 <= x0 or y1 <= y0:
+            issues.append(ValidationIssue(name, f"Bbox {bbox.xyxy} has no area", idx))
+        if min(x0, y0) < 0 \
+            or (entry.image_width is not None and x1 > entry.image_width) \
+            or (entry.image_height is not None and y1 > entry.image_height):
+            issues.append(ValidationIssue(name, f"Bbox {bbox.xyxy} is outside the image", idx))
+        if duplicate_iou_threshold is not None and idx > 0:
+            duplicate = find_duplicate(bboxs[:idx], bbox.xyxy, bbox.class_name, duplicate_iou_threshold)
+            if duplicate is not None:
+                issues.append(ValidationIssue(name, f"Bbox duplicates bbox {duplicate[0]} (IoU {duplicate[1]:.2f})", idx))
+
+    for idx, mask in enumerate(entry.masks or []):
+        if mask.class_name is not None and labels is not None and mask.class_name not in labels:
+            issues.append(ValidationIssue(name, f"Mask class '{mask.class_name}' is not allowed"))
+        if (entry.image_height is not None and mask.size[0] != entry.image_height) \
+            or (entry.image_width is not None and mask.size[1] != entry.image_width):
+            issues.append(ValidationIssue(name, f"Mask {idx} has size {mask.size}, but the image is {entry.image_height}x{entry.image_width}"))
+
+    return issues
+
+
+def validate_entries(
+    entries: Iterable[ImageAnnotations.Annotation],
+    labels: Optional[Collection[str]] = None,
+    duplicate_iou_threshold: Optional[float] = None,
+    on_entry: Optional[Callable[[int], None]] = None
+    ) -> List[ValidationIssue]:
+    """Check the annotations of several images, e.g. streamed from a file
+
+    Args:
+        entries (Iterable[ImageAnnotations.Annotation]): Annotation for each image
+        labels (Optional[Collection[str]], optional): Allowed labels. Defaults to None, i.e. any label is allowed.
+        duplicate_iou_threshold (Optional[float], optional): IoU at or above which two bboxs are duplicates. Defaults to None, i.e. no check.
+        on_entry (Optional[Callable[[int], None]], optional): Called with the number of images checked so far. Defaults to None.
+
+    Returns:
+        List[ValidationIssue]: Issues found
+    """
+    # Constant time lookups for long lists of labels
+    if isinstance(labels, list):
+        labels = set(labels)
+
+    issues: List[ValidationIssue] = []
+    for no_checked, entry in enumerate(entries, start=1):
+        issues += validate_entry(entry, labels, duplicate_iou_threshold)
+        if on_entry is not None:
+            on_entry(no_checked)
+    return issues
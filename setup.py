@@ -18,17 +18,24 @@ setup(
         "Operating System :: OS Independent",
     ],
     install_requires=[
-        "dash",
+        "dash>=2.18",
         "scikit_image",
         "plotly",
         "dash_bootstrap_components",
         "dataclasses",
         "mashumaro",
+        "numpy",
         "pandas",
         "Pillow",
         "pyyaml",
-        "scikit-image"
+        "scikit-image",
+        "scipy"
     ],
+    extras_require={
+        "large_images": ["tifffile"],
+        "remote": ["requests"],
+        "video": ["av"],
+    },
     python_requires=">=3.6",
     entry_points = {
         'console_scripts': ['dacv=dash_annotate_cv.command_line:cli'],
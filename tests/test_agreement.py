@@ -0,0 +1,90 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.agreement import cohens_kappa
+from dash_annotate_cv.formats.default import write_default_json
+from dash_annotate_cv.formats.coco import write_to_coco
+import pytest
+import os
+
+
+Bbox = dacv.ImageAnnotations.Annotation.Bbox
+Label = dacv.ImageAnnotations.Annotation.Label
+
+
+def make_anns(entries) -> dacv.ImageAnnotations:
+    anns = dacv.ImageAnnotations.new()
+    for image_name, label, bboxs in entries:
+        anns.image_to_entry[image_name] = dacv.ImageAnnotations.Annotation(
+            image_name=image_name,
+            label=Label(single=label) if label is not None else None,
+            bboxs=bboxs
+            )
+    return anns
+
+
+class TestAgreement:
+
+    def test_match_bboxs(self):
+        bboxs_a = [ Bbox(xyxy=[0,0,10,10]), Bbox(xyxy=[20,20,30,30]), Bbox(xyxy=[100,100,110,110]) ]
+        # Greedy matching of the first bbox of b would take a[0]; the optimal assignment does not
+        bboxs_b = [ Bbox(xyxy=[19,19,30,30]), Bbox(xyxy=[1,0,10,10]) ]
+        match = dacv.match_bboxs(bboxs_a, bboxs_b, iou_threshold=0.5)
+        assert sorted((i,j) for i, j, _ in match.matches) == [(0,1), (1,0)]
+        assert match.unmatched_a == [2]
+        assert match.unmatched_b == []
+
+        assert dacv.match_bboxs([], bboxs_b).unmatched_b == [0,1]
+
+    def test_cohens_kappa(self):
+        assert cohens_kappa({}) is None
+        assert cohens_kappa({("cat","cat"): 5, ("dog","dog"): 5}) == pytest.approx(1.0)
+        # Textbook example: po = 0.7, pe = 0.5
+        assert cohens_kappa({("y","y"): 20, ("y","n"): 5, ("n","y"): 10, ("n","n"): 15}) == pytest.approx(0.4)
+
+    @pytest.mark.parametrize("workers", [1, 2])
+    def test_compute_agreement(self, workers: int):
+        anns_a = make_anns([
+            ("1", "cat", [ Bbox(xyxy=[0,0,10,10], class_name="cat"), Bbox(xyxy=[50,50,60,60], class_name="dog") ]),
+            ("2", "dog", [ Bbox(xyxy=[0,0,10,10], class_name="dog") ]),
+            ("3", "cat", None),
+            ("only_a", "cat", None)
+            ])
+        anns_b = make_anns([
+            ("1", "cat", [ Bbox(xyxy=[0,0,10,11], class_name="cat"), Bbox(xyxy=[50,50,60,60], class_name="cat") ]),
+            ("2", "cat", [ Bbox(xyxy=[0,0,10,10], class_name="dog"), Bbox(xyxy=[80,80,90,90], class_name="dog") ]),
+            ("3", "cat", None)
+            ])
+        report = dacv.compute_agreement({"a": anns_a, "b": anns_b, "c": anns_a}, workers=workers, chunk_size=1)
+        assert len(report.pairs) == 3
+
+        pair = report.pair("b", "a")
+        assert pair.no_images_common == 3
+        assert pair.no_images_labeled_both == 3
+        assert pair.label_accuracy == pytest.approx(2/3)
+        assert pair.no_bboxs_a == 3 and pair.no_bboxs_b == 4
+        assert pair.no_bboxs_matched == 3
+        assert pair.per_class["cat"].tp == 1 and pair.per_class["cat"].fp == 1 and pair.per_class["cat"].fn == 0
+        assert pair.per_class["dog"].tp == 1 and pair.per_class["dog"].fp == 1 and pair.per_class["dog"].fn == 1
+        assert pair.per_class["dog"].precision == pytest.approx(0.5)
+        assert pair.per_class["dog"].recall == pytest.approx(0.5)
+
+        same = report.pair("a", "c")
+        assert same.no_images_common == 4
+        assert same.label_kappa == pytest.approx(1.0)
+        assert same.mean_iou == pytest.approx(1.0)
+        assert all(c.fp == 0 and c.fn == 0 for c in same.per_class.values())
+
+        # Serializable for the CLI report
+        assert dacv.AgreementReport.from_dict(report.to_dict()) == report
+
+    def test_load_annotators(self, tmp_path):
+        anns = make_anns([ ("1", "cat", [ Bbox(xyxy=[0,0,10,10], class_name="cat") ]) ])
+        anns.image_to_entry["1"].image_width = 100
+        anns.image_to_entry["1"].image_height = 100
+        fname_json = os.path.join(tmp_path, "alice.json")
+        fname_coco = os.path.join(tmp_path, "bob.coco.json")
+        write_default_json(anns, fname_json)
+        write_to_coco(anns, fname_coco)
+
+        loaded = dacv.load_annotators([fname_json, f"robert={fname_coco}"])
+        assert list(loaded.keys()) == ["alice", "robert"]
+        assert loaded["alice"].image_to_entry["1"].bboxs == loaded["robert"].image_to_entry["1"].bboxs
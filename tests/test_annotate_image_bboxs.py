@@ -1,5 +1,6 @@
 import dash_annotate_cv as dacv
 import pytest
+from dash_annotate_cv.annotate_image_bboxs import BboxListView
 from typing import Dict, List
 
 @pytest.fixture
@@ -74,4 +75,34 @@ class TestBboxToShapeConverter:
     
     def test_bbox_to_shape(self, converter: dacv.BboxToShapeConverter, matching_bboxs: List[dacv.Bbox], matching_shapes: List[Dict]):
         shape = converter.bbox_to_shape(matching_bboxs[0])
-        check_shapes_match([shape], [matching_shapes[0]])
\ No newline at end of file
+        check_shapes_match([shape], [matching_shapes[0]])
+
+class TestBboxListView:
+
+    def test_add_and_page(self):
+        view = BboxListView(page_size=2)
+        view.reset(1)
+        assert view.added() == [("append", 1)]
+        assert view.no_pages == 1
+
+        # A third bbox goes on a new page, which is rendered
+        assert view.added() is None
+        assert view.page == 1
+        assert view.page_range() == (2, 3)
+        assert view.changed(0) == []
+        assert view.changed(2) == [("replace", 0, 2)]
+
+    def test_remove(self):
+        view = BboxListView(page_size=2)
+        view.reset(5)
+        keys = list(view.keys)
+
+        # The first bbox of the next page moves up into the last row
+        assert view.removed(0) == [("remove", 0), ("append", 1)]
+        assert view.idx_of(keys[2]) == 1
+
+        # Emptying the last page goes back a page
+        view.page = 1
+        assert view.removed(3) == [("remove", 1)]
+        assert view.removed(2) is None
+        assert view.page == 0
@@ -1,6 +1,7 @@
 import dash_annotate_cv as dacv
 from skimage import data
 from PIL import Image
+from dash_annotate_cv.image_source import IndexAboveError, IndexBelowError
 import pytest
 
 @pytest.fixture
@@ -218,4 +219,115 @@ class TestAnnotateImageController:
         assert controller.curr is not None
         assert controller.curr.image_name == "camera"
 
+    def test_progress(self, controller: dacv.AnnotateImageController):
+        progress = controller.progress()
+        assert progress.no_images_total == 3
+        assert progress.no_images_done == 0
+
+        # Bboxs
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        controller.add_bbox(dacv.Bbox(xyxy=[0,20,30,40], class_name="dog"))
+        controller.update_bbox(dacv.BboxUpdate(idx=1, class_name_new="cat"))
+        progress = controller.progress()
+        assert progress.no_images_done == 1
+        assert progress.no_images_with_bboxs == 1
+        assert progress.no_bboxs == 2
+        assert progress.bboxs_per_class == {"cat": 2}
+
+        # Labels
+        controller.store_label_single("cat")
+        controller.store_label_multiple(["cat","dog"])
+        progress = controller.progress()
+        assert progress.no_images_done == 2
+        assert progress.no_images_labeled == 2
+        assert progress.labels_per_class == {"cat": 2, "dog": 1}
+        assert progress.fraction_done == pytest.approx(2/3)
+
+        # Delete
+        controller.previous_image()
+        controller.previous_image()
+        controller.delete_bbox(0)
+        controller.delete_bbox(0)
+        progress = controller.progress()
+        assert progress.no_bboxs == 0
+        assert progress.no_images_with_bboxs == 0
+        assert progress.no_images_done == 2
+
+        # Same as rebuilding from scratch
+        rebuilt = dacv.AnnotationStats.from_annotations(controller.annotations).snapshot(no_images_total=3)
+        assert rebuilt == progress
+
+    def test_store_label_batch(self, controller: dacv.AnnotateImageController):
+        writes = []
+        write = controller.annotation_writer.write
+        controller.annotation_writer.write = lambda *args: (writes.append(1), write(*args))[1]
+
+        names = [ controller.image_name_at_idx(idx) for idx in range(3) ]
+        assert names == ["chelsea", "astronaut", "camera"]
+        controller.store_label_single("dog", image_names=names[1:])
+
+        # One write, current image unchanged
+        assert len(writes) == 1
+        assert controller.curr is not None
+        assert controller.curr.image_name == "chelsea"
+        assert controller.label_for_image("chelsea") is None
+        label = controller.label_for_image("camera")
+        assert label is not None and label.single == "dog"
+        assert controller.annotations.image_to_entry["astronaut"].label is not controller.annotations.image_to_entry["camera"].label
+        assert controller.progress().no_images_done == 2
+
+        # Batch including the current image refreshes it
+        controller.store_label_multiple(["cat","dog"], image_names=names)
+        assert controller.curr is not None
+        assert controller.curr.label_multiple == ["cat","dog"]
+        assert controller.progress().no_images_done == 3
+
+    def test_store_labels_batch(self, controller: dacv.AnnotateImageController):
+        controller.store_labels_batch([("chelsea","cat"), ("camera",["cat","dog"])])
+        assert controller.annotations.image_to_entry["chelsea"].label.single == "cat" # type: ignore
+        assert controller.annotations.image_to_entry["camera"].label.multiple == ["cat","dog"] # type: ignore
+        assert controller.curr is not None
+        assert controller.curr.image_name == "chelsea"
+        assert controller.curr.label_single == "cat"
+
+        # Nothing is stored if any label is invalid
+        with pytest.raises(dacv.InvalidLabelError):
+            controller.store_labels_batch([("astronaut","dog"), ("camera","invalid")])
+        assert "astronaut" not in controller.annotations.image_to_entry
+
+    def test_go_to_image(self, controller: dacv.AnnotateImageController):
+        controller.go_to_image(2)
+        assert controller.curr is not None
+        assert controller.curr.image_name == "camera"
+        controller.previous_image()
+        assert controller.curr.image_name == "astronaut"
+        with pytest.raises(IndexAboveError):
+            controller.go_to_image(3)
+        with pytest.raises(IndexBelowError):
+            controller.go_to_image(-1)
+
+    def test_masks(self, controller: dacv.AnnotateImageController):
+        assert controller.curr is not None
+        height, width = controller.curr.image.height, controller.curr.image.width
+        rle = dacv.rle_from_polygon([(10,10),(50,10),(50,30),(10,30)], height, width)
+        controller.add_mask(rle)
+        controller.update_mask_class(0, "cat")
+        assert len(controller.curr_masks) == 1
+        mask = controller.annotations.image_to_entry["chelsea"].masks[0] # type: ignore
+        assert mask.class_name == "cat"
+        assert mask.area == 40 * 20
+        assert mask.xyxy == [10,10,50,30]
+        assert controller.progress().no_masks == 1
+        assert controller.progress().no_images_done == 1
+
+        with pytest.raises(dacv.InvalidMaskError):
+            controller.add_mask(dacv.rle_from_polygon([(10,10),(50,10),(50,30)], height + 1, width))
+        with pytest.raises(dacv.InvalidMaskError):
+            controller.add_mask(dacv.rle_from_polygon([], height, width))
+        with pytest.raises(dacv.InvalidLabelError):
+            controller.update_mask_class(0, "invalid")
 
+        controller.delete_mask(0)
+        assert controller.curr_masks == []
+        assert controller.progress().no_masks == 0
+        assert controller.progress().no_images_done == 0
@@ -0,0 +1,77 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.formats.default import load_from_default_json_if_exist
+from PIL import Image
+import multiprocessing
+import pytest
+
+
+NO_IMAGES = 60
+NO_WORKERS = 4
+
+
+def _storage(json_file: str) -> dacv.AnnotationStorage:
+    return dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=json_file, multi_process=True)
+
+
+def _label(name: str, value: str) -> dacv.ImageAnnotations.Annotation:
+    return dacv.ImageAnnotations.Annotation(image_name=name, label=dacv.ImageAnnotations.Annotation.Label(single=value))
+
+
+def _annotate(json_file: str, worker: int) -> int:
+    names = [ f"image{i}" for i in range(NO_IMAGES) ]
+    storage = _storage(json_file)
+    controller = dacv.AnnotateImageController(
+        label_source=dacv.LabelSource(labels=["cat", "dog"]),
+        image_source=dacv.ImageSource(images=[ (name, Image.new("RGB", (16,16))) for name in names ]),
+        annotation_storage=storage,
+        annotations_existing=dacv.load_image_anns_from_storage(storage)
+        )
+    for idx in range(worker, NO_IMAGES, NO_WORKERS):
+        controller.store_label_single("cat", image_names=[names[idx]])
+        controller.go_to_image(idx)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,8,8], class_name="dog"))
+    return controller.progress().no_images_done
+
+
+class TestAnnotationStorage:
+
+    def test_multi_process_requires_json(self, tmp_path):
+        with pytest.raises(AssertionError):
+            dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=str(tmp_path / "coco.json"), multi_process=True)
+
+    def test_merge_entries_of_other_writers(self, tmp_path):
+        json_file = str(tmp_path / "anns.json")
+        writer_a, writer_b = dacv.AnnotationWriter(_storage(json_file)), dacv.AnnotationWriter(_storage(json_file))
+        anns_a, anns_b = dacv.ImageAnnotations.new(), dacv.ImageAnnotations.new()
+
+        anns_a.image_to_entry["a"] = _label("a", "cat")
+        assert writer_a.write(anns_a, ["a"]) == []
+
+        # B changes another image and the image A wrote: its own change wins, the other is taken from the file
+        anns_b.image_to_entry["a"] = _label("a", "dog")
+        anns_b.image_to_entry["b"] = _label("b", "dog")
+        anns_a.image_to_entry["c"] = _label("c", "cat")
+        assert writer_b.write(anns_b, ["a", "b"]) == []
+        replaced = writer_a.write(anns_a, ["c"])
+        assert sorted([ entry_new.image_name for _, entry_new in replaced ]) == ["a", "b"]
+
+        anns = load_from_default_json_if_exist(json_file)
+        assert anns is not None
+        assert { name: entry.label.single for name, entry in anns.image_to_entry.items() } == {"a": "dog", "b": "dog", "c": "cat"} # type: ignore
+        assert anns_a.image_to_entry["a"].label.single == "dog" # type: ignore
+
+    def test_multi_process_no_lost_updates(self, tmp_path):
+        json_file = str(tmp_path / "anns.json")
+        ctx = multiprocessing.get_context("spawn")
+        with ctx.Pool(NO_WORKERS) as pool:
+            no_done = pool.starmap(_annotate, [ (json_file, worker) for worker in range(NO_WORKERS) ])
+
+        anns = load_from_default_json_if_exist(json_file)
+        assert anns is not None
+        assert len(anns.image_to_entry) == NO_IMAGES
+        for entry in anns.image_to_entry.values():
+            assert entry.label is not None and entry.label.single == "cat"
+            assert entry.bboxs is not None and len(entry.bboxs) == 1
+
+        # The process that wrote last has seen every other process's annotations
+        assert max(no_done) == NO_IMAGES
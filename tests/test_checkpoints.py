@@ -0,0 +1,88 @@
+import dash_annotate_cv as dacv
+from skimage import data
+from PIL import Image
+import os
+
+
+def entry(image_name: str, label: str) -> dacv.ImageAnnotations.Annotation:
+    return dacv.ImageAnnotations.Annotation(image_name=image_name, label=dacv.ImageAnnotations.Annotation.Label(single=label))
+
+
+class TestCheckpointStore:
+
+    def test_deltas_and_restore(self, tmp_path):
+        store = dacv.CheckpointStore(str(tmp_path))
+        anns = dacv.ImageAnnotations(image_to_entry={ f"{i}.jpg": entry(f"{i}.jpg", "cat") for i in range(10) })
+        assert store.checkpoint(anns) is not None
+
+        # Only changed images are stored after the first checkpoint
+        anns.image_to_entry["3.jpg"] = entry("3.jpg", "dog")
+        store.mark_changed(["3.jpg"])
+        info = store.checkpoint(anns)
+        assert info is not None and not info.is_base and info.no_entries == 1
+        assert store.checkpoint(anns) is None
+
+        del anns.image_to_entry["4.jpg"]
+        store.mark_changed(["4.jpg"])
+        info = store.checkpoint(anns)
+        assert info is not None and info.no_deleted == 1
+
+        assert [ info.checkpoint_id for info in store.checkpoints() ] == [1, 2, 3]
+        restored = store.restore(2)
+        assert len(restored.image_to_entry) == 10
+        assert restored.image_to_entry["3.jpg"].label == entry("3.jpg", "dog").label
+
+        # Restored annotations are independent of the checkpoints
+        restored.image_to_entry.clear()
+        assert len(store.restore(2).image_to_entry) == 10
+        assert store.restore(3) == anns
+
+        # A new store starts with a base checkpoint, and lists the existing ones
+        store = dacv.CheckpointStore(str(tmp_path))
+        assert len(store.checkpoints()) == 3
+        info = store.checkpoint(anns)
+        assert info is not None and info.is_base
+
+    def test_retention(self, tmp_path):
+        store = dacv.CheckpointStore(str(tmp_path), keep=2)
+        anns = dacv.ImageAnnotations.new()
+        for i in range(5):
+            anns.image_to_entry[f"{i}.jpg"] = entry(f"{i}.jpg", "cat")
+            store.mark_changed([f"{i}.jpg"])
+            store.checkpoint(anns)
+
+        # Pruned down to the last two once there were more than four; the oldest kept one is now a base
+        checkpoints = store.checkpoints()
+        assert [ info.checkpoint_id for info in checkpoints ] == [4, 5]
+        assert checkpoints[0].is_base
+        assert len([ f for f in os.listdir(tmp_path) if f.endswith(".json.gz") ]) == 2
+        assert set(store.restore(4).image_to_entry.keys()) == { f"{i}.jpg" for i in range(4) }
+        assert store.restore(5) == anns
+
+
+class TestControllerCheckpoints:
+
+    def test_restore(self, tmp_path):
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "dog"]),
+            image_source=dacv.ImageSource(images=[ ("chelsea", Image.fromarray(data.chelsea())), ("camera", Image.fromarray(data.camera())), ("astronaut", Image.fromarray(data.astronaut())) ]), # type: ignore
+            annotation_storage=dacv.AnnotationStorage(checkpoint_dir=str(tmp_path), checkpoint_every_n=1)
+            )
+        controller.store_label_single("cat")
+        checkpoint_id = controller.checkpoints()[-1].checkpoint_id
+        controller.store_label_single("dog")
+        checkpoint_id_before = controller.checkpoints()[-1].checkpoint_id
+        assert controller.progress().no_images_labeled == 2
+
+        controller.restore_checkpoint(checkpoint_id)
+        assert list(controller.annotations.image_to_entry.keys()) == ["chelsea"]
+        assert controller.progress().no_images_labeled == 1
+
+        # Undo the restore
+        controller.restore_checkpoint(checkpoint_id_before)
+        assert controller.progress().no_images_labeled == 2
+
+        # The latest checkpoint matches the annotations
+        store = controller.annotation_writer.checkpoints
+        assert store is not None
+        assert store.restore(store.checkpoints()[-1].checkpoint_id) == controller.annotations
@@ -0,0 +1,138 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.convert import convert_annotations, choose_no_shards
+from dash_annotate_cv.formats.coco import write_to_coco, load_from_coco_if_exist
+from dash_annotate_cv.formats.default import write_default_json, load_from_default_json_if_exist
+from dash_annotate_cv.formats.json_stream import JsonStreamReader
+from dash_annotate_cv.rle import rle_encode
+import numpy as np
+import pytest
+import io
+import json
+import os
+
+
+@pytest.fixture
+def anns():
+    anns = dacv.ImageAnnotations.new()
+    for i in range(50):
+        anns.image_to_entry[f"img_{i}.jpg"] = dacv.ImageAnnotations.Annotation(
+            image_name=f"img_{i}.jpg",
+            label=dacv.ImageAnnotations.Annotation.Label(single="cat", timestamp=1.5, author="me"),
+            bboxs=[ dacv.ImageAnnotations.Annotation.Bbox(xyxy=[j,j,j+10,j+20], class_name=["cat","dog"][j % 2]) for j in range(i % 4) ],
+            image_height=100,
+            image_width=200
+            )
+    return anns
+
+
+@pytest.fixture
+def anns_masks():
+    # One bbox and one mask of a class without bboxs per image
+    anns = dacv.ImageAnnotations.new()
+    for i in range(200):
+        mask = np.zeros((20, 30), dtype=bool)
+        mask[i % 10:i % 10 + 5, 2:12] = True
+        rle = rle_encode(mask)
+        anns.image_to_entry[f"img_{i}.jpg"] = dacv.ImageAnnotations.Annotation(
+            image_name=f"img_{i}.jpg",
+            bboxs=[ dacv.ImageAnnotations.Annotation.Bbox(xyxy=[1,1,10,10], class_name="cat") ],
+            masks=[ dacv.ImageAnnotations.Annotation.Mask(size=rle["size"], counts=rle["counts"], class_name="mcls") ],
+            image_height=20,
+            image_width=30
+            )
+    return anns
+
+
+def json_storage(fname: str) -> dacv.AnnotationStorage:
+    return dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=fname)
+
+
+def coco_storage(fname: str) -> dacv.AnnotationStorage:
+    return dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=fname)
+
+
+class TestJsonStream:
+
+    def test_small_chunks(self):
+        text = '{"skip": [1, {"a": [2, 3]}, "x"], "values": [12345, -1.5e3, "a\\"b", {"k": [true, null]}], "after": 1}'
+        reader = JsonStreamReader(io.StringIO(text), chunk_size=3)
+        assert reader.seek_member("values")
+        values = []
+        for _ in reader.iter_array():
+            values.append(reader.decode_value())
+        assert values == [12345, -1500.0, 'a"b', {"k": [True, None]}]
+
+
+class TestConvert:
+
+    @pytest.mark.parametrize("workers,max_memory_mb", [(1, None), (2, None), (1, 0.01)])
+    def test_json_to_coco(self, anns: dacv.ImageAnnotations, tmp_path, workers: int, max_memory_mb):
+        fname_json = os.path.join(tmp_path, "anns.json")
+        write_default_json(anns, fname_json)
+        fname_coco_expected = os.path.join(tmp_path, "expected.coco.json")
+        write_to_coco(anns, fname_coco_expected)
+
+        fname_coco = os.path.join(tmp_path, "out.coco.json")
+        progress = []
+        result = convert_annotations(fname_json, coco_storage(fname_coco), workers=workers, max_memory_mb=max_memory_mb, progress=progress.append)
+        assert result.no_images == 50
+        assert result.no_bboxs == sum(len(ann.bboxs or []) for ann in anns.image_to_entry.values())
+        assert len(progress) > 0
+
+        # Shards change the order of images, so compare per image
+        expected = load_from_coco_if_exist(fname_coco_expected)
+        loaded = load_from_coco_if_exist(fname_coco)
+        assert expected is not None and loaded is not None
+        assert expected.image_to_entry == loaded.image_to_entry
+
+    @pytest.mark.parametrize("workers,max_memory_mb", [(1, None), (3, None), (2, 0.01)])
+    def test_coco_to_json(self, anns: dacv.ImageAnnotations, tmp_path, workers: int, max_memory_mb):
+        fname_coco = os.path.join(tmp_path, "anns.coco.json")
+        write_to_coco(anns, fname_coco)
+
+        fname_json = os.path.join(tmp_path, "out.json")
+        convert_annotations(fname_coco, json_storage(fname_json), workers=workers, max_memory_mb=max_memory_mb)
+
+        expected = load_from_coco_if_exist(fname_coco)
+        loaded = load_from_default_json_if_exist(fname_json)
+        assert expected is not None and loaded is not None
+        assert expected.image_to_entry == loaded.image_to_entry
+
+    @pytest.mark.parametrize("workers,max_memory_mb", [(1, None), (2, 0.001)])
+    def test_masks(self, anns_masks: dacv.ImageAnnotations, tmp_path, workers: int, max_memory_mb):
+        fname_json = os.path.join(tmp_path, "anns.json")
+        write_default_json(anns_masks, fname_json)
+
+        fname_coco = os.path.join(tmp_path, "out.coco.json")
+        result = convert_annotations(fname_json, coco_storage(fname_coco), workers=workers, max_memory_mb=max_memory_mb)
+        assert result.no_images == 200
+        with open(fname_coco) as f:
+            coco = json.load(f)
+        assert len(coco["annotations"]) == 400
+        assert len(set(ann["id"] for ann in coco["annotations"])) == 400
+        assert sorted(cat["name"] for cat in coco["categories"]) == ["cat", "mcls"]
+        fname_coco_expected = os.path.join(tmp_path, "expected.coco.json")
+        write_to_coco(anns_masks, fname_coco_expected)
+        expected = load_from_coco_if_exist(fname_coco_expected)
+        loaded = load_from_coco_if_exist(fname_coco)
+        assert expected is not None and loaded is not None
+        assert expected.image_to_entry == loaded.image_to_entry
+
+        # And back, splitting the masks from the bboxs
+        fname_out = os.path.join(tmp_path, "out.json")
+        convert_annotations(fname_coco, json_storage(fname_out), workers=workers, max_memory_mb=max_memory_mb)
+        loaded = load_from_default_json_if_exist(fname_out)
+        assert loaded is not None and loaded.image_to_entry == expected.image_to_entry
+
+    def test_json_to_json(self, anns: dacv.ImageAnnotations, tmp_path):
+        fname_json = os.path.join(tmp_path, "anns.json")
+        write_default_json(anns, fname_json)
+        fname_out = os.path.join(tmp_path, "out.json")
+        convert_annotations(fname_json, json_storage(fname_out), workers=2)
+        loaded = load_from_default_json_if_exist(fname_out)
+        assert loaded == anns
+
+    def test_choose_no_shards(self):
+        assert choose_no_shards(1000) == 1
+        assert choose_no_shards(1000, workers=4) == 4
+        assert choose_no_shards(100 * 1024 * 1024, workers=2, max_memory_mb=100) > 2
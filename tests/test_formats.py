@@ -92,4 +92,20 @@ class TestFormats:
         # Load
         anns_loaded = dacv.load_image_anns_from_storage(storage_json)
         assert anns_loaded is not None
-        assert anns == anns_loaded
\ No newline at end of file
+        assert anns == anns_loaded
+
+
+    def test_masks(self, tmp_path, anns: dacv.ImageAnnotations):
+        rle = dacv.rle_from_polygon([(10,10),(50,10),(50,30),(10,30)], 100, 100)
+        mask = dacv.ImageAnnotations.Annotation.Mask(size=rle["size"], counts=rle["counts"], class_name="cat")
+        anns.image_to_entry["test.jpg"].masks = [mask]
+
+        for storage in [
+            dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=str(tmp_path / "anns.json")),
+            dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=str(tmp_path / "coco.json"))
+            ]:
+            dacv.AnnotationWriter(storage).write(anns)
+            anns_loaded = dacv.load_image_anns_from_storage(storage)
+            assert anns_loaded is not None
+            assert anns_loaded.image_to_entry["test.jpg"].masks == [mask]
+            assert len(anns_loaded.image_to_entry["test.jpg"].bboxs or []) == 1
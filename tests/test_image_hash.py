@@ -0,0 +1,149 @@
+import dash_annotate_cv as dacv
+from skimage import data
+from PIL import Image, ImageEnhance
+import random
+import pytest
+import json
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    fnames = []
+    for name, image in [ ("a", data.chelsea()), ("b", data.camera()), ("c", data.chelsea()[:, ::-1]) ]:
+        fname = str(tmp_path / f"{name}.jpg")
+        Image.fromarray(image).save(fname)
+        fnames.append(fname)
+
+    # Near-duplicate of the first image
+    fname = str(tmp_path / "a_copy.jpg")
+    Image.open(fnames[0]).resize((200, 150)).save(fname, quality=60)
+    fnames.append(fname)
+    return fnames
+
+
+@pytest.fixture
+def cache_file(tmp_path):
+    return str(tmp_path / "hashes.json")
+
+
+class TestHashes:
+
+    def test_hashes(self):
+        image = Image.fromarray(data.astronaut())
+        brighter = ImageEnhance.Brightness(image).enhance(1.2)
+        assert dacv.hamming_distance(dacv.difference_hash(image), dacv.difference_hash(image.resize((256, 256)))) <= 4
+        assert dacv.hamming_distance(dacv.difference_hash(image), dacv.difference_hash(brighter)) <= 4
+        assert dacv.hamming_distance(dacv.average_hash(image), dacv.average_hash(Image.fromarray(data.camera()))) > 10
+        assert dacv.difference_hash(image, hash_size=16) < 2**256
+
+    def test_source_image_unchanged(self, image_files):
+        # An opened JPEG can be decoded at a reduced scale; the image being annotated must keep its size
+        with Image.open(image_files[1]) as image:
+            dacv.difference_hash(image)
+            dacv.average_hash(image)
+            assert image.size == (512, 512)
+
+
+class TestBKTree:
+
+    def test_search(self):
+        rng = random.Random(0)
+        hashes = [ rng.getrandbits(64) for _ in range(500) ]
+        tree = dacv.BKTree()
+        for idx, hash in enumerate(hashes):
+            tree.add(hash, idx)
+        tree.add(hashes[0], "copy")
+        assert len(tree) == 501
+
+        query = hashes[0] ^ 0b1011
+        expected = sorted([ (idx, dacv.hamming_distance(query, hash)) for idx, hash in enumerate(hashes) if dacv.hamming_distance(query, hash) <= 20 ], key=lambda x: x[1])
+        found = tree.search(query, 20)
+        assert set(found[:2]) == {(0, 3), ("copy", 3)}
+        assert sorted(idx for idx, _ in found if idx != "copy") == sorted(idx for idx, _ in expected)
+
+
+class TestImageHashIndex:
+
+    def test_cache(self, tmp_path, image_files, cache_file):
+        index = dacv.ImageHashIndex(cache_file=cache_file, workers=2)
+        index.build(image_files + [str(tmp_path / "missing.jpg")])
+        assert index.duplicates_of(0, 6) == [3]
+        assert index.duplicates_of(4, 6) == []
+        assert index.groups(6) == [[0, 3]]
+
+        # Cached hashes are reused, changed files are hashed again
+        with open(cache_file) as f:
+            assert len(json.load(f)["hashes"]) == 4
+        Image.fromarray(data.camera()).save(image_files[0])
+        index = dacv.ImageHashIndex(cache_file=cache_file)
+        index.build(image_files)
+        assert index.duplicates_of(1, 6) == [0]
+
+    def test_batches(self, image_files, cache_file):
+        # Files are hashed in batches as they come, mixed with in-memory images
+        index = dacv.ImageHashIndex(cache_file=cache_file, workers=2)
+        index.build([image_files[0], Image.fromarray(data.camera()), image_files[2], image_files[3]], batch_size=1)
+        assert index.groups(6) == [[0, 3]]
+        assert index.duplicates_of(1, 6) == []
+
+    def test_iterator_of_images(self, image_files, cache_file):
+        # Sources are consumed one at a time, and the images are not changed
+        opened = []
+        def sources():
+            for fname in image_files:
+                image = Image.open(fname)
+                opened.append(image)
+                yield image
+
+        index = dacv.ImageHashIndex(cache_file=cache_file)
+        index.build(sources())
+        assert index.groups(6) == [[0, 3]]
+        assert [ image.size for image in opened ] == [ Image.open(fname).size for fname in image_files ]
+
+
+class TestControllerDuplicates:
+
+    def test_skip_and_propagate(self, image_files, cache_file):
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "other"]),
+            image_source=dacv.ImageSource(source_type=dacv.ImageSource.Type.LIST_OF_FILES, list_of_files=image_files, duplicate_max_distance=6, duplicate_hash_cache_file=cache_file)
+            )
+        assert controller.duplicates_at_idx(3) == [0]
+        controller.store_label_single("cat")
+        controller.store_label_single("other")
+
+        # The duplicate of the first image is skipped
+        with pytest.raises(dacv.image_source.IndexAboveError):
+            controller.store_label_single("cat")
+        assert len(controller.annotations.image_to_entry) == 3
+
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "other"]),
+            image_source=dacv.ImageSource(source_type=dacv.ImageSource.Type.LIST_OF_FILES, list_of_files=image_files, duplicate_max_distance=6, duplicate_hash_cache_file=cache_file, duplicate_action=dacv.DuplicateImageAction.PROPAGATE)
+            )
+        controller.store_label_single("cat")
+        assert controller.annotations.image_to_entry[image_files[3]].label.single == "cat" # type: ignore
+
+    def test_image_size_unchanged(self, image_files, cache_file):
+        # Hashing must not shrink the image shown for annotation
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "other"]),
+            image_source=dacv.ImageSource(
+                source_type=dacv.ImageSource.Type.LOADER,
+                images_loader=lambda idx: Image.open(image_files[idx]),
+                image_names=[ str(idx) for idx in range(len(image_files)) ],
+                duplicate_max_distance=4,
+                duplicate_hash_cache_file=cache_file
+                )
+            )
+        assert controller.curr is not None
+        assert controller.curr.image.size == Image.open(image_files[0]).size
+
+    def test_propagate_batch(self, image_files, cache_file):
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "other"]),
+            image_source=dacv.ImageSource(source_type=dacv.ImageSource.Type.LIST_OF_FILES, list_of_files=image_files, duplicate_max_distance=6, duplicate_hash_cache_file=cache_file, duplicate_action=dacv.DuplicateImageAction.PROPAGATE)
+            )
+        controller.store_labels_batch([(image_files[0], "cat"), (image_files[1], "other")])
+        assert controller.annotations.image_to_entry[image_files[3]].label.single == "cat" # type: ignore
+        assert image_files[2] not in controller.annotations.image_to_entry
@@ -0,0 +1,134 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.image_order import PriorityOrder, shuffled_order, stratified_order, load_priority_file
+from dash_annotate_cv.image_reader import ImageNameIndex
+from dash_annotate_cv.image_source import ImageIterator
+from skimage import data
+from PIL import Image
+import numpy as np
+import json
+import pytest
+
+
+def positions(order, no_images):
+    return [ order.idx_at(pos) for pos in range(no_images) ]
+
+
+@pytest.fixture
+def images():
+    return [ ("chelsea", Image.fromarray(data.chelsea())), ("camera", Image.fromarray(data.camera())), ("astronaut", Image.fromarray(data.astronaut())) ]
+
+
+@pytest.fixture
+def priority_file(tmp_path):
+    fname = str(tmp_path / "scores.json")
+    with open(fname, "w") as f:
+        json.dump({"camera": 0.2, "astronaut": 0.9}, f)
+    return fname
+
+
+class TestOrders:
+
+    def test_shuffled(self):
+        order = shuffled_order(100, seed=3)
+        idxs = positions(order, 100)
+        assert sorted(idxs) == list(range(100))
+        assert idxs != list(range(100))
+        assert idxs == positions(shuffled_order(100, seed=3), 100)
+        assert all(order.pos_of(idx) == pos for pos, idx in enumerate(idxs))
+
+    def test_stratified(self):
+        # A large and a small folder: the small one is spread over the whole order
+        groups = np.array([0] * 90 + [1] * 10)
+        idxs = positions(stratified_order(groups, seed=0), 100)
+        assert sorted(idxs) == list(range(100))
+        for start in range(0, 100, 20):
+            assert 1 <= sum(1 for idx in idxs[start:start+20] if groups[idx] == 1) <= 3
+
+
+class TestPriorityOrder:
+
+    def test_updates(self):
+        order = PriorityOrder(np.array([0.1, 0.9, np.nan, 0.5, np.nan]))
+        assert order.idx_at(0) == 1
+
+        # Updates reorder the images not visited yet
+        order.update(4, 0.7)
+        order.update(3, 0.05)
+        order.update(1, 0.0)
+        assert order.idx_at(1) == 4
+        assert order.score(3) == 0.05
+        assert positions(order, 5) == [1, 4, 0, 3, 2]
+        assert order.pos_of(1) == 0
+
+    def test_go_to(self):
+        order = PriorityOrder(np.array([0.1, 0.9, 0.5]))
+        assert order.pos_of(0) == 0
+        assert positions(order, 3) == [0, 1, 2]
+
+    def test_load_priority_file(self, tmp_path):
+        fname_csv = str(tmp_path / "scores.csv")
+        with open(fname_csv, "w") as f:
+            f.write("image_name,score\na.jpg,0.5\nb.jpg,0.25\n")
+        fname_json = str(tmp_path / "scores.json")
+        with open(fname_json, "w") as f:
+            json.dump([{"image_name": "a.jpg", "score": 0.5}, {"image_name": "b.jpg", "score": 0.25}], f)
+        assert load_priority_file(fname_csv) == load_priority_file(fname_json) == {"a.jpg": 0.5, "b.jpg": 0.25}
+
+
+class TestImageNameIndex:
+
+    def test_idx_of_name(self):
+        names = [ f"img_{idx}.jpg" for idx in range(1000) ] + ["img_3.jpg"]
+        reads = []
+        def name_at_idx(idx):
+            reads.append(idx)
+            return names[idx]
+
+        index = ImageNameIndex(len(names), name_at_idx)
+        reads.clear()
+        assert index.idx_of_name("img_500.jpg") == 500
+        assert index.idx_of_name("img_3.jpg") == 3
+        assert index.idx_of_name("missing.jpg") is None
+
+        # Only names with a matching hash are read again
+        assert len(reads) <= 3
+
+    def test_manifest_source(self, tmp_path):
+        fname = str(tmp_path / "manifest.txt")
+        with open(fname, "w") as f:
+            f.write("\n".join(f"dir/img_{idx}.jpg" for idx in range(100)) + "\n")
+        iterator = ImageIterator(dacv.ImageSource(source_type=dacv.ImageSource.Type.MANIFEST, manifest_file=fname, manifest_index_dir=str(tmp_path / "index")))
+        assert iterator.idx_of_name("dir/img_42.jpg") == 42
+        assert iterator.idx_of_name("img_42.jpg") is None
+        iterator.close()
+
+
+class TestControllerPriority:
+
+    def test_order(self, images, priority_file):
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "dog"]),
+            image_source=dacv.ImageSource(images=images, order=dacv.ImageSource.Order.PRIORITY, order_priority_file=priority_file) # type: ignore
+            )
+        assert controller.curr is not None and controller.curr.image_name == "astronaut"
+        assert controller.curr_position == 0
+        controller.update_priorities({"chelsea": 0.5, "missing": 1.0})
+        controller.store_label_single("cat")
+        assert controller.curr is not None and controller.curr.image_name == "chelsea"
+
+        # Skipping to the next image without annotation follows the order
+        controller.go_to_image(2)
+        controller.skip_to_next_missing_ann()
+        assert controller.curr is not None and controller.curr.image_name == "chelsea"
+        controller.previous_image()
+        assert controller.curr is not None and controller.curr.image_name == "astronaut"
+
+        # Ordering does not change the images
+        assert [ image.size for _, image in images ] == [ (451, 300), (512, 512), (512, 512) ]
+
+    def test_update_needs_priority_order(self, images):
+        with pytest.raises(AssertionError):
+            dacv.AnnotateImageController(
+                label_source=dacv.LabelSource(labels=["cat", "dog"]),
+                image_source=dacv.ImageSource(images=images) # type: ignore
+                ).update_priorities({"chelsea": 0.5})
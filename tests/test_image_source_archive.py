@@ -0,0 +1,95 @@
+from dash_annotate_cv.image_source import ImageSource, ImageIterator
+from dash_annotate_cv.image_source_archive import ArchiveImageReader, load_archive_index
+from dash_annotate_cv import image_source_archive
+from concurrent.futures import ThreadPoolExecutor
+from skimage import data
+from PIL import Image
+import numpy as np
+import pytest
+import tarfile
+import zipfile
+import io
+import os
+
+
+IMAGES = { "chelsea.png": data.chelsea(), "camera.png": data.camera(), "sub/coffee.png": data.coffee() }
+
+
+def png(array) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format="PNG")
+    return buf.getvalue()
+
+
+@pytest.fixture(params=["zip", "tar"])
+def archive(request, tmp_path):
+    if request.param == "zip":
+        fname = str(tmp_path / "images.zip")
+        with zipfile.ZipFile(fname, "w") as zf:
+            for idx, (name, array) in enumerate(IMAGES.items()):
+                zf.writestr(name, png(array), compress_type=zipfile.ZIP_DEFLATED if idx % 2 == 0 else zipfile.ZIP_STORED)
+            zf.writestr("notes.txt", "not an image")
+    else:
+        fname = str(tmp_path / "images.tar")
+        with tarfile.open(fname, "w") as tf:
+            for name, array in IMAGES.items():
+                payload = png(array)
+                info = tarfile.TarInfo(name)
+                info.size = len(payload)
+                tf.addfile(info, io.BytesIO(payload))
+    return fname
+
+
+class TestArchiveImageReader:
+
+    def test_read(self, archive, tmp_path):
+        image_source = ImageSource(
+            source_type=ImageSource.Type.ARCHIVE,
+            archive_file=archive,
+            folder_pattern="*.png",
+            archive_index_dir=str(tmp_path / "index"),
+            duplicate_max_distance=4,
+            duplicate_hash_cache_file=str(tmp_path / "hashes.json")
+            )
+        iterator = ImageIterator(image_source)
+        try:
+            assert iterator.no_images == 3
+            assert [ iterator.name_at_idx(idx) for idx in range(3) ] == sorted(IMAGES.keys())
+            for idx in [2, 0, 1]:
+                _, name, image = iterator.go_to(idx)
+                assert np.array_equal(np.array(image), IMAGES[name])
+
+            # Hashing the images did not change them
+            assert iterator.hash_index is not None and all(hash is not None for hash in iterator.hash_index.hashes)
+        finally:
+            iterator.close()
+
+    def test_concurrent_reads(self, archive, tmp_path):
+        reader = ArchiveImageReader(archive, pattern="*.png", index_dir=str(tmp_path / "index"))
+        try:
+            idxs = [ idx % 3 for idx in range(60) ]
+            with ThreadPoolExecutor(max_workers=6) as executor:
+                arrays = list(executor.map(lambda idx: np.array(reader.image_at_idx(idx)), idxs))
+            for idx, array in zip(idxs, arrays):
+                assert np.array_equal(array, IMAGES[reader.name_at_idx(idx)])
+            assert 1 < len(reader._handles) <= 6
+        finally:
+            reader.close()
+
+
+class TestArchiveIndex:
+
+    def test_cached(self, archive, tmp_path, monkeypatch):
+        index_dir = str(tmp_path / "index")
+        index = load_archive_index(archive, index_dir)
+
+        def fail(fname):
+            raise AssertionError("Index was rebuilt")
+        monkeypatch.setattr(image_source_archive, "build_archive_index", fail)
+        assert load_archive_index(archive, index_dir) == index
+
+        # Changing the archive invalidates the index
+        monkeypatch.undo()
+        stat = os.stat(archive)
+        os.utime(archive, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+        assert load_archive_index(archive, index_dir).archive_mtime_ns == stat.st_mtime_ns + 10**9
@@ -0,0 +1,74 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.image_source import ImageIterator, ImageSource
+from dash_annotate_cv.image_source_manifest import build_manifest_index
+from skimage import data
+from PIL import Image
+import os
+import pytest
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    fnames = []
+    for name, image in [ ("chelsea", data.chelsea()), ("camera", data.camera()) ]:
+        fnames.append(str(tmp_path / f"{name}.jpg"))
+        Image.fromarray(image).save(fnames[-1])
+    return fnames
+
+
+class TestManifestIndex:
+
+    def test_cached(self, tmp_path):
+        fname = str(tmp_path / "manifest.txt")
+        with open(fname, "wb") as f:
+            f.write("a.jpg\r\n\nb/ü.jpg\nc.jpg".encode("utf-8"))
+        files = dacv.ManifestFileList(fname, index_dir=str(tmp_path / "index"))
+        assert len(files) == 3
+        assert list(files) == ["a.jpg", "b/ü.jpg", "c.jpg"]
+        assert files[-1] == "c.jpg" and files[1:] == ["b/ü.jpg", "c.jpg"]
+        with pytest.raises(IndexError):
+            files[3]
+        files.close()
+
+        # Cached and memory-mapped; indexed again when the manifest changes
+        assert len(os.listdir(tmp_path / "index")) == 1
+        with open(fname, "a") as f:
+            f.write("\nd.jpg\n")
+        os.utime(fname, ns=(0, 0))
+        assert len(dacv.load_manifest_index(fname, index_dir=str(tmp_path / "index"))) == 4
+
+    def test_chunks(self, tmp_path, monkeypatch):
+        import dash_annotate_cv.image_source_manifest as manifest
+        fname = str(tmp_path / "manifest.txt")
+        names = [ f"img{idx}.jpg" for idx in range(100) ]
+        with open(fname, "w", newline="") as f:
+            f.write("\r\n".join(names))
+        monkeypatch.setattr(manifest, "_CHUNK_SIZE", 7)
+        index = build_manifest_index(fname)
+        with open(fname, "rb") as f:
+            data_bytes = f.read()
+        assert [ data_bytes[start:end].decode() for start, end in index ] == names
+
+
+class TestManifestSource:
+
+    def test_iterate(self, tmp_path, image_files):
+        fnames = image_files
+        fname = str(tmp_path / "manifest.txt")
+        with open(fname, "w") as f:
+            f.write("\n".join(fnames) + "\n")
+
+        iterator = ImageIterator(ImageSource(
+            source_type=ImageSource.Type.MANIFEST,
+            manifest_file=fname,
+            manifest_index_dir=str(tmp_path / "index"),
+            duplicate_max_distance=4,
+            duplicate_hash_cache_file=str(tmp_path / "hashes.json")
+            ))
+        assert iterator.no_images == 2
+        assert iterator.name_at_idx(1) == fnames[1]
+        assert iterator.idx_of_name(fnames[1]) == 1
+        assert iterator.duplicates_of(0) == []
+        _, name, image = iterator.go_to(1)
+        assert name == fnames[1] and image.size == (512, 512)
+        iterator.close()
@@ -0,0 +1,92 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.image_source import ImageIterator, ImageSource
+from skimage import data
+from PIL import Image
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def stack():
+    return np.stack([data.chelsea(), data.astronaut()[:300, :451]])
+
+
+class TestLoaderImageReader:
+
+    def test_load_on_access(self):
+        loaded = []
+        def loader(idx: int):
+            loaded.append(idx)
+            return data.camera() if idx == 0 else data.chelsea()
+
+        iterator = ImageIterator(ImageSource(source_type=ImageSource.Type.LOADER, images_loader=loader, image_names=["camera", "chelsea"], images_cache_size=1))
+        assert iterator.no_images == 2 and loaded == []
+        _, name, image = iterator.next()
+        assert name == "camera" and image.size == (512, 512)
+        iterator.next()
+        iterator.prev()
+        assert loaded == [0, 1, 0]
+
+
+class TestGeneratorImageReader:
+
+    def test_restart(self):
+        runs = []
+        def factory():
+            runs.append(1)
+            for idx in range(5):
+                yield f"img{idx}", np.full((4, 4), idx, dtype=np.uint8)
+
+        reader = dacv.GeneratorImageReader(factory, cache_size=2)
+        assert reader.no_images == 5 and reader.name_at_idx(3) == "img3"
+        assert np.asarray(reader.image_at_idx(3))[0, 0] == 3
+
+        # Stepping back within the cache does not restart the generator; further back does
+        assert np.asarray(reader.image_at_idx(2))[0, 0] == 2
+        assert np.asarray(reader.image_at_idx(4))[0, 0] == 4
+        assert len(runs) == 2
+        assert np.asarray(reader.image_at_idx(0))[0, 0] == 0
+        assert len(runs) == 3
+
+
+class TestArrayImageReader:
+
+    def test_controller(self, stack, tmp_path):
+        original = stack.copy()
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "astronaut"]),
+            image_source=ImageSource(source_type=ImageSource.Type.ARRAY, images_array=stack, duplicate_max_distance=4, duplicate_hash_cache_file=str(tmp_path / "hashes.json"))
+            )
+        assert controller.curr is not None and controller.curr.image_name == "000000"
+        assert np.array_equal(np.asarray(controller.curr.image), stack[0])
+        controller.store_label_single("cat")
+        assert controller.curr is not None and controller.curr.image_name == "000001"
+
+        # Hashing and showing the images leaves the stack unchanged
+        assert controller.curr.image.size == (451, 300)
+        assert np.array_equal(stack, original)
+
+
+class TestSharedMemoryImageReader:
+
+    def test_no_copy(self):
+        block, array = dacv.create_shared_image_stack((2, 8, 8, 3))
+        try:
+            array[:] = 7
+            image_source = ImageSource(source_type=ImageSource.Type.SHARED_MEMORY, shared_memory_name=block.name, shared_memory_shape=[2, 8, 8, 3], image_names=["a", "b"])
+            reader = dacv.SharedMemoryImageReader(block.name, (2, 8, 8, 3), names=["a", "b"])
+
+            # The reader sees writes to the block: the pixels are not copied
+            array[1] = 9
+            assert np.asarray(reader.image_at_idx(1))[0, 0, 0] == 9
+            reader.close()
+
+            iterator = ImageIterator(image_source)
+            _, name, image = iterator.next()
+            assert name == "a" and isinstance(image, Image.Image) and image.size == (8, 8)
+            del image
+            iterator.close()
+        finally:
+            del array
+            block.close()
+            block.unlink()
@@ -0,0 +1,57 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.image_source import ImageIterator, ImageSource
+import numpy as np
+import pytest
+
+
+@pytest.fixture
+def npy_file(tmp_path):
+    fname = str(tmp_path / "stack.npy")
+    stack = np.zeros((3, 32, 48, 2), dtype=np.uint16)
+    stack[:, :, :, 0] = np.linspace(0, 4000, 48, dtype=np.uint16)
+    stack[1, :, :, 1] = 60000
+    np.save(fname, stack)
+    return fname
+
+
+class TestWindow:
+
+    def test_window_to_uint8(self):
+        values = np.array([[0, 1000, 2000, 3000]], dtype=np.uint16)
+        assert dacv.window_to_uint8(values, (1000, 2000)).ravel().tolist() == [0, 0, 255, 255]
+        assert dacv.window_to_uint8(values, (0, 3000), gamma=0.5)[0, 1] > dacv.window_to_uint8(values, (0, 3000))[0, 1]
+        assert values.ravel().tolist() == [0, 1000, 2000, 3000]
+
+
+class TestNpyImageReader:
+
+    def test_reader(self, npy_file):
+        reader = dacv.NpyImageReader(npy_file, cache_size=1)
+        assert reader.no_images == 3
+        assert reader.name_at_idx(2) == f"{npy_file}#000002"
+        assert isinstance(reader.array, np.memmap)
+
+        # Displayed as 8 bits, from the first channel, stretched to the percentiles of the image
+        image = reader.image_at_idx(0)
+        assert image.mode == "L" and image.size == (48, 32)
+        pixels = np.asarray(image)
+        assert pixels[0, 0] == 0 and pixels[0, -1] == 255
+
+        # The stored values are unchanged
+        assert reader.array_at_idx(1).dtype == np.uint16 and reader.array_at_idx(1)[0, 0, 1] == 60000
+        assert reader.image_at_idx(0) is image
+        reader.close()
+
+    def test_source(self, npy_file):
+        image_source = ImageSource(source_type=ImageSource.Type.NPY, npy_file=npy_file, npy_window=[0, 60000], npy_channels=[1, 0, 0])
+        iterator = ImageIterator(image_source)
+        iterator.go_to(1)
+        _, name, image = iterator.next()
+        assert name.endswith("#000002")
+        assert image.mode == "RGB"
+        _, _, image = iterator.prev()
+        assert np.asarray(image)[0, 0, 0] == 255
+        iterator.close()
+
+        with pytest.raises(AssertionError):
+            ImageSource(source_type=ImageSource.Type.NPY, npy_file=npy_file, npy_window=[10, 0])
@@ -0,0 +1,178 @@
+from dash_annotate_cv.image_source import ImageSource, ImageIterator
+from dash_annotate_cv.image_source_remote import RemoteImageReader, DiskLRUCache
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+from skimage import data
+from PIL import Image
+import threading
+import pytest
+import io
+import os
+
+
+def jpeg(array) -> bytes:
+    buf = io.BytesIO()
+    Image.fromarray(array).save(buf, format="JPEG")
+    return buf.getvalue()
+
+
+class Bucket(BaseHTTPRequestHandler):
+    """Stand-in for an S3-compatible bucket: objects, and paged listing
+    """
+
+    objects = {}
+    requests = []
+    page_size = 2
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        if url.path == "/bucket/" and query.get("list-type") == ["2"]:
+            return self._list(query)
+        key = unquote(url.path[len("/bucket/"):])
+        self.requests.append(key)
+        if key not in self.objects:
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = self.objects[key]
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _list(self, query):
+        keys = sorted(k for k in self.objects if k.startswith(query.get("prefix", [""])[0]))
+        start = int(query.get("continuation-token", ["0"])[0])
+        page = keys[start:start+self.page_size]
+        truncated = start + self.page_size < len(keys)
+        xml = '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+        xml += "".join(f"<Contents><Key>{k}</Key></Contents>" for k in page)
+        xml += f"<IsTruncated>{'true' if truncated else 'false'}</IsTruncated>"
+        if truncated:
+            xml += f"<NextContinuationToken>{start+self.page_size}</NextContinuationToken>"
+        xml += "</ListBucketResult>"
+        body = xml.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def bucket():
+    Bucket.objects = {
+        "images/chelsea.jpg": jpeg(data.chelsea()),
+        "images/camera man.jpg": jpeg(data.camera()),
+        "images/astronaut.jpg": jpeg(data.astronaut()),
+        "images/notes.txt": b"not an image",
+        "other/coffee.jpg": jpeg(data.coffee()),
+        }
+    Bucket.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Bucket)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}/bucket"
+    server.shutdown()
+    server.server_close()
+
+
+class TestRemoteImageReader:
+
+    def test_list_and_read(self, bucket, tmp_path):
+        image_source = ImageSource(
+            source_type=ImageSource.Type.REMOTE,
+            remote_url=bucket,
+            remote_prefix="images/",
+            folder_pattern="*.jpg",
+            remote_cache_dir=str(tmp_path),
+            remote_prefetch=2
+            )
+        iterator = ImageIterator(image_source)
+        try:
+            assert iterator.no_images == 3
+            assert iterator.name_at_idx(1) == "images/camera man.jpg"
+
+            idx, name, image = iterator.next()
+            assert (idx, name) == (0, "images/astronaut.jpg")
+            assert image.size == (512, 512)
+
+            # The following images are downloaded in the background
+            reader: RemoteImageReader = iterator._reader # type: ignore
+            for future in list(reader._pending.values()):
+                future.result()
+            no_requests = len(Bucket.requests)
+            idx, name, image = iterator.next()
+            assert name == "images/camera man.jpg"
+            assert image.size == (512, 512)
+            assert len(Bucket.requests) == no_requests
+        finally:
+            iterator.close()
+
+    def test_read_ahead_follows_order(self, bucket, tmp_path):
+        image_source = ImageSource(
+            source_type=ImageSource.Type.REMOTE,
+            remote_url=bucket,
+            remote_keys=[ f"images/{idx}.jpg" for idx in range(10) ],
+            remote_cache_dir=str(tmp_path),
+            remote_prefetch=2,
+            order=ImageSource.Order.SHUFFLE
+            )
+        for idx in range(10):
+            Bucket.objects[f"images/{idx}.jpg"] = jpeg(data.camera()[::8, ::8])
+        iterator = ImageIterator(image_source)
+        reader: RemoteImageReader = iterator._reader # type: ignore
+        try:
+            # The images at the next positions are downloaded, not those at the next indexes
+            iterator.go_to(iterator.order.idx_at(4))
+            iterator.next()
+            iterator.prev()
+            for future in list(reader._pending.values()):
+                future.result()
+            expected = { iterator.order.idx_at(pos) for pos in [2, 3, 4, 5, 6, 7] }
+            assert { idx for idx in range(10) if reader.cache.get(reader.keys[idx]) is not None } == expected
+        finally:
+            iterator.close()
+
+    def test_duplicates(self, bucket, tmp_path):
+        # Images are hashed as they are downloaded ahead; the images shown keep their size
+        image_source = ImageSource(
+            source_type=ImageSource.Type.REMOTE,
+            remote_url=bucket,
+            remote_prefix="images/",
+            folder_pattern="*.jpg",
+            remote_cache_dir=str(tmp_path / "cache"),
+            duplicate_max_distance=4,
+            duplicate_hash_cache_file=str(tmp_path / "hashes.json")
+            )
+        iterator = ImageIterator(image_source)
+        try:
+            assert iterator.hash_index is not None
+            assert all(hash is not None for hash in iterator.hash_index.hashes)
+            assert iterator.duplicates_of(0) == []
+            _, _, image = iterator.next()
+            assert image.size == (512, 512)
+        finally:
+            iterator.close()
+
+
+class TestDiskLRUCache:
+
+    def test_eviction(self, tmp_path):
+        cache = DiskLRUCache(str(tmp_path), max_bytes=25)
+        cache.put("a", b"x" * 10)
+        cache.put("b", b"x" * 10)
+        assert cache.get("a") is not None
+        cache.put("c", b"x" * 10)
+
+        # b was least recently used
+        assert cache.get("b") is None
+        assert cache.get("a") is not None and cache.get("c") is not None
+        assert cache.no_bytes == 20
+        assert len(os.listdir(str(tmp_path))) == 2
+
+        # The index is rebuilt from the directory
+        assert DiskLRUCache(str(tmp_path), max_bytes=25).no_bytes == 20
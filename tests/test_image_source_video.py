@@ -0,0 +1,91 @@
+from dash_annotate_cv.image_source import ImageSource, ImageIterator
+from dash_annotate_cv.image_source_video import VideoIndex, FrameBuffer, frame_name
+from PIL import Image
+import numpy as np
+import pytest
+
+
+def write_video(fname: str, no_frames: int, gop_size: int):
+    av = pytest.importorskip("av")
+    with av.open(fname, "w") as container:
+        stream = container.add_stream("mpeg4", rate=25)
+        stream.width = 64
+        stream.height = 48
+        stream.pix_fmt = "yuv420p"
+        stream.codec_context.gop_size = gop_size
+        for frame_no in range(no_frames):
+            # Each frame has a distinct uniform brightness
+            array = np.full((48, 64, 3), 4 * frame_no, dtype=np.uint8)
+            for packet in stream.encode(av.VideoFrame.from_ndarray(array, format="rgb24")):
+                container.mux(packet)
+        for packet in stream.encode():
+            container.mux(packet)
+
+
+def is_frame(image: Image.Image, frame_no: int) -> bool:
+    # Allow for lossy encoding and color conversion; shown frames are at least three apart
+    return abs(np.array(image).mean() / 4 - frame_no) <= 1
+
+
+@pytest.fixture
+def video_file(tmp_path):
+    fname = str(tmp_path / "video.mp4")
+    write_video(fname, no_frames=60, gop_size=10)
+    return fname
+
+
+class TestVideoIndex:
+
+    def test_keyframe_before(self):
+        index = VideoIndex(frame_pts=list(range(0, 300, 10)), keyframes=[0, 12, 24])
+        assert index.no_frames == 30
+        assert index.keyframe_before(0) == 0
+        assert index.keyframe_before(11) == 0
+        assert index.keyframe_before(12) == 12
+        assert index.keyframe_before(29) == 24
+
+
+class TestFrameBuffer:
+
+    def test_keeps_frames_near_cursor(self):
+        buffer = FrameBuffer(capacity=3)
+        image = Image.new("RGB", (2, 2))
+        buffer.cursor = 10
+        for frame_no in [4, 8, 10, 12]:
+            buffer.put(frame_no, image)
+        assert len(buffer) == 3
+        assert 4 not in buffer
+        assert buffer.wants(9)
+        assert not buffer.wants(20)
+        assert not buffer.wants(10)
+
+
+class TestVideoImageReader:
+
+    def test_frames(self, video_file):
+        iterator = ImageIterator(ImageSource(source_type=ImageSource.Type.VIDEO, video_file=video_file, video_stride=3, video_buffer_size=8))
+        reader = iterator._reader
+        try:
+            assert iterator.no_images == 20
+            assert iterator.name_at_idx(2) == frame_name(video_file, 6)
+            assert len(reader.index.keyframes) >= 6 # type: ignore
+
+            # Random jumps seek to a keyframe instead of decoding from the start
+            for idx in [15, 4, 19, 0, 10]:
+                _, name, image = iterator.go_to(idx)
+                assert name == frame_name(video_file, 3 * idx)
+                assert is_frame(image, 3 * idx)
+
+            # Stepping reads frames decoded ahead of and behind the cursor
+            iterator.go_to(10)
+            for frame_no in [33, 36, 39]:
+                _, _, image = iterator.next()
+                assert is_frame(image, frame_no)
+            _, _, image = iterator.prev()
+            assert is_frame(image, 36)
+            assert len(reader.buffer) <= 8 # type: ignore
+
+            # Buffered frames are handed out at full size
+            assert image.size == (64, 48)
+        finally:
+            iterator.close()
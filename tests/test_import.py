@@ -0,0 +1,30 @@
+import dash_annotate_cv as dacv
+import subprocess
+import sys
+
+
+def modules_after(statement: str):
+    code = f"import sys; {statement}; print(','.join(sorted(sys.modules.keys())))"
+    output = subprocess.run([sys.executable, "-c", code], check=True, capture_output=True, text=True).stdout
+    return set(output.strip().split(","))
+
+
+class TestImport:
+
+    def test_core_import_is_headless(self):
+        modules = modules_after("import dash_annotate_cv; import dash_annotate_cv.formats.coco; import dash_annotate_cv.formats.default")
+        for ui_module in ["dash", "plotly", "pandas", "dash_bootstrap_components"]:
+            assert ui_module not in modules
+
+    def test_lazy_ui_import(self):
+        modules = modules_after("import dash_annotate_cv; dash_annotate_cv.AnnotateImageBboxsAIO")
+        assert "dash" in modules
+        assert dacv.AnnotateImageLabelsAIO.__name__ == "AnnotateImageLabelsAIO"
+        assert "AnnotateImageBboxsAIO" in dir(dacv)
+
+    def test_lazy_tool_import(self):
+        modules = modules_after("import dash_annotate_cv")
+        for module in ["dash_annotate_cv.agreement", "dash_annotate_cv.jobs", "dash_annotate_cv.image_source_archive", "dash_annotate_cv.image_source_remote"]:
+            assert module not in modules
+        assert dacv.JobRunner.__name__ == "JobRunner"
+        assert "ArchiveImageReader" in dir(dacv)
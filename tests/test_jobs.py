@@ -0,0 +1,140 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.formats.coco import load_from_coco_if_exist
+from dash_annotate_cv.formats.default import write_default_json
+from PIL import Image
+import threading
+import pytest
+
+
+def _annotations(no_images: int) -> dacv.ImageAnnotations:
+    anns = dacv.ImageAnnotations.new()
+    for idx in range(no_images):
+        anns.image_to_entry[f"image{idx}"] = dacv.ImageAnnotations.Annotation(
+            image_name=f"image{idx}",
+            bboxs=[ dacv.ImageAnnotations.Annotation.Bbox(xyxy=[0,0,10,10], class_name="cat") ],
+            image_width=100,
+            image_height=100
+            )
+    return anns
+
+
+@pytest.fixture
+def runner():
+    runner = dacv.JobRunner(max_workers=1)
+    yield runner
+    runner.shutdown()
+
+
+class TestJobs:
+
+    def test_success_and_failure(self, runner: dacv.JobRunner):
+        def succeed(context: dacv.JobContext):
+            context.report("work", 5, 10)
+            return "done"
+        def fail(context: dacv.JobContext):
+            raise ValueError("broken")
+
+        job = runner.wait(runner.submit("succeed", succeed), timeout=10)
+        assert job.status == dacv.JobStatus.SUCCEEDED
+        assert job.message == "done"
+        assert (job.stage, job.done, job.total) == ("work", 5, 10)
+        assert job.fraction_done == 1.0
+        assert job.finished is not None
+
+        job = runner.wait(runner.submit("fail", fail), timeout=10)
+        assert job.status == dacv.JobStatus.FAILED
+        assert job.message == "ValueError: broken"
+        assert [ j.name for j in runner.jobs() ] == ["fail", "succeed"]
+
+    def test_cancel(self, runner: dacv.JobRunner):
+        started, release = threading.Event(), threading.Event()
+        def block(context: dacv.JobContext):
+            started.set()
+            release.wait(10)
+            context.report("work", 1)
+            return "not cancelled"
+
+        job_id_running = runner.submit("running", block)
+        job_id_pending = runner.submit("pending", block)
+        assert started.wait(10)
+        assert runner.cancel(job_id_running)
+        assert runner.cancel(job_id_pending)
+        release.set()
+        assert runner.wait(job_id_running, timeout=10).status == dacv.JobStatus.CANCELLED
+        assert runner.wait(job_id_pending, timeout=10).status == dacv.JobStatus.CANCELLED
+        assert not runner.cancel(job_id_running)
+
+    def test_export_job(self, runner: dacv.JobRunner, tmp_path):
+        anns = _annotations(20)
+        coco_file = str(tmp_path / "export.coco.json")
+        job_fn = dacv.export_job(anns, dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=coco_file))
+
+        # Changes after the job was created are not exported
+        anns.image_to_entry["image0"].bboxs = []
+        job = runner.wait(runner.submit("export", job_fn), timeout=30)
+        assert job.status == dacv.JobStatus.SUCCEEDED, job.message
+        exported = load_from_coco_if_exist(coco_file)
+        assert exported is not None
+        assert len(exported.image_to_entry) == 20
+        assert len(exported.image_to_entry["image0"].bboxs or []) == 1
+
+    def test_import_job(self, runner: dacv.JobRunner, tmp_path):
+        json_file = str(tmp_path / "import.json")
+        imported = _annotations(3)
+        imported.image_to_entry["image0"].label = dacv.ImageAnnotations.Annotation.Label(single="dog", timestamp=1.0)
+        write_default_json(imported, json_file)
+
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "dog"]),
+            image_source=dacv.ImageSource(images=[ (f"image{idx}", Image.new("RGB", (100,100))) for idx in range(4) ])
+            )
+        controller.go_to_image(0)
+        controller.add_bbox(dacv.Bbox(xyxy=[50,50,60,60], class_name="dog"))
+
+        job = runner.wait(runner.submit("import", dacv.import_job(controller, json_file)), timeout=30)
+        assert job.status == dacv.JobStatus.SUCCEEDED, job.message
+        assert len(controller.annotations.image_to_entry) == 3
+        assert len(controller.annotations.image_to_entry["image0"].bboxs or []) == 2
+        assert controller.progress().no_images_done == 3
+        assert controller.progress().no_bboxs == 4
+        assert controller.curr is not None and controller.curr.label_single == "dog"
+
+    def test_import_during_edits(self, runner: dacv.JobRunner, tmp_path):
+        json_file = str(tmp_path / "import.json")
+        imported = _annotations(3)
+        for entry in imported.image_to_entry.values():
+            entry.image_name = f"other/{entry.image_name}"
+        write_default_json(imported, json_file)
+
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(labels=["cat", "dog"]),
+            image_source=dacv.ImageSource(images=[ (f"dir/image{idx}", Image.new("RGB", (100,100))) for idx in range(4) ]),
+            options=dacv.AnnotateImageOptions(use_basename_for_image=True)
+            )
+
+        # Bboxs added while the import runs are kept, and imported images are keyed by basename
+        job_id = runner.submit("import", dacv.import_job(controller, json_file))
+        for idx in range(50):
+            controller.add_bbox(dacv.Bbox(xyxy=[20+idx,20+idx,30+idx,30+idx], class_name="dog"))
+        job = runner.wait(job_id, timeout=30)
+        assert job.status == dacv.JobStatus.SUCCEEDED, job.message
+        assert sorted(controller.annotations.image_to_entry.keys()) == ["image0", "image1", "image2"]
+        assert len(controller.annotations.image_to_entry["image0"].bboxs or []) == 51
+        assert controller.progress().no_bboxs == 53
+        assert controller.curr is not None and len(controller.curr_bboxs) == 51
+
+    def test_validate_job(self, runner: dacv.JobRunner, tmp_path):
+        anns = _annotations(5)
+        anns.image_to_entry["image1"].bboxs[0].class_name = "bird" # type: ignore
+        anns.image_to_entry["image2"].bboxs.append(dacv.ImageAnnotations.Annotation.Bbox(xyxy=[0,0,10,11], class_name="cat")) # type: ignore
+        json_file = str(tmp_path / "validate.json")
+        write_default_json(anns, json_file)
+
+        for job_fn in [
+            dacv.validate_job(annotations=anns, labels=["cat"], duplicate_iou_threshold=0.8),
+            dacv.validate_job(input_file=json_file, labels=["cat"], duplicate_iou_threshold=0.8)
+            ]:
+            job = runner.wait(runner.submit("validate", job_fn), timeout=30)
+            assert job.status == dacv.JobStatus.SUCCEEDED, job.message
+            assert job.message == "Checked 5 images: 2 issues in 2 images"
+            assert job.details[0] == "image1 (bbox 0): Class 'bird' is not allowed"
@@ -0,0 +1,47 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.keyboard import label_keys, keyboard_legend
+from skimage import data
+from PIL import Image
+import pytest
+
+
+@pytest.fixture
+def images():
+    return [ (f"image{i}", Image.fromarray(data.camera())) for i in range(5) ]
+
+
+class TestLabelKeys:
+
+    def test_label_keys(self):
+        labels = [ f"label{i}" for i in range(12) ]
+        keys = label_keys(labels)
+        assert len(keys) == 10
+        assert keys["1"] == "label0"
+        assert keys["0"] == "label9"
+        assert "1: label0" in keyboard_legend(labels[:2], multiple=False)
+
+
+class TestKeyboardWindow:
+
+    def test_window(self, tmp_path, images):
+        aio = dacv.AnnotateImageLabelsAIO(
+            label_source=dacv.LabelSource(labels=["cat", "dog"]),
+            image_source=dacv.ImageSource(images=images),
+            options=dacv.AnnotateImageOptions(keyboard_shortcuts=True, keyboard_batch_size=2, keyboard_image_size=64, thumbnail_cache_dir=str(tmp_path))
+            )
+        aio.controller.store_labels_batch([("image3", "dog")])
+
+        window = aio._create_keyboard_window(2, seq=3)
+        assert window["aio_id"] == aio.aio_id
+        assert window["start"] == 2
+        assert window["seq"] == 3
+        assert window["no_images"] == 5
+        assert [ item["name"] for item in window["items"] ] == ["image2", "image3", "image4"]
+        assert [ item["label"] for item in window["items"] ] == [None, "dog", None]
+        assert window["items"][0]["src"].startswith("data:image/jpeg;base64,")
+
+        # Past the last image
+        assert aio._create_keyboard_window(5)["items"] == []
+
+        # Thumbnails are made from copies
+        assert all(image.size == (512, 512) for _, image in images)
@@ -0,0 +1,53 @@
+from dash_annotate_cv.label_source import LabelSource, LabelSet
+from dash_annotate_cv.label_dropdown import label_options, FULL_OPTIONS_MAX, SEARCH_LIMIT
+import pytest
+
+
+@pytest.fixture
+def large_label_set():
+    return LabelSet([ f"class {i}" for i in range(FULL_OPTIONS_MAX + 1) ] + ["dog"])
+
+
+class TestLabelSet:
+
+    def test_lookup(self):
+        label_set = LabelSource(labels=["cat", "dog", "cat"]).get_label_set()
+        assert "dog" in label_set
+        assert "bird" not in label_set
+        assert len(label_set) == 3
+        assert label_set.index("cat") == 0
+        assert list(label_set) == ["cat", "dog", "cat"]
+
+    def test_search(self):
+        label_set = LabelSet(["Trail running shoes", "Running shorts", "Rugby ball", "T-shirt", "Tennis racket with an extremely long name"])
+        assert label_set.search("run") == ["Trail running shoes", "Running shorts"]
+        assert label_set.search("RU") == ["Trail running shoes", "Running shorts", "Rugby ball"]
+        assert label_set.search("shirt") == ["T-shirt"]
+        assert label_set.search("ball", limit=0) == []
+        assert label_set.search("nning") == []
+        assert label_set.search("") == label_set.labels
+
+        # Beyond the indexed prefix length
+        assert label_set.search("running shoes") == ["Trail running shoes"]
+        assert label_set.search("extremely long nam") == ["Tennis racket with an extremely long name"]
+        assert label_set.search("extremely long nose") == []
+
+
+class TestLabelOptions:
+
+    def test_options(self, large_label_set):
+        small = LabelSet(["cat", "dog"])
+        assert label_options(small, "cat") == ["cat", "dog"]
+
+        large = large_label_set
+        assert label_options(large) == []
+        assert label_options(large, "class 7") == ["class 7"]
+        assert label_options(large, ["dog"], "d") == ["dog"]
+
+        # The selected label stays among the options
+        options = label_options(large, "class 100", "class")
+        assert len(options) == SEARCH_LIMIT + 1
+        assert options[:3] == ["class 100", "class 0", "class 1"]
+
+        # Searching does not change the labels
+        assert len(large.labels) == FULL_OPTIONS_MAX + 2 and large.labels[-1] == "dog"
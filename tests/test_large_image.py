@@ -0,0 +1,83 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.image_source import ImageIterator
+from dash_annotate_cv.large_image import LargeImage, viewport_from_relayout
+import numpy as np
+import pytest
+import os
+
+
+tifffile = pytest.importorskip("tifffile")
+
+
+@pytest.fixture
+def pixels():
+    rng = np.random.default_rng(0)
+    return rng.integers(0, 255, size=(1100, 700, 3), dtype=np.uint8)
+
+
+class TestLargeImage:
+
+    @pytest.mark.parametrize("layout", ["tiled", "strips"])
+    def test_read_region(self, tmp_path, pixels, layout: str):
+        fname = os.path.join(tmp_path, "image.tif")
+        if layout == "tiled":
+            tifffile.imwrite(fname, pixels, tile=(128,128), compression="zlib")
+        else:
+            tifffile.imwrite(fname, pixels, rowsperstrip=50)
+
+        image = LargeImage(fname, cache_dir=os.path.join(tmp_path, "cache"), tile_cache_bytes=100000)
+        assert image.size == (700, 1100)
+        region = image.read_region([100, 250, 333, 901])
+        assert np.array_equal(region, pixels[250:901,100:333])
+
+        # Pyramid built on disk down to a single tile
+        assert [ (level.width, level.height) for level in image.levels ] == [(700,1100), (350,550), (175,275), (88,138)]
+        expected = pixels.reshape(550, 2, 350, 2, 3).astype(np.float64).mean(axis=(1,3)).round()
+        assert np.array_equal(image.read_region([0, 0, 700, 1100], level=1), expected)
+        image.close()
+
+        # Reused from the cache
+        image = LargeImage(fname, cache_dir=os.path.join(tmp_path, "cache"))
+        assert len(image.levels) == 4
+        assert len(os.listdir(os.path.join(tmp_path, "cache"))) == 1
+        image.close()
+
+    def test_viewport(self, tmp_path, pixels):
+        fname = os.path.join(tmp_path, "image.tif")
+        tifffile.imwrite(fname, pixels, tile=(128,128))
+        image = LargeImage(fname, cache_dir=os.path.join(tmp_path, "cache"))
+
+        assert image.choose_level(700, 1100, 256) == 2
+        assert image.choose_level(100, 100, 256) == 0
+
+        overview = image.overview(256)
+        assert max(overview.size) <= 256
+
+        # Zoomed in: full resolution, clipped to the image
+        region, xyxy = image.viewport([-50, 1000, 200, 1200], 1024)
+        assert xyxy == [0, 1000, 200, 1100]
+        assert region.size == (200, 100)
+        image.close()
+
+    def test_viewport_from_relayout(self):
+        relayout = {"xaxis.range[0]": 10, "xaxis.range[1]": 20.5, "yaxis.range[0]": 90, "yaxis.range[1]": 30}
+        assert viewport_from_relayout(relayout, 100, 100) == [10, 30, 20.5, 90]
+        assert viewport_from_relayout({"xaxis.autorange": True, "yaxis.autorange": "reversed"}, 100, 50) == [0, 0, 100, 50]
+        assert viewport_from_relayout({"shapes": []}, 100, 50) is None
+
+    def test_image_source(self, tmp_path, pixels):
+        fname_large = os.path.join(tmp_path, "large.tif")
+        fname_small = os.path.join(tmp_path, "small.tif")
+        tifffile.imwrite(fname_large, pixels, tile=(128,128))
+        tifffile.imwrite(fname_small, pixels[:10,:10])
+        image_source = dacv.ImageSource(
+            source_type=dacv.ImageSource.Type.LIST_OF_FILES, 
+            list_of_files=[fname_large, fname_small], 
+            large_image_min_pixels=10000,
+            large_image_cache_dir=os.path.join(tmp_path, "cache")
+            )
+        iterator = ImageIterator(image_source)
+        _, _, image = iterator.next()
+        assert isinstance(image, LargeImage)
+        _, _, image = iterator.next()
+        assert not isinstance(image, LargeImage)
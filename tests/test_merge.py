@@ -0,0 +1,147 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.formats.default import write_default_json, load_from_default_json_if_exist
+from dash_annotate_cv.formats.coco import write_to_coco
+from dash_annotate_cv.rle import rle_encode
+import numpy as np
+import pytest
+import json
+import os
+
+
+Bbox = dacv.ImageAnnotations.Annotation.Bbox
+Label = dacv.ImageAnnotations.Annotation.Label
+BboxHistory = dacv.ImageAnnotations.Annotation.BboxHistory
+Mask = dacv.ImageAnnotations.Annotation.Mask
+
+
+def entry(image_name: str, label=None, bboxs=None, history_bboxs=None) -> dacv.ImageAnnotations.Annotation:
+    return dacv.ImageAnnotations.Annotation(image_name=image_name, label=label, bboxs=bboxs, history_bboxs=history_bboxs, image_width=100, image_height=100)
+
+
+class TestMergeImageEntries:
+
+    def test_latest_wins(self):
+        a = entry("1",
+            label=Label(single="cat", timestamp=1.0, author="alice"),
+            bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat", timestamp=1.0, author="alice"), Bbox(xyxy=[50,50,60,60], class_name="dog", timestamp=1.0, author="alice") ],
+            history_bboxs=[ BboxHistory(operation=BboxHistory.Operation.ADD, bbox=Bbox(xyxy=[0,0,10,10], class_name="cat", timestamp=1.0, author="alice")) ]
+            )
+        b = entry("1",
+            label=Label(single="dog", timestamp=2.0, author="bob"),
+            bboxs=[ Bbox(xyxy=[0,0,10,11], class_name="dog", timestamp=2.0, author="bob"), Bbox(xyxy=[50,50,60,60], class_name="dog", timestamp=0.5, author="bob"), Bbox(xyxy=[80,80,90,90], class_name="cat", author="bob") ],
+            history_bboxs=[ BboxHistory(operation=BboxHistory.Operation.ADD, bbox=Bbox(xyxy=[0,0,10,10], class_name="cat", timestamp=1.0, author="alice")) ]
+            )
+        merged, no_conflicts = dacv.merge_image_entries([a, b])
+        assert no_conflicts == 2
+        assert merged.label == Label(single="dog")
+        assert merged.bboxs == [ Bbox(xyxy=[0,0,10,11], class_name="dog"), Bbox(xyxy=[50,50,60,60], class_name="dog"), Bbox(xyxy=[80,80,90,90], class_name="cat") ]
+
+        # Losing bbox recorded as deleted, shared history not repeated
+        assert merged.history_bboxs is not None and len(merged.history_bboxs) == 2
+        assert merged.history_bboxs[0].operation == BboxHistory.Operation.DELETE
+        assert merged.history_bboxs[0].bbox == Bbox(xyxy=[0,0,10,10], class_name="cat")
+        assert merged.history_labels == [ Label(single="cat") ]
+
+        # Inputs are not modified
+        assert a.bboxs is not None and a.bboxs[0].xyxy == [0,0,10,10]
+
+    def test_policies(self):
+        a = entry("1", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat", timestamp=1.0, author="alice") ])
+        b = entry("1", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="dog", timestamp=2.0, author="bob") ])
+
+        merged, _ = dacv.merge_image_entries([a, b], dacv.MergeOptions(conflict_policy=dacv.ConflictPolicy.FIRST))
+        assert merged.bboxs == [ Bbox(xyxy=[0,0,10,10], class_name="cat") ]
+
+        options = dacv.MergeOptions(conflict_policy=dacv.ConflictPolicy.AUTHOR_PRIORITY, author_priority=["alice"])
+        merged, _ = dacv.merge_image_entries([b, a], options)
+        assert merged.bboxs == [ Bbox(xyxy=[0,0,10,10], class_name="cat") ]
+
+        merged, _ = dacv.merge_image_entries([a, b], dacv.MergeOptions(preserve_history=False))
+        assert merged.bboxs == [ Bbox(xyxy=[0,0,10,10], class_name="dog") ]
+        assert merged.history_bboxs is None
+
+
+class TestMergeAnnotations:
+
+    @pytest.mark.parametrize("workers,max_memory_mb", [(1, None), (2, 0.01), (1, 0.01)])
+    def test_merge_files(self, tmp_path, workers: int, max_memory_mb):
+        anns_a = dacv.ImageAnnotations.new()
+        anns_b = dacv.ImageAnnotations.new()
+        for i in range(40):
+            anns_a.image_to_entry[f"{i}.jpg"] = entry(f"{i}.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat", timestamp=1.0) ])
+            if i % 2 == 0:
+                anns_b.image_to_entry[f"{i}.jpg"] = entry(f"{i}.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="dog", timestamp=2.0), Bbox(xyxy=[50,50,60,60], class_name="dog", timestamp=2.0) ])
+        anns_b.image_to_entry["only_b.jpg"] = entry("only_b.jpg", label=Label(single="cat"))
+
+        fname_a = os.path.join(tmp_path, "a.json")
+        fname_b = os.path.join(tmp_path, "b.coco.json")
+        write_default_json(anns_a, fname_a)
+        write_to_coco(anns_b, fname_b)
+
+        fname_out = os.path.join(tmp_path, "out.json")
+        storage = dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=fname_out)
+        # COCO does not store timestamps, so let the earlier input win
+        options = dacv.MergeOptions(conflict_policy=dacv.ConflictPolicy.FIRST)
+        result = dacv.merge_annotations([fname_b, fname_a], storage, options=options, workers=workers, max_memory_mb=max_memory_mb)
+        assert result.no_images == 41
+        assert result.no_conflicts == 20
+        assert result.no_bboxs == 60
+        if max_memory_mb is not None:
+            assert result.no_shards > 1
+
+        merged = load_from_default_json_if_exist(fname_out)
+        assert merged is not None
+        assert "only_b.jpg" in merged.image_to_entry
+        for i in range(40):
+            bboxs = merged.image_to_entry[f"{i}.jpg"].bboxs
+            assert bboxs is not None
+            if i % 2 == 0:
+                assert [ bbox.class_name for bbox in bboxs ] == ["dog", "dog"]
+            else:
+                assert bboxs == [ Bbox(xyxy=[0,0,10,10], class_name="cat") ]
+
+    @pytest.mark.parametrize("workers,max_memory_mb", [(1, None), (2, 0.001)])
+    def test_merge_masks(self, tmp_path, workers: int, max_memory_mb):
+        mask = np.zeros((100, 100), dtype=bool)
+        mask[10:20, 30:50] = True
+        rle = rle_encode(mask)
+        anns_a = dacv.ImageAnnotations.new()
+        anns_b = dacv.ImageAnnotations.new()
+        for i in range(50):
+            anns_a.image_to_entry[f"{i}.jpg"] = entry(f"{i}.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat") ])
+            anns_b.image_to_entry[f"{i}.jpg"] = dacv.ImageAnnotations.Annotation(image_name=f"{i}.jpg", masks=[ Mask(size=rle["size"], counts=rle["counts"], class_name="mcls") ], image_width=100, image_height=100)
+
+        fname_a = os.path.join(tmp_path, "a.json")
+        fname_b = os.path.join(tmp_path, "b.coco.json")
+        write_default_json(anns_a, fname_a)
+        write_to_coco(anns_b, fname_b)
+
+        fname_out = os.path.join(tmp_path, "out.coco.json")
+        storage = dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=fname_out)
+        result = dacv.merge_annotations([fname_a, fname_b], storage, workers=workers, max_memory_mb=max_memory_mb)
+        assert result.no_images == 50
+        with open(fname_out) as f:
+            coco = json.load(f)
+        assert len(coco["annotations"]) == 100
+        assert sum(isinstance(ann["segmentation"], dict) for ann in coco["annotations"]) == 50
+
+    def test_no_history(self, tmp_path):
+        # Images in one input only lose their history too
+        history = [ BboxHistory(operation=BboxHistory.Operation.ADD, bbox=Bbox(xyxy=[0,0,10,10], class_name="cat")) ]
+        anns_a = dacv.ImageAnnotations.new()
+        anns_b = dacv.ImageAnnotations.new()
+        anns_a.image_to_entry["both.jpg"] = entry("both.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat") ], history_bboxs=history)
+        anns_b.image_to_entry["both.jpg"] = entry("both.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="dog") ], history_bboxs=history)
+        anns_a.image_to_entry["only_a.jpg"] = entry("only_a.jpg", bboxs=[ Bbox(xyxy=[0,0,10,10], class_name="cat") ], history_bboxs=history)
+
+        fnames = [ os.path.join(tmp_path, "a.json"), os.path.join(tmp_path, "b.json") ]
+        write_default_json(anns_a, fnames[0])
+        write_default_json(anns_b, fnames[1])
+        fname_out = os.path.join(tmp_path, "out.json")
+        storage = dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=fname_out)
+        dacv.merge_annotations(fnames, storage, options=dacv.MergeOptions(preserve_history=False))
+
+        merged = load_from_default_json_if_exist(fname_out)
+        assert merged is not None
+        assert all(ann.history_bboxs is None and ann.history_labels is None for ann in merged.image_to_entry.values())
+        assert merged.image_to_entry["only_a.jpg"].bboxs == [ Bbox(xyxy=[0,0,10,10], class_name="cat") ]
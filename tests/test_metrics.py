@@ -0,0 +1,91 @@
+import dash_annotate_cv as dacv
+from flask import Flask
+import pytest
+import os
+
+
+@pytest.fixture
+def registry():
+    return dacv.MetricsRegistry()
+
+
+@pytest.fixture
+def anns():
+    return dacv.ImageAnnotations(
+        image_to_entry={
+            "test.jpg": dacv.ImageAnnotations.Annotation(
+                image_name="test.jpg",
+                bboxs=[dacv.ImageAnnotations.Annotation.Bbox(xyxy=[1,2,3,4], class_name="cat")],
+                image_height=100,
+                image_width=100
+                )
+            }
+        )
+
+
+class TestMetrics:
+
+    def test_histogram(self):
+        hist = dacv.Histogram(buckets=(1.0, 2.0, 5.0))
+        for value in [0.5, 1.5, 1.5, 4.0, 10.0]:
+            hist.observe(value)
+        assert hist.count == 5
+        assert hist.sum == pytest.approx(17.5)
+        assert hist.counts == [1, 2, 1, 1]
+        assert hist.quantile(0.5) == 2.0
+        assert hist.quantile(1.0) == float("inf")
+
+    def test_instrument_callback(self, registry: dacv.MetricsRegistry):
+
+        @registry.instrument_callback("test.callback")
+        def callback(x):
+            if x < 0:
+                raise ValueError("negative")
+            return x
+
+        assert callback(1) == 1
+        with pytest.raises(ValueError):
+            callback(-1)
+
+        hist = registry.histogram("callback_duration_seconds", {"callback": "test.callback"})
+        assert hist is not None
+        assert hist.count == 2
+        assert registry.counter_value("callback_errors_total", {"callback": "test.callback"}) == 1
+
+    def test_cache_hit_rate(self, registry: dacv.MetricsRegistry):
+        assert registry.cache_hit_rate("images") is None
+        registry.record_cache("images", hit=True)
+        registry.record_cache("images", hit=True)
+        registry.record_cache("images", hit=False)
+        assert registry.cache_hit_rate("images") == pytest.approx(2/3)
+
+    def test_render_prometheus(self, registry: dacv.MetricsRegistry):
+        registry.inc("things_total", 2, {"kind": "a"})
+        registry.observe("latency_seconds", 0.003, {"callback": "cb"})
+        text = registry.render_prometheus()
+        assert '# TYPE dacv_things_total counter' in text
+        assert 'dacv_things_total{kind="a"} 2.0' in text
+        assert '# TYPE dacv_latency_seconds histogram' in text
+        assert 'dacv_latency_seconds_bucket{callback="cb",le="0.005"} 1' in text
+        assert 'dacv_latency_seconds_bucket{callback="cb",le="+Inf"} 1' in text
+        assert 'dacv_latency_seconds_count{callback="cb"} 1' in text
+
+    def test_metrics_route(self, registry: dacv.MetricsRegistry):
+        server = Flask(__name__)
+        dacv.register_metrics_route(server, metrics_registry=registry)
+        registry.inc("things_total")
+        response = server.test_client().get("/metrics")
+        assert response.status_code == 200
+        assert "dacv_things_total 1.0" in response.get_data(as_text=True)
+
+    def test_storage_write_metrics(self, anns: dacv.ImageAnnotations, tmp_path):
+        dacv.metrics_registry.reset()
+        json_file = os.path.join(tmp_path, "anns.json")
+        writer = dacv.AnnotationWriter(dacv.AnnotationStorage(storage_types=[dacv.StorageType.JSON], json_file=json_file))
+        writer.write(anns)
+
+        labels = {"storage_type": "json"}
+        hist = dacv.metrics_registry.histogram("storage_write_duration_seconds", labels)
+        assert hist is not None
+        assert hist.count == 1
+        assert dacv.metrics_registry.counter_value("storage_bytes_written_total", labels) == os.path.getsize(json_file)
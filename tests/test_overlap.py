@@ -0,0 +1,115 @@
+import dash_annotate_cv as dacv
+from dash_annotate_cv.overlap import iou_one_to_many, xyxy_array
+from skimage import data
+from PIL import Image
+import numpy as np
+import pytest
+
+
+def make_controller(policy: dacv.DuplicatePolicy) -> dacv.AnnotateImageController:
+    return dacv.AnnotateImageController(
+        label_source=dacv.LabelSource(labels=["cat", "dog"]),
+        image_source=dacv.ImageSource(images=[("chelsea",Image.fromarray(data.chelsea()))]),
+        options=dacv.AnnotateImageOptions(duplicate_iou_threshold=0.9, duplicate_policy=policy)
+        )
+
+
+def iou_brute_force(a, b) -> float:
+    w = max(0, min(a[2],b[2]) - max(a[0],b[0]))
+    h = max(0, min(a[3],b[3]) - max(a[1],b[1]))
+    union = (a[2]-a[0])*(a[3]-a[1]) + (b[2]-b[0])*(b[3]-b[1]) - w*h
+    return w*h/union if union > 0 else 0.0
+
+
+class TestOverlap:
+
+    def test_iou_matrix(self):
+        a = xyxy_array([[0,0,10,10], [0,0,5,10]])
+        b = xyxy_array([[0,0,10,10], [5,0,15,10], [20,20,30,30]])
+        ious = dacv.iou_matrix(a, b)
+        assert ious.shape == (2,3)
+        assert ious[0,0] == pytest.approx(1.0)
+        assert ious[0,1] == pytest.approx(50/150)
+        assert ious[0,2] == 0.0
+        assert ious[1,0] == pytest.approx(0.5)
+        assert iou_one_to_many([0,0,10,10], b) == pytest.approx(ious[0])
+
+    def test_find_duplicates(self):
+        rng = np.random.default_rng(0)
+        anns = dacv.ImageAnnotations.new()
+        for i in range(30):
+            xy = rng.integers(0, 20, size=(rng.integers(0, 12), 2))
+            bboxs = [ dacv.ImageAnnotations.Annotation.Bbox(xyxy=[int(x),int(y),int(x)+10,int(y)+10], class_name=rng.choice(["cat","dog",None])) for x,y in xy ]
+            anns.image_to_entry[str(i)] = dacv.ImageAnnotations.Annotation(image_name=str(i), bboxs=bboxs)
+
+        # Small batches to exercise batching
+        pairs = dacv.find_duplicates(anns, iou_threshold=0.5, max_batch_elements=200)
+
+        expected = set()
+        for name, entry in anns.image_to_entry.items():
+            bboxs = entry.bboxs or []
+            for i in range(len(bboxs)):
+                for j in range(i+1, len(bboxs)):
+                    compatible = bboxs[i].class_name is None or bboxs[j].class_name is None or bboxs[i].class_name == bboxs[j].class_name
+                    if compatible and iou_brute_force(bboxs[i].xyxy, bboxs[j].xyxy) >= 0.5:
+                        expected.add((name, i, j))
+        assert set((p.image_name, p.idx_a, p.idx_b) for p in pairs) == expected
+        assert len(expected) > 0
+
+        no_removed = dacv.merge_duplicates(anns, pairs)
+        assert no_removed > 0
+        assert len(dacv.find_duplicates(anns, iou_threshold=0.5)) < len(pairs)
+
+    def test_policy_reject(self):
+        controller = make_controller(dacv.DuplicatePolicy.REJECT)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        with pytest.raises(dacv.DuplicateBboxError):
+            controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name=None))
+        # Different class is not a duplicate
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="dog"))
+        controller.add_bbox(dacv.Bbox(xyxy=[50,50,60,60], class_name="cat"))
+        with pytest.raises(dacv.DuplicateBboxError):
+            controller.update_bbox(dacv.BboxUpdate(idx=2, xyxy_new=[0,0,10,10]))
+        assert len(controller.curr_bboxs) == 3
+
+    def test_policy_merge(self):
+        controller = make_controller(dacv.DuplicatePolicy.MERGE)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name=None))
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        assert controller.curr_bboxs == [dacv.Bbox(xyxy=[0,0,10,10], class_name="cat")]
+
+        controller.add_bbox(dacv.Bbox(xyxy=[50,50,60,60], class_name="cat"))
+        controller.update_bbox(dacv.BboxUpdate(idx=1, xyxy_new=[0,0,10,10]))
+        assert controller.curr_bboxs == [dacv.Bbox(xyxy=[0,0,10,10], class_name="cat")]
+        assert controller.progress().no_bboxs == 1
+
+    def test_update_class_and_move(self):
+        # The update is checked with the new class
+        controller = make_controller(dacv.DuplicatePolicy.REJECT)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        controller.add_bbox(dacv.Bbox(xyxy=[50,50,60,60], class_name="dog"))
+        with pytest.raises(dacv.DuplicateBboxError):
+            controller.update_bbox(dacv.BboxUpdate(idx=1, xyxy_new=[0,0,10,10], class_name_new="cat"))
+        controller.add_bbox(dacv.Bbox(xyxy=[20,20,30,30], class_name="cat"))
+        controller.update_bbox(dacv.BboxUpdate(idx=2, xyxy_new=[0,0,10,10], class_name_new="dog"))
+        assert controller.curr_bboxs[2] == dacv.Bbox(xyxy=[0,0,10,10], class_name="dog")
+
+    def test_policy_merge_single_write(self):
+        controller = make_controller(dacv.DuplicatePolicy.MERGE)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name=None))
+        controller.add_bbox(dacv.Bbox(xyxy=[50,50,60,60], class_name="dog"))
+        writes = []
+        write = controller._write
+        controller._write = lambda image_names: (writes.append(image_names), write(image_names)) # type: ignore
+        controller.update_bbox(dacv.BboxUpdate(idx=1, xyxy_new=[0,0,10,10]))
+        assert controller.curr_bboxs == [dacv.Bbox(xyxy=[0,0,10,10], class_name="dog")]
+        assert len(writes) == 1
+        assert controller.progress().bboxs_per_class == {"dog": 1}
+        history = controller.annotations.image_to_entry["chelsea"].history_bboxs or []
+        assert [ op.operation for op in history[:2] ] == [dacv.ImageAnnotations.Annotation.BboxHistory.Operation.UPDATE, dacv.ImageAnnotations.Annotation.BboxHistory.Operation.DELETE]
+
+    def test_policy_warn(self):
+        controller = make_controller(dacv.DuplicatePolicy.WARN)
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="cat"))
+        assert len(controller.curr_bboxs) == 2
@@ -0,0 +1,83 @@
+from dash_annotate_cv.rle import rle_encode, rle_decode, rle_area, rle_to_xyxy, rle_from_positions, rle_sample, rle_from_polygon, \
+    rle_overlay, path_to_polygon, counts_to_string, counts_from_string
+import numpy as np
+import pytest
+
+
+def random_masks():
+    rng = np.random.default_rng(0)
+    for idx in range(100):
+        height, width = rng.integers(1, 40, 2)
+        mask = rng.random((height, width)) < rng.random()
+        if idx % 3 == 0:
+            # Blob spanning several columns
+            mask[:] = False
+            mask[rng.integers(0, height):, rng.integers(0, width):] = True
+        yield mask
+
+
+@pytest.fixture
+def masks():
+    return list(random_masks())
+
+
+class TestCounts:
+
+    def test_string_roundtrip(self):
+        counts = [0, 5, 100, 3, 100000, 1, 2, 70000]
+        assert counts_from_string(counts_to_string(counts)).tolist() == counts
+        # Same as the COCO API
+        assert counts_to_string([3, 2, 4]) == "324"
+
+
+class TestEncode:
+
+    def test_encode_decode(self, masks):
+        for mask in masks:
+            original = mask.copy()
+            rle = rle_encode(mask)
+            assert np.array_equal(mask, original)
+            assert rle["size"] == list(mask.shape)
+            assert isinstance(rle["counts"], str)
+            assert np.array_equal(rle_decode(rle), mask)
+            assert rle_from_positions(np.flatnonzero(mask.ravel(order="F")), *mask.shape) == rle
+
+    def test_area_and_bbox_from_runs(self, masks):
+        for mask in masks:
+            rle = rle_encode(mask)
+            assert rle_area(rle) == mask.sum()
+            ys, xs = np.nonzero(mask)
+            expected = [xs.min(), ys.min(), xs.max() + 1, ys.max() + 1] if mask.any() else [0, 0, 0, 0]
+            assert rle_to_xyxy(rle) == expected
+
+
+class TestSample:
+
+    def test_sample(self):
+        mask = np.zeros((40, 60), dtype=bool)
+        mask[10:20, 30:60] = True
+        rle = rle_encode(mask)
+        assert np.array_equal(rle_sample(rle, 40, 60), mask)
+        assert np.array_equal(rle_sample(rle, 4, 6), mask[5::10, 5::10])
+
+        overlay = rle_overlay([rle], [(255, 0, 0)], max_size=6)
+        assert overlay.size == (6, 4)
+        assert overlay.mode == "RGBA"
+        assert np.array(overlay)[1, 4].tolist() == [255, 0, 0, 127]
+        assert np.array(overlay)[0, 0, 3] == 0
+
+
+class TestPolygon:
+
+    def test_polygon(self):
+        xy = path_to_polygon("M2,2L8,2L8,6L2,6Z")
+        assert xy == [(2, 2), (8, 2), (8, 6), (2, 6)]
+        rle = rle_from_polygon(xy, 10, 12)
+        mask = np.zeros((10, 12), dtype=bool)
+        mask[2:6, 2:8] = True
+        assert np.array_equal(rle_decode(rle), mask)
+
+        # Clipped to the image
+        rle = rle_from_polygon([(-5, -5), (4, -5), (4, 3), (-5, 3)], 10, 12)
+        assert rle_to_xyxy(rle) == [0, 0, 4, 3]
+        assert rle_area(rle_from_polygon([(20, 20), (30, 20), (30, 30)], 10, 12)) == 0
@@ -0,0 +1,79 @@
+import dash_annotate_cv as dacv
+from skimage import data
+from PIL import Image
+import copy
+import json
+import pytest
+
+
+TREE = {
+    "name": "object",
+    "children": [
+        {"name": "animal", "children": [{"name": "cat"}, {"name": "dog", "children": [{"name": "terrier"}]}]},
+        {"name": "vehicle", "children": [{"name": "car"}]}
+    ]
+}
+
+
+@pytest.fixture
+def taxonomy_file(tmp_path):
+    fname = str(tmp_path / "taxonomy.json")
+    with open(fname, "w") as f:
+        json.dump(TREE, f)
+    return fname
+
+
+class TestTaxonomy:
+
+    def test_ancestry_index(self):
+        tree = copy.deepcopy(TREE)
+        taxonomy = dacv.Taxonomy.from_json(tree)
+        assert tree == TREE
+        assert taxonomy.labels == ["object", "animal", "cat", "dog", "terrier", "vehicle", "car"]
+        assert taxonomy.ancestors("terrier") == ("object", "animal", "dog")
+        assert taxonomy.parent("object") is None
+        assert taxonomy.depth("car") == 2
+        assert taxonomy.is_descendant("terrier", "animal")
+        assert taxonomy.is_descendant("animal", "animal")
+        assert not taxonomy.is_descendant("car", "animal")
+        assert not taxonomy.is_descendant("animal", "terrier")
+        assert not taxonomy.is_descendant("bird", "animal")
+        assert taxonomy.descendants("animal") == ["animal", "cat", "dog", "terrier"]
+        assert taxonomy.supercategories()["terrier"] == "dog"
+        assert taxonomy.roll_up({"terrier": 2, "cat": 1, "bird": 5}) == {"object": 3, "animal": 3, "dog": 2, "terrier": 2, "cat": 1, "bird": 5}
+
+    def test_duplicate_names(self):
+        with pytest.raises(AssertionError):
+            dacv.Taxonomy.from_json([{"name": "cat"}, {"name": "animal", "children": [{"name": "cat"}]}])
+
+
+class TestTaxonomyLabelSource:
+
+    def test_label_source(self, taxonomy_file):
+        label_source = dacv.LabelSource(source_type=dacv.LabelSource.Type.TAXONOMY_FILE, taxonomy_file=taxonomy_file)
+        assert label_source.get_labels() == ["object", "animal", "cat", "dog", "terrier", "vehicle", "car"]
+        label_source.taxonomy_root = "dog"
+        assert label_source.get_labels() == ["dog", "terrier"]
+
+
+class TestTaxonomyController:
+
+    def test_bboxs_and_coco(self, taxonomy_file, tmp_path):
+        coco_file = str(tmp_path / "coco.json")
+        controller = dacv.AnnotateImageController(
+            label_source=dacv.LabelSource(source_type=dacv.LabelSource.Type.TAXONOMY_FILE, taxonomy_file=taxonomy_file, taxonomy_root="animal"),
+            image_source=dacv.ImageSource(images=[ ("chelsea", Image.fromarray(data.chelsea())) ]), # type: ignore
+            annotation_storage=dacv.AnnotationStorage(storage_types=[dacv.StorageType.COCO], coco_file=coco_file)
+            )
+        with pytest.raises(dacv.InvalidLabelError):
+            controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="car"))
+        controller.add_bbox(dacv.Bbox(xyxy=[0,0,10,10], class_name="terrier"))
+        controller.add_bbox(dacv.Bbox(xyxy=[20,20,40,40], class_name="cat"))
+
+        progress = controller.progress()
+        assert progress.bboxs_per_class_rolled_up["animal"] == 2
+        assert progress.bboxs_per_class_rolled_up["dog"] == 1
+
+        with open(coco_file) as f:
+            categories = json.load(f)["categories"]
+        assert { cat["name"]: cat["supercategory"] for cat in categories } == {"terrier": "dog", "cat": "animal"}
@@ -0,0 +1,79 @@
+from dash_annotate_cv.thumbnails import ThumbnailCache, make_thumbnail
+from skimage import data
+from PIL import Image
+import pytest
+import io
+import os
+
+
+@pytest.fixture
+def image_files(tmp_path):
+    fnames = []
+    for name, image in [ ("chelsea", data.chelsea()), ("camera", data.camera()) ]:
+        fname = str(tmp_path / f"{name}.jpg")
+        Image.fromarray(image).save(fname)
+        fnames.append(fname)
+    return fnames
+
+
+class TestMakeThumbnail:
+
+    def test_make_thumbnail(self):
+        image = Image.fromarray(data.astronaut())
+        thumbnail = Image.open(io.BytesIO(make_thumbnail(image, 64)))
+        assert thumbnail.format == "JPEG"
+        assert max(thumbnail.size) == 64
+
+    def test_source_image_unchanged(self, image_files):
+        # An opened JPEG can be decoded at a reduced scale; the image being annotated must keep its size
+        with Image.open(image_files[1]) as image:
+            make_thumbnail(image, 32)
+            assert image.size == (512, 512)
+            assert image.load() is not None and image.size == (512, 512)
+
+
+class TestThumbnailCache:
+
+    def test_files(self, tmp_path, image_files):
+        fnames = image_files + [str(tmp_path / "missing.jpg")]
+        cache_dir = str(tmp_path / "thumbnails")
+
+        cache = ThumbnailCache(size=32, cache_dir=cache_dir, workers=2)
+        try:
+            cache.prefetch(fnames[:2])
+            thumbnails = cache.get_many(fnames[:2])
+            assert all(t is not None for t in thumbnails)
+            assert max(Image.open(io.BytesIO(thumbnails[0])).size) == 32 # type: ignore
+            assert len(os.listdir(cache_dir)) == 2
+            assert cache.get_many(fnames[2:]) == [None]
+        finally:
+            cache.close()
+
+        # A new cache reuses the thumbnails on disk without a worker pool
+        cache = ThumbnailCache(size=32, cache_dir=cache_dir)
+        assert cache.get_many(fnames[:2]) == thumbnails
+        assert cache._executor is None
+        cache.close()
+
+    def test_in_memory(self, tmp_path, image_files):
+        with Image.open(image_files[1]) as image:
+            cache = ThumbnailCache(size=32, cache_dir=str(tmp_path / "thumbnails"))
+            first = cache.get_many([image], ["camera"])[0]
+            assert first is not None
+            assert cache.get_many([image], ["camera"])[0] is first
+            assert os.listdir(str(tmp_path / "thumbnails")) == []
+            assert image.size == (512, 512)
+
+    def test_in_memory_keyed_by_name(self, tmp_path):
+        # Readers return a new image object on every call: thumbnails are cached by name, not by object
+        cache = ThumbnailCache(size=32, cache_dir=str(tmp_path), memory_max_items=2)
+        first = cache.get_many([Image.fromarray(data.camera())], ["camera"])[0]
+        assert cache.get_many([Image.fromarray(data.chelsea())], ["camera"])[0] is first
+
+        # Least recently used thumbnails are evicted
+        cache.get_many([Image.fromarray(data.chelsea()), Image.fromarray(data.astronaut())], ["chelsea", "astronaut"])
+        assert list(cache._memory.keys()) == ["chelsea", "astronaut"]
+
+        # Without names, nothing is kept
+        cache.get_many([Image.fromarray(data.coins())])
+        assert len(cache._memory) == 2
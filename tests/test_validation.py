@@ -0,0 +1,42 @@
+import dash_annotate_cv as dacv
+
+Ann = dacv.ImageAnnotations.Annotation
+
+
+class TestValidateEntry:
+
+    def test_issues(self):
+        entry = Ann(
+            image_name="image",
+            label=Ann.Label(multiple=["cat", "bird"]),
+            bboxs=[
+                Ann.Bbox(xyxy=[0,0,10,10], class_name="cat"),
+                Ann.Bbox(xyxy=[0,0,10,10]),
+                Ann.Bbox(xyxy=[5,5,5,20], class_name="cat"),
+                Ann.Bbox(xyxy=[90,90,110,100], class_name="dog")
+                ],
+            image_width=100,
+            image_height=100
+            )
+        issues = dacv.validate_entry(entry, labels=["cat", "dog"], duplicate_iou_threshold=0.9)
+        assert [ (issue.bbox_idx, issue.message) for issue in issues ] == [
+            (None, "Label 'bird' is not allowed"),
+            (1, "Bbox duplicates bbox 0 (IoU 1.00)"),
+            (2, "Bbox [5, 5, 5, 20] has no area"),
+            (3, "Bbox [90, 90, 110, 100] is outside the image")
+            ]
+
+        # No labels or duplicate threshold: only geometry is checked
+        assert len(dacv.validate_entry(entry)) == 2
+
+        # The entry is reported on, not fixed
+        assert entry.bboxs is not None and len(entry.bboxs) == 4 and entry.label.multiple == ["cat", "bird"] # type: ignore
+
+
+class TestValidateEntries:
+
+    def test_progress(self):
+        entries = [ Ann(image_name=f"image{idx}", label=Ann.Label(single="cat")) for idx in range(3) ]
+        counts = []
+        assert dacv.validate_entries(entries, labels=["cat"], on_entry=counts.append) == []
+        assert counts == [1, 2, 3]